@@ -11,13 +11,16 @@ import asyncio
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple, AsyncIterator, AsyncGenerator
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator, AsyncGenerator, Callable
 
 from tabulate import tabulate
 
 from base_client import BaseClientFeatures, Colors
+from conversation_codecs import get_codec
+from conversation_persister import WriteBehindPersister
 from providers.base_provider import BaseAIProvider, ProviderError
 from config import Config
+from context_budget import DEFAULT_BUDGET_SETTINGS, fit_to_budget
 
 
 class AsyncClient(BaseClientFeatures):
@@ -42,6 +45,20 @@ class AsyncClient(BaseClientFeatures):
         self.provider = provider
         # If global_config is not provided, create a default quiet one.
         self.global_config = global_config if global_config else Config(quiet=True)
+        storage_format = self.global_config.get("conversation_storage_format", "json")
+        if storage_format in self.STORAGE_FORMATS:
+            self.storage_format = storage_format
+        else:
+            print(f"{Colors.WARNING}Unknown conversation_storage_format '{storage_format}'. Using 'json'.{Colors.ENDC}")
+        self.codec = get_codec(self.global_config.get("conversation_codec", "json"))
+        layout = self.global_config.get("conversation_layout", "flat")
+        if layout in self.LAYOUTS:
+            self.layout = layout
+        else:
+            print(f"{Colors.WARNING}Unknown conversation_layout '{layout}'. Using 'flat'.{Colors.ENDC}")
+        self.provider_manager = None  # Set by ClientManager; owns the shared HTTP transport
+        # Autosaves from hot paths are coalesced and written behind the response
+        self.persister = WriteBehindPersister(coalesce_ms=self.global_config.get("autosave_coalesce_ms", 250))
 
         self.conversation_id: Optional[str] = None
         self.conversation_data: Dict[str, Any] = {}  # Stores the entire conversation structure
@@ -55,6 +72,7 @@ class AsyncClient(BaseClientFeatures):
         self.system_instruction: str = self.global_config.get("default_system_instruction", Config.DEFAULT_SYSTEM_INSTRUCTION)
 
         self.current_user_message_id: Optional[str] = None  # Tracks the ID of the most recent user message added via add_user_message
+        self.last_context_report: Optional[Dict[str, Any]] = None  # What the context budget did to the last request
         self.is_web_ui: bool = False  # Flag to indicate if the client is used by the web UI
 
         self.ensure_directories()  # Ensure the conversations directory exists
@@ -122,7 +140,8 @@ class AsyncClient(BaseClientFeatures):
         self.system_instruction = current_system_instruction  # Update client's current system instruction
 
         # Create the basic conversation data structure
-        self.conversation_data = self.create_metadata_structure(title, self.conversation_id, current_system_instruction)
+        self.conversation_data = self.open_conversation(
+            self.create_metadata_structure(title, self.conversation_id, current_system_instruction))
         conv_meta = self.conversation_data["metadata"]  # Convenience alias
         conv_meta["provider"] = self.provider.provider_name
         conv_meta["model"] = self.current_model_name
@@ -136,11 +155,28 @@ class AsyncClient(BaseClientFeatures):
         await self.save_conversation()  # Initial save of the new conversation structure
 
     async def save_conversation(self, quiet: bool = False) -> None:
-        """Saves the current conversation data to a file."""
+        """Saves the current conversation data to a file and waits until it is on disk."""
         if not self.conversation_id or not self.conversation_data:
             if not quiet: print(f"{Colors.WARNING}No active conversation to save.{Colors.ENDC}")
             return
+        self._mark_conversation_dirty(quiet=quiet)
+        await self.persister.flush(self.conversation_id)
+
+    def schedule_save(self) -> None:
+        """
+        Marks the current conversation dirty. The write happens in the background
+        after the autosave coalescing window; use flush_pending_saves() or
+        save_conversation() when the data must be on disk before continuing.
+        """
+        if not self.conversation_id or not self.conversation_data:
+            return
+        self._mark_conversation_dirty(quiet=True)
+
+    async def flush_pending_saves(self) -> None:
+        """Writes all pending autosaves (e.g. on shutdown)."""
+        await self.persister.flush()
 
+    def _mark_conversation_dirty(self, quiet: bool) -> None:
         # Ensure metadata reflects current client state before saving
         conv_meta = self.conversation_data.setdefault("metadata", {})
         conv_meta["provider"] = self.provider.provider_name
@@ -149,13 +185,15 @@ class AsyncClient(BaseClientFeatures):
         conv_meta["streaming_preference"] = self.use_streaming  # Save current session streaming pref
         conv_meta["system_instruction"] = self.system_instruction  # Save current system instruction
 
-        await super().save_conversation_data(
-            conversation_data=self.conversation_data,
-            conversation_id=self.conversation_id,
-            title=conv_meta.get("title", "Untitled"),  # Get title from metadata
-            conversations_dir=self.base_directory,
+        # Bind the conversation now: the client may switch conversations before the write runs
+        conversation_data, conversation_id, conversations_dir = self.conversation_data, self.conversation_id, self.base_directory
+        self.persister.mark_dirty(conversation_id, lambda: self.save_conversation_data(
+            conversation_data=conversation_data,
+            conversation_id=conversation_id,
+            title=conversation_data.get("metadata", {}).get("title", "Untitled"),  # Title read at write time (renames)
+            conversations_dir=conversations_dir,
             quiet=quiet
-        )
+        ))
 
     async def load_conversation(self, name_or_idx_or_id: Optional[str] = None) -> None:
         """Loads a conversation from a file, by name, index, or ID."""
@@ -209,7 +247,7 @@ class AsyncClient(BaseClientFeatures):
         loaded_data = await super().load_conversation_data(Path(selected_conv_info["path"]))
         if not loaded_data: return  # Error message handled by superclass method
 
-        self.conversation_data = loaded_data
+        self.conversation_data = self.open_conversation(loaded_data)  # Another session's open copy has newer turns
         self.conversation_id = loaded_data.get("conversation_id")
         conv_meta = self.conversation_data.get("metadata", {})
         self.conversation_name = conv_meta.get("title", "Untitled")
@@ -282,8 +320,7 @@ class AsyncClient(BaseClientFeatures):
             self._add_message_to_conversation(self.conversation_data, user_msg_obj)
             user_msg_id = user_msg_obj["id"]  # Get the ID of the added user message
 
-            # Prepare history and parameters for the provider
-            history_for_provider = self._build_history_for_provider()
+            # Prepare parameters for the provider (history is built per provider, see _generate_with_failover)
             current_params = self.conversation_data.get("metadata", {}).get("params", self.params).copy()
             current_streaming_pref = self.conversation_data.get("metadata", {}).get("streaming_preference", self.use_streaming)
             response_text = ""
@@ -293,8 +330,13 @@ class AsyncClient(BaseClientFeatures):
                 print(f"\r{Colors.CYAN}{self.provider.provider_name} is thinking... (streaming){Colors.ENDC}", end="", flush=True)
                 print("\r" + " " * (len(self.provider.provider_name) + 30) + "\r", end="", flush=True)  # Clear thinking line
                 print(f"{Colors.GREEN}AI: {Colors.ENDC}", end="", flush=True)  # AI prefix
-                stream_generator: AsyncGenerator[Dict[str, Any], None] = await self.provider.generate_response(history_for_provider, current_params, stream=True)  # type: ignore
-                async for chunk_data in stream_generator:
+                served_provider, served_model = self.provider.provider_name, self.current_model_name
+                async for chunk_data in self._stream_with_failover(current_params):
+                    if chunk_data.get("failover"):
+                        notice = chunk_data["failover"]
+                        print(f"\n{Colors.WARNING}[{notice['from']} unavailable, switching to {notice['to']} ({notice['model']})]{Colors.ENDC}")
+                        served_provider, served_model = notice["to"], notice["model"]
+                        continue
                     if chunk_data.get("error"):
                         response_text = f"Error from provider: {chunk_data['error']}"
                         print(f"\n{Colors.FAIL}{response_text}{Colors.ENDC}")  # Print error
@@ -304,27 +346,32 @@ class AsyncClient(BaseClientFeatures):
                         response_text += chunk_data["chunk"]
                     if chunk_data.get("done"):  # Stream finished
                         token_usage = chunk_data.get("token_usage", {})
+                        served_provider = chunk_data.get("provider", served_provider)  # The handle that served the reply
+                        served_model = chunk_data.get("model", served_model)
                         full_response_text_from_provider = chunk_data.get("full_response", response_text)
                         if full_response_text_from_provider: response_text = full_response_text_from_provider  # Ensure full text
                         break
                 print()  # Newline after streaming
             else:  # Handle non-streaming response
                 print(f"\r{Colors.CYAN}{self.provider.provider_name} is thinking...{Colors.ENDC}", end="", flush=True)
-                raw_response_text, metadata = await self.provider.generate_response(history_for_provider, current_params, stream=False)  # type: ignore
+                served_by, (raw_response_text, metadata) = await self._generate_with_failover(current_params)
                 print("\r" + " " * (len(self.provider.provider_name) + 20) + "\r", end="", flush=True)  # Clear thinking line
+                served_provider, served_model = served_by.provider_name, served_by.config.model
+                if served_by is not self.provider:
+                    print(f"{Colors.WARNING}[{self.provider.provider_name} unavailable, answered by {served_provider} ({served_model})]{Colors.ENDC}")
                 response_text = raw_response_text if raw_response_text is not None else ""
                 token_usage = metadata.get("token_usage", {})
                 print(f"\n{Colors.GREEN}AI: {Colors.ENDC}{response_text}")  # Print full response
 
-            # Add AI's response to conversation data
+            # Add AI's response to conversation data (recording the provider that actually served it)
             ai_msg_obj = self.create_message_structure(
-                role="assistant", text=response_text, model=self.current_model_name,
-                provider=self.provider.provider_name,  # *** ADDED: Track provider per message ***
+                role="assistant", text=response_text, model=served_model,
+                provider=served_provider,  # *** ADDED: Track provider per message ***
                 params=current_params, token_usage=token_usage,
                 parent_id=user_msg_id, branch_id=self.active_branch
             )
             self._add_message_to_conversation(self.conversation_data, ai_msg_obj)
-            await self.save_conversation(quiet=True)  # Auto-save
+            self.schedule_save()  # Auto-save
             return response_text
         except Exception as e:
             print(f"{Colors.FAIL}Error generating response via {self.provider.provider_name}: {e}{Colors.ENDC}")
@@ -340,36 +387,124 @@ class AsyncClient(BaseClientFeatures):
                     params=self.params, parent_id=err_parent_id, branch_id=self.active_branch
                 )
                 self._add_message_to_conversation(self.conversation_data, error_message_obj)
-                await self.save_conversation(quiet=True)
+                self.schedule_save()
             return None
 
-    def _build_history_for_provider(self) -> List[Dict[str, Any]]:
-        """
-        Builds the message history for the AI provider, including system instruction.
-        Returns a list of message dicts compatible with provider's normalize_messages.
-        """
-        provider_history: List[Dict[str, Any]] = []
-
-        # Get system instruction from current conversation's metadata, or client's current, or global default
+    def _current_system_instruction(self) -> Optional[str]:
+        """The system instruction for requests: the conversation's, the client's, or the global default."""
         current_system_instruction = self.conversation_data.get("metadata", {}).get("system_instruction", self.system_instruction)
         if not current_system_instruction or not current_system_instruction.strip():  # Fallback if empty
             current_system_instruction = self.global_config.get("default_system_instruction", Config.DEFAULT_SYSTEM_INSTRUCTION)
+        return current_system_instruction if current_system_instruction and current_system_instruction.strip() else None
 
-        # Prepend system instruction if it exists (as a user message, to be normalized by provider)
-        if current_system_instruction and current_system_instruction.strip():
-            provider_history.append({"role": "user", "content": current_system_instruction, "is_system_instruction": True})  # Mark for potential special handling
-            provider_history.append({"role": "assistant", "content": "Understood. I will follow these instructions."})  # Standard AI ack for system prompt
+    @staticmethod
+    def _system_preamble(system_instruction: Optional[str]) -> List[Dict[str, Any]]:
+        """The system instruction as a message, for budgeting only (providers receive it out-of-band)."""
+        return [{"role": "system", "content": system_instruction}] if system_instruction else []
 
-        # Add actual stored messages from the active conversation branch
+    def _build_history_for_provider(self, provider: Optional[BaseAIProvider] = None) -> List[Dict[str, Any]]:
+        """
+        Builds the message history for the AI provider. The system instruction is not part of it;
+        it is passed to generate_cached separately (see _current_system_instruction).
+        Args:
+            provider: Provider to format the history for (defaults to the active one; differs on failover).
+        Returns a list of message dicts compatible with provider's normalize_messages.
+        """
+        # Stored messages from the active conversation branch, trimmed to the model's context window
+        provider = provider or self.provider
         actual_stored_messages = self.get_conversation_history()  # Gets messages from current active branch
-        for msg_data in actual_stored_messages:
-            provider_history.append({
-                "role": msg_data["role"],
-                "content": msg_data.get("content", ""),
-                "attachments": msg_data.get("attachments")  # Pass attachments
-            })
+        current_params = self.conversation_data.get("metadata", {}).get("params", self.params)
+        preamble = self._system_preamble(self._current_system_instruction())
+        provider_history = self._fit_history_to_context(provider, preamble, actual_stored_messages, current_params)
         # The provider's normalize_messages method is responsible for final formatting
-        return self.provider.normalize_messages(provider_history)
+        return provider.normalize_messages(provider_history)
+
+    def _fit_history_to_context(self, provider: BaseAIProvider, preamble: List[Dict[str, Any]],
+                                stored_messages: List[Dict[str, Any]], params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Drops the oldest turns that do not fit the provider's context window (see context_budget.py)
+        and returns the rest as provider messages, hydrating attachments only for the kept ones.
+        Args:
+            preamble: Messages always sent ahead of the history (system instruction).
+            stored_messages: Stored messages (role, content, attachments, id, pinned), oldest first.
+            params: Generation params; their max_output_tokens is reserved for the reply.
+        """
+        settings = {**DEFAULT_BUDGET_SETTINGS, **(self.global_config.get("context_budget", {}) or {})}
+        context_window = (settings["context_windows"] or {}).get(provider.config.model) or provider.get_context_window()
+        kept_messages = stored_messages
+        self.last_context_report = None
+        if settings["enabled"] and context_window:
+            merged_params = {**provider.get_default_params(), **(params or {})}
+            kept_messages, report = fit_to_budget(
+                preamble, stored_messages, context_window, int(merged_params.get("max_output_tokens") or 0),
+                strategy=settings["strategy"], keep_first=settings["keep_first"], keep_last=settings["keep_last"],
+                safety_margin=settings["safety_margin"])
+            self.last_context_report = report.to_dict()
+            if report.dropped:
+                dropped_tokens = sum(d["tokens"] for d in report.dropped)
+                print(f"{Colors.WARNING}[Context] Left out {len(report.dropped)} older message(s) (~{dropped_tokens} tokens) "
+                      f"to fit {provider.config.model}'s {context_window}-token window ({report.strategy}).{Colors.ENDC}")
+            if report.over_budget:
+                print(f"{Colors.WARNING}[Context] Prompt (~{report.prompt_tokens} tokens) still exceeds the "
+                      f"{report.budget_tokens}-token budget for {provider.config.model}.{Colors.ENDC}")
+        return [{
+            "role": msg_data["role"],
+            "content": msg_data.get("content", ""),
+            "attachments": self.get_attachment_store().hydrate_all(msg_data.get("attachments"))  # Blob bytes are read only here
+        } for msg_data in kept_messages]
+
+    def set_message_pinned(self, message_id: str, pinned: bool = True) -> bool:
+        """
+        Pins a message so the "pinned" context budget strategy never leaves it out of a request.
+        Returns: True if the message exists in the current conversation.
+        """
+        message = self.conversation_data.get("messages", {}).get(message_id) if self.conversation_data else None
+        if not message:
+            return False
+        if pinned:
+            message["pinned"] = True
+        else:
+            message.pop("pinned", None)
+        self.touch_conversation(self.conversation_data, message_id)
+        self.mark_messages_changed(self.base_directory, self.conversation_id, self.conversation_data, message_id)
+        self.schedule_save()
+        return True
+
+    async def _generate_with_failover(self, params: Dict[str, Any],
+                                      build_messages: Optional[Callable[[BaseAIProvider], List[Dict[str, Any]]]] = None,
+                                      use_cache: bool = True) -> Tuple[BaseAIProvider, Tuple[str, Dict[str, Any]]]:
+        """
+        Non-streaming generation on the active provider, falling back along the configured
+        provider chain when it is unavailable. Returns (serving provider, (text, metadata)).
+        Args:
+            build_messages: Builds the history for a provider (defaults to the active branch).
+            use_cache: Whether the exact-match response cache may answer (see providers/response_cache.py).
+        """
+        build_messages = build_messages or self._build_history_for_provider
+        system_instruction = self._current_system_instruction()
+        if self.provider_manager is None:
+            return self.provider, await self.provider.generate_cached(build_messages(self.provider), params, use_cache=use_cache,  # type: ignore
+                                                                      system_instruction=system_instruction)
+        return await self.provider_manager.generate_with_failover(self.provider, build_messages, params, use_cache=use_cache,
+                                                                  system_instruction=system_instruction)
+
+    async def _stream_with_failover(self, params: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming counterpart of _generate_with_failover. Yields provider chunks, "failover"
+        notices, and a "done" chunk carrying the "provider" and "model" that served the reply.
+        """
+        system_instruction = self._current_system_instruction()
+        if self.provider_manager is not None:
+            async for chunk_data in self.provider_manager.stream_with_failover(self.provider, self._build_history_for_provider, params,
+                                                                               system_instruction=system_instruction):
+                yield chunk_data
+            return
+        stream_generator: AsyncGenerator[Dict[str, Any], None] = await self.provider.generate_cached(  # type: ignore
+            self._build_history_for_provider(), params, stream=True, system_instruction=system_instruction)
+        async for chunk_data in stream_generator:
+            if chunk_data.get("done"):
+                chunk_data = dict(chunk_data, provider=self.provider.provider_name, model=self.current_model_name)
+            yield chunk_data
 
     async def get_available_models(self) -> List[Dict[str, Any]]:
         """Gets list of available models from the current provider."""
@@ -377,7 +512,7 @@ class AsyncClient(BaseClientFeatures):
             print(f"{Colors.FAIL}Provider '{self.provider.provider_name}' is not initialized.{Colors.ENDC}")
             return []
         try:
-            return await self.provider.list_models()
+            return await self.provider.list_models_cached()
         except Exception as e:
             print(f"{Colors.FAIL}Error getting models from provider '{self.provider.provider_name}': {e}{Colors.ENDC}")
             return []
@@ -412,7 +547,7 @@ class AsyncClient(BaseClientFeatures):
                     self.conversation_data["metadata"]["model"] = new_model_name
                     self.conversation_data["metadata"]["provider"] = self.provider.provider_name  # Ensure provider is also current
                     print(f"{Colors.CYAN}Conversation model updated. Saving...{Colors.ENDC}")
-                    await self.save_conversation(quiet=True)
+                    self.schedule_save()
                 print(f"{Colors.GREEN}Selected model: {self.current_model_name} (Provider: {self.provider.provider_name}){Colors.ENDC}")
             else:
                 print(f"{Colors.FAIL}Invalid selection number.{Colors.ENDC}")
@@ -426,8 +561,9 @@ class AsyncClient(BaseClientFeatures):
         if self.conversation_data and "metadata" in self.conversation_data:  # If a conversation is active
             self.conversation_data["metadata"]["system_instruction"] = new_instruction
             self.conversation_data["metadata"]["updated_at"] = datetime.now().isoformat()
+            self.touch_conversation(self.conversation_data)
             print(f"{Colors.GREEN}System instruction updated in current conversation metadata.{Colors.ENDC}")
-            await self.save_conversation(quiet=True)
+            self.schedule_save()
         else:  # No active conversation
             print(f"{Colors.YELLOW}No active conversation. System instruction '{new_instruction[:50]}...' will apply to the next new conversation started in this session.{Colors.ENDC}")
 
@@ -471,7 +607,7 @@ class AsyncClient(BaseClientFeatures):
                     self.conversation_data["metadata"].setdefault("params", {}).update(new_params_for_conv)
                     self.conversation_data["metadata"]["updated_at"] = datetime.now().isoformat()
                     print(f"{Colors.CYAN}Saving updated generation parameters to current conversation...{Colors.ENDC}")
-                    await self.save_conversation(quiet=True)
+                    self.schedule_save()
                 print(f"{Colors.GREEN}Generation parameters updated successfully.{Colors.ENDC}")
             else:
                 print(f"{Colors.CYAN}No changes made to generation parameters.{Colors.ENDC}")
@@ -497,12 +633,15 @@ class AsyncClient(BaseClientFeatures):
         self._add_message_to_conversation(self.conversation_data, user_msg)
         self.current_user_message_id = user_msg["id"]  # Track this for parenting the AI's response
 
-    def add_assistant_message(self, message_text: str, token_usage: Optional[Dict[str, Any]] = None) -> None:
+    def add_assistant_message(self, message_text: str, token_usage: Optional[Dict[str, Any]] = None,
+                              provider_name: Optional[str] = None, model_name: Optional[str] = None) -> None:
         """
         Adds an assistant message to conversation data. For GUI to update state after AI call.
         Args:
             message_text: Text content of AI's response.
             token_usage: Optional token usage metrics.
+            provider_name: Provider that generated the response (defaults to the active one).
+            model_name: Model that generated the response (defaults to the conversation's model).
         """
         if not self.conversation_id or not self.conversation_data:
             print(f"{Colors.FAIL}[Client Error] add_assistant_message called without an active conversation.{Colors.ENDC}")
@@ -517,10 +656,13 @@ class AsyncClient(BaseClientFeatures):
         conv_meta = self.conversation_data.get("metadata", {})
         ai_model_name = conv_meta.get("model", self.current_model_name)  # Use conversation's model if set
         ai_params = conv_meta.get("params", self.params).copy()  # Use conversation's params if set
+        ai_provider_name = provider_name or self.provider.provider_name
+        if model_name:  # As reported by the provider handle that served it (a fallback may have stood in)
+            ai_model_name = model_name
 
         ai_msg = self.create_message_structure(
             role="assistant", text=text_to_add, model=ai_model_name,
-            provider=self.provider.provider_name,  # *** ADDED: Track provider per message ***
+            provider=ai_provider_name,  # *** ADDED: Track provider per message ***
             params=ai_params, token_usage=token_usage, parent_id=parent_id_for_ai, branch_id=self.active_branch
         )
         self._add_message_to_conversation(self.conversation_data, ai_msg)
@@ -542,15 +684,13 @@ class AsyncClient(BaseClientFeatures):
             print(f"{Colors.FAIL}[Client Error] Conversation data not initialized.{Colors.ENDC}")
             return "Error: Conversation data not initialized.", None
 
-        history_for_provider = self._build_history_for_provider()
         current_params = self.conversation_data.get("metadata", {}).get("params", self.params).copy()
         try:
-            response_tuple: Tuple[str, Dict[str, Any]] = await self.provider.generate_response(history_for_provider, current_params, stream=False)  # type: ignore
-            response_text, metadata = response_tuple
+            served_by, (response_text, metadata) = await self._generate_with_failover(current_params)
 
             # *** FIX: Add assistant message to conversation data ***
             token_usage_data = metadata.get("token_usage", {})
-            self.add_assistant_message(response_text, token_usage_data)
+            self.add_assistant_message(response_text, token_usage_data, served_by.provider_name, served_by.config.model)
             # *** End FIX ***
 
             return response_text, token_usage_data  # Return the extracted token usage
@@ -579,35 +719,42 @@ class AsyncClient(BaseClientFeatures):
             return
 
         user_message_id_for_parenting = self.current_user_message_id  # Parent for the upcoming AI message
-        history_for_provider = self._build_history_for_provider()
         current_params = self.conversation_data.get("metadata", {}).get("params", self.params).copy()
         current_model_for_stream = self.conversation_data.get("metadata", {}).get("model", self.current_model_name)
         full_response_text = ""
         final_token_usage = {}
+        served_provider = self.provider.provider_name
         try:
-            stream_generator: AsyncGenerator[Dict[str, Any], None] = await self.provider.generate_response(history_for_provider, current_params, stream=True)  # type: ignore
-            async for chunk_data in stream_generator:
+            async for chunk_data in self._stream_with_failover(current_params):
+                if chunk_data.get("failover"):  # Active provider unavailable; the chain moved on
+                    served_provider = chunk_data["failover"]["to"]
+                    current_model_for_stream = chunk_data["failover"]["model"]
+                    yield chunk_data
+                    continue
                 if chunk_data.get("error"): yield chunk_data; return  # Propagate error
                 if chunk_data.get("chunk"):
                     full_response_text += chunk_data["chunk"]
                     yield {"chunk": chunk_data["chunk"]}  # Yield text chunk
                 if chunk_data.get("done"):  # Stream finished from provider
                     final_token_usage = chunk_data.get("token_usage", {})
+                    served_provider = chunk_data.get("provider", served_provider)  # The handle that served the reply
+                    current_model_for_stream = chunk_data.get("model", current_model_for_stream)
                     # Ensure full_response_text is the complete one from the provider if available
                     full_response_text = chunk_data.get("full_response", full_response_text)
                     break  # Exit loop once provider signals done
 
             # After stream completion, add the full AI message and save
-            self.add_assistant_message(full_response_text, final_token_usage)
+            self.add_assistant_message(full_response_text, final_token_usage, served_provider, current_model_for_stream)
             assistant_msg_id = self._get_last_message_id(self.conversation_data, self.active_branch)  # Get ID of the just-added AI message
-            await self.save_conversation(quiet=True)  # Save conversation with new AI message
+            self.schedule_save()  # Save conversation with new AI message
 
             # Yield final 'done' event to GUI with all details
             yield {
                 "done": True, "full_response": full_response_text,
                 "conversation_id": self.conversation_id, "message_id": assistant_msg_id,
                 "parent_id": user_message_id_for_parenting, "model": current_model_for_stream,
-                "token_usage": final_token_usage
+                "provider": served_provider, "token_usage": final_token_usage,
+                "context": self.last_context_report
             }
         except Exception as e:
             print(f"{Colors.FAIL}[Client Error] Streaming provider error for '{self.provider.provider_name}': {e}{Colors.ENDC}")
@@ -638,15 +785,17 @@ class AsyncClient(BaseClientFeatures):
                     'timestamp': msg.get("timestamp"),
                     'parent_id': msg.get("parent_id"),
                     'token_usage': msg.get("token_usage"),  # Present for assistant messages
-                    'attachments': msg.get("attachments")  # Include attachments if present
+                    'attachments': msg.get("attachments"),  # Include attachments if present
+                    'pinned': msg.get("pinned", False)  # Kept in context by the "pinned" budget strategy
                 })
         return hist_list
 
-    async def retry_message(self, assistant_message_id_to_retry: str) -> Dict[str, Any]:
+    async def retry_message(self, assistant_message_id_to_retry: str, use_cache: bool = False) -> Dict[str, Any]:
         """
         Retries generating an AI response for a previous user message, creating a new branch.
         Args:
             assistant_message_id_to_retry: The ID of the assistant message whose generation should be retried.
+            use_cache: Allow a cached answer; off by default since a retry asks for a new sample.
         Returns:
             A dictionary with details of the new AI message and its sibling context.
         """
@@ -672,38 +821,39 @@ class AsyncClient(BaseClientFeatures):
 
         # Build history up to (and including) the parent user message for the retry
         history_ids_for_retry = self._build_message_chain_up_to_id(parent_user_id, branch_of_parent_user_message)
-        history_for_provider_raw_retry: List[Dict[str, Any]] = []
+        stored_history_for_retry: List[Dict[str, Any]] = []
         for mid in history_ids_for_retry:
             msg = messages_dict[mid]
-            history_for_provider_raw_retry.append({
+            stored_history_for_retry.append({
                 "role": msg["type"],
                 "content": msg.get("content", ""),
-                "attachments": msg.get("attachments")  # Include attachments for retry context
+                "attachments": msg.get("attachments"),  # Hydrated for retry context once the budget is applied
+                "id": mid,
+                "pinned": msg.get("pinned", False)
             })
 
-        # Prepend current system instruction for the retry
-        current_system_instruction = self.conversation_data.get("metadata", {}).get("system_instruction", self.system_instruction)
-        history_with_system_prompt_for_retry: List[Dict[str, Any]] = []
-        if current_system_instruction and current_system_instruction.strip():
-            history_with_system_prompt_for_retry.append({"role": "user", "content": current_system_instruction, "is_system_instruction": True})
-            history_with_system_prompt_for_retry.append({"role": "assistant", "content": "Understood."})
-        history_with_system_prompt_for_retry.extend(history_for_provider_raw_retry)
+        # The current system instruction goes out-of-band (see _generate_with_failover); it only counts toward the budget here
+        retry_preamble = self._system_preamble(self._current_system_instruction())
 
-        normalized_history_for_retry = self.provider.normalize_messages(history_with_system_prompt_for_retry)
         current_params_for_retry = self.conversation_data.get("metadata", {}).get("params", self.params).copy()
         current_model_for_retry = self.conversation_data.get("metadata", {}).get("model", self.current_model_name)
 
         try:
             # Generate new response (non-streaming for retry simplicity here)
-            response_tuple: Tuple[str, Dict[str, Any]] = await self.provider.generate_response(normalized_history_for_retry, current_params_for_retry, stream=False)  # type: ignore
-            new_response_text, metadata = response_tuple
+            served_by, (new_response_text, metadata) = await self._generate_with_failover(
+                current_params_for_retry,
+                lambda provider: provider.normalize_messages(self._fit_history_to_context(
+                    provider, retry_preamble, stored_history_for_retry, current_params_for_retry)),
+                use_cache=use_cache)
+            if served_by is not self.provider:  # Answered by a fallback provider
+                current_model_for_retry = served_by.config.model
             new_token_usage = metadata.get("token_usage", {})
 
             # Create new assistant message on a new branch
             new_branch_id = f"branch_{uuid.uuid4().hex[:8]}"  # Unique ID for the new branch
             new_assistant_msg_obj = self.create_message_structure(
                 role="assistant", text=new_response_text or "", model=current_model_for_retry,
-                provider=self.provider.provider_name,  # *** ADDED: Track provider per message ***
+                provider=served_by.provider_name,  # *** ADDED: Track provider per message ***
                 params=current_params_for_retry, token_usage=new_token_usage,
                 parent_id=parent_user_id, branch_id=new_branch_id  # Assign to new branch
             )
@@ -713,18 +863,18 @@ class AsyncClient(BaseClientFeatures):
             self.active_branch = new_branch_id
             self.conversation_data["metadata"]["active_leaf"] = new_assistant_msg_obj["id"]
             self.conversation_data["metadata"]["updated_at"] = datetime.now().isoformat()
-            await self.save_conversation(quiet=True)
+            self.schedule_save()
 
             # Get sibling info for the new message
             parent_user_msg_children = messages_dict[parent_user_id].get("children", [])
-            new_msg_idx = parent_user_msg_children.index(new_assistant_msg_obj["id"]) if new_assistant_msg_obj["id"] in parent_user_msg_children else -1
+            new_msg_idx = self.get_tree(self.conversation_data).child_index(parent_user_id, new_assistant_msg_obj["id"])
 
             print(f"{Colors.GREEN}[Client] Retry successful. New assistant message ID: {new_assistant_msg_obj['id'][:8]} on new branch '{new_branch_id}'.{Colors.ENDC}")
             return {
                 "message": new_assistant_msg_obj,  # The new AI message object
                 "sibling_index": new_msg_idx,
                 "total_siblings": len(parent_user_msg_children),
-                "system_instruction": current_system_instruction  # Return the system instruction used
+                "system_instruction": self._current_system_instruction()  # Return the system instruction used
             }
         except Exception as e:
             # Revert active branch/leaf if retry failed
@@ -769,6 +919,7 @@ class AsyncClient(BaseClientFeatures):
             raise ValueError("No active conversation or messages found to switch sibling.")
 
         messages = self.conversation_data["messages"]
+        tree = self.get_tree(self.conversation_data)
         current_message_obj = messages.get(message_id)
         if not current_message_obj: raise ValueError(f"Message {message_id} not found.")
 
@@ -782,8 +933,7 @@ class AsyncClient(BaseClientFeatures):
             if parent_id and parent_id in messages:
                 parent_message_obj = messages[parent_id]
                 siblings_ids = parent_message_obj.get("children", [])  # Children of user message are assistant responses
-                if message_id in siblings_ids:
-                    current_index_in_siblings = siblings_ids.index(message_id)
+                current_index_in_siblings = tree.child_index(parent_id, message_id)
             else:  # Orphaned assistant message? Or first assistant message with no explicit parent in tree?
                 siblings_ids = [message_id];
                 current_index_in_siblings = 0  # Treat as only child
@@ -792,10 +942,8 @@ class AsyncClient(BaseClientFeatures):
             siblings_ids = current_message_obj.get("children", [])
             # Determine which child is currently active (if any)
             active_leaf_for_user_parent = self.conversation_data.get("metadata", {}).get("active_leaf")
-            if active_leaf_for_user_parent and active_leaf_for_user_parent in siblings_ids:
-                current_index_in_siblings = siblings_ids.index(active_leaf_for_user_parent)
-            else:  # No active child, or active leaf is not a child of this user message
-                current_index_in_siblings = -1  # Indicate no current active sibling
+            # -1 when there is no active child, or the active leaf is not a child of this user message
+            current_index_in_siblings = tree.child_index(message_id, active_leaf_for_user_parent) if active_leaf_for_user_parent else -1
         else:  # Should not happen for valid messages
             raise ValueError(f"Cannot navigate siblings for message type: {current_message_obj['type']}")
 
@@ -824,7 +972,8 @@ class AsyncClient(BaseClientFeatures):
             self.active_branch = new_active_message_obj.get("branch_id", self.active_branch)  # Switch to sibling's branch
             self.conversation_data.setdefault("metadata", {})["active_leaf"] = new_active_message_id
             self.conversation_data["metadata"]["updated_at"] = datetime.now().isoformat()
-            await self.save_conversation(quiet=True)
+            self.touch_conversation(self.conversation_data)  # The active path moved
+            self.schedule_save()
             print(f"{Colors.GREEN}[Client] Switched. New active AI message: {new_active_message_id[:8]}, Branch: {self.active_branch}, Index: {new_sibling_idx}{Colors.ENDC}")
         else:
             print(f"{Colors.YELLOW}Navigation '{direction}' from message {message_id} resulted in no change or invalid index.{Colors.ENDC}")
@@ -848,6 +997,7 @@ class AsyncClient(BaseClientFeatures):
         if not self.conversation_data or "messages" not in self.conversation_data:
             raise ValueError("No conversation data available.")
         messages = self.conversation_data["messages"]
+        tree = self.get_tree(self.conversation_data)
         target_msg_obj = messages.get(message_id)
         if not target_msg_obj: raise ValueError(f"Message with ID '{message_id}' not found.")
 
@@ -860,7 +1010,7 @@ class AsyncClient(BaseClientFeatures):
             if parent_id_for_siblings and parent_id_for_siblings in messages:
                 parent_msg_obj = messages[parent_id_for_siblings]
                 sibling_ids = parent_msg_obj.get("children", [])  # Children of user message are AI siblings
-                if message_id in sibling_ids: current_idx = sibling_ids.index(message_id)
+                current_idx = tree.child_index(parent_id_for_siblings, message_id)
             else:  # Orphaned or first assistant message
                 sibling_ids = [message_id];
                 current_idx = 0
@@ -869,10 +1019,8 @@ class AsyncClient(BaseClientFeatures):
             sibling_ids = target_msg_obj.get("children", [])
             # Determine which child is currently active (if any)
             active_leaf = self.conversation_data.get("metadata", {}).get("active_leaf")
-            if active_leaf and active_leaf in sibling_ids:
-                current_idx = sibling_ids.index(active_leaf)  # Index of the active AI response among its siblings
-            else:
-                current_idx = -1  # No active child, or active leaf is not a direct child
+            # Index of the active AI response among its siblings; -1 if the active leaf is not a direct child
+            current_idx = tree.child_index(message_id, active_leaf) if active_leaf else -1
         else:  # Should not happen
             raise ValueError(f"Cannot determine siblings for message type: {target_msg_obj['type']}")
 
@@ -1019,5 +1167,5 @@ class AsyncClient(BaseClientFeatures):
         if self.conversation_data and "metadata" in self.conversation_data:
             self.conversation_data["metadata"]["streaming_preference"] = self.use_streaming
             print(f"{Colors.CYAN}Streaming preference for current conversation '{self.conversation_name}' updated.{Colors.ENDC}")
-            await self.save_conversation(quiet=True)  # Save change to conversation file
+            self.schedule_save()  # Save change to conversation file
         return self.use_streaming
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+CannonAI Attachment Store - Content-addressed storage for message attachments.
+
+Attachment bytes live in ``<conversations_dir>/.attachments/<ab>/<sha256>``,
+written once and shared by every message that references the same content.
+Messages keep only a small reference:
+
+    {"mime_type": "image/png", "blob": "<sha256 hex>", "size": 12345}
+
+The bytes are read back (memory-mapped) only when a provider request is built.
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentStore:
+    """Deduplicating blob store for one conversations directory."""
+
+    DIRNAME = ".attachments"
+
+    def __init__(self, conversations_dir: Path):
+        self.root = Path(conversations_dir) / self.DIRNAME
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    # ---------- Writing ----------
+
+    def put_bytes(self, raw: bytes) -> str:
+        """Stores raw bytes (if not already present) and returns their sha256 hex digest."""
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{digest}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+        return digest
+
+    def externalize(self, attachment: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a reference for an attachment carrying inline `data`; other attachments pass through."""
+        data = attachment.get("data")
+        if data is None or "blob" in attachment:
+            return attachment
+        if isinstance(data, str):
+            try:
+                raw = base64.b64decode(data, validate=True)
+            except (binascii.Error, ValueError):
+                logger.warning("Attachment data is not valid base64; keeping it inline.")
+                return attachment
+        else:
+            raw = bytes(data)
+        reference = {k: v for k, v in attachment.items() if k != "data"}
+        reference["blob"] = self.put_bytes(raw)
+        reference["size"] = len(raw)
+        return reference
+
+    def externalize_all(self, attachments: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+        if not attachments:
+            return attachments
+        return [self.externalize(att) if isinstance(att, dict) else att for att in attachments]
+
+    def externalize_conversation(self, conversation_data: Dict[str, Any]) -> int:
+        """Moves inline attachment data of a loaded (legacy) conversation into the store. Returns the count moved."""
+        moved = 0
+        for message in conversation_data.get("messages", {}).values():
+            attachments = message.get("attachments")
+            if not attachments or not any(isinstance(att, dict) and "data" in att for att in attachments):
+                continue
+            message["attachments"] = self.externalize_all(attachments)
+            moved += sum(1 for att in message["attachments"] if isinstance(att, dict) and "blob" in att)
+        return moved
+
+    # ---------- Reading ----------
+
+    def hydrate(self, attachment: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the attachment in the inline form providers expect (`data` as base64 text)."""
+        digest = attachment.get("blob")
+        if not digest:
+            return attachment
+        hydrated = {k: v for k, v in attachment.items() if k not in ("blob", "size")}
+        try:
+            path = self._blob_path(digest)
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    hydrated["data"] = ""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        hydrated["data"] = base64.b64encode(mapped).decode("ascii")
+        except OSError as e:
+            logger.error(f"Attachment blob {digest[:12]} could not be read: {e}")
+            return attachment
+        return hydrated
+
+    def hydrate_all(self, attachments: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+        if not attachments:
+            return attachments
+        return [self.hydrate(att) if isinstance(att, dict) else att for att in attachments]
@@ -11,13 +11,21 @@ import os
 import platform
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Union
+from typing import Callable, Dict, List, Any, Optional, Union
 import uuid
 import logging
 logger = logging.getLogger(__name__)
 
 import asyncio
 
+from attachment_store import AttachmentStore
+from conversation_catalog import ConversationCatalog
+from conversation_codecs import Codec, get_codec, load_file
+from conversation_header import read_json_header, update_json_metadata, order_for_header_reads
+from conversation_journal import ConversationJournal, JOURNAL_SUFFIX
+from conversation_layout import conversations_root, sharded_relpath
+from conversation_tree import ConversationTree, SharedConversations
+
 try:
     from colorama import init, Fore, Style
     init(autoreset=True)
@@ -49,6 +57,8 @@ class BaseClientFeatures:
     """
 
     VERSION = "2.3.0"
+    STORAGE_FORMATS = ("json", "journal")
+    LAYOUTS = ("flat", "sharded")
 
     def __init__(self, conversations_dir: Optional[Path] = None):
         if conversations_dir is None:
@@ -57,6 +67,31 @@ class BaseClientFeatures:
             self.base_directory = project_root / "cannonai_conversations"
         else:
             self.base_directory = Path(conversations_dir)
+        self._catalogs: Dict[Path, ConversationCatalog] = {}  # One persistent listing index per conversations directory
+        self.storage_format: str = "json"  # "json" rewrites the whole file; "journal" appends deltas (see conversation_journal)
+        self.codec: Codec = get_codec("json")  # Serialization of "json"-format files (see conversation_codecs)
+        self.layout: str = "flat"  # "flat" names files by title; "sharded" uses ab/cd/<id> paths (see conversation_layout)
+        self._journal = ConversationJournal()
+        self._attachment_stores: Dict[Path, AttachmentStore] = {}
+        self._tree: Optional[ConversationTree] = None  # Index over the most recently used conversation structure
+        self.shared_conversations: Optional[SharedConversations] = None  # Set when clients share conversations (GUI sessions)
+
+    def get_catalog(self, conversations_dir: Optional[Path] = None) -> ConversationCatalog:
+        """Returns the (cached) conversation catalog for a conversations directory."""
+        catalog_dir = Path(conversations_dir or self.base_directory)
+        catalog = self._catalogs.get(catalog_dir)
+        if catalog is None:
+            catalog = ConversationCatalog(catalog_dir)
+            self._catalogs[catalog_dir] = catalog
+        return catalog
+
+    def get_attachment_store(self, conversations_dir: Optional[Path] = None) -> AttachmentStore:
+        """Returns the attachment blob store for a conversations directory."""
+        store_dir = Path(conversations_dir or self.base_directory)
+        store = self._attachment_stores.get(store_dir)
+        if store is None:
+            store = self._attachment_stores[store_dir] = AttachmentStore(store_dir)
+        return store
 
     def ensure_directories(self, base_dir: Optional[Path] = None) -> None:
         dir_to_ensure = base_dir or self.base_directory
@@ -71,6 +106,12 @@ class BaseClientFeatures:
         safe_title = safe_title[:50]
         return f"{safe_title}_{conversation_id[:8]}.json"
 
+    def conversation_path(self, conversations_dir: Path, title: str, conversation_id: str) -> Path:
+        """Where a conversation is saved under the configured layout (always with a .json suffix)."""
+        if self.layout == "sharded":
+            return conversations_dir / sharded_relpath(conversation_id)
+        return conversations_dir / self.format_filename(title, conversation_id)
+
     def generate_conversation_id(self) -> str:
         return str(uuid.uuid4())
 
@@ -100,6 +141,8 @@ class BaseClientFeatures:
                          Each attachment is a dict, e.g.,
                          {'mime_type': 'image/png', 'data': base64_string} or
                          {'mime_type': 'image/jpeg', 'uri': 'gs://bucket/image.jpg'}
+                         Inline data is moved to the attachment store and the message
+                         keeps a {'mime_type', 'blob', 'size'} reference instead.
 
         Returns:
             Message structure dictionary.
@@ -119,7 +162,7 @@ class BaseClientFeatures:
 
         # *** FIX: Include attachments in the message structure if provided ***
         if attachments:
-            message_dict["attachments"] = attachments
+            message_dict["attachments"] = self.get_attachment_store().externalize_all(attachments)
 
         if role == "assistant":
             if model: message_dict["model"] = model
@@ -153,66 +196,51 @@ class BaseClientFeatures:
             }
         }
 
+    def share_conversations(self, shared: SharedConversations, journal: ConversationJournal) -> None:
+        """
+        Opens conversations through `shared` and writes journals through `journal`, both
+        common to a group of clients, so they work on one structure per conversation and
+        none of them repeats (or misses) another's journal appends.
+        """
+        self.shared_conversations = shared
+        self._journal = journal
+
+    def open_conversation(self, conversation_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The structure to use for a conversation being loaded or created: `conversation_data`
+        itself, or the copy another client sharing conversations already has open.
+        """
+        if self.shared_conversations is None:
+            return conversation_data
+        self._tree = self.shared_conversations.open(conversation_data)
+        return self._tree.data
+
+    def get_tree(self, conversation_data: Dict[str, Any]) -> ConversationTree:
+        """Returns the cached ConversationTree for `conversation_data`, rebuilding it if stale."""
+        if self.shared_conversations is not None:
+            self._tree = self.shared_conversations.tree(conversation_data)
+            return self._tree
+        tree = self._tree
+        if tree is None or not tree.is_current(conversation_data):
+            tree = self._tree = ConversationTree(conversation_data)
+        return tree
+
+    def touch_conversation(self, conversation_data: Dict[str, Any], *message_ids: str) -> int:
+        """Records a change to `conversation_data` (and to `message_ids`) for delta sync. Returns the new revision."""
+        return self.get_tree(conversation_data).touch(*message_ids)
+
     def _build_message_chain(self, conversation_data: Dict[str, Any], branch_id: Optional[str] = None) -> List[str]:
+        """Message IDs from the root to the branch's last message (cached per branch; do not modify)."""
         if not conversation_data or "messages" not in conversation_data: return []
-        messages = conversation_data.get("messages", {})
-        if not messages: return []
-
+        if not conversation_data.get("messages"): return []
         actual_branch_id = branch_id or conversation_data.get("metadata", {}).get("active_branch", "main")
-        branch_info = conversation_data.get("branches", {}).get(actual_branch_id, {})
-        leaf_id = branch_info.get("last_message")  # This leaf_id is the end of the active branch.
-
-        if not leaf_id or leaf_id not in messages:
-            # If no leaf_id for the branch, it might be an empty branch or metadata issue.
-            # Attempt to find any message on this branch, or default to empty.
-            # This part might need more robust handling if branches can be truly empty after creation.
-            # For now, returning empty if the designated leaf isn't found.
-            return []
-
-        chain = []
-        current_id: Optional[str] = leaf_id  # Start from the active leaf of the active branch
-        visited_ids_for_chain = set()  # Prevent loops in case of malformed data
-
-        while current_id and current_id not in visited_ids_for_chain:
-            visited_ids_for_chain.add(current_id)
-            # current_msg_data = messages.get(current_id, {}) # No longer needed for the removed condition
-
-            # Simply add the current message ID to the chain
-            chain.append(current_id)
-
-            # Move to its parent
-            current_id = messages.get(current_id, {}).get("parent_id")
-
-        chain.reverse()  # Order from oldest to newest
-        return chain
+        return self.get_tree(conversation_data).branch_path(actual_branch_id)
 
     def _add_message_to_conversation(self, conversation_data: Dict[str, Any], message: Dict[str, Any]) -> None:
         if not conversation_data:
             print(f"{Colors.WARNING}Attempted to add message but conversation_data is not initialized/provided.{Colors.ENDC}")
             return
-        msg_id = message["id"]
-        parent_id = message.get("parent_id")
-        branch_id = message.get("branch_id", "main")
-        conversation_data.setdefault("messages", {})
-        conversation_data.setdefault("branches", {})
-        conversation_data.setdefault("metadata", {}).setdefault("active_branch", "main")
-        conversation_data["messages"][msg_id] = message
-        if parent_id and parent_id in conversation_data["messages"]:
-            parent_message_data = conversation_data["messages"][parent_id]
-            parent_message_data.setdefault("children", [])
-            if msg_id not in parent_message_data["children"]:
-                parent_message_data["children"].append(msg_id)
-        if branch_id not in conversation_data["branches"]:
-            conversation_data["branches"][branch_id] = {
-                "created_at": message.get("timestamp", datetime.now().isoformat()),
-                "last_message": None, "message_count": 0
-            }
-        branch_info = conversation_data["branches"][branch_id]
-        branch_info["last_message"] = msg_id
-        count = sum(1 for m_data_content in conversation_data["messages"].values() if m_data_content.get("branch_id") == branch_id)
-        branch_info["message_count"] = count
-        if branch_id == conversation_data.get("metadata", {}).get("active_branch"):
-            conversation_data["metadata"]["active_leaf"] = msg_id
+        self.get_tree(conversation_data).add_message(message)
 
     def _get_last_message_id(self, conversation_data: Dict[str, Any], branch_id: Optional[str] = None) -> Optional[str]:
         if not conversation_data: return None
@@ -228,17 +256,35 @@ class BaseClientFeatures:
         if not conversation_id or not conversation_data:
             if not quiet: print(f"{Colors.WARNING}No active conversation data to save.{Colors.ENDC}")
             return
-        filename = self.format_filename(title, conversation_id)
-        filepath = conversations_dir / filename
+        filepath = self.conversation_path(conversations_dir, title, conversation_id)
+        use_journal = self.storage_format == "journal"
+        if use_journal:
+            filepath = filepath.with_suffix(JOURNAL_SUFFIX)
+        # A sibling file in the other format is superseded by this save
+        other_format_path = filepath.with_suffix(".json" if use_journal else JOURNAL_SUFFIX)
         if "metadata" in conversation_data:
             conversation_data["metadata"]["updated_at"] = datetime.now().isoformat()
             conversation_data["metadata"]["total_message_count"] = len(conversation_data.get("messages", {}))
         if not quiet: print(f"{Colors.CYAN}Saving conversation (v{self.VERSION}) to {filepath}...{Colors.ENDC}")
         try:
+            # Serialize on the calling (event loop) thread so the structure is not read
+            # while it is being mutated; only the file I/O runs in the worker thread.
+            write_file = self.prepare_conversation_write(filepath, conversation_data)
+            summary = ConversationCatalog.summarize_conversation(conversation_data)
+            catalog = self.get_catalog(conversations_dir)
+            search_update = catalog.prepare_search_update(filepath, conversation_data)
+
             def save_json_sync():
+                # A legacy flat file of this conversation is superseded by its sharded path
+                legacy_path = catalog.find_path_by_id(conversation_id) if self.layout == "sharded" else None
                 filepath.parent.mkdir(parents=True, exist_ok=True)
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(conversation_data, f, indent=2, ensure_ascii=False)
+                write_file()
+                catalog.record_summary(filepath, summary)
+                catalog.apply_search_update(filepath, search_update)
+                for superseded in (other_format_path, legacy_path):
+                    if superseded and superseded != filepath and superseded.exists():
+                        os.remove(superseded)
+                        self.forget_conversation_file(superseded)
             await asyncio.to_thread(save_json_sync)
             if not quiet:
                 msg_count = len(conversation_data.get("messages", {}))
@@ -246,14 +292,109 @@ class BaseClientFeatures:
         except Exception as e:
             print(f"{Colors.FAIL}Error saving conversation '{title}' to {filepath}: {e}{Colors.ENDC}")
 
-    async def load_conversation_data(self, filepath: Path) -> Optional[Dict[str, Any]]:
+    def read_conversation_file(self, filepath: Path) -> Dict[str, Any]:
+        """Reads a conversation file in either storage format (synchronous)."""
+        if filepath.suffix == JOURNAL_SUFFIX:
+            return self._journal.load(filepath)
+        return load_file(filepath)
+
+    def prepare_conversation_write(self, filepath: Path, conversation_data: Dict[str, Any]) -> Callable[[], None]:
+        """
+        Serializes a conversation for the format implied by the file suffix and
+        returns a callable that performs the file I/O. Non-journal files are encoded
+        with the configured codec (compression happens in the returned callable),
+        written to a temporary file and moved into place with os.replace.
+        """
+        if filepath.suffix == JOURNAL_SUFFIX:
+            prepared = self._journal.prepare_save(filepath, conversation_data)
+            return lambda: self._journal.commit(prepared)
+        codec = self.codec
+        encoded = codec.encode(order_for_header_reads(conversation_data))
+
+        def write_json_atomic() -> None:
+            tmp_path = filepath.with_name(filepath.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(codec.finish(encoded))
+            os.replace(tmp_path, filepath)
+        return write_json_atomic
+
+    def write_conversation_file(self, filepath: Path, conversation_data: Dict[str, Any]) -> None:
+        """Writes a conversation file in the format implied by its suffix (synchronous)."""
+        self.prepare_conversation_write(filepath, conversation_data)()
+
+    def read_conversation_header(self, filepath: Path) -> Dict[str, Any]:
+        """
+        Reads conversation_id, version, metadata (and branches where available) without
+        decoding message bodies (synchronous). Files that keep metadata after the
+        messages fall back to a full read.
+        """
+        if filepath.suffix == JOURNAL_SUFFIX:
+            return self._journal.read_header(filepath)
+        header = read_json_header(filepath)
+        if "metadata" not in header.values and header.reached_messages:
+            full_data = self.read_conversation_file(filepath)
+            return {k: v for k, v in full_data.items() if k != "messages"}
+        return header.values
+
+    def update_conversation_metadata(self, filepath: Path, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Applies metadata changes to a conversation file without re-encoding its messages
+        (synchronous). Journals get an appended metadata record; JSON files get their
+        header spliced. Returns the resulting metadata.
+        """
+        if filepath.suffix == JOURNAL_SUFFIX:
+            self._journal.append_metadata(filepath, changes)
+            return self._journal.read_header(filepath).get("metadata", {})
+        metadata = dict(read_json_header(filepath).values.get("metadata") or {})
+        metadata.update(changes)
+        if not update_json_metadata(filepath, metadata):
+            full_data = self.read_conversation_file(filepath)
+            full_data.setdefault("metadata", {}).update(changes)
+            metadata = full_data["metadata"]
+            self.write_conversation_file(filepath, full_data)
+        return metadata
+
+    def mark_messages_changed(self, conversations_dir: Path, conversation_id: str,
+                              conversation_data: Dict[str, Any], *message_ids: str) -> None:
+        """
+        Records that already saved messages were modified in place, so the next save
+        re-indexes them for search and, for journals, writes them again (JSON files are
+        rewritten whole on every save anyway).
+        """
+        if not conversation_id or not conversation_data:
+            return
+        title = conversation_data.get("metadata", {}).get("title", "Untitled")
+        filepath = self.conversation_path(conversations_dir, title, conversation_id)
+        if self.storage_format == "journal":
+            filepath = filepath.with_suffix(JOURNAL_SUFFIX)
+            self._journal.mark_messages_changed(filepath, message_ids)
+        self.get_catalog(conversations_dir).mark_messages_changed(filepath, message_ids)
+
+    def forget_conversation_file(self, filepath: Path) -> None:
+        """Drops cached state (catalog row, journal write state) for a file that was removed or moved."""
+        self._journal.forget(filepath)
+        self.get_catalog(conversations_root(filepath)).remove(filepath)
+
+    async def load_conversation_data(self, filepath: Path, metadata_only: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Loads a conversation file. With metadata_only=True only the header
+        (conversation_id, version, metadata, branches) is read; message bodies are
+        not decoded and the result has no "messages" key.
+        """
         if not filepath.exists():
             print(f"{Colors.FAIL}Conversation file not found: {filepath}{Colors.ENDC}")
             return None
         try:
-            def load_json_sync():
-                with open(filepath, 'r', encoding='utf-8') as f: return json.load(f)
-            loaded_data = await asyncio.to_thread(load_json_sync)
+            def load_sync():
+                if metadata_only:
+                    return self.read_conversation_header(filepath)
+                data = self.read_conversation_file(filepath)
+                if isinstance(data, dict):
+                    # Older files carry base64 attachments inline; move them to the blob store
+                    if self.get_attachment_store(conversations_root(filepath)).externalize_conversation(data):
+                        self._journal.forget(filepath)  # Journal message records are immutable; rewrite on next save
+                return data
+            loaded_data = await asyncio.to_thread(load_sync)
             if not isinstance(loaded_data, dict) or "conversation_id" not in loaded_data or "metadata" not in loaded_data:
                 print(f"{Colors.WARNING}File {filepath} does not appear to be a valid CannonAI conversation file.{Colors.ENDC}")
                 return None
@@ -273,38 +414,32 @@ class BaseClientFeatures:
         if potential_path1.exists() and potential_path1.is_file(): return potential_path1
         potential_path2 = conversations_dir / f"{conversation_id_or_filename}.json"
         if potential_path2.exists() and potential_path2.is_file(): return potential_path2
-        for file_path in conversations_dir.glob("*.json"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f: data = json.load(f)
-                if data.get("conversation_id") == conversation_id_or_filename: return file_path
-            except (json.JSONDecodeError, IOError, TypeError): continue
-        return None
+        potential_path3 = conversations_dir / f"{conversation_id_or_filename}{JOURNAL_SUFFIX}"
+        if potential_path3.exists() and potential_path3.is_file(): return potential_path3
+        # Sharded files are named <conversation_id>.json, so both IDs and filenames map to a path
+        conversation_id = Path(conversation_id_or_filename).stem if conversation_id_or_filename.endswith((".json", JOURNAL_SUFFIX)) else conversation_id_or_filename
+        for suffix in (".json", JOURNAL_SUFFIX):
+            sharded_path = conversations_dir / sharded_relpath(conversation_id, suffix)
+            if sharded_path.is_file(): return sharded_path
+        # ID lookups go through the catalog's ID index instead of parsing every file
+        return self.get_catalog(conversations_dir).find_path_by_id(conversation_id_or_filename)
 
     async def list_conversation_files_info(self, conversations_dir: Path) -> List[Dict[str, Any]]:
+        """Lists conversation summaries from the persistent catalog, re-reading only changed files."""
         def list_files_sync():
-            convs_info = []
             if not conversations_dir.exists():
                 print(f"{Colors.WARNING}Conversations directory not found: {conversations_dir}{Colors.ENDC}")
-                return convs_info
-            for file_path in conversations_dir.glob("*.json"):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f: data = json.load(f)
-                    metadata = data.get("metadata", {})
-                    messages_dict = data.get("messages", {})
-                    message_count = len(messages_dict)
-                    if message_count == 0 and "history" in data and isinstance(data["history"], list):
-                        message_count = sum(1 for item in data.get("history", []) if item.get("type") == "message")
-                    sys_instruct_prev = metadata.get("system_instruction", "")
-                    sys_instruct_prev = (sys_instruct_prev[:50] + "...") if len(sys_instruct_prev) > 50 else sys_instruct_prev
-                    convs_info.append({
-                        "filename": file_path.name, "path": str(file_path),
-                        "title": metadata.get("title", "Untitled Conversation"),
-                        "provider": metadata.get("provider", "N/A"), "model": metadata.get("model", "N/A"),
-                        "created_at": metadata.get("created_at", "N/A"), "updated_at": metadata.get("updated_at", "N/A"),
-                        "message_count": message_count, "conversation_id": data.get("conversation_id"),
-                        "system_instruction_preview": sys_instruct_prev or "N/A"
-                    })
-                except Exception as e:
-                    print(f"{Colors.WARNING}Error reading or parsing {file_path.name}: {e}{Colors.ENDC}")
-            return sorted(convs_info, key=lambda x: x.get("updated_at", "0"), reverse=True)
-        return await asyncio.to_thread(list_files_sync)
\ No newline at end of file
+                return []
+            return self.get_catalog(conversations_dir).list_entries()
+        return await asyncio.to_thread(list_files_sync)
+
+    async def conversation_list_version(self, conversations_dir: Path) -> Optional[str]:
+        """Changes whenever list_conversation_files_info() would return something else (see ConversationCatalog.fingerprint)."""
+        if not conversations_dir.exists():
+            return None
+        return await asyncio.to_thread(self.get_catalog(conversations_dir).fingerprint)
+
+    async def search_conversations(self, conversations_dir: Path, query: str,
+                                   page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Full-text search over every saved conversation; see ConversationCatalog.search."""
+        return await asyncio.to_thread(self.get_catalog(conversations_dir).search, query, page, page_size)
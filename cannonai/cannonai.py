@@ -17,6 +17,7 @@ from command_handler import sync_command_loop, async_command_loop
 
 # Import colors
 from base_client import Colors
+from conversation_layout import migrate_to_sharded
 
 
 # from gui.server import start_gui_server # Imported locally when --gui is used
@@ -67,8 +68,12 @@ def parse_arguments():
                         help='Directory to store conversations. Overrides config.')
     parser.add_argument('--gui', action='store_true',
                         help='Launch with GUI interface. CLI --api-key is ignored in GUI mode.')
+    parser.add_argument('--asgi', action='store_true',
+                        help='With --gui, serve the GUI as an ASGI app under uvicorn instead of the Flask server.')
     parser.add_argument('--quiet', action='store_true',
                         help='Suppress non-essential output messages (like "Config loaded").')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report import times of a cold start (CLI, or GUI with --gui) for the configured provider and exit.')
 
 
     # Configuration options
@@ -76,6 +81,8 @@ def parse_arguments():
     config_group.add_argument('--config', help='Path to configuration file.')
     config_group.add_argument('--setup', action='store_true',
                               help='Run configuration setup wizard.')
+    config_group.add_argument('--migrate-layout', action='store_true',
+                              help='Move conversation files into the sharded ab/cd/<id> layout, switch the config to it, and exit.')
 
     # Advanced options for generation parameters
     advanced_group = parser.add_argument_group('Generation Parameters (Overrides Config)')
@@ -126,6 +133,23 @@ def main():
         config.setup_wizard() # Wizard uses its own print statements
         sys.exit(0)
 
+    if args.profile_startup:
+        from startup_profile import profile_startup, print_startup_report
+        provider_name = args.provider or config.get("default_provider", "gemini")
+        print_startup_report(profile_startup(provider_name, gui=args.gui), Colors)
+        sys.exit(0)
+
+    if args.migrate_layout:
+        conversations_dir = Path(args.conversations_dir or config.get("conversations_dir") or Path.home() / "cannonai_conversations")
+        if not conversations_dir.is_dir():
+            print(f"{Colors.FAIL}Conversations directory not found: {conversations_dir}{Colors.ENDC}")
+            sys.exit(1)
+        moved = migrate_to_sharded(conversations_dir)
+        print(f"{Colors.GREEN}Moved {len(moved)} conversation file(s) into the sharded layout in {conversations_dir}.{Colors.ENDC}")
+        config.set("conversation_layout", "sharded")
+        config.save_config()
+        sys.exit(0)
+
     display_welcome_message()
     # The "Config loaded from..." message is now handled by Config class itself based on its quiet flag.
 
@@ -140,9 +164,12 @@ def main():
 
     if args.gui:
         if not args.quiet:
-            print(f"{Colors.BLUE}Starting GUI mode (Flask + Bootstrap)...{Colors.ENDC}")
+            print(f"{Colors.BLUE}Starting GUI mode ({'ASGI' if args.asgi else 'Flask'} + Bootstrap)...{Colors.ENDC}")
         try:
-            from gui.server import start_gui_server
+            if args.asgi:
+                from gui.asgi import start_asgi_server as start_gui_server
+            else:
+                from gui.server import start_gui_server
             start_gui_server(config,
                              host="127.0.0.1",
                              port=8080,
@@ -186,7 +213,11 @@ async def async_initialize_and_run(client):
         print(f"{Colors.FAIL}Failed to initialize the AI client (provider: {client.provider.provider_name}). Exiting.{Colors.ENDC}")
         sys.exit(1)
 
-    await async_command_loop(client)
+    try:
+        await async_command_loop(client)
+    finally:
+        if client.provider_manager:
+            await client.provider_manager.aclose()  # Close pooled provider connections
 
 
 if __name__ == "__main__":
@@ -11,7 +11,8 @@ from typing import Optional, Union, Dict, Any
 from async_client import AsyncClient # The refactored provider-agnostic client
 # from sync_client import SyncClient # Sync client would need similar refactoring if used
 
-from providers import get_provider_class, ProviderConfig, BaseAIProvider, ProviderError
+from providers import BaseAIProvider, ProviderError
+from provider_manager import ProviderManager # Owns the shared HTTP transport providers send requests through
 from config import Config # For accessing API keys and default models
 from base_client import Colors # For printing error messages during client creation
 
@@ -78,12 +79,10 @@ class ClientManager:
         conversations_dir = conversations_dir_override or (Path(conversations_dir_str) if conversations_dir_str else Path.home() / "cannonai_conversations")
 
 
-        # 5. Initialize Provider Instance
+        # 5. Initialize Provider Instance (through a ProviderManager, so it uses the shared HTTP transport)
+        provider_manager = ProviderManager(config)
         try:
-            provider_class = get_provider_class(provider_name) # from providers/__init__.py
-            # ProviderConfig holds API key and model, potentially other provider-specific settings later
-            provider_config_obj = ProviderConfig(api_key=api_key, model=model_name)
-            provider_instance: BaseAIProvider = provider_class(provider_config_obj)
+            provider_instance: BaseAIProvider = provider_manager.create_provider(provider_name, model_name, api_key=api_key)
             print(f"[ClientManager] Instantiated provider: {provider_instance.__class__.__name__}")
         except ValueError as ve: # Unknown provider from get_provider_class
             print(f"{Colors.FAIL}[ClientManager] Error: {ve}{Colors.ENDC}")
@@ -98,8 +97,11 @@ class ClientManager:
         # 6. Create the AsyncClient instance with the initialized provider
         client = AsyncClient(
             provider=provider_instance,
-            conversations_dir=conversations_dir
+            conversations_dir=conversations_dir,
+            global_config=config
         )
+        client.provider_manager = provider_manager
+        provider_manager.register_provider(provider_name, provider_instance)
         print(f"[ClientManager] AsyncClient created with provider '{provider_name}'.")
 
         # 7. Apply Client-Level Settings (Generation Params, Streaming Preference)
@@ -85,6 +85,14 @@ class CommandHandler:
             "/config": {
                 "handler": self.cmd_config,
                 "description": "Open configuration settings"
+            },
+            "/search": {
+                "handler": self.cmd_search,
+                "description": "Search saved conversations (usage: /search <terms>)"
+            },
+            "/cache": {
+                "handler": self.cmd_cache,
+                "description": "Show prompt-prefix and response cache statistics (usage: /cache [clear])"
             }
         }
         
@@ -99,9 +107,9 @@ class CommandHandler:
         Returns:
             True if the application should exit, False otherwise
         """
-        # Parse command and arguments
-        parts = command.lower().split(maxsplit=1)
-        cmd = parts[0]
+        # Parse command and arguments (arguments keep their case, e.g. search terms and titles)
+        parts = command.strip().split(maxsplit=1)
+        cmd = parts[0].lower()
         args = parts[1] if len(parts) > 1 else ""
         
         # Check for command aliases
@@ -111,7 +119,7 @@ class CommandHandler:
                 # Call the method with await since we're in an async context
                 # Pass arguments if the command accepts them
                 handler = info["handler"]
-                if args and (cmd == "/model" or cmd == "/load"):
+                if args and (cmd == "/model" or cmd == "/load" or cmd == "/search" or cmd == "/cache"):
                     result = await handler(args)
                 else:
                     result = await handler()
@@ -188,6 +196,7 @@ class CommandHandler:
         """Save and exit the application (async version)."""
         print("Saving conversation before exit...")
         await self.client.save_conversation()
+        await self.client.flush_pending_saves()
         print(f"{Colors.GREEN}Goodbye!{Colors.ENDC}")
         return True
     
@@ -219,7 +228,69 @@ class CommandHandler:
         """List saved conversations (async version)."""
         await self.client.display_conversations()
         return False
-    
+
+    async def cmd_search(self, command_args: str = "") -> bool:
+        """Full-text search across saved conversations (async version).
+
+        Args:
+            command_args: Search terms; a trailing * matches word prefixes
+        """
+        query = command_args.strip()
+        if not query:
+            print(f"{Colors.WARNING}Usage: /search <terms>{Colors.ENDC}")
+            return False
+        await self.client.flush_pending_saves()
+        try:
+            response = await self.client.search_conversations(self.client.base_directory, query)
+        except Exception as e:
+            print(f"{Colors.FAIL}Search failed: {e}{Colors.ENDC}")
+            return False
+        if not response["results"]:
+            print(f"{Colors.WARNING}No matches for '{query}'.{Colors.ENDC}")
+            return False
+        print(f"\n{Colors.HEADER}Matches for '{query}' ({response['total']} total):{Colors.ENDC}")
+        for result in response["results"]:
+            where = result["role"] or result["kind"]
+            print(f"{Colors.BOLD}{result['title'] or result['filename']}{Colors.ENDC} "
+                  f"{Colors.CYAN}[{where}]{Colors.ENDC}")
+            print(f"    {result['snippet']}")
+        if response["total"] > len(response["results"]):
+            print(f"{Colors.CYAN}Showing the first {len(response['results'])} matches.{Colors.ENDC}")
+        return False
+
+    async def cmd_cache(self, command_args: str = "") -> bool:
+        """Show prompt-prefix and response cache statistics, or clear the response cache (async version).
+
+        Args:
+            command_args: "clear" to drop every cached response
+        """
+        provider = self.client.provider
+        if command_args.strip().lower() != "clear" and hasattr(provider, "prompt_cache_stats"):
+            prefix = provider.prompt_cache_stats.to_dict()
+            status = "on" if provider.prompt_cache_settings.get("enabled") else "off (set prompt_cache.enabled in the config)"
+            print(f"\n{Colors.HEADER}Prompt-prefix cache ({provider.provider_name}, {status}):{Colors.ENDC}")
+            print(f"  Requests with a cached prefix: {prefix['hits']} of {prefix['requests']}"
+                  f"  Cached tokens: {prefix['cached_tokens']} of {prefix['prompt_tokens']} prompt tokens"
+                  f" ({prefix['cached_token_ratio']:.0%})  Cache writes: {prefix['cache_creation_tokens']} tokens")
+            if prefix['avg_ttft_ms_hit'] is not None or prefix['avg_ttft_ms_miss'] is not None:
+                print(f"  Avg time to first token: {prefix['avg_ttft_ms_hit'] or '-'} ms with a cached prefix, "
+                      f"{prefix['avg_ttft_ms_miss'] or '-'} ms without")
+        cache = getattr(provider, "response_cache", None)
+        if cache is None or not cache.enabled:
+            print(f"{Colors.WARNING}The response cache is disabled (set response_cache.enabled in the config).{Colors.ENDC}")
+            return False
+        if command_args.strip().lower() == "clear":
+            cache.clear()
+            print(f"{Colors.GREEN}Response cache cleared.{Colors.ENDC}")
+            return False
+        stats = cache.get_stats()
+        print(f"\n{Colors.HEADER}Response cache:{Colors.ENDC}")
+        print(f"  Hits: {stats['hits_memory'] + stats['hits_disk']} (memory {stats['hits_memory']}, disk {stats['hits_disk']})"
+              f"  Misses: {stats['misses']}  Hit rate: {stats['hit_rate']:.0%}")
+        print(f"  Stored: {stats['stores']}  Bypassed: {stats['bypassed']}  Evicted: {stats['evictions']}")
+        print(f"  In memory: {stats['memory_size']} entries  Disk: {stats['disk_path'] or 'off'}")
+        return False
+
     async def cmd_load(self, command_args: str = "") -> bool:
         """Load a saved conversation (async version).
         
@@ -470,8 +541,7 @@ async def async_command_loop(client):
             
             # Handle commands
             if user_input.startswith('/'):
-                command = user_input.split()[0].lower()
-                should_exit = await handler.async_handle_command(command)
+                should_exit = await handler.async_handle_command(user_input)
                 if should_exit:
                     break
                 continue
@@ -490,6 +560,7 @@ async def async_command_loop(client):
         except KeyboardInterrupt:
             print("\nDetected Ctrl+C. Saving conversation...")
             await client.save_conversation()
+            await client.flush_pending_saves()
             print(f"{Colors.GREEN}Goodbye!{Colors.ENDC}")
             break
         except Exception as e:
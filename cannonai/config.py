@@ -51,6 +51,15 @@ class Config:
                 "openai": "gpt-3.5-turbo"
             },
             "conversations_dir": str(project_root / "cannonai_conversations"),
+            "conversation_storage_format": "json",  # "json" or "journal" (append-only, see conversation_journal.py)
+            "conversation_codec": "json",  # json, json-compact, gzip, zstd or msgpack (see conversation_codecs.py)
+            "conversation_layout": "flat",  # "flat" (title-based names) or "sharded" (ab/cd/<id>, see conversation_layout.py)
+            "provider_fallback_chain": [],  # Ordered providers to fail over to, e.g. ["gemini", "openai", "deepseek"]
+            "provider_fallback_models": {},  # Model per provider when it stands in, e.g. {"openai": "gpt-4o-mini"}
+            "context_budget": {"enabled": True, "strategy": "drop_oldest", "keep_first": 1, "keep_last": 4, "safety_margin": 0.05},  # History trimming to fit the model's window (see context_budget.py)
+            "prompt_cache": {"enabled": False, "min_prefix_tokens": 1024, "ttl_seconds": 300, "max_cached_contents": 8},  # Provider-side prompt-prefix caching (see providers/prompt_cache.py)
+            "response_cache": {"enabled": False, "memory_entries": 256, "disk": True, "ttl_seconds": 604800, "max_disk_mb": 100},  # Exact-match provider response cache (see providers/response_cache.py)
+            "http_transport": {"max_connections": 20, "max_keepalive_connections": 10, "keepalive_expiry": 60.0, "http2": True},  # Shared provider HTTP pool (see providers/transport.py)
             "generation_params": {
                 "temperature": 0.7,
                 "max_output_tokens": 800,
@@ -58,6 +67,8 @@ class Config:
                 "top_k": 40
             },
             "use_streaming": False,
+            "autosave_coalesce_ms": 250,  # Window in which background autosaves of a conversation are merged
+            "gui_sessions": {"enabled": True, "idle_timeout_seconds": 1800, "max_sessions": 32},  # Per-user GUI clients (see gui/sessions.py)
             "default_system_instruction": self.DEFAULT_SYSTEM_INSTRUCTION,  # This is the global default
         }
         self.quiet = quiet
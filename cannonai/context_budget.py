@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+CannonAI Context Budget - Fits conversation history into a model's context window.
+
+Before a request leaves the process the client estimates the prompt size
+locally, reserves room for the reply (`max_output_tokens`) and, when the
+history does not fit, drops whole turns (a user message and the replies to it)
+according to the configured strategy:
+
+    drop_oldest  Drop the oldest turns first.
+    first_last   Keep the first N and last M turns; drop from the middle first.
+    pinned       Never drop turns containing a pinned message; drop the oldest others.
+
+The system instruction and the turn holding the newest user message are always
+kept. Token counts use tiktoken when it is installed and a characters-per-token
+estimate otherwise. Settings come from the "context_budget" config section.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Tuple
+
+from providers.token_estimator import TokenEstimator, get_estimator
+
+STRATEGIES = ("drop_oldest", "first_last", "pinned")
+
+DEFAULT_BUDGET_SETTINGS: Dict[str, Any] = {
+    "enabled": True,
+    "strategy": "drop_oldest",
+    "keep_first": 1,  # Turns kept at the start by the first_last strategy
+    "keep_last": 4,  # Turns kept at the end by the first_last strategy
+    "safety_margin": 0.05,  # Fraction of the window left unused to absorb estimation error
+    "context_windows": {},  # Per-model overrides, e.g. {"my-finetune": 32768}
+}
+
+
+@dataclass
+class ContextReport:
+    """What the budget engine did to one request."""
+    context_window: int
+    reserved_output_tokens: int
+    budget_tokens: int
+    original_tokens: int
+    prompt_tokens: int
+    strategy: str
+    dropped: List[Dict[str, Any]] = field(default_factory=list)  # {"id", "role", "tokens", "preview"}
+    over_budget: bool = False  # Still too large after dropping everything the strategy allows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"context_window": self.context_window, "reserved_output_tokens": self.reserved_output_tokens,
+                "budget_tokens": self.budget_tokens, "original_tokens": self.original_tokens,
+                "prompt_tokens": self.prompt_tokens, "strategy": self.strategy,
+                "dropped_count": len(self.dropped), "dropped": self.dropped, "over_budget": self.over_budget}
+
+
+def group_turns(messages: List[Dict[str, Any]]) -> List[List[int]]:
+    """Indices of `messages` grouped into turns, each starting at a user message."""
+    turns: List[List[int]] = []
+    for index, message in enumerate(messages):
+        if message.get("role") == "user" or not turns:
+            turns.append([index])
+        else:
+            turns[-1].append(index)
+    return turns
+
+
+def _drop_order(turns: List[List[int]], messages: List[Dict[str, Any]], strategy: str,
+                keep_first: int, keep_last: int) -> List[int]:
+    """Turn indices in the order they may be dropped (the newest turn is never listed)."""
+    candidates = list(range(len(turns) - 1))
+    if strategy == "first_last":
+        protected = set(candidates[:keep_first]) | set(candidates[max(len(candidates) - max(keep_last - 1, 0), 0):])
+        middle = [t for t in candidates if t not in protected]
+        return middle + [t for t in candidates if t in protected]
+    if strategy == "pinned":
+        return [t for t in candidates if not any(messages[i].get("pinned") for i in turns[t])]
+    return candidates
+
+
+def fit_to_budget(preamble: List[Dict[str, Any]], messages: List[Dict[str, Any]], context_window: int,
+                  max_output_tokens: int, strategy: str = "drop_oldest", keep_first: int = 1, keep_last: int = 4,
+                  safety_margin: float = 0.05,
+                  estimator: Optional[TokenEstimator] = None) -> Tuple[List[Dict[str, Any]], ContextReport]:
+    """
+    Drops turns from `messages` until preamble + messages fit the window minus the reply reservation.
+
+    Args:
+        preamble: Messages always sent (the system instruction).
+        messages: Stored conversation messages, oldest first; may carry "id" and "pinned".
+        context_window: The model's total context size in tokens.
+        max_output_tokens: Tokens reserved for the reply.
+        strategy: One of STRATEGIES.
+
+    Returns:
+        The kept messages (in order) and a ContextReport.
+    """
+    estimator = estimator or get_estimator()
+    if strategy not in STRATEGIES:
+        strategy = "drop_oldest"
+    budget = int(context_window * (1 - safety_margin)) - max_output_tokens
+    costs = [estimator.count_message(m) for m in messages]
+    preamble_tokens = sum(estimator.count_message(m) for m in preamble)
+    total = original = preamble_tokens + sum(costs)
+    report = ContextReport(context_window=context_window, reserved_output_tokens=max_output_tokens,
+                           budget_tokens=budget, original_tokens=original, prompt_tokens=original, strategy=strategy)
+    if total <= budget:
+        return messages, report
+
+    turns = group_turns(messages)
+    dropped_turns = set()
+    for turn_index in _drop_order(turns, messages, strategy, keep_first, keep_last):
+        if total <= budget:
+            break
+        dropped_turns.add(turn_index)
+        total -= sum(costs[i] for i in turns[turn_index])
+
+    dropped_indices = {i for t in dropped_turns for i in turns[t]}
+    for i in sorted(dropped_indices):
+        content = messages[i].get("content") or ""
+        report.dropped.append({"id": messages[i].get("id"), "role": messages[i].get("role"), "tokens": costs[i],
+                               "preview": content[:60] + ("..." if len(content) > 60 else "")})
+    report.prompt_tokens = total
+    report.over_budget = total > budget
+    return [m for i, m in enumerate(messages) if i not in dropped_indices], report
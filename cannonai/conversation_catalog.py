@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Catalog - Persistent index of saved conversation files.
+
+This module keeps a small SQLite sidecar database next to the conversation files
+so that listing conversations does not require parsing every file on disk.
+Each row is keyed by the file's path relative to the directory (see
+conversation_layout for the flat and sharded layouts) and stamped with the file's mtime and size; only
+files whose stamp changed since the last refresh are re-read.
+
+The same database holds an FTS5 full-text index over message content, titles
+and system instructions. Saves add only the messages not yet indexed (the indexed
+message IDs are kept per file, so this holds across restarts) plus the messages
+marked as changed in place; files changed outside the client are re-indexed lazily
+on the next search.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+
+from conversation_codecs import load_file
+from conversation_header import read_json_header
+from conversation_journal import ConversationJournal, JOURNAL_SUFFIX
+from conversation_layout import DirectoryScanner, relative_key
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationCatalog:
+    """
+    SQLite-backed catalog of conversation summaries for one conversations directory.
+
+    The catalog is updated incrementally by the client on save, rename, duplicate
+    and delete, and lazily reconciled against the directory on listing.
+    """
+
+    CATALOG_FILENAME = ".cannonai_catalog.sqlite3"
+    SCHEMA_VERSION = "3"
+
+    def __init__(self, conversations_dir: Path):
+        self.conversations_dir = Path(conversations_dir)
+        self.db_path = self.conversations_dir / self.CATALOG_FILENAME
+        self._lock = threading.RLock()  # Catalog is used from asyncio.to_thread worker threads
+        self._conn: Optional[sqlite3.Connection] = None
+        self._reconciled = False  # Whether refresh() has run against the directory in this process
+        self._scanner = DirectoryScanner(self.conversations_dir)
+        self.search_available = True  # False when SQLite was built without FTS5
+        self._indexed_ids: Dict[str, set] = {}  # filename -> message IDs known to be in the search index
+        self._changed_ids: Dict[str, set] = {}  # filename -> indexed message IDs edited since they were indexed
+
+    # ---------- Connection management ----------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        self.conversations_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            self._conn = self._open_and_migrate()
+        except sqlite3.DatabaseError as e:
+            # A corrupt catalog is only a cache; drop it and rebuild from the files.
+            logger.warning(f"Conversation catalog at {self.db_path} is unreadable ({e}). Rebuilding.")
+            self._discard_db_file()
+            self._reconciled = False
+            self._conn = self._open_and_migrate()
+        return self._conn
+
+    def _open_and_migrate(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS catalog_info (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM catalog_info WHERE key = 'schema_version'").fetchone()
+        if row is None or row["value"] != self.SCHEMA_VERSION:
+            for table in ("conversations", "search_fts", "search_docs", "search_state"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                filename TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                conversation_id TEXT,
+                title TEXT,
+                provider TEXT,
+                model TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                message_count INTEGER,
+                system_instruction_preview TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_conversation_id ON conversations (conversation_id)")
+        # Search index: each search_docs row shares its rowid with the search_fts row holding the text
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_docs (
+                rowid INTEGER PRIMARY KEY,
+                filename TEXT NOT NULL,
+                message_id TEXT,
+                kind TEXT NOT NULL,
+                role TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_search_docs_filename ON search_docs (filename, message_id)")
+        # message_ids: JSON list of the message IDs whose documents are in the index
+        conn.execute("CREATE TABLE IF NOT EXISTS search_state (filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, message_ids TEXT)")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(content, tokenize = 'unicode61 remove_diacritics 2')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 is unavailable ({e}); conversation search is disabled.")
+            self.search_available = False
+        conn.execute("INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('schema_version', ?)", (self.SCHEMA_VERSION,))
+        conn.commit()
+        return conn
+
+    def _discard_db_file(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(f"{self.db_path}{suffix}")
+            except FileNotFoundError:
+                pass
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- Summaries ----------
+
+    @staticmethod
+    def summarize_conversation(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the listing summary for an in-memory conversation structure."""
+        metadata = data.get("metadata", {})
+        if "messages" in data:
+            message_count = len(data["messages"])
+        else:  # Header-only read; saves record the count in metadata
+            message_count = metadata.get("total_message_count", 0)
+        if message_count == 0 and "history" in data and isinstance(data["history"], list):
+            message_count = sum(1 for item in data.get("history", []) if item.get("type") == "message")
+        sys_instruct_prev = metadata.get("system_instruction", "") or ""
+        sys_instruct_prev = (sys_instruct_prev[:50] + "...") if len(sys_instruct_prev) > 50 else sys_instruct_prev
+        return {
+            "conversation_id": data.get("conversation_id"),
+            "title": metadata.get("title", "Untitled Conversation"),
+            "provider": metadata.get("provider", "N/A"),
+            "model": metadata.get("model", "N/A"),
+            "created_at": metadata.get("created_at", "N/A"),
+            "updated_at": metadata.get("updated_at", "N/A"),
+            "message_count": message_count,
+            "system_instruction_preview": sys_instruct_prev or "N/A",
+        }
+
+    def _read_summary_from_file(self, file_path: Path) -> Dict[str, Any]:
+        # Header-only read when the file records total_message_count ahead of its messages
+        if file_path.suffix == JOURNAL_SUFFIX:
+            header = ConversationJournal().read_header(file_path)
+        else:
+            header = read_json_header(file_path).values
+        if "total_message_count" in header.get("metadata", {}):
+            return self.summarize_conversation(header)
+        if file_path.suffix == JOURNAL_SUFFIX:
+            return self.summarize_conversation(ConversationJournal().load(file_path))
+        return self.summarize_conversation(load_file(file_path))
+
+    @staticmethod
+    def _stat_stamp(file_path: Path) -> Tuple[int, int]:
+        st = file_path.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def _upsert(self, conn: sqlite3.Connection, filename: str, stamp: Tuple[int, int], summary: Dict[str, Any]) -> None:
+        conn.execute("""
+            INSERT OR REPLACE INTO conversations (
+                filename, mtime_ns, size, conversation_id, title, provider, model,
+                created_at, updated_at, message_count, system_instruction_preview
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (filename, stamp[0], stamp[1], summary.get("conversation_id"), summary.get("title"),
+              summary.get("provider"), summary.get("model"), summary.get("created_at"),
+              summary.get("updated_at"), summary.get("message_count"), summary.get("system_instruction_preview")))
+
+    def _row_to_info(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "filename": Path(row["filename"]).name, "path": str(self.conversations_dir / row["filename"]),
+            "title": row["title"], "provider": row["provider"], "model": row["model"],
+            "created_at": row["created_at"], "updated_at": row["updated_at"],
+            "message_count": row["message_count"], "conversation_id": row["conversation_id"],
+            "system_instruction_preview": row["system_instruction_preview"],
+        }
+
+    # ---------- Incremental updates ----------
+
+    def key_for(self, file_path: Path) -> str:
+        return relative_key(self.conversations_dir, Path(file_path))
+
+    def record(self, file_path: Path, conversation_data: Dict[str, Any]) -> None:
+        """Records a just-written conversation file using its in-memory data (no re-parse)."""
+        self.record_summary(file_path, self.summarize_conversation(conversation_data))
+
+    def record_summary(self, file_path: Path, summary: Dict[str, Any]) -> None:
+        """Records a just-written conversation file using a precomputed summary."""
+        file_path = Path(file_path)
+        try:
+            stamp = self._stat_stamp(file_path)
+        except OSError as e:
+            logger.warning(f"Catalog could not stat {file_path}: {e}")
+            return
+        with self._lock:
+            conn = self._connect()
+            self._upsert(conn, self.key_for(file_path), stamp, summary)
+            conn.commit()
+
+    def remove(self, file_path: Path) -> None:
+        """Removes a conversation file's entry and search documents (after delete or rename)."""
+        filename = self.key_for(file_path)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM conversations WHERE filename = ?", (filename,))
+            self._delete_search_docs(conn, filename)
+            conn.commit()
+
+    def refresh(self) -> None:
+        """
+        Reconciles the catalog with the directory. Only files whose mtime or size
+        changed since they were last recorded are opened and parsed.
+        """
+        if not self.conversations_dir.exists():
+            return
+        with self._lock:
+            conn = self._connect()
+            known = {row["filename"]: (row["mtime_ns"], row["size"])
+                     for row in conn.execute("SELECT filename, mtime_ns, size FROM conversations")}
+            seen = self._scanner.scan()
+            for key, stamp in seen.items():
+                if known.get(key) == stamp:
+                    continue
+                try:
+                    summary = self._read_summary_from_file(self.conversations_dir / key)
+                except Exception as e:
+                    logger.warning(f"Error reading or parsing {key}: {e}")
+                    continue
+                self._upsert(conn, key, stamp, summary)
+            stale = [name for name in known if name not in seen]
+            if stale:
+                conn.executemany("DELETE FROM conversations WHERE filename = ?", [(name,) for name in stale])
+                for name in stale:
+                    self._delete_search_docs(conn, name)
+            conn.commit()
+            self._reconciled = True
+
+    # ---------- Queries ----------
+
+    def fingerprint(self) -> str:
+        """
+        Changes whenever list_entries() would: the row count, newest file mtime and total
+        size, read after a refresh. A save always writes the newest mtime, and rows written
+        by other clients sharing the database count too.
+        """
+        self.refresh()
+        with self._lock:
+            conn = self._connect()
+            count, newest_mtime, size_total = conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(mtime_ns), 0), COALESCE(SUM(size), 0) FROM conversations").fetchone()
+        return f"{count}-{newest_mtime}-{size_total}"
+
+    def list_entries(self) -> List[Dict[str, Any]]:
+        """Returns summaries for all conversation files, newest first."""
+        self.refresh()
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT * FROM conversations ORDER BY updated_at DESC").fetchall()
+        return [self._row_to_info(row) for row in rows]
+
+    def find_path_by_id(self, conversation_id: str) -> Optional[Path]:
+        """
+        Resolves a conversation ID to its file path via the index.
+
+        Each hit is verified against the file's current mtime/size; a stale row is
+        re-read for that single file only. The directory is reconciled only when the
+        catalog has not been reconciled yet in this process (e.g. it was missing or
+        corrupt), so steady-state lookups cost one indexed query and one stat.
+        """
+        with self._lock:
+            path = self._lookup_verified(conversation_id)
+            if path is None and not self._reconciled:
+                self.refresh()
+                path = self._lookup_verified(conversation_id)
+            return path
+
+    def _lookup_verified(self, conversation_id: str) -> Optional[Path]:
+        conn = self._connect()
+        rows = conn.execute("SELECT filename, mtime_ns, size FROM conversations WHERE conversation_id = ?",
+                            (conversation_id,)).fetchall()
+        for row in rows:
+            file_path = self.conversations_dir / row["filename"]
+            try:
+                stamp = self._stat_stamp(file_path)
+            except OSError:
+                conn.execute("DELETE FROM conversations WHERE filename = ?", (row["filename"],))
+                conn.commit()
+                continue
+            if stamp == (row["mtime_ns"], row["size"]):
+                return file_path
+            try:
+                summary = self._read_summary_from_file(file_path)
+            except Exception as e:
+                logger.warning(f"Error reading or parsing {file_path.name}: {e}")
+                continue
+            self._upsert(conn, row["filename"], stamp, summary)
+            conn.commit()
+            if summary.get("conversation_id") == conversation_id:
+                return file_path
+        return None
+
+
+    # ---------- Full-text search ----------
+
+    def prepare_search_update(self, file_path: Path, conversation_data: Dict[str, Any]) -> Optional["_SearchUpdate"]:
+        """
+        Collects the text to index for a conversation that is about to be saved.
+
+        Runs on the thread that owns the live structure; only messages not yet in
+        the index, or marked as changed, are collected. `apply_search_update` writes
+        them after the save.
+        """
+        if not self.search_available:
+            return None
+        filename = self.key_for(file_path)
+        with self._lock:
+            known_ids = self._indexed_ids.get(filename)
+            if known_ids is None:
+                known_ids = self._load_indexed_ids(filename)
+            changed_ids = self._changed_ids.pop(filename, set())
+        full = known_ids is None
+        messages = conversation_data.get("messages", {})
+        new_docs = [(msg_id, msg.get("type"), msg.get("content") or "")
+                    for msg_id, msg in messages.items()
+                    if (full or msg_id not in known_ids or msg_id in changed_ids) and msg.get("content")]
+        metadata = conversation_data.get("metadata", {})
+        return _SearchUpdate(filename, full, new_docs, set(messages.keys()), changed_ids,
+                             metadata.get("title") or "", metadata.get("system_instruction") or "")
+
+    def mark_messages_changed(self, file_path: Path, message_ids: Iterable[str]) -> None:
+        """Has the next save re-index `message_ids` because they were edited after being indexed."""
+        filename = self.key_for(file_path)
+        with self._lock:
+            self._changed_ids.setdefault(filename, set()).update(message_ids)
+
+    def _load_indexed_ids(self, filename: str) -> Optional[set]:
+        """The indexed message IDs recorded for a file by an earlier save (possibly in another process)."""
+        conn = self._connect()
+        if not self.search_available:
+            return None
+        row = conn.execute("SELECT message_ids FROM search_state WHERE filename = ?", (filename,)).fetchone()
+        if row is None or row["message_ids"] is None:
+            return None
+        known_ids = set(json.loads(row["message_ids"]))
+        self._indexed_ids[filename] = known_ids
+        return known_ids
+
+    def apply_search_update(self, file_path: Path, update: Optional["_SearchUpdate"]) -> None:
+        """Writes a prepared search update and stamps the index with the file's current mtime/size."""
+        if update is None:
+            return
+        try:
+            stamp = self._stat_stamp(Path(file_path))
+        except OSError:
+            return
+        with self._lock:
+            conn = self._connect()
+            if not self.search_available:
+                return
+            self._write_search_docs(conn, update)
+            self._stamp_search_state(conn, update.filename, stamp)
+            conn.commit()
+
+    def _write_search_docs(self, conn: sqlite3.Connection, update: "_SearchUpdate") -> None:
+        if update.full:
+            self._delete_search_docs(conn, update.filename)
+        else:  # Title and system instruction may have changed, as may the messages marked as changed
+            self._delete_search_docs(conn, update.filename, kinds=("title", "system"))
+            for message_id in update.changed_ids:
+                params = (update.filename, message_id)
+                conn.execute("DELETE FROM search_fts WHERE rowid IN "
+                             "(SELECT rowid FROM search_docs WHERE filename = ? AND message_id = ?)", params)
+                conn.execute("DELETE FROM search_docs WHERE filename = ? AND message_id = ?", params)
+        docs = [(None, "title", None, update.title), (None, "system", None, update.system_instruction)]
+        docs += [(msg_id, "message", role, content) for msg_id, role, content in update.new_docs]
+        for message_id, kind, role, content in docs:
+            if not content:
+                continue
+            cursor = conn.execute("INSERT INTO search_docs (filename, message_id, kind, role) VALUES (?, ?, ?, ?)",
+                                  (update.filename, message_id, kind, role))
+            conn.execute("INSERT INTO search_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+        indexed = self._indexed_ids.setdefault(update.filename, set())
+        indexed.update(update.message_ids)
+
+    def _stamp_search_state(self, conn: sqlite3.Connection, filename: str, stamp: Tuple[int, int]) -> None:
+        indexed = sorted(self._indexed_ids.get(filename, ()))
+        conn.execute("INSERT OR REPLACE INTO search_state (filename, mtime_ns, size, message_ids) VALUES (?, ?, ?, ?)",
+                     (filename, stamp[0], stamp[1], json.dumps(indexed)))
+
+    def _delete_search_docs(self, conn: sqlite3.Connection, filename: str, kinds: Optional[Tuple[str, ...]] = None) -> None:
+        if not self.search_available:
+            return
+        if kinds is None:
+            where, params = "filename = ?", (filename,)
+            self._indexed_ids.pop(filename, None)
+            self._changed_ids.pop(filename, None)
+            conn.execute("DELETE FROM search_state WHERE filename = ?", (filename,))
+        else:
+            where = f"filename = ? AND kind IN ({', '.join('?' for _ in kinds)})"
+            params = (filename,) + tuple(kinds)
+        conn.execute(f"DELETE FROM search_fts WHERE rowid IN (SELECT rowid FROM search_docs WHERE {where})", params)
+        conn.execute(f"DELETE FROM search_docs WHERE {where}", params)
+
+    def _reindex_stale_search_docs(self, conn: sqlite3.Connection) -> None:
+        """Re-indexes files that changed since they were indexed (or were never indexed)."""
+        rows = conn.execute("""
+            SELECT c.filename FROM conversations c LEFT JOIN search_state s ON s.filename = c.filename
+            WHERE s.filename IS NULL OR s.mtime_ns != c.mtime_ns OR s.size != c.size
+        """).fetchall()
+        for row in rows:
+            file_path = self.conversations_dir / row["filename"]
+            try:
+                if file_path.suffix == JOURNAL_SUFFIX:
+                    data = ConversationJournal().load(file_path)
+                else:
+                    data = load_file(file_path)
+                stamp = self._stat_stamp(file_path)
+            except Exception as e:
+                logger.warning(f"Could not index {row['filename']} for search: {e}")
+                continue
+            self._delete_search_docs(conn, row["filename"])  # Forgets the indexed IDs, so the update is full
+            self._write_search_docs(conn, self.prepare_search_update(file_path, data))
+            self._stamp_search_state(conn, row["filename"], stamp)
+        if rows:
+            conn.commit()
+
+    @staticmethod
+    def _build_match_query(query: str) -> str:
+        # Quote every term so user input cannot inject FTS5 syntax; a trailing * keeps prefix search
+        terms = []
+        for term in query.split():
+            prefix = term.endswith("*") and len(term) > 1
+            term = term.rstrip("*").replace('"', '""')
+            if term:
+                terms.append(f'"{term}"' + ("*" if prefix else ""))
+        return " ".join(terms)
+
+    def search(self, query: str, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """
+        Ranked full-text search across all conversations in the directory.
+
+        Returns:
+            {"query", "page", "page_size", "total", "results": [...]} where each result
+            has filename, conversation_id, title, message_id (None for title/system
+            instruction hits), kind, role, snippet and score (lower is better).
+        """
+        if not self.search_available:
+            raise RuntimeError("Conversation search requires SQLite with FTS5 support.")
+        page, page_size = max(1, page), max(1, min(page_size, 100))
+        match = self._build_match_query(query)
+        response: Dict[str, Any] = {"query": query, "page": page, "page_size": page_size, "total": 0, "results": []}
+        if not match:
+            return response
+        self.refresh()
+        with self._lock:
+            conn = self._connect()
+            if not self.search_available:
+                raise RuntimeError("Conversation search requires SQLite with FTS5 support.")
+            self._reindex_stale_search_docs(conn)
+            response["total"] = conn.execute("SELECT count(*) FROM search_fts WHERE search_fts MATCH ?", (match,)).fetchone()[0]
+            rows = conn.execute("""
+                SELECT d.filename, d.message_id, d.kind, d.role, c.conversation_id, c.title, c.updated_at,
+                       snippet(search_fts, 0, '[', ']', '...', 12) AS snippet, bm25(search_fts) AS score
+                FROM search_fts
+                JOIN search_docs d ON d.rowid = search_fts.rowid
+                LEFT JOIN conversations c ON c.filename = d.filename
+                WHERE search_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (match, page_size, (page - 1) * page_size)).fetchall()
+        response["results"] = [{
+            "filename": Path(row["filename"]).name, "path": str(self.conversations_dir / row["filename"]),
+            "conversation_id": row["conversation_id"], "title": row["title"],
+            "updated_at": row["updated_at"], "message_id": row["message_id"], "kind": row["kind"],
+            "role": row["role"], "snippet": row["snippet"], "score": row["score"],
+        } for row in rows]
+        return response
+
+
+class _SearchUpdate:
+    """Text collected on the event loop for one conversation's search index update."""
+
+    def __init__(self, filename: str, full: bool, new_docs: List[Tuple[str, Optional[str], str]],
+                 message_ids: set, changed_ids: set, title: str, system_instruction: str):
+        self.filename = filename
+        self.full = full  # Replace every document of the file instead of appending
+        self.new_docs = new_docs  # (message_id, role, content)
+        self.message_ids = message_ids
+        self.changed_ids = changed_ids  # Indexed messages whose documents are replaced
+        self.title = title
+        self.system_instruction = system_instruction
+
+if __name__ == "__main__":
+    # Lookup microbenchmark: resolve IDs against catalogs of increasing size.
+    import tempfile
+    import time
+    import uuid
+
+    for total in (100, 1000, 10000):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = Path(tmp_dir)
+            catalog = ConversationCatalog(tmp_path)
+            ids = []
+            for i in range(total):
+                conv_id = str(uuid.uuid4())
+                ids.append(conv_id)
+                file_path = tmp_path / f"conv_{i}_{conv_id[:8]}.json"
+                data = {"conversation_id": conv_id, "metadata": {"title": f"Conversation {i}"}, "messages": {}}
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                catalog.record(file_path, data)
+            catalog.refresh()
+            lookups = ids[::max(1, total // 500)]
+            start = time.perf_counter()
+            for conv_id in lookups:
+                assert catalog.find_path_by_id(conv_id) is not None
+            elapsed = time.perf_counter() - start
+            catalog.close()
+            print(f"{total:>6} conversations: {elapsed / len(lookups) * 1e6:8.1f} us per ID lookup")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Codecs - Pluggable serialization for conversation files.
+
+Available codecs (selected with "conversation_codec" in cannonai_config.json):
+
+    json          Pretty-printed UTF-8 JSON (indent=2), the historical format
+    json-compact  UTF-8 JSON without indentation or spaces
+    gzip          Compact JSON, gzip-compressed
+    zstd          Compact JSON, zstd-compressed (requires `pip install zstandard`)
+    msgpack       MessagePack (requires `pip install msgpack`)
+
+Reading never depends on the configured codec: the format of an existing file
+is detected from its leading magic bytes.
+"""
+
+import gzip
+import io
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    zstd_available = True
+except ImportError:
+    zstd_available = False
+
+try:
+    import msgpack
+    msgpack_available = True
+except ImportError:
+    msgpack_available = False
+
+DEFAULT_CODEC = "json"
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_MSGPACK_MAGIC = b"CNAI-MSGPACK1\n"  # MessagePack has no magic of its own
+_MAGIC_READ_SIZE = 16
+
+
+class Codec:
+    """
+    A conversation file format.
+
+    `encode` turns the live structure into bytes and must run on the thread that
+    mutates the conversation; `finish` (e.g. compression) only touches those bytes
+    and can run in a worker thread.
+    """
+
+    def __init__(self, name: str, encode: Callable[[Dict[str, Any]], bytes], decode: Callable[[bytes], Dict[str, Any]],
+                 finish: Callable[[bytes], bytes] = lambda b: b, plain_text: bool = False):
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.finish = finish
+        self.plain_text = plain_text  # File bytes are the JSON text itself (header splicing is possible)
+
+
+def _json_pretty(data: Dict[str, Any]) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def _json_compact(data: Dict[str, Any]) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+
+def _json_decode(raw: bytes) -> Dict[str, Any]:
+    return json.loads(raw.decode('utf-8'))
+
+
+def _zstd_compress(raw: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(raw)
+
+
+def _zstd_decompress(raw: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+
+
+def _msgpack_encode(data: Dict[str, Any]) -> bytes:
+    return _MSGPACK_MAGIC + msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_decode(raw: bytes) -> Dict[str, Any]:
+    return msgpack.unpackb(raw[len(_MSGPACK_MAGIC):], raw=False, strict_map_key=False)
+
+
+CODECS: Dict[str, Codec] = {
+    "json": Codec("json", _json_pretty, _json_decode, plain_text=True),
+    "json-compact": Codec("json-compact", _json_compact, _json_decode, plain_text=True),
+    "gzip": Codec("gzip", _json_compact, lambda raw: _json_decode(gzip.decompress(raw)),
+                  finish=lambda raw: gzip.compress(raw, compresslevel=6)),
+}
+if zstd_available:
+    CODECS["zstd"] = Codec("zstd", _json_compact, lambda raw: _json_decode(_zstd_decompress(raw)), finish=_zstd_compress)
+if msgpack_available:
+    CODECS["msgpack"] = Codec("msgpack", _msgpack_encode, _msgpack_decode)
+
+KNOWN_CODECS = ("json", "json-compact", "gzip", "zstd", "msgpack")
+
+
+def get_codec(name: Optional[str]) -> Codec:
+    """Returns the codec for a config value, falling back to plain JSON if it is unknown or unavailable."""
+    name = name or DEFAULT_CODEC
+    codec = CODECS.get(name)
+    if codec is None:
+        if name in KNOWN_CODECS:
+            package = "zstandard" if name == "zstd" else name
+            logger.warning(f"Conversation codec '{name}' needs the '{package}' package (pip install {package}). Using '{DEFAULT_CODEC}'.")
+        else:
+            logger.warning(f"Unknown conversation codec '{name}'. Using '{DEFAULT_CODEC}'.")
+        codec = CODECS[DEFAULT_CODEC]
+    return codec
+
+
+def detect_codec_name(head: bytes) -> str:
+    """Identifies the format of a conversation file from its first bytes."""
+    if head.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(_ZSTD_MAGIC):
+        return "zstd"
+    if head.startswith(_MSGPACK_MAGIC):
+        return "msgpack"
+    return "json"  # Plain and compact JSON read the same way
+
+
+def detect_file_codec(path: Path) -> Codec:
+    with open(path, 'rb') as f:
+        name = detect_codec_name(f.read(_MAGIC_READ_SIZE))
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"{Path(path).name} is stored with the '{name}' codec, which is not installed")
+    return codec
+
+
+def load_file(path: Path) -> Dict[str, Any]:
+    """Reads and decodes a conversation file in any supported format."""
+    codec = detect_file_codec(path)
+    with open(path, 'rb') as f:
+        return codec.decode(f.read())
+
+
+def open_text_stream(path: Path) -> Optional[TextIO]:
+    """
+    Opens a JSON-based conversation file as a decompressed text stream so that a
+    reader can stop early. Returns None for formats that are not JSON text.
+    """
+    codec = detect_file_codec(path)
+    if codec.plain_text:
+        return open(path, 'r', encoding='utf-8')
+    if codec.name == "gzip":
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if codec.name == "zstd":
+        raw_stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(raw_stream, encoding='utf-8')
+    return None
+
+
+if __name__ == "__main__":
+    # Size and latency benchmark on a synthetic 5k-message conversation.
+    import os
+    import tempfile
+    import time
+    import uuid
+    from datetime import datetime
+
+    messages: Dict[str, Any] = {}
+    parent = None
+    for i in range(5000):
+        msg_id = str(uuid.uuid4())
+        messages[msg_id] = {
+            "id": msg_id, "parent_id": parent, "branch_id": "main",
+            "type": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i}: " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8,
+            "timestamp": datetime.now().isoformat(), "children": [],
+        }
+        if parent:
+            messages[parent]["children"].append(msg_id)
+        parent = msg_id
+    conversation = {"conversation_id": str(uuid.uuid4()), "version": "2.3.0",
+                    "metadata": {"title": "Benchmark", "total_message_count": len(messages)},
+                    "branches": {"main": {"last_message": parent, "message_count": len(messages)}},
+                    "messages": messages}
+
+    print(f"{'codec':<14}{'size':>12}{'save ms':>10}{'load ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, codec in CODECS.items():
+            path = Path(tmp_dir) / f"bench_{name}.json"
+            start = time.perf_counter()
+            payload = codec.finish(codec.encode(conversation))
+            with open(path, 'wb') as f:
+                f.write(payload)
+            save_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            loaded = load_file(path)
+            load_ms = (time.perf_counter() - start) * 1000
+            assert loaded == conversation
+            print(f"{name:<14}{os.path.getsize(path):>12,}{save_ms:>10.1f}{load_ms:>10.1f}")
+    missing = [name for name in KNOWN_CODECS if name not in CODECS]
+    if missing:
+        print(f"Not installed: {', '.join(missing)}")
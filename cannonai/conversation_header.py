@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Header - Read and update conversation metadata without
+decoding message bodies.
+
+JSON conversation files are written with every top-level key before
+``messages`` (``conversation_id``, ``version``, ``metadata``, ``branches``), so
+``read_json_header`` can stream the file and stop as soon as it reaches the
+``messages`` key (gzip and zstd files are decompressed on the fly).
+``update_json_metadata`` splices a new ``metadata`` value into the header of an
+uncompressed file and copies the remaining bytes through unchanged.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Any, Tuple
+
+from conversation_codecs import detect_file_codec, load_file, open_text_stream
+
+_CHUNK_CHARS = 64 * 1024
+_WHITESPACE = " \t\n\r"
+STOP_KEY = "messages"
+
+
+class JsonHeader:
+    """Top-level values read before the `messages` key, with their character spans."""
+
+    def __init__(self, values: Dict[str, Any], spans: Dict[str, Tuple[int, int]], text: str, reached_messages: bool):
+        self.values = values
+        self.spans = spans
+        self.text = text  # Decoded prefix of the file covering at least the header
+        self.reached_messages = reached_messages  # False if the file has no `messages` key (whole object read)
+
+
+class _StreamingReader:
+    """Incrementally reads a text file so the JSON decoder only sees the prefix it needs."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(_CHUNK_CHARS)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def skip_whitespace(self, pos: int) -> int:
+        while True:
+            while pos < len(self.buf) and self.buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(self.buf) or not self.fill():
+                return pos
+
+    def expect(self, pos: int, char: str) -> int:
+        pos = self.skip_whitespace(pos)
+        if pos >= len(self.buf) or self.buf[pos] != char:
+            raise ValueError(f"Expected '{char}' at offset {pos} while reading conversation header")
+        return pos + 1
+
+    def decode(self, decoder: json.JSONDecoder, pos: int) -> Tuple[Any, int]:
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A value ending exactly at the buffer edge may be truncated (e.g. a number); read more to be sure
+            if end >= len(self.buf) and self.fill():
+                continue
+            return value, end
+
+
+def read_json_header(path: Path) -> JsonHeader:
+    """Reads top-level keys of a JSON conversation file up to (not including) `messages`."""
+    decoder = json.JSONDecoder()
+    values: Dict[str, Any] = {}
+    spans: Dict[str, Tuple[int, int]] = {}
+    stream = open_text_stream(path)
+    if stream is None:  # Binary codec: no streaming header, decode everything
+        values = {k: v for k, v in load_file(path).items() if k != STOP_KEY}
+        return JsonHeader(values, spans, "", reached_messages=True)
+    with stream as f:
+        reader = _StreamingReader(f)
+        reader.fill()
+        pos = reader.expect(0, "{")
+        while True:
+            pos = reader.skip_whitespace(pos)
+            if pos < len(reader.buf) and reader.buf[pos] == "}":
+                return JsonHeader(values, spans, reader.buf, reached_messages=False)
+            key, pos = reader.decode(decoder, pos)
+            pos = reader.expect(pos, ":")
+            pos = reader.skip_whitespace(pos)
+            if key == STOP_KEY:
+                return JsonHeader(values, spans, reader.buf, reached_messages=True)
+            value, end = reader.decode(decoder, pos)
+            values[key], spans[key] = value, (pos, end)
+            pos = reader.skip_whitespace(end)
+            if pos < len(reader.buf) and reader.buf[pos] == ",":
+                pos += 1
+
+
+def update_json_metadata(path: Path, metadata: Dict[str, Any]) -> bool:
+    """
+    Replaces the `metadata` value of a JSON conversation file in place.
+
+    Only the header is decoded and re-encoded; everything after the old metadata
+    value is copied byte for byte. Returns False (file untouched) when the file
+    does not keep `metadata` ahead of `messages` or is compressed/binary, so the
+    caller can fall back to a full rewrite.
+    """
+    path = Path(path)
+    if not detect_file_codec(path).plain_text:
+        return False
+    header = read_json_header(path)
+    span = header.spans.get("metadata")
+    if span is None:
+        return False
+    start, end = span
+    new_value = json.dumps(metadata, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+    new_prefix = (header.text[:start] + new_value).encode('utf-8')
+    tail_offset = len(header.text[:end].encode('utf-8'))
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        dst.write(new_prefix)
+        src.seek(tail_offset)
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, path)
+    return True
+
+
+def order_for_header_reads(conversation_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a shallow copy with `messages` moved last so the header can be read without it."""
+    if STOP_KEY not in conversation_data:
+        return conversation_data
+    ordered = {k: v for k, v in conversation_data.items() if k != STOP_KEY}
+    ordered[STOP_KEY] = conversation_data[STOP_KEY]
+    return ordered
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Journal - Append-only storage format for conversations.
+
+A journal file (``*.jsonl``) holds one compact JSON record per line:
+
+    {"type": "header", ...}    conversation_id, version, metadata and branches
+    {"type": "message", ...}   one message (children are rebuilt from parent_id on replay)
+    {"type": "meta", ...}      changed metadata keys and branch entries since the last save
+
+Saving a conversation appends only the records for new messages and a metadata
+delta, so a new turn costs a few hundred bytes instead of a full rewrite. When
+the number of appended records grows past a threshold the file is compacted,
+i.e. rewritten as a fresh header plus one record per message.
+
+A message's ``children`` list is not stored; it is derived from ``parent_id``
+on replay. A message changed after it was written (e.g. pinned) is appended
+again on the next save (see ``mark_messages_changed``); replay keeps the last
+record for each id, in the position of the first.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Any, Set
+
+from conversation_codecs import load_file
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".jsonl"
+JSON_SUFFIX = ".json"
+JOURNAL_FORMAT_NAME = "cannonai-journal"
+JOURNAL_FORMAT_VERSION = 1
+
+# Top-level keys handled by dedicated record types; everything else lives in the header.
+_STRUCTURED_KEYS = ("metadata", "messages", "branches")
+# Records are written with "type" first, so message lines can be skipped by prefix
+_MESSAGE_RECORD_PREFIX = '{"type":"message"'
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+class _JournalState:
+    """What has already been persisted to one journal file."""
+
+    def __init__(self, message_ids: Set[str], metadata: Dict[str, Any],
+                 branches: Dict[str, Any], header_extra: Dict[str, Any], appended_records: int):
+        self.message_ids = message_ids
+        self.changed_ids: Set[str] = set()  # Written messages to append again on the next save
+        self.metadata = metadata
+        self.branches = branches
+        self.header_extra = header_extra
+        self.appended_records = appended_records
+
+
+class _PreparedWrite:
+    """Serialized journal records waiting to be written."""
+
+    def __init__(self, path: Path, payload: str, replace: bool):
+        self.path = path
+        self.payload = payload
+        self.replace = replace  # True: atomically replace the file; False: append
+
+
+class ConversationJournal:
+    """Reads and writes conversations in the append-only journal format."""
+
+    def __init__(self, compact_after_records: int = 500):
+        """
+        Args:
+            compact_after_records: Number of appended records after which the next
+                save compacts the journal instead of appending.
+        """
+        self.compact_after_records = compact_after_records
+        self._states: Dict[Path, _JournalState] = {}
+        self._lock = threading.Lock()
+
+    # ---------- Reading ----------
+
+    def load(self, path: Path) -> Dict[str, Any]:
+        """Replays a journal file into the standard in-memory conversation structure."""
+        path = Path(path)
+        data: Dict[str, Any] = {}
+        metadata: Dict[str, Any] = {}
+        branches: Dict[str, Any] = {}
+        messages: Dict[str, Dict[str, Any]] = {}
+        appended = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from an interrupted append; everything before it is intact.
+                    logger.warning(f"Ignoring unreadable journal record at {path.name}:{line_no}")
+                    continue
+                record_type = record.get("type")
+                if record_type == "header":
+                    if record.get("format") != JOURNAL_FORMAT_NAME:
+                        raise ValueError(f"{path} is not a CannonAI journal file")
+                    data = {k: v for k, v in record.items() if k not in ("type", "format", "journal_version") + _STRUCTURED_KEYS}
+                    metadata = dict(record.get("metadata", {}))
+                    branches = dict(record.get("branches", {}))
+                    messages = {}
+                    appended = 0
+                elif record_type == "message":
+                    message = record["message"]
+                    message["children"] = []
+                    messages[message["id"]] = message
+                    appended += 1
+                elif record_type == "meta":
+                    metadata.update(record.get("metadata", {}))
+                    for key in record.get("removed_metadata", []):
+                        metadata.pop(key, None)
+                    branches.update(record.get("branches", {}))
+                    appended += 1
+        for msg_id, message in messages.items():  # Rebuild children in insertion order
+            parent_id = message.get("parent_id")
+            if parent_id and parent_id in messages:
+                messages[parent_id]["children"].append(msg_id)
+        data["metadata"] = metadata
+        data["messages"] = messages
+        data["branches"] = branches
+        with self._lock:
+            self._states[path] = self._snapshot_state(data, appended)
+        return data
+
+    # ---------- Writing ----------
+
+    def save(self, path: Path, conversation_data: Dict[str, Any]) -> int:
+        """
+        Persists a conversation to a journal file, appending deltas when possible.
+
+        Returns:
+            Number of bytes written.
+        """
+        return self.commit(self.prepare_save(path, conversation_data))
+
+    def prepare_save(self, path: Path, conversation_data: Dict[str, Any]) -> "_PreparedWrite":
+        """
+        Computes the records for a save without touching the file.
+
+        This reads the live conversation structure, so it should run on the thread
+        that mutates it; `commit()` does the file I/O and may run anywhere.
+        """
+        path = Path(path)
+        with self._lock:
+            state = self._states.get(path)
+            if (state is None or not path.exists() or state.appended_records >= self.compact_after_records
+                    or self._header_extra(conversation_data) != state.header_extra):
+                return self._prepare_compaction(path, conversation_data)
+
+            lines: List[str] = []
+            messages = conversation_data.get("messages", {})
+            new_ids = [msg_id for msg_id in messages if msg_id not in state.message_ids]
+            changed_ids = [msg_id for msg_id in state.changed_ids if msg_id in messages]
+            for msg_id in changed_ids + new_ids:
+                lines.append(_dumps({"type": "message", "message": self._message_record(messages[msg_id])}))
+
+            metadata = conversation_data.get("metadata", {})
+            branches = conversation_data.get("branches", {})
+            changed_meta = {k: v for k, v in metadata.items() if state.metadata.get(k, _MISSING) != v}
+            removed_meta = [k for k in state.metadata if k not in metadata]
+            changed_branches = {k: v for k, v in branches.items() if state.branches.get(k, _MISSING) != v}
+            if changed_meta or removed_meta or changed_branches:
+                meta_record: Dict[str, Any] = {"type": "meta"}
+                if changed_meta: meta_record["metadata"] = changed_meta
+                if removed_meta: meta_record["removed_metadata"] = removed_meta
+                if changed_branches: meta_record["branches"] = changed_branches
+                lines.append(_dumps(meta_record))
+
+            # State advances optimistically; commit() forgets it if the write fails.
+            state.message_ids.update(new_ids)
+            state.changed_ids.clear()
+            state.metadata = copy.deepcopy(metadata)
+            state.branches = copy.deepcopy(branches)
+            state.appended_records += len(lines)
+            payload = "\n".join(lines) + "\n" if lines else ""
+            return _PreparedWrite(path, payload, replace=False)
+
+    def commit(self, prepared: "_PreparedWrite") -> int:
+        """Writes a prepared save to disk. Returns the number of bytes written."""
+        if not prepared.payload:
+            return 0
+        try:
+            if prepared.replace:
+                prepared.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = prepared.path.with_name(prepared.path.name + ".tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(prepared.payload)
+                os.replace(tmp_path, prepared.path)
+            else:
+                with open(prepared.path, 'a', encoding='utf-8') as f:
+                    f.write(prepared.payload)
+        except Exception:
+            self.forget(prepared.path)  # Next save rewrites the journal from scratch
+            raise
+        return len(prepared.payload.encode('utf-8'))
+
+    def compact(self, path: Path, conversation_data: Dict[str, Any]) -> int:
+        """Rewrites a journal as a single header plus one record per message."""
+        with self._lock:
+            prepared = self._prepare_compaction(Path(path), conversation_data)
+        return self.commit(prepared)
+
+    def _prepare_compaction(self, path: Path, conversation_data: Dict[str, Any]) -> "_PreparedWrite":
+        header = {"type": "header", "format": JOURNAL_FORMAT_NAME, "journal_version": JOURNAL_FORMAT_VERSION}
+        header.update(self._header_extra(conversation_data))
+        header["metadata"] = conversation_data.get("metadata", {})
+        header["branches"] = conversation_data.get("branches", {})
+        lines = [_dumps(header)]
+        for message in conversation_data.get("messages", {}).values():
+            lines.append(_dumps({"type": "message", "message": self._message_record(message)}))
+        self._states[path] = self._snapshot_state(conversation_data, 0)
+        return _PreparedWrite(path, "\n".join(lines) + "\n", replace=True)
+
+    def read_header(self, path: Path) -> Dict[str, Any]:
+        """
+        Returns the conversation without messages: header values, metadata and branches
+        with all meta deltas applied. Message records are skipped without being decoded.
+        """
+        path = Path(path)
+        data: Dict[str, Any] = {}
+        metadata: Dict[str, Any] = {}
+        branches: Dict[str, Any] = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(_MESSAGE_RECORD_PREFIX) or not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                record_type = record.get("type")
+                if record_type == "header":
+                    data = {k: v for k, v in record.items() if k not in ("type", "format", "journal_version") + _STRUCTURED_KEYS}
+                    metadata = dict(record.get("metadata", {}))
+                    branches = dict(record.get("branches", {}))
+                elif record_type == "meta":
+                    metadata.update(record.get("metadata", {}))
+                    for key in record.get("removed_metadata", []):
+                        metadata.pop(key, None)
+                    branches.update(record.get("branches", {}))
+        data["metadata"] = metadata
+        data["branches"] = branches
+        return data
+
+    def append_metadata(self, path: Path, changes: Dict[str, Any]) -> None:
+        """Appends a metadata delta (e.g. a new title) without touching message records."""
+        path = Path(path)
+        with self._lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(_dumps({"type": "meta", "metadata": changes}) + "\n")
+            state = self._states.get(path)
+            if state is not None:
+                state.metadata.update(copy.deepcopy(changes))
+                state.appended_records += 1
+
+    def mark_messages_changed(self, path: Path, message_ids: Iterable[str]) -> None:
+        """Has the next save append `message_ids` again because they changed after being written."""
+        with self._lock:
+            state = self._states.get(Path(path))
+            if state is not None:  # Without state the next save compacts, which writes every message
+                state.changed_ids.update(msg_id for msg_id in message_ids if msg_id in state.message_ids)
+
+    def forget(self, path: Path) -> None:
+        """Drops cached write state for a path (e.g. after the file was deleted or renamed)."""
+        with self._lock:
+            self._states.pop(Path(path), None)
+
+    # ---------- Helpers ----------
+
+    @staticmethod
+    def _message_record(message: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in message.items() if k != "children"}
+
+    @staticmethod
+    def _header_extra(conversation_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in conversation_data.items() if k not in _STRUCTURED_KEYS}
+
+    def _snapshot_state(self, conversation_data: Dict[str, Any], appended_records: int) -> _JournalState:
+        return _JournalState(
+            message_ids=set(conversation_data.get("messages", {}).keys()),
+            metadata=copy.deepcopy(conversation_data.get("metadata", {})),
+            branches=copy.deepcopy(conversation_data.get("branches", {})),
+            header_extra=copy.deepcopy(self._header_extra(conversation_data)),
+            appended_records=appended_records,
+        )
+
+
+class _Missing:
+    """Sentinel that never compares equal to a stored value."""
+
+    def __eq__(self, other: Any) -> bool:
+        return False
+
+    def __ne__(self, other: Any) -> bool:
+        return True
+
+
+_MISSING = _Missing()
+
+
+# ---------- Converters ----------
+
+def convert_json_to_journal(json_path: Path, remove_source: bool = False) -> Path:
+    """Converts a standard JSON conversation file into a journal file next to it."""
+    json_path = Path(json_path)
+    data = load_file(json_path)
+    journal_path = json_path.with_suffix(JOURNAL_SUFFIX)
+    ConversationJournal().compact(journal_path, data)
+    if remove_source:
+        os.remove(json_path)
+    return journal_path
+
+
+def convert_journal_to_json(journal_path: Path, remove_source: bool = False) -> Path:
+    """Converts a journal file back into the standard pretty-printed JSON layout."""
+    journal_path = Path(journal_path)
+    data = ConversationJournal().load(journal_path)
+    json_path = journal_path.with_suffix(JSON_SUFFIX)
+    tmp_path = json_path.with_name(json_path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, json_path)
+    if remove_source:
+        os.remove(journal_path)
+    return json_path
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Layout - Where conversation files live inside a
+conversations directory.
+
+Available layouts (selected with "conversation_layout" in cannonai_config.json):
+
+    flat     <title>_<id prefix>.json side by side (the historical layout)
+    sharded  <ab>/<cd>/<conversation id>.json, keyed by the conversation ID
+
+Sharded paths depend only on the conversation ID, so renaming a conversation
+never moves its file; the title lives in the metadata and the catalog. Both
+layouts are always readable, the setting only decides where saves go.
+``migrate_to_sharded`` moves the files of a flat directory into shards.
+"""
+
+import hashlib
+import logging
+import os
+import string
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from conversation_header import read_json_header
+from conversation_journal import ConversationJournal, JOURNAL_SUFFIX, JSON_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("flat", "sharded")
+DEFAULT_LAYOUT = "flat"
+CONVERSATION_SUFFIXES = (JSON_SUFFIX, JOURNAL_SUFFIX)
+_HEX = set(string.hexdigits.lower())
+
+
+def _shard_key(conversation_id: str) -> str:
+    key = conversation_id.replace("-", "").lower()[:4]
+    if len(key) < 4 or not set(key) <= _HEX:  # Non-UUID IDs are spread by hash instead
+        key = hashlib.sha1(conversation_id.encode("utf-8")).hexdigest()[:4]
+    return key
+
+
+def _is_shard_name(name: str) -> bool:
+    return len(name) == 2 and set(name) <= _HEX
+
+
+def sharded_relpath(conversation_id: str, suffix: str = JSON_SUFFIX) -> Path:
+    """Relative path of a conversation in the sharded layout."""
+    key = _shard_key(conversation_id)
+    return Path(key[:2]) / key[2:] / f"{conversation_id}{suffix}"
+
+
+def conversations_root(file_path: Path) -> Path:
+    """Returns the conversations directory a conversation file belongs to, for either layout."""
+    file_path = Path(file_path)
+    leaf, top = file_path.parent, file_path.parent.parent
+    if _is_shard_name(leaf.name) and _is_shard_name(top.name) and _shard_key(file_path.stem) == top.name + leaf.name:
+        return top.parent
+    return file_path.parent
+
+
+def relative_key(conversations_dir: Path, file_path: Path) -> str:
+    """Catalog key of a conversation file: its path relative to the conversations directory."""
+    file_path = Path(file_path)
+    try:
+        return file_path.relative_to(conversations_dir).as_posix()
+    except ValueError:
+        return file_path.name
+
+
+class DirectoryScanner:
+    """
+    Lists conversation files in both layouts with their (mtime_ns, size) stamps.
+
+    Leaf shard directories whose own mtime did not change since the previous scan
+    are not listed again. Saves replace files atomically, which updates the
+    directory mtime; in-place journal appends do not, but the client records those
+    in the catalog itself when it writes them.
+    """
+
+    def __init__(self, conversations_dir: Path):
+        self.root = Path(conversations_dir)
+        self._shards: Dict[str, Tuple[int, Dict[str, Tuple[int, int]]]] = {}  # "ab/cd" -> (dir mtime_ns, files)
+
+    @staticmethod
+    def _list_files(directory: str, prefix: str) -> Dict[str, Tuple[int, int]]:
+        files: Dict[str, Tuple[int, int]] = {}
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.endswith(CONVERSATION_SUFFIXES) or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files[prefix + entry.name] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """Returns {relative key: (mtime_ns, size)} for every conversation file."""
+        found = self._list_files(str(self.root), "")
+        seen_shards = set()
+        with os.scandir(self.root) as top_it:
+            top_dirs = [entry for entry in top_it if _is_shard_name(entry.name) and entry.is_dir()]
+        for top in top_dirs:
+            with os.scandir(top.path) as leaf_it:
+                leaves = [entry for entry in leaf_it if _is_shard_name(entry.name) and entry.is_dir()]
+            for leaf in leaves:
+                shard = f"{top.name}/{leaf.name}"
+                seen_shards.add(shard)
+                try:
+                    dir_mtime = leaf.stat().st_mtime_ns
+                except OSError:
+                    continue
+                cached = self._shards.get(shard)
+                if cached is None or cached[0] != dir_mtime:
+                    cached = (dir_mtime, self._list_files(leaf.path, shard + "/"))
+                    self._shards[shard] = cached
+                found.update(cached[1])
+        for shard in [s for s in self._shards if s not in seen_shards]:
+            del self._shards[shard]
+        return found
+
+
+def _read_conversation_id(file_path: Path) -> Optional[str]:
+    if file_path.suffix == JOURNAL_SUFFIX:
+        return ConversationJournal().read_header(file_path).get("conversation_id")
+    return read_json_header(file_path).values.get("conversation_id")
+
+
+def migrate_to_sharded(conversations_dir: Path, dry_run: bool = False) -> List[Tuple[Path, Path]]:
+    """
+    Moves every flat conversation file into its sharded location.
+
+    Files whose target already exists, or whose conversation ID cannot be read,
+    are left in place (and logged). Returns the (source, target) pairs moved.
+    The catalog picks the moves up on its next refresh.
+    """
+    root = Path(conversations_dir)
+    moved: List[Tuple[Path, Path]] = []
+    for key in sorted(DirectoryScanner._list_files(str(root), "")):
+        source = root / key
+        try:
+            conversation_id = _read_conversation_id(source)
+        except Exception as e:
+            logger.warning(f"Skipping {key}: could not read its conversation ID ({e})")
+            continue
+        if not conversation_id:
+            logger.warning(f"Skipping {key}: no conversation ID in file")
+            continue
+        target = root / sharded_relpath(conversation_id, source.suffix)
+        if target.exists():
+            logger.warning(f"Skipping {key}: {relative_key(root, target)} already exists")
+            continue
+        if not dry_run:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, target)
+        moved.append((source, target))
+    return moved
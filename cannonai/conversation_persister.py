@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Persister - Write-behind autosave for conversations.
+
+Hot paths (sending a message, retrying, navigating siblings, changing settings)
+mark a conversation dirty instead of awaiting a save. Saves for the same
+conversation are coalesced within a short window and never overlap; callers
+that need durability await ``flush()``.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SaveCallable = Callable[[], Awaitable[None]]
+
+
+class WriteBehindPersister:
+    """
+    Coalescing, per-key write-behind queue.
+
+    All methods must be called from the event loop that owns the persister.
+    The save callable registered last for a key wins; it is invoked once the
+    coalescing window has elapsed (or on flush), serialized per key.
+    """
+
+    def __init__(self, coalesce_ms: int = 250):
+        self.coalesce_seconds = max(0, coalesce_ms) / 1000.0
+        self._pending: Dict[str, SaveCallable] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"requested": 0, "written": 0, "failed": 0}
+
+    def mark_dirty(self, key: str, save: SaveCallable) -> None:
+        """Schedules `save` for `key`, replacing any save not yet started for that key."""
+        self._pending[key] = save
+        self.stats["requested"] += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    def has_pending(self, key: Optional[str] = None) -> bool:
+        return bool(self._pending) if key is None else key in self._pending
+
+    async def flush(self, key: Optional[str] = None) -> None:
+        """Writes pending saves now (for one key, or all) and waits for in-flight writes."""
+        keys = [key] if key is not None else list(set(self._pending) | set(self._tasks))
+        for k in keys:
+            await self._write_pending(k)
+
+    async def discard(self, key: str) -> None:
+        """Drops a pending save (e.g. the conversation was deleted) and waits for any in-flight write."""
+        self._pending.pop(key, None)
+        async with self._lock_for(key):
+            pass
+
+    async def close(self) -> None:
+        """Flushes everything; call on shutdown."""
+        await self.flush()
+
+    def _lock_for(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def _drain(self, key: str) -> None:
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.coalesce_seconds)
+                await self._write_pending(key)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def _write_pending(self, key: str) -> None:
+        async with self._lock_for(key):
+            save = self._pending.pop(key, None)
+            if save is None:
+                return
+            try:
+                await save()
+                self.stats["written"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Write-behind save for {key} failed: {e}", exc_info=True)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+CannonAI Conversation Tree - Indexed view over a conversation's message tree.
+
+``ConversationTree`` wraps ``conversation_data["messages"]`` (it does not copy
+it) and keeps the derived structures that the client otherwise recomputes on
+every call: per-branch message counters, each message's position among its
+parent's children, and a cached root-to-leaf path per branch. A branch's path
+is extended in place when a message is appended to its leaf and rebuilt only
+when the branch's ``last_message`` moves somewhere else.
+
+The tree also numbers changes: ``revision`` grows with every added or changed
+message (and every move of the active path), and each message records the
+revision that last touched it. ``changes_since()`` uses this to hand the GUI only
+the messages it has not seen. Revisions are never stored in the conversation
+file. They come from one process-wide counter that never runs behind the clock
+(in ms), so no two trees (other conversations, a rebuilt or reopened index, an
+earlier server run) issue the same number, and any revision from before an
+index was built is answered with "send everything". Callers still check that a
+revision belongs to the conversation they ask about (see gui/api_handlers.py).
+
+``SharedConversations`` hands several clients (the GUI sessions) the same
+structure and tree for a conversation, so each sees the others' turns and
+revisions and no save drops messages another client added.
+"""
+
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+_revision_lock = threading.Lock()
+_last_revision = 0
+
+
+def next_revision() -> int:
+    """A revision above every one issued so far in this process and no lower than the clock in ms."""
+    global _last_revision
+    with _revision_lock:
+        _last_revision = max(_last_revision + 1, int(time.time() * 1000))
+        return _last_revision
+
+
+class ConversationTree:
+    """Index over one conversation structure; the structure itself stays the source of truth."""
+
+    def __init__(self, conversation_data: Dict[str, Any]):
+        """
+        Args:
+            conversation_data: The conversation structure to index
+        """
+        self.data = conversation_data
+        self.messages: Dict[str, Dict[str, Any]] = conversation_data.setdefault("messages", {})
+        self._branch_counts: Dict[str, int] = {}
+        self._child_positions: Dict[str, int] = {}  # message ID -> index in its parent's children list
+        self._paths: Dict[str, Tuple[str, List[str]]] = {}  # branch ID -> (leaf ID, root..leaf IDs)
+        self._indexed_count = 0
+        self.base_revision = next_revision()  # Revision of every message present when the index was built
+        self.revision = self.base_revision
+        self._message_revisions: Dict[str, int] = {}  # message ID -> revision of its last change (if after the build)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._branch_counts.clear()
+        self._child_positions.clear()
+        self._paths.clear()
+        for msg_id, message in self.messages.items():
+            branch_id = message.get("branch_id", "main")
+            self._branch_counts[branch_id] = self._branch_counts.get(branch_id, 0) + 1
+            for position, child_id in enumerate(message.get("children", [])):
+                self._child_positions[child_id] = position
+        self._indexed_count = len(self.messages)
+
+    def is_current(self, conversation_data: Dict[str, Any]) -> bool:
+        """Whether this index still describes `conversation_data` (same objects, no outside inserts)."""
+        return (conversation_data is self.data
+                and conversation_data.get("messages") is self.messages
+                and len(self.messages) == self._indexed_count)
+
+    # ---------- Mutation ----------
+
+    def touch(self, *message_ids: str) -> int:
+        """Starts a new revision, marking `message_ids` as changed in it. Returns the new revision."""
+        self.revision = next_revision()
+        for msg_id in message_ids:
+            self._message_revisions[msg_id] = self.revision
+        return self.revision
+
+    def add_message(self, message: Dict[str, Any]) -> None:
+        """Inserts a message, links it to its parent and advances its branch leaf."""
+        data = self.data
+        msg_id = message["id"]
+        parent_id = message.get("parent_id")
+        branch_id = message.get("branch_id", "main")
+        data.setdefault("branches", {})
+        data.setdefault("metadata", {}).setdefault("active_branch", "main")
+
+        replaced = self.messages.get(msg_id)
+        if replaced is not None:
+            old_branch = replaced.get("branch_id", "main")
+            self._branch_counts[old_branch] = self._branch_counts.get(old_branch, 1) - 1
+        self.messages[msg_id] = message
+        self._branch_counts[branch_id] = self._branch_counts.get(branch_id, 0) + 1
+        self._indexed_count = len(self.messages)
+
+        if parent_id and parent_id in self.messages:
+            siblings = self.messages[parent_id].setdefault("children", [])
+            if msg_id not in self._child_positions or self._child_positions[msg_id] >= len(siblings) \
+                    or siblings[self._child_positions[msg_id]] != msg_id:
+                self._child_positions[msg_id] = len(siblings)
+                siblings.append(msg_id)
+            self.touch(msg_id, parent_id)  # The parent's children list changed too
+        else:
+            self.touch(msg_id)
+
+        if branch_id not in data["branches"]:
+            data["branches"][branch_id] = {
+                "created_at": message.get("timestamp", datetime.now().isoformat()),
+                "last_message": None, "message_count": 0
+            }
+        branch_info = data["branches"][branch_id]
+        previous_leaf = branch_info.get("last_message")
+        branch_info["last_message"] = msg_id
+        branch_info["message_count"] = self._branch_counts[branch_id]
+
+        cached = self._paths.get(branch_id)
+        if cached is not None and cached[0] == previous_leaf and parent_id == previous_leaf and replaced is None:
+            cached[1].append(msg_id)
+            self._paths[branch_id] = (msg_id, cached[1])
+        else:
+            self._paths.pop(branch_id, None)
+
+        if branch_id == data["metadata"].get("active_branch"):
+            data["metadata"]["active_leaf"] = msg_id
+
+    # ---------- Queries ----------
+
+    def changes_since(self, since_revision: int) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Messages added or changed after `since_revision`, keyed by ID.
+
+        Returns None when the revision predates this index or is not one it issued
+        (another conversation, session or server run); the caller sends the full tree.
+        """
+        if since_revision < self.base_revision or since_revision > self.revision:
+            return None
+        return {msg_id: self.messages[msg_id] for msg_id, revision in self._message_revisions.items()
+                if revision > since_revision and msg_id in self.messages}
+
+    def branch_path(self, branch_id: str) -> List[str]:
+        """
+        Returns message IDs from the root to the branch's last message.
+
+        The returned list is the cached path itself; callers must not modify it.
+        """
+        leaf_id = self.data.get("branches", {}).get(branch_id, {}).get("last_message")
+        if not leaf_id or leaf_id not in self.messages:
+            return []
+        cached = self._paths.get(branch_id)
+        if cached is not None and cached[0] == leaf_id:
+            return cached[1]
+        path = self.path_to(leaf_id)
+        self._paths[branch_id] = (leaf_id, path)
+        return path
+
+    def path_to(self, leaf_id: str) -> List[str]:
+        """Walks parent pointers from `leaf_id` to the root (uncached)."""
+        chain: List[str] = []
+        visited = set()  # Prevent loops in case of malformed data
+        current_id: Optional[str] = leaf_id
+        while current_id and current_id not in visited:
+            visited.add(current_id)
+            chain.append(current_id)
+            current_id = self.messages.get(current_id, {}).get("parent_id")
+        chain.reverse()
+        return chain
+
+    def branch_count(self, branch_id: str) -> int:
+        return self._branch_counts.get(branch_id, 0)
+
+    def child_index(self, parent_id: str, child_id: str) -> int:
+        """Position of `child_id` among `parent_id`'s children, or -1."""
+        siblings = self.messages.get(parent_id, {}).get("children", [])
+        position = self._child_positions.get(child_id)
+        if position is not None and position < len(siblings) and siblings[position] == child_id:
+            return position
+        if child_id in siblings:  # Children edited outside the tree; repair the index
+            self._reindex()
+            return self._child_positions[child_id]
+        return -1
+
+
+class SharedConversations:
+    """
+    One conversation structure and ConversationTree per conversation ID, for clients
+    that work on the same conversations. Entries live as long as a client's tree
+    references them (BaseClientFeatures keeps the one it last used).
+    """
+
+    def __init__(self):
+        self._trees: 'weakref.WeakValueDictionary[str, ConversationTree]' = weakref.WeakValueDictionary()
+
+    def open(self, conversation_data: Dict[str, Any]) -> ConversationTree:
+        """
+        The tree of the conversation. When another client already has it open, that
+        structure (and its unsaved changes) wins over `conversation_data`, e.g. a copy
+        just read from disk.
+        """
+        conversation_id = conversation_data.get("conversation_id") or ""
+        tree = self._trees.get(conversation_id)
+        if tree is None:
+            tree = self._trees[conversation_id] = ConversationTree(conversation_data)
+        return tree
+
+    def tree(self, conversation_data: Dict[str, Any]) -> ConversationTree:
+        """The shared tree for `conversation_data`, rebuilt when it is stale."""
+        conversation_id = conversation_data.get("conversation_id") or ""
+        tree = self._trees.get(conversation_id)
+        if tree is None or not tree.is_current(conversation_data):
+            tree = self._trees[conversation_id] = ConversationTree(conversation_data)
+        return tree
@@ -1,9 +1,11 @@
 """
 Gemini Chat GUI Package
 
-This package contains the Flask-based web GUI implementation for Gemini Chat.
+This package contains the Flask-based web GUI implementation for Gemini Chat,
+and an ASGI alternative (asgi.py) that serves the same API on the client's event loop.
 """
 
 from .server import start_gui_server
+from .asgi import start_asgi_server
 
-__all__ = ['start_gui_server']
+__all__ = ['start_gui_server', 'start_asgi_server']
@@ -3,13 +3,25 @@
 CannonAI GUI - API Handlers
 
 This module contains the business logic for handling API requests,
-separating concerns from the Flask routing layer.
+separating concerns from the routing layer.
 It interacts with the AsyncClient for core AI and conversation management.
 System instructions are now managed via conversation metadata.
+
+Each handler is a coroutine (`*_async`) meant to run on the client's event loop:
+the ASGI app (gui/asgi.py) awaits them directly, while the Flask routes call the
+blocking wrappers of the same name, which hand the coroutine to that loop.
+
+Status, retry and navigation responses carry the conversation's revision. A
+caller that sends back the revision it last saw (`since_revision`) together with
+the conversation it was issued for (`since_conversation_id`) receives only the
+messages added or changed since then plus the active path (see
+_conversation_state) instead of the full history and message tree. Read routes
+answer If-None-Match from cheap version stamps (resource_etag_async, settings_etag)
+without building the payload.
 """
 
 import asyncio
-import json
+import functools
 import logging
 import os  # Retained for potential use, though not directly in this refactor
 import uuid  # Retained for potential use
@@ -22,6 +34,8 @@ from command_handler import CommandHandler  # Retained
 from base_client import Colors  # Retained
 from config import Config  # For default system instruction if needed
 from provider_manager import ProviderManager  # *** ADDED: For seamless provider switching ***
+from .http_cache import make_etag
+from .sessions import ConversationLocks
 
 logger = logging.getLogger("cannonai.gui.api_handlers")
 
@@ -30,6 +44,55 @@ logger = logging.getLogger("cannonai.gui.api_handlers")
 main_config: Optional[Config] = None
 
 
+def get_settings_payload(app_config: Optional[Config], client: Optional[AsyncClient]) -> Dict[str, Any]:
+    """Settings shown by the GUI: global defaults, plus the live session state once the client is ready."""
+    settings_data = {
+        "default_provider": app_config.get("default_provider"),
+        "provider_models": app_config.get("provider_models", {}),
+        "system_instruction": app_config.get("default_system_instruction", "You are a helpful assistant."),
+        "generation_params": app_config.get("generation_params", {}),
+        "use_streaming": app_config.get("use_streaming", False)
+    }
+    if client is not None and client.provider:
+        settings_data.update({
+            # Current session specific settings
+            "current_provider_name": client.provider.provider_name,
+            "current_model": client.current_model_name,
+            "current_params": client.params,
+            "current_streaming_preference": client.use_streaming,
+            "current_system_instruction_for_active_conv": client.system_instruction
+        })
+    return settings_data
+
+
+def settings_etag(app_config: Optional[Config], client: Optional[AsyncClient]) -> str:
+    """
+    ETag for get_settings_payload. The payload mixes config defaults with live session
+    state that has no file to stamp (and config edits may not be saved yet), and it is
+    small, so the tag hashes the payload itself.
+    """
+    return make_etag("settings", get_settings_payload(app_config, client))
+
+
+def parse_revision(value: Any) -> Optional[int]:
+    """A `since_revision` request value as an int; missing or malformed values mean "send everything"."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _serialized(handler):
+    """Runs a handler that changes the conversation under that conversation's lock (see gui/sessions.py)."""
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        async with self.conversation_lock():
+            return await handler(self, *args, **kwargs)
+    return wrapper
+
+
 class APIHandlers:
     """Handles API business logic for the GUI server."""
 
@@ -38,6 +101,7 @@ class APIHandlers:
         self.command_handler = command_handler  # Retained, though its use of system instruction might change
         self.event_loop = event_loop
         self.provider_manager: Optional[ProviderManager] = None  # *** ADDED: Will be set later ***
+        self.conversation_locks: Optional[ConversationLocks] = None  # Shared across sessions by the SessionPool
 
         if self.client and self.client.provider:
             logger.info(f"APIHandlers initialized with client for provider: {self.client.provider.provider_name}.")
@@ -51,6 +115,12 @@ class APIHandlers:
         self.provider_manager = provider_manager
         logger.info("Provider manager set for API handlers")
 
+    def conversation_lock(self) -> asyncio.Lock:
+        """Lock of the current conversation; held by handlers that change it, so concurrent requests take turns."""
+        if self.conversation_locks is None:
+            self.conversation_locks = ConversationLocks()
+        return self.conversation_locks.get(self.client.conversation_id if self.client else None)
+
     def run_async(self, coro, timeout: int = 60) -> Any:
         """
         Run an async coroutine in the event loop from a synchronous context
@@ -81,7 +151,75 @@ class APIHandlers:
             logger.error(f"Exception in APIHandlers async operation: {e}", exc_info=True)
             raise  # Re-raise
 
-    def get_status(self) -> Dict[str, Any]:
+    def _run_handler(self, coro, timeout: int = 60) -> Dict[str, Any]:
+        """Runs an *_async handler via run_async; a timeout or a stopped loop becomes an error response."""
+        try:
+            return self.run_async(coro, timeout=timeout)
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}" if str(e) else type(e).__name__, 'status_code': 500}
+
+    def _conversation_state(self, since_revision: Optional[int] = None,
+                            since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        The active conversation's history and message tree, or only what changed after `since_revision`.
+
+        A delta ('delta': True) replaces 'history' and 'full_message_tree' with 'changed_messages'
+        (messages added or changed since that revision, keyed by ID) and 'active_path' (message IDs
+        from the root to the active leaf). The full state is sent when no revision is given, when
+        it was issued for another conversation (`since_conversation_id`), or when it was not
+        issued by this conversation's current index.
+        """
+        conv_data = self.client.conversation_data
+        tree = self.client.get_tree(conv_data)
+        changed = None
+        if since_revision is not None and since_conversation_id == self.client.conversation_id:
+            changed = tree.changes_since(since_revision)
+        if changed is None:
+            return {
+                'revision': tree.revision,
+                'delta': False,
+                'history': self.client.get_conversation_history(),  # Actual stored messages
+                'full_message_tree': conv_data.get("messages", {}),
+            }
+        return {
+            'revision': tree.revision,
+            'delta': True,
+            'changed_messages': changed,
+            'active_path': list(self.client._build_message_chain(conv_data, self.client.active_branch)),
+        }
+
+    async def resource_etag_async(self, resource: str) -> Optional[str]:
+        """
+        ETag for a read route, from version stamps rather than the payload: 'conversations'
+        (catalog fingerprint), 'models' (provider and model-list version) or 'tree' (conversation
+        revision and metadata). None when there is no current stamp; the route then answers in full.
+        """
+        if not self.client:
+            return None
+        if resource == 'conversations':
+            version = await self.client.conversation_list_version(self.client.base_directory)
+            return make_etag(resource, str(self.client.base_directory), version) if version else None
+        if resource == 'models':
+            provider = self.client.provider
+            version = provider.model_list_version if provider else None
+            return make_etag(resource, provider.provider_name, version) if version is not None else None
+        if resource == 'tree':
+            if not self.client.conversation_id or not self.client.conversation_data:
+                return None
+            revision = self.client.get_tree(self.client.conversation_data).revision
+            return make_etag(resource, self.client.conversation_id, revision,
+                             self.client.conversation_data.get("metadata", {}))
+        return None
+
+    def resource_etag(self, resource: str) -> Optional[str]:
+        """Blocking form of resource_etag_async, for the Flask server (None if it fails)."""
+        try:
+            return self.run_async(self.resource_etag_async(resource), timeout=30)
+        except Exception as e:
+            logger.warning(f"Could not compute ETag for '{resource}': {e}")
+            return None
+
+    def get_status(self, since_revision: Optional[int] = None, since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """Get current client status, including active conversation details and system instruction from metadata."""
         if not self.client or not self.client.provider:
             return {'connected': False, 'error': 'Client or provider not initialized'}
@@ -92,17 +230,14 @@ class APIHandlers:
         # Get system instruction from conversation metadata, fallback to client's current (which might be global default)
         current_system_instruction = metadata.get("system_instruction", self.client.system_instruction)
 
-        active_branch_history = []  # Actual stored messages
-        current_messages_tree = {}
+        conversation_state = {'revision': None, 'delta': False, 'history': [], 'full_message_tree': {}}
 
         if self.client.conversation_id and conv_data:
             try:
-                # get_conversation_history() now returns only stored user/assistant messages
-                active_branch_history = self.client.get_conversation_history()
-                current_messages_tree = conv_data.get("messages", {})
+                conversation_state = self._conversation_state(since_revision, since_conversation_id)
             except Exception as e:
                 logger.error(f"Error getting history/tree for status: {e}", exc_info=True)
-                active_branch_history = [{"role": "system", "content": f"Error loading history: {e}"}]  # Error placeholder
+                conversation_state['history'] = [{"role": "system", "content": f"Error loading history: {e}"}]  # Error placeholder
 
         return {
             'connected': self.client.provider.is_initialized,
@@ -112,25 +247,32 @@ class APIHandlers:
             'conversation_id': self.client.conversation_id,
             'conversation_name': metadata.get("title", getattr(self.client, 'conversation_name', 'New Conversation')),
             'params': metadata.get("params", self.client.params).copy(),  # Use conv's params, then client's
-            'history': active_branch_history,  # Actual stored messages
-            'full_message_tree': current_messages_tree,
+            **conversation_state,  # Full history and tree, or a delta (see _conversation_state)
             'system_instruction': current_system_instruction,  # From metadata
+            'provider_stats': self.client.provider.get_retry_stats(),  # Retry / circuit-breaker counters
+            'response_cache': self.client.provider.response_cache.get_stats() if self.client.provider.response_cache else None,
+            'prompt_cache': self.client.provider.prompt_cache_stats.to_dict(),
         }
 
-    def get_models(self) -> Dict[str, Any]:
+    async def get_models_async(self) -> Dict[str, Any]:
         """Gets available models from the current provider."""
         logger.debug("APIHandlers: Fetching available models.")
         if not self.client or not self.client.provider:
             return {'error': 'Client or provider not initialized', 'status_code': 503, 'models': [], 'current_provider': 'N/A'}
         try:
-            models = self.run_async(self.client.get_available_models())
+            models = await self.client.get_available_models()
             logger.debug(f"API Handlers found {len(models)} models for provider {self.client.provider.provider_name}.")
             return {'models': models, 'current_provider': self.client.provider.provider_name}
         except Exception as e:
             logger.error(f"Failed to get models via APIHandlers: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500, 'models': [], 'current_provider': self.client.provider.provider_name if self.client and self.client.provider else 'N/A'}
 
-    def update_settings(self, provider: Optional[str] = None,
+    def get_models(self) -> Dict[str, Any]:
+        """Blocking form of get_models_async, for the Flask server."""
+        return self._run_handler(self.get_models_async())
+
+    @_serialized
+    async def update_settings_async(self, provider: Optional[str] = None,
                         model: Optional[str] = None,
                         streaming: Optional[bool] = None,  # This is client's session default streaming
                         params: Optional[Dict[str, Any]] = None
@@ -153,8 +295,8 @@ class APIHandlers:
                     return {'error': 'Provider switching not available', 'status_code': 503}
                 
                 try:
-                    # Switch to the new provider
-                    new_provider = self.run_async(self.provider_manager.switch_provider(provider, model))
+                    # Switch to the new provider (a handle of our own: other sessions may use the same provider)
+                    new_provider = await self.provider_manager.get_session_provider(provider, model)
                     
                     # Update the client's provider
                     self.client.provider = new_provider
@@ -206,7 +348,7 @@ class APIHandlers:
                 logger.debug(f"Client params updated: {self.client.params}")
 
             if self.client.conversation_id and self.client.conversation_data:  # Save if changes affected current conv
-                self.run_async(self.client.save_conversation(quiet=True))
+                self.client.schedule_save()
 
             # Return current effective state
             conv_meta = self.client.conversation_data.get("metadata", {}) if self.client.conversation_data else {}
@@ -222,7 +364,17 @@ class APIHandlers:
             logger.error(f"Failed to update settings: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def update_conversation_system_instruction(self, conversation_id: str, new_instruction: str) -> Dict[str, Any]:
+    def update_settings(self, provider: Optional[str] = None,
+                        model: Optional[str] = None,
+                        streaming: Optional[bool] = None,  # This is client's session default streaming
+                        params: Optional[Dict[str, Any]] = None
+                        # system_instruction is now handled by update_conversation_system_instruction
+                        ) -> Dict[str, Any]:
+        """Blocking form of update_settings_async, for the Flask server."""
+        return self._run_handler(self.update_settings_async(provider, model, streaming, params))
+
+    @_serialized
+    async def update_conversation_system_instruction_async(self, conversation_id: str, new_instruction: str) -> Dict[str, Any]:
         """Updates the system instruction for a specific conversation (or current if IDs match)."""
         logger.info(f"APIHandlers: Updating system instruction for conversation ID '{conversation_id}' to: '{new_instruction[:50]}...'")
         if not self.client:
@@ -231,26 +383,21 @@ class APIHandlers:
         try:
             if self.client.conversation_id == conversation_id:
                 # Update active conversation
-                self.run_async(self.client.update_system_instruction(new_instruction))
+                await self.client.update_system_instruction(new_instruction)
                 current_sys_instruct = self.client.system_instruction
             else:
                 # Load the specified conversation, update its metadata, then save it.
                 # This is a simplified approach. A more robust one might involve a dedicated client method.
                 logger.info(f"Target conversation '{conversation_id}' is not active. Loading to update.")
-                conv_file_path = self.run_async(asyncio.to_thread(self.client._find_conversation_file_by_id_or_filename, self.client.base_directory, conversation_id))
+                conv_file_path = await asyncio.to_thread(self.client._find_conversation_file_by_id_or_filename, self.client.base_directory, conversation_id)
                 if not conv_file_path:
                     return {'error': f"Conversation with ID '{conversation_id}' not found.", 'status_code': 404}
 
-                loaded_conv_data = self.run_async(self.client.load_conversation_data(conv_file_path))
-                if not loaded_conv_data:
-                    return {'error': f"Failed to load conversation data for ID '{conversation_id}'.", 'status_code': 500}
-
-                loaded_conv_data.setdefault("metadata", {})["system_instruction"] = new_instruction
-                loaded_conv_data["metadata"]["updated_at"] = datetime.now().isoformat()
-
-                # Save the modified non-active conversation
-                title_for_save = loaded_conv_data.get("metadata", {}).get("title", "Untitled")
-                self.run_async(self.client.save_conversation_data(loaded_conv_data, conversation_id, title_for_save, self.client.base_directory, quiet=False))
+                # Only the metadata header is rewritten; message bodies are left untouched
+                await self.client.flush_pending_saves()
+                changes = {"system_instruction": new_instruction, "updated_at": datetime.now().isoformat()}
+                await asyncio.to_thread(self.client.update_conversation_metadata, conv_file_path, changes)
+                self.client.get_catalog().record(conv_file_path, self.client.read_conversation_header(conv_file_path))
                 current_sys_instruct = new_instruction  # The instruction that was set
                 logger.info(f"System instruction for non-active conversation '{conversation_id}' updated and saved.")
 
@@ -264,23 +411,49 @@ class APIHandlers:
             logger.error(f"Failed to update system instruction for conversation '{conversation_id}': {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def get_conversations(self) -> Dict[str, Any]:
+    def update_conversation_system_instruction(self, conversation_id: str, new_instruction: str) -> Dict[str, Any]:
+        """Blocking form of update_conversation_system_instruction_async, for the Flask server."""
+        return self._run_handler(self.update_conversation_system_instruction_async(conversation_id, new_instruction))
+
+    async def get_conversations_async(self) -> Dict[str, Any]:
         """Lists all saved conversations."""
         logger.debug("APIHandlers: Fetching conversations list.")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503, 'conversations': []}
         try:
-            conversations = self.run_async(self.client.list_conversations())
+            conversations = await self.client.list_conversations()
             return {'conversations': conversations}
         except Exception as e:
             logger.error(f"Failed to get conversations: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500, 'conversations': []}
 
-    def new_conversation(self, title: str = '') -> Dict[str, Any]:
+    def get_conversations(self) -> Dict[str, Any]:
+        """Blocking form of get_conversations_async, for the Flask server."""
+        return self._run_handler(self.get_conversations_async())
+
+    async def search_conversations_async(self, query: str, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Ranked full-text search across saved conversations; results carry message IDs for navigation."""
+        logger.debug(f"APIHandlers: Searching conversations for '{query}' (page {page}).")
+        if not self.client: return {'error': 'Client not initialized', 'status_code': 503, 'results': []}
+        if not query.strip():
+            return {'error': 'Search query is required', 'status_code': 400, 'results': []}
+        try:
+            await self.client.flush_pending_saves()
+            return await self.client.search_conversations(self.client.base_directory, query, page, page_size)
+        except Exception as e:
+            logger.error(f"Conversation search failed: {e}", exc_info=True)
+            return {'error': str(e), 'status_code': 500, 'results': []}
+
+    def search_conversations(self, query: str, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Blocking form of search_conversations_async, for the Flask server."""
+        return self._run_handler(self.search_conversations_async(query, page, page_size))
+
+    @_serialized
+    async def new_conversation_async(self, title: str = '') -> Dict[str, Any]:
         """Starts a new conversation."""
         logger.info(f"APIHandlers: Starting new conversation with title: '{title if title else '(auto-generated)'}'")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
-            self.run_async(self.client.start_new_conversation(title=title, is_web_ui=True))
+            await self.client.start_new_conversation(title=title, is_web_ui=True)
 
             # After new conversation, get its state
             conv_meta = self.client.conversation_data.get("metadata", {})
@@ -288,40 +461,41 @@ class APIHandlers:
                 'success': True,
                 'conversation_id': self.client.conversation_id,
                 'conversation_name': conv_meta.get("title", self.client.conversation_name),
-                'history': [],  # New conversation has no stored messages yet
+                **self._conversation_state(),  # Empty history and tree, and the starting revision
                 'provider_name': conv_meta.get("provider", self.client.provider.provider_name if self.client.provider else 'N/A'),
                 'model': conv_meta.get("model", self.client.current_model_name if self.client.provider else 'N/A'),
                 'params': conv_meta.get("params", self.client.params).copy(),
                 'streaming': conv_meta.get("streaming_preference", self.client.use_streaming),
-                'full_message_tree': self.client.conversation_data.get("messages", {}),  # Should be empty
                 'system_instruction': conv_meta.get("system_instruction", self.client.system_instruction),
             }
         except Exception as e:
             logger.error(f"Failed to create new conversation: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def load_conversation(self, conversation_identifier: str) -> Dict[str, Any]:
+    def new_conversation(self, title: str = '') -> Dict[str, Any]:
+        """Blocking form of new_conversation_async, for the Flask server."""
+        return self._run_handler(self.new_conversation_async(title))
+
+    @_serialized
+    async def load_conversation_async(self, conversation_identifier: str) -> Dict[str, Any]:
         """Loads an existing conversation."""
         logger.info(f"APIHandlers: Loading conversation: '{conversation_identifier}'")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
-            self.run_async(self.client.load_conversation(conversation_identifier))
+            await self.client.load_conversation(conversation_identifier)
 
             # After loading, get its state
-            active_history = self.client.get_conversation_history()  # Actual stored messages
             conv_meta = self.client.conversation_data.get("metadata", {})
-            full_tree = self.client.conversation_data.get("messages", {})
 
             return {
                 'success': True,
                 'conversation_id': self.client.conversation_id,
                 'conversation_name': conv_meta.get("title", "Untitled"),
-                'history': active_history,
+                **self._conversation_state(),  # Always the full history and tree
                 'provider_name': conv_meta.get("provider", self.client.provider.provider_name if self.client.provider else 'N/A'),
                 'model': conv_meta.get("model", self.client.current_model_name if self.client.provider else 'N/A'),
                 'params': conv_meta.get("params", self.client.params).copy(),
                 'streaming': conv_meta.get("streaming_preference", self.client.use_streaming),
-                'full_message_tree': full_tree,
                 'system_instruction': conv_meta.get("system_instruction", self.client.system_instruction),
             }
         except FileNotFoundError:  # More specific error
@@ -331,37 +505,46 @@ class APIHandlers:
             logger.error(f"Failed to load conversation '{conversation_identifier}': {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def save_conversation(self) -> Dict[str, Any]:
+    def load_conversation(self, conversation_identifier: str) -> Dict[str, Any]:
+        """Blocking form of load_conversation_async, for the Flask server."""
+        return self._run_handler(self.load_conversation_async(conversation_identifier))
+
+    @_serialized
+    async def save_conversation_async(self) -> Dict[str, Any]:
         """Saves the currently active conversation."""
         logger.info("APIHandlers: Saving current conversation.")
         if not self.client or not self.client.conversation_id or not self.client.conversation_data:
             return {'error': 'No active conversation to save', 'status_code': 400}
         try:
-            self.run_async(self.client.save_conversation())
+            await self.client.save_conversation()
             title = self.client.conversation_data.get("metadata", {}).get("title", "Untitled")
             return {'success': True, 'message': f"Conversation '{title}' saved."}
         except Exception as e:
             logger.error(f"Failed to save conversation: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
+    def save_conversation(self) -> Dict[str, Any]:
+        """Blocking form of save_conversation_async, for the Flask server."""
+        return self._run_handler(self.save_conversation_async())
+
     def _find_conv_file(self, conv_id_or_name: str) -> Optional[Path]:
         """Helper to find conversation file path (synchronous part)."""
         if not self.client or not self.client.base_directory: return None
         # This is a synchronous call, run it in a thread from async context
         return self.client._find_conversation_file_by_id_or_filename(self.client.base_directory, conv_id_or_name)
 
-    def duplicate_conversation(self, conversation_id_to_duplicate: str, new_title: str) -> Dict[str, Any]:
+    async def duplicate_conversation_async(self, conversation_id_to_duplicate: str, new_title: str) -> Dict[str, Any]:
         """Duplicates an existing conversation with a new title and ID."""
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         logger.info(f"APIHandlers: Duplicating conversation ID/File: {conversation_id_to_duplicate} to new title: '{new_title}'")
         try:
             # _find_conv_file is sync, so run in thread
-            original_filepath = self.run_async(asyncio.to_thread(self._find_conv_file, conversation_id_to_duplicate))
+            await self.client.flush_pending_saves()  # Settle background autosaves before touching files
+            original_filepath = await asyncio.to_thread(self._find_conv_file, conversation_id_to_duplicate)
             if not original_filepath or not original_filepath.exists():
                 return {'error': 'Original conversation file not found', 'status_code': 404}
 
-            with open(original_filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = self.client.read_conversation_file(original_filepath)
 
             new_conv_id_str = self.client.generate_conversation_id()  # New unique ID
             data['conversation_id'] = new_conv_id_str  # Update ID in duplicated data
@@ -376,54 +559,64 @@ class APIHandlers:
             data['metadata']['model'] = data['metadata'].get('model', self.client.current_model_name if self.client.provider else "unknown")
             # System instruction is already in metadata if present, will be copied.
 
-            new_filename_str = self.client.format_filename(new_title, new_conv_id_str)
-            new_filepath = self.client.base_directory / new_filename_str
+            new_filepath = self.client.conversation_path(self.client.base_directory, new_title, new_conv_id_str).with_suffix(original_filepath.suffix)
+            new_filename_str = new_filepath.name
 
-            with open(new_filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            new_filepath.parent.mkdir(parents=True, exist_ok=True)
+            self.client.write_conversation_file(new_filepath, data)
+            self.client.get_catalog().record(new_filepath, data)
 
             return {'success': True, 'new_conversation_id': new_conv_id_str, 'new_title': new_title, 'new_filename': new_filename_str}
         except Exception as e:
             logger.error(f"Error duplicating conversation: {e}", exc_info=True)
             return {'error': f'Server error during duplication: {str(e)}', 'status_code': 500}
 
-    def rename_conversation(self, conversation_id_or_filename_to_rename: str, new_title: str) -> Dict[str, Any]:
+    def duplicate_conversation(self, conversation_id_to_duplicate: str, new_title: str) -> Dict[str, Any]:
+        """Blocking form of duplicate_conversation_async, for the Flask server."""
+        return self._run_handler(self.duplicate_conversation_async(conversation_id_to_duplicate, new_title))
+
+    @_serialized
+    async def rename_conversation_async(self, conversation_id_or_filename_to_rename: str, new_title: str) -> Dict[str, Any]:
         """Renames an existing conversation."""
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         logger.info(f"APIHandlers: Renaming conversation ID/File: {conversation_id_or_filename_to_rename} to new title: '{new_title}'")
         try:
-            original_filepath = self.run_async(asyncio.to_thread(self._find_conv_file, conversation_id_or_filename_to_rename))
+            await self.client.flush_pending_saves()  # Settle background autosaves before touching files
+            original_filepath = await asyncio.to_thread(self._find_conv_file, conversation_id_or_filename_to_rename)
             if not original_filepath or not original_filepath.exists():
                 return {'error': 'Conversation file not found for renaming', 'status_code': 404}
 
-            with open(original_filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = self.client.read_conversation_header(original_filepath)
 
             actual_conversation_id = data.get('conversation_id')
             if not actual_conversation_id:
                 return {'error': 'Internal error: Conversation ID missing from file', 'status_code': 500}
 
-            data.setdefault('metadata', {})
-            data['metadata']['title'] = new_title
-            data['metadata']['updated_at'] = datetime.now().isoformat()
-
-            # Save changes back to the *original file path first* if filename doesn't change
-            # Then, rename the file if the title change implies a filename change.
-            with open(original_filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # Update the title in the file's header (messages are not re-encoded),
+            # then rename the file if the title change implies a filename change.
+            data['metadata'] = self.client.update_conversation_metadata(
+                original_filepath, {'title': new_title, 'updated_at': datetime.now().isoformat()})
 
-            new_filename_str = self.client.format_filename(new_title, actual_conversation_id)
-            new_filepath = self.client.base_directory / new_filename_str
+            # Sharded files (and flat files under the sharded layout) keep their ID-based path
+            if self.client.layout == "sharded":
+                new_filepath = original_filepath
+            else:
+                new_filepath = (self.client.base_directory / self.client.format_filename(new_title, actual_conversation_id)).with_suffix(original_filepath.suffix)
+            new_filename_str = new_filepath.name
 
             if original_filepath != new_filepath:
                 try:
                     os.rename(original_filepath, new_filepath)
                     logger.info(f"Renamed file from {original_filepath.name} to {new_filepath.name}")
+                    self.client.forget_conversation_file(original_filepath)
                 except OSError as e_os:
                     logger.error(f"Error renaming file from {original_filepath} to {new_filepath}: {e_os}")
+                    self.client.get_catalog().record(original_filepath, data)
                     # If rename fails, the content is updated but filename might be old. This is a partial success.
                     return {'error': f'Content updated, but failed to rename file: {e_os}', 'status_code': 500, 'partial_success': True, 'conversation_id': actual_conversation_id, 'new_title': new_title}
 
+            self.client.get_catalog().record(new_filepath, data)
+
             # If renaming the active conversation, update client's current name
             if self.client.conversation_id == actual_conversation_id:
                 self.client.conversation_name = new_title
@@ -435,25 +628,30 @@ class APIHandlers:
             logger.error(f"Error renaming conversation: {e}", exc_info=True)
             return {'error': f'Server error during rename: {str(e)}', 'status_code': 500}
 
-    def delete_conversation(self, conversation_id_or_filename_to_delete: str) -> Dict[str, Any]:
+    def rename_conversation(self, conversation_id_or_filename_to_rename: str, new_title: str) -> Dict[str, Any]:
+        """Blocking form of rename_conversation_async, for the Flask server."""
+        return self._run_handler(self.rename_conversation_async(conversation_id_or_filename_to_rename, new_title))
+
+    async def delete_conversation_async(self, conversation_id_or_filename_to_delete: str) -> Dict[str, Any]:
         """Deletes an existing conversation file."""
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         logger.info(f"APIHandlers: Deleting conversation ID/File: {conversation_id_or_filename_to_delete}")
         try:
-            filepath_to_delete = self.run_async(asyncio.to_thread(self._find_conv_file, conversation_id_or_filename_to_delete))
+            await self.client.flush_pending_saves()  # Settle background autosaves before touching files
+            filepath_to_delete = await asyncio.to_thread(self._find_conv_file, conversation_id_or_filename_to_delete)
             if not filepath_to_delete or not filepath_to_delete.exists():
                 return {'error': 'Conversation file not found for deletion', 'status_code': 404}
 
             # Try to get the actual conversation_id from the file before deleting
             actual_conv_id_from_file = conversation_id_or_filename_to_delete  # Fallback
             try:
-                with open(filepath_to_delete, 'r', encoding='utf-8') as f_read:
-                    data_read = json.load(f_read)
-                    actual_conv_id_from_file = data_read.get('conversation_id', actual_conv_id_from_file)
+                data_read = self.client.read_conversation_header(filepath_to_delete)
+                actual_conv_id_from_file = data_read.get('conversation_id', actual_conv_id_from_file)
             except Exception:  # Ignore if can't read ID, proceed with deletion
                 pass
 
             os.remove(filepath_to_delete)
+            self.client.forget_conversation_file(filepath_to_delete)
             logger.info(f"Deleted conversation file: {filepath_to_delete.name}")
 
             return {'success': True, 'deleted_conversation_id': actual_conv_id_from_file}
@@ -461,12 +659,25 @@ class APIHandlers:
             logger.error(f"Error deleting conversation: {e}", exc_info=True)
             return {'error': f'Server error during deletion: {str(e)}', 'status_code': 500}
 
-    def send_message(self, message_content: str) -> Dict[str, Any]:
-        """Handles a non-streaming message send request."""
+    def delete_conversation(self, conversation_id_or_filename_to_delete: str) -> Dict[str, Any]:
+        """Blocking form of delete_conversation_async, for the Flask server."""
+        return self._run_handler(self.delete_conversation_async(conversation_id_or_filename_to_delete))
+
+    @_serialized
+    async def send_message_async(self, message_content: str, attachments: Optional[List[Dict[str, Any]]] = None,
+                                 add_user_message: bool = False) -> Dict[str, Any]:
+        """Handles a non-streaming message send request (adding the user message first if add_user_message)."""
         logger.debug(f"APIHandlers: Handling non-streaming send for: '{message_content[:50]}...'")
         if not self.client or not self.client.provider:
             return {'error': 'Client or provider not initialized', 'status_code': 503}
 
+        if add_user_message:  # Under the conversation lock, so a concurrent send cannot take over the turn
+            try:
+                self.client.add_user_message(message_content, attachments=attachments)
+            except ValueError as e:
+                logger.warning(f"ValueError adding user message: {e}")
+                return {'error': str(e), 'status_code': 400}
+
         try:
             # GUI client should call client.add_user_message() before this to set current_user_message_id
             # This method assumes current_user_message_id is set.
@@ -475,7 +686,7 @@ class APIHandlers:
                 # For robustness, add it now if it wasn't, though GUI flow should handle this.
                 self.client.add_user_message(message_content)
 
-            response_text, token_usage_dict = self.run_async(self.client.get_response())
+            response_text, token_usage_dict = await self.client.get_response()
 
             if response_text is None and token_usage_dict is None:  # Indicates provider error from client.get_response
                 logger.error("AI client's get_response returned None for text and token_usage, likely provider error.")
@@ -491,60 +702,75 @@ class APIHandlers:
                 self.client.active_branch
             )
             # The parent of this assistant message is the user message ID that was being processed
-            user_message_id_for_parenting = self.client.conversation_data["messages"].get(assistant_message_id, {}).get("parent_id") if assistant_message_id else self.client.current_user_message_id
+            assistant_message = self.client.conversation_data["messages"].get(assistant_message_id, {}) if assistant_message_id else {}
+            user_message_id_for_parenting = assistant_message.get("parent_id") if assistant_message_id else self.client.current_user_message_id
 
-            # Save conversation after successful response
-            self.run_async(self.client.save_conversation(quiet=True))
+            # Save conversation after successful response (written behind the reply)
+            self.client.schedule_save()
 
             return {
                 'response': response_text,
                 'conversation_id': self.client.conversation_id,
                 'message_id': assistant_message_id,  # ID of the AI's response message
                 'parent_id': user_message_id_for_parenting,  # ID of the user message it's responding to
-                'provider_name': self.client.provider.provider_name,
-                'model': self.client.current_model_name,
-                'token_usage': token_usage_dict or {}
+                'provider_name': assistant_message.get("provider", self.client.provider.provider_name),  # A fallback may have served it
+                'model': assistant_message.get("model", self.client.current_model_name),
+                'token_usage': token_usage_dict or {},
+                'context': self.client.last_context_report  # Older messages left out to fit the context window
             }
         except Exception as e:
             logger.error(f"Failed in APIHandlers send_message (non-streaming): {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    async def stream_message(self, message_content: str) -> AsyncGenerator[Dict[str, Any], None]:
-        """Handles a streaming message send request."""
-        logger.debug(f"APIHandlers: Initiating stream for message (content already added by client.add_user_message): '{message_content[:50]}...'")
+    def send_message(self, message_content: str, attachments: Optional[List[Dict[str, Any]]] = None,
+                     add_user_message: bool = False) -> Dict[str, Any]:
+        """Blocking form of send_message_async, for the Flask server."""
+        return self._run_handler(self.send_message_async(message_content, attachments, add_user_message))
+
+    async def stream_message(self, message_content: str, attachments: Optional[List[Dict[str, Any]]] = None,
+                             add_user_message: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """Handles a streaming message send request (adding the user message first if add_user_message)."""
+        logger.debug(f"APIHandlers: Initiating stream for message: '{message_content[:50]}...'")
         if not self.client or not self.client.provider:
             yield {"error": "Client or provider not initialized in APIHandlers."}
             return
 
-        # Ensure current_user_message_id is set (GUI should call client.add_user_message first)
-        if not self.client.current_user_message_id:
-            logger.warning("APIHandlers.stream_message called but client.current_user_message_id is not set. Adding user message now.")
-            # This is a fallback. Ideally, the route handler ensures add_user_message is called.
-            self.client.add_user_message(message_content)  # This is a sync call, ensure it's safe in async context or refactor add_user_message
-            if not self.client.current_user_message_id:  # If still not set
-                yield {"error": "Failed to process user message before streaming."};
-                return
+        async with self.conversation_lock():  # Held for the whole stream
+            if add_user_message:
+                try:
+                    self.client.add_user_message(message_content, attachments=attachments)
+                except ValueError as e:
+                    yield {"error": str(e)}
+                    return
 
-        try:
-            async for data_event in self.client.get_streaming_response():
-                yield data_event  # Yield each event from the client's streaming method
-                if data_event.get("error") or data_event.get("done"):
-                    break  # Stop if error or done signal received
-            logger.debug("APIHandlers: Streaming finished.")
-        except Exception as e:
-            logger.error(f"Streaming error in APIHandlers.stream_message: {e}", exc_info=True)
-            yield {"error": f"API Handler streaming error: {str(e)}"}
+            # Ensure current_user_message_id is set (callers that add the message themselves must do it first)
+            if not self.client.current_user_message_id:
+                logger.warning("APIHandlers.stream_message called but client.current_user_message_id is not set. Adding user message now.")
+                self.client.add_user_message(message_content)
+                if not self.client.current_user_message_id:  # If still not set
+                    yield {"error": "Failed to process user message before streaming."};
+                    return
+
+            try:
+                async for data_event in self.client.get_streaming_response():
+                    yield data_event  # Yield each event from the client's streaming method
+                    if data_event.get("error") or data_event.get("done"):
+                        break  # Stop if error or done signal received
+                logger.debug("APIHandlers: Streaming finished.")
+            except Exception as e:
+                logger.error(f"Streaming error in APIHandlers.stream_message: {e}", exc_info=True)
+                yield {"error": f"API Handler streaming error: {str(e)}"}
 
-    def retry_message(self, assistant_message_id_to_retry: str) -> Dict[str, Any]:
-        """Retries generating an assistant message, creating a new branch."""
+    @_serialized
+    async def retry_message_async(self, assistant_message_id_to_retry: str, since_revision: Optional[int] = None,
+                                  since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Retries generating an assistant message, creating a new branch (with a delta if since_revision)."""
         logger.info(f"APIHandlers: Retrying assistant message: {assistant_message_id_to_retry}")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
-            retry_result_dict = self.run_async(self.client.retry_message(assistant_message_id_to_retry))
+            retry_result_dict = await self.client.retry_message(assistant_message_id_to_retry)
 
             # After retry, client's active branch/leaf and history are updated.
-            current_active_history = self.client.get_conversation_history()  # Stored messages
-            current_full_tree = self.client.conversation_data.get("messages", {})
             conv_meta = self.client.conversation_data.get("metadata", {})
 
             return {
@@ -552,25 +778,29 @@ class APIHandlers:
                 'message': retry_result_dict.get('message', {}),  # The new AI message object
                 'sibling_index': retry_result_dict.get('sibling_index', -1),
                 'total_siblings': retry_result_dict.get('total_siblings', 0),
-                'history': current_active_history,
                 'conversation_id': self.client.conversation_id,
                 'conversation_name': conv_meta.get("title"),
-                'full_message_tree': current_full_tree,
+                **self._conversation_state(since_revision, since_conversation_id),
                 'system_instruction': conv_meta.get("system_instruction", self.client.system_instruction),
             }
         except Exception as e:
             logger.error(f"Failed to retry message {assistant_message_id_to_retry}: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def navigate_sibling(self, message_id: str, direction: str) -> Dict[str, Any]:
-        """Navigates to a sibling (alternative) AI response."""
+    def retry_message(self, assistant_message_id_to_retry: str, since_revision: Optional[int] = None,
+                      since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Blocking form of retry_message_async, for the Flask server."""
+        return self._run_handler(self.retry_message_async(assistant_message_id_to_retry, since_revision, since_conversation_id))
+
+    @_serialized
+    async def navigate_sibling_async(self, message_id: str, direction: str, since_revision: Optional[int] = None,
+                                     since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Navigates to a sibling (alternative) AI response (with a delta if since_revision)."""
         logger.info(f"APIHandlers: Navigating {direction} from message: {message_id}")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
-            nav_result_dict = self.run_async(self.client.switch_to_sibling(message_id, direction))
+            nav_result_dict = await self.client.switch_to_sibling(message_id, direction)
 
-            current_active_history = self.client.get_conversation_history()  # Stored messages
-            current_full_tree = self.client.conversation_data.get("messages", {})
             conv_meta = self.client.conversation_data.get("metadata", {})
 
             return {
@@ -578,23 +808,27 @@ class APIHandlers:
                 'message': nav_result_dict.get('message', {}),  # The new active AI message
                 'sibling_index': nav_result_dict.get('sibling_index', -1),
                 'total_siblings': nav_result_dict.get('total_siblings', 0),
-                'history': current_active_history,
                 'conversation_id': self.client.conversation_id,
                 'conversation_name': conv_meta.get("title"),
-                'full_message_tree': current_full_tree,
+                **self._conversation_state(since_revision, since_conversation_id),
                 'system_instruction': conv_meta.get("system_instruction", self.client.system_instruction),
             }
         except Exception as e:
             logger.error(f"Failed to navigate sibling for {message_id} ({direction}): {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def get_message_info(self, message_id: str) -> Dict[str, Any]:
+    def navigate_sibling(self, message_id: str, direction: str, since_revision: Optional[int] = None,
+                         since_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Blocking form of navigate_sibling_async, for the Flask server."""
+        return self._run_handler(self.navigate_sibling_async(message_id, direction, since_revision, since_conversation_id))
+
+    async def get_message_info_async(self, message_id: str) -> Dict[str, Any]:
         """Gets detailed information about a specific message and its siblings."""
         logger.debug(f"APIHandlers: Getting info for message: {message_id}")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
             # get_message_siblings now returns more comprehensive info
-            sibling_info_dict = self.run_async(self.client.get_message_siblings(message_id))
+            sibling_info_dict = await self.client.get_message_siblings(message_id)
 
             messages_dict = self.client.conversation_data.get("messages", {}) if self.client.conversation_data else {}
             message_data = messages_dict.get(message_id, {})
@@ -613,18 +847,44 @@ class APIHandlers:
             logger.error(f"Failed to get message info for {message_id}: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def get_conversation_tree(self) -> Dict[str, Any]:
+    def get_message_info(self, message_id: str) -> Dict[str, Any]:
+        """Blocking form of get_message_info_async, for the Flask server."""
+        return self._run_handler(self.get_message_info_async(message_id))
+
+    @_serialized
+    async def pin_message_async(self, message_id: str, pinned: bool) -> Dict[str, Any]:
+        """Pins or unpins a message for the "pinned" context budget strategy."""
+        logger.info(f"APIHandlers: Setting pinned={pinned} on message: {message_id}")
+        if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
+        try:
+            found = self.client.set_message_pinned(message_id, pinned)  # Schedules the save
+            if not found:
+                return {'error': f"Message {message_id} not found in conversation data", 'status_code': 404}
+            return {'success': True, 'message_id': message_id, 'pinned': pinned}
+        except Exception as e:
+            logger.error(f"Failed to pin message {message_id}: {e}", exc_info=True)
+            return {'error': str(e), 'status_code': 500}
+
+    def pin_message(self, message_id: str, pinned: bool) -> Dict[str, Any]:
+        """Blocking form of pin_message_async, for the Flask server."""
+        return self._run_handler(self.pin_message_async(message_id, pinned))
+
+    async def get_conversation_tree_async(self) -> Dict[str, Any]:
         """Gets the full message tree structure for the current conversation."""
         logger.debug("APIHandlers: Getting full conversation tree.")
         if not self.client: return {'error': 'Client not initialized', 'status_code': 503}
         try:
-            tree_data = self.run_async(self.client.get_conversation_tree())  # client method returns nodes, edges, metadata
+            tree_data = await self.client.get_conversation_tree()  # client method returns nodes, edges, metadata
             return {'success': True, **tree_data}  # Spread the dict from client
         except Exception as e:
             logger.error(f"Failed to get conversation tree: {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
 
-    def execute_command(self, command_str: str) -> Dict[str, Any]:
+    def get_conversation_tree(self) -> Dict[str, Any]:
+        """Blocking form of get_conversation_tree_async, for the Flask server."""
+        return self._run_handler(self.get_conversation_tree_async())
+
+    async def execute_command_async(self, command_str: str) -> Dict[str, Any]:
         """Executes a text command, primarily for CLI-like interactions if GUI uses it."""
         logger.info(f"APIHandlers: Executing command: '{command_str}'")
         if not self.client or not self.command_handler:
@@ -632,7 +892,7 @@ class APIHandlers:
 
         try:
             # Command handler logic needs to be async-aware if calling async client methods
-            # For simplicity, assuming command_handler's methods are designed to be run via self.run_async if they are async
+            # For simplicity, assuming command_handler's methods are awaited here if they are async
 
             # This part needs careful review based on CommandHandler implementation
             # For now, let's map common commands to their API handler methods for structured responses.
@@ -641,25 +901,25 @@ class APIHandlers:
             cmd_args = parts[1] if len(parts) > 1 else ""
 
             if cmd_name == '/new':
-                return self.new_conversation(title=cmd_args)
+                return await self.new_conversation_async(title=cmd_args)
             elif cmd_name == '/load':
                 if not cmd_args: return {'error': 'Specify conversation name/ID/number to load', 'status_code': 400}
-                return self.load_conversation(cmd_args)
+                return await self.load_conversation_async(cmd_args)
             elif cmd_name == '/save':
-                return self.save_conversation()
+                return await self.save_conversation_async()
             elif cmd_name == '/list':
-                convos = self.get_conversations()  # This already returns a dict with 'conversations'
+                convos = await self.get_conversations_async()  # This already returns a dict with 'conversations'
                 return {'success': True, 'message': 'Conversations list refreshed.', **convos}
             elif cmd_name == '/model':
                 if cmd_args:
-                    return self.update_settings(model=cmd_args)  # update_settings returns full state
+                    return await self.update_settings_async(model=cmd_args)  # update_settings returns full state
                 else:
-                    return self.get_models()  # get_models returns models and current provider
+                    return await self.get_models_async()  # get_models returns models and current provider
             elif cmd_name == '/stream':  # Toggles client's session default streaming
                 # update_settings handles the logic for toggling self.client.use_streaming
                 # and saving to global config.
                 current_streaming_pref = self.client.conversation_data.get("metadata", {}).get("streaming_preference", self.client.use_streaming)
-                response = self.update_settings(streaming=not current_streaming_pref)
+                response = await self.update_settings_async(streaming=not current_streaming_pref)
                 new_streaming_status = self.client.conversation_data.get("metadata", {}).get("streaming_preference", self.client.use_streaming)
                 response['message'] = f"Session and conversation streaming preference set to {'ON' if new_streaming_status else 'OFF'}."
                 return response
@@ -669,10 +929,14 @@ class APIHandlers:
 
             logger.warning(f"Command '{cmd_name}' not directly mapped in APIHandlers.execute_command for rich response. Falling back to CommandHandler (if implemented).")
             # Fallback to generic command handler if one exists and is appropriate
-            # result = self.run_async(self.command_handler.handle_command_async(command_str)) # Example
+            # result = await self.command_handler.handle_command_async(command_str) # Example
             # return {'success': True, 'message': 'Command processed by generic handler.', 'details': result}
             return {'error': f"Command '{cmd_name}' not fully supported via this API route for structured GUI response.", 'status_code': 400}
 
         except Exception as e:
             logger.error(f"Failed to execute command '{command_str}': {e}", exc_info=True)
             return {'error': str(e), 'status_code': 500}
+
+    def execute_command(self, command_str: str) -> Dict[str, Any]:
+        """Blocking form of execute_command_async, for the Flask server."""
+        return self._run_handler(self.execute_command_async(command_str))
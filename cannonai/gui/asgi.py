@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+"""
+CannonAI GUI ASGI Application - Serves the GUI on the client's own event loop
+
+An alternative to the Flask server (server.py) with the same `/api/*` contract.
+The Flask server runs each request on a WSGI thread that blocks on
+APIHandlers.run_async while the work happens on the separate GUI loop thread.
+Here the AI client lives on the ASGI server's loop and the route handlers await
+the APIHandlers coroutines directly, so a concurrent stream costs one coroutine
+instead of a thread plus two cross-thread hops per chunk.
+
+The app is plain ASGI with no framework dependency; any ASGI server can run it:
+
+    python cannonai/cannonai.py --gui --asgi
+    uvicorn --factory gui.asgi:create_app   (from the cannonai directory)
+"""
+
+import asyncio
+import json
+import logging
+import re
+import webbrowser
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from .api_handlers import get_settings_payload, parse_revision, settings_etag
+from .http_cache import API_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets, etag_matches, maybe_compress
+from .init_helpers import AsyncComponentManager, get_component_manager
+from .sessions import SESSION_COOKIE, SESSION_HEADER, SESSIONLESS_PATHS
+from .streaming import format_sse_message
+from config import Config
+from base_client import Colors
+
+logger = logging.getLogger("cannonai.gui.asgi")
+
+GUI_DIR = Path(__file__).resolve().parent
+STATIC_DIR = GUI_DIR / "static"
+INDEX_TEMPLATE = GUI_DIR / "templates" / "index.html"
+
+STREAM_ITEM_TIMEOUT = 90  # Seconds to wait for the next stream event (same as the Flask route)
+
+# index.html only uses static_url('...'), so it is rendered without a template engine
+STATIC_URL_PATTERN = re.compile(r"""\{\{\s*static_url\(\s*'([^']+)'\s*\)\s*\}\}""")
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+JsonResult = Tuple[Optional[Dict[str, Any]], int]  # (None, 304) answers a conditional GET
+
+
+class Request:
+    """The parts of an HTTP request the route handlers use, and the session's handlers and client."""
+
+    def __init__(self, method: str, path: str, query_string: bytes, body: bytes, path_params: Dict[str, str],
+                 handlers: Optional[Any], client: Optional[Any], headers: Optional[Dict[str, str]] = None):
+        self.method = method
+        self.path = path
+        self.headers = headers or {}  # Lower-case names
+        self.etag: Optional[str] = None  # Set by routes that support conditional GET
+        self.query = {key: values[-1] for key, values in parse_qs(query_string.decode("latin-1")).items()}
+        self.body = body
+        self.path_params = path_params
+        self.handlers = handlers
+        self.client = client
+
+    def json(self) -> Dict[str, Any]:
+        """Parsed JSON body; an empty or invalid body counts as no fields."""
+        try:
+            data = json.loads(self.body) if self.body else {}
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def query_int(self, name: str, default: int) -> int:
+        try:
+            return int(self.query.get(name, default))
+        except ValueError:
+            return default
+
+    def not_modified(self, etag: Optional[str]) -> bool:
+        """Records `etag` for the response; True when the caller's If-None-Match already names it."""
+        self.etag = etag
+        return etag_matches(self.headers.get('if-none-match'), etag)
+
+
+def _header_dict(scope: Dict[str, Any]) -> Dict[str, str]:
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get('headers', [])}
+
+
+def _handler_result(result: Dict[str, Any]) -> JsonResult:
+    """Status code convention shared with routes.py: explicit status_code, else 500 on error."""
+    return result, result.get('status_code', 200 if 'error' not in result else 500)
+
+
+class ASGIApp:
+    """ASGI application serving the CannonAI GUI and its JSON/SSE API."""
+
+    def __init__(self, app_config: Config, cli_args: Optional[Any] = None,
+                 component_manager: Optional[AsyncComponentManager] = None):
+        self.app_config = app_config
+        self.cli_args = cli_args
+        self.components = component_manager or get_component_manager()
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._started = False
+        self.assets = StaticAssets(STATIC_DIR)
+
+        # (method, path pattern, handler); JSON handlers return (payload, status), SSE handlers an event generator
+        self.json_routes: List[Tuple[str, re.Pattern, Callable[[Request], Awaitable[JsonResult]]]] = []
+        self.stream_routes: List[Tuple[str, re.Pattern, Callable[[Request], AsyncGenerator[Dict[str, Any], None]]]] = []
+        for method, pattern, handler in [
+            ('GET', r'/api/status', self.get_status),
+            ('GET', r'/api/models', self.get_models),
+            ('POST', r'/api/send', self.send_message),
+            ('GET', r'/api/conversations', self.get_conversations),
+            ('GET', r'/api/search', self.search_conversations),
+            ('POST', r'/api/conversation/new', self.new_conversation),
+            ('POST', r'/api/conversation/load/(?P<conversation_identifier>[^/]+)', self.load_conversation),
+            ('POST', r'/api/conversation/save', self.save_conversation),
+            ('POST', r'/api/conversation/duplicate/(?P<conversation_id>[^/]+)', self.duplicate_conversation),
+            ('POST', r'/api/conversation/rename/(?P<conversation_id>[^/]+)', self.rename_conversation),
+            ('DELETE', r'/api/conversation/delete/(?P<conversation_id>[^/]+)', self.delete_conversation),
+            ('GET', r'/api/settings', self.get_settings),
+            ('POST', r'/api/settings', self.update_settings),
+            ('POST', r'/api/conversation/(?P<conversation_id>[^/]+)/system_instruction',
+             self.update_conversation_system_instruction),
+            ('POST', r'/api/command', self.execute_command),
+            ('POST', r'/api/retry/(?P<message_id>[^/]+)', self.retry_message),
+            ('GET', r'/api/message/(?P<message_id>[^/]+)', self.get_message_info),
+            ('POST', r'/api/message/(?P<message_id>[^/]+)/pin', self.pin_message),
+            ('POST', r'/api/navigate', self.navigate_sibling),
+            ('GET', r'/api/tree', self.get_conversation_tree),
+            ('GET', r'/api/health', self.health_check),
+        ]:
+            self.json_routes.append((method, re.compile(pattern + r'$'), handler))
+        self.stream_routes.append(('POST', re.compile(r'/api/stream$'), self.stream_message))
+        self.stream_routes.append(('GET', re.compile(r'/api/test/stream$'), self.test_stream))
+
+    # ============ Lifecycle ============
+
+    async def startup(self) -> None:
+        """Initializes the AI client and API handlers on this loop (once)."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            print("[ASGI] Initializing async components on the server loop...")
+            await self.components.initialize_on_current_loop(self.app_config, self.cli_args)
+            if self.components.is_ready():
+                client = self.components.chat_client
+                print(f"{Colors.GREEN}[ASGI] GUI components initialized successfully{Colors.ENDC}")
+                print(f"{Colors.CYAN}[ASGI] Active Provider: {client.provider.provider_name}, Model: {client.current_model_name}{Colors.ENDC}")
+            else:
+                status = self.components.get_status()
+                logger.critical(f"GUI components did NOT initialize. Server may not function correctly: {status}")
+                print(f"{Colors.FAIL}[ASGI] Failed to initialize GUI components: {status.get('error')}{Colors.ENDC}")
+
+    async def shutdown(self) -> None:
+        print("[ASGI] Cleaning up resources")
+        await self.components.aclose()
+        print(f"{Colors.GREEN}[ASGI] Shutdown complete{Colors.ENDC}")
+
+    # ============ ASGI Entry Point ============
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        # Servers that skip the lifespan protocol still get an initialized client
+        await self.startup()
+
+        method = scope['method']
+        path = scope['path']
+        if method == 'OPTIONS':
+            await self._send_preflight(scope, send)
+            return
+        if path == '/' and method in ('GET', 'HEAD'):
+            await self._send_index(send)
+            return
+        if method in ('GET', 'HEAD'):
+            versioned = self.assets.parse_versioned_path(path)
+            if versioned:
+                await self._send_static(versioned[1], scope, send, digest=versioned[0])
+                return
+            if path.startswith('/static/'):
+                await self._send_static(path[len('/static/'):], scope, send)
+                return
+
+        body = await self._read_body(receive)
+        for routes, is_stream in ((self.json_routes, False), (self.stream_routes, True)):
+            for route_method, pattern, handler in routes:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    await self._dispatch(scope, handler, is_stream, match.groupdict(), body, receive, send)
+                    return
+
+        allowed = any(pattern.match(path) for routes in (self.json_routes, self.stream_routes) for _, pattern, _ in routes)
+        if allowed:
+            await self._send_json(send, {'error': 'Method not allowed'}, 405)
+        else:
+            await self._send_json(send, {'error': 'Not found'}, 404)
+
+    async def _dispatch(self, scope: Dict[str, Any], handler: Callable, is_stream: bool, path_params: Dict[str, str],
+                        body: bytes, receive: Callable, send: Callable) -> None:
+        """Runs a route with the caller's session (cookie or X-Session-Token); new sessions get their token back."""
+        pool = self.components.session_pool
+        session = None
+        handlers, client = self.components.api_handlers, self.components.chat_client
+        if pool is not None and scope['path'] not in SESSIONLESS_PATHS:
+            session, created = await pool.acquire(self._session_token(scope))
+            handlers, client = session.api_handlers, session.client
+            if created:
+                send = self._with_session_token(send, session.token)
+        request = Request(scope['method'], scope['path'], scope.get('query_string', b''), body, path_params,
+                          handlers, client, _header_dict(scope))
+        try:
+            if is_stream:
+                await self._send_event_stream(handler(request), receive, send)
+            else:
+                await self._run_json_handler(handler, request, send)
+        finally:
+            if session is not None:
+                pool.release(session)
+
+    @staticmethod
+    def _session_token(scope: Dict[str, Any]) -> Optional[str]:
+        headers = dict(scope.get('headers', []))
+        token = headers.get(SESSION_HEADER.lower().encode())
+        if token:
+            return token.decode("latin-1")
+        cookie = SimpleCookie(headers.get(b"cookie", b"").decode("latin-1"))
+        return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+
+    @staticmethod
+    def _with_session_token(send: Callable, token: str) -> Callable:
+        """Wraps send so the response start carries the new session's cookie and token header."""
+        async def send_with_token(message: Dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': list(message.get('headers', [])) + [
+                    (b"set-cookie", f"{SESSION_COOKIE}={token}; Path=/; HttpOnly; SameSite=Lax".encode()),
+                    (SESSION_HEADER.lower().encode(), token.encode())]}
+            await send(message)
+        return send_with_token
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"ASGI startup failed: {e}", exc_info=True)
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await self.shutdown()
+                finally:
+                    await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _run_json_handler(self, handler: Callable[[Request], Awaitable[JsonResult]],
+                                request: Request, send: Callable) -> None:
+        try:
+            payload, status = await handler(request)
+        except ValueError as e:
+            logger.warning(f"ValueError handling {request.method} {request.path}: {e}")
+            payload, status = {'error': str(e)}, 400
+        except Exception as e:
+            error_msg = f"Server error processing {request.path}: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            payload, status = {'error': error_msg}, 500
+        await self._send_json(send, payload, status, request)
+
+    # ============ Response Helpers ============
+
+    @staticmethod
+    async def _read_body(receive: Callable) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _send_response(send: Callable, status: int, body: bytes, content_type: Optional[bytes],
+                             extra_headers: Optional[List[Tuple[str, str]]] = None) -> None:
+        headers = [(b"content-type", content_type)] if content_type else []
+        headers += [(b"content-length", str(len(body)).encode())] + CORS_HEADERS
+        headers += [(name.lower().encode(), value.encode("latin-1")) for name, value in extra_headers or []]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _send_json(self, send: Callable, payload: Optional[Dict[str, Any]], status: int = 200,
+                         request: Optional[Request] = None) -> None:
+        """JSON response; with the request, it carries the route's ETag (or is a 304) and may be compressed."""
+        extra_headers: List[Tuple[str, str]] = []
+        if request is not None and request.etag and status in (200, 304):
+            extra_headers += [("ETag", request.etag), ("Cache-Control", API_CACHE_CONTROL)]
+        if status == 304:
+            await self._send_response(send, 304, b"", None, extra_headers)
+            return
+        body = json.dumps(payload).encode()
+        if request is not None:
+            body, encoding = maybe_compress(body, "application/json", request.headers.get('accept-encoding'))
+            extra_headers.append(("Vary", "Accept-Encoding"))
+            if encoding:
+                extra_headers.append(("Content-Encoding", encoding))
+        await self._send_response(send, status, body, b"application/json", extra_headers)
+
+    @staticmethod
+    async def _send_preflight(scope: Dict[str, Any], send: Callable) -> None:
+        request_headers = dict(scope.get('headers', []))
+        headers = CORS_HEADERS + [
+            (b"access-control-allow-methods", b"GET, HEAD, POST, DELETE, OPTIONS"),
+            (b"access-control-allow-headers", request_headers.get(b"access-control-request-headers", b"*")),
+            (b"content-length", b"0"),
+        ]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _send_index(self, send: Callable) -> None:
+        html = await asyncio.to_thread(INDEX_TEMPLATE.read_text, encoding="utf-8")
+        await asyncio.to_thread(self.assets.refresh)  # Picks up edited static files so the page links their new digest
+        html = STATIC_URL_PATTERN.sub(lambda m: self.assets.url(m.group(1)), html)
+        await self._send_response(send, 200, html.encode("utf-8"), b"text/html; charset=utf-8",
+                                  [("Cache-Control", REVALIDATE_CACHE_CONTROL)])
+
+    async def _send_static(self, relative_path: str, scope: Dict[str, Any], send: Callable,
+                           digest: Optional[str] = None) -> None:
+        """Serves a file from the in-memory static assets (only files found under STATIC_DIR exist there)."""
+        headers = _header_dict(scope)
+        status, extra_headers, body = self.assets.response(
+            relative_path, headers.get('if-none-match'), headers.get('accept-encoding'), digest=digest)
+        content_type = next((value for name, value in extra_headers if name == "Content-Type"), None)
+        extra_headers = [(name, value) for name, value in extra_headers if name != "Content-Type"]
+        await self._send_response(send, status, body, content_type.encode() if content_type else None, extra_headers)
+
+    async def _send_event_stream(self, events: AsyncGenerator[Dict[str, Any], None],
+                                 receive: Callable, send: Callable) -> None:
+        """Sends events as SSE until the generator ends; a client disconnect cancels the generator."""
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")] + CORS_HEADERS})
+
+        async def pump() -> None:
+            try:
+                async for event in events:
+                    await send({'type': 'http.response.body', 'body': format_sse_message(event).encode(),
+                                'more_body': True})
+            finally:
+                await events.aclose()
+
+        async def wait_for_disconnect() -> None:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        pump_task = asyncio.ensure_future(pump())
+        disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect_task.cancel()
+            if not pump_task.done():
+                print("[ASGI] Client disconnected, cancelling stream")
+                pump_task.cancel()
+            await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+        if not pump_task.cancelled() and pump_task.exception() is None:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    # ============ Status & Model Routes ============
+
+    async def get_status(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'connected': False, 'error': 'GUI API service not ready'}, 503
+        return request.handlers.get_status(parse_revision(request.query.get('since_revision')),
+                                           request.query.get('since_conversation_id')), 200
+
+    async def get_models(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready', 'models': []}, 503
+        if request.not_modified(await request.handlers.resource_etag_async('models')):
+            return None, 304
+        return _handler_result(await request.handlers.get_models_async())
+
+    # ============ Message Handling Routes ============
+
+    async def send_message(self, request: Request) -> JsonResult:
+        if not request.handlers or not request.client:
+            return {'error': 'GUI API service or client not ready'}, 503
+        data = request.json()
+        message_content = data.get('message', '')
+        attachments = data.get('attachments')
+        if not message_content and not attachments:
+            return {'error': 'No message content or attachments provided'}, 400
+        return _handler_result(await request.handlers.send_message_async(message_content, attachments,
+                                                                          add_user_message=True))
+
+    async def stream_message(self, request: Request) -> AsyncGenerator[Dict[str, Any], None]:
+        if not request.handlers or not request.client:
+            logger.error("GUI API service or client not ready for streaming.")
+            yield {'error': 'Server not ready for streaming.'}
+            return
+        data = request.json()
+        message_content = data.get('message', '')
+        attachments = data.get('attachments')
+        if not message_content and not attachments:
+            logger.warning("No message content or attachments provided for streaming via /api/stream.")
+            yield {'error': 'No message or attachments provided for streaming.'}
+            return
+
+        # The handler adds the user message under the conversation lock
+        stream = request.handlers.stream_message(message_content, attachments, add_user_message=True)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(stream.__anext__(), timeout=STREAM_ITEM_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    error_msg = f"Stream timeout after {STREAM_ITEM_TIMEOUT}s waiting for response"
+                    logger.warning(error_msg)
+                    yield {'error': error_msg}
+                    break
+                yield item
+                if item.get("error") or item.get("done"):
+                    break
+        finally:
+            await stream.aclose()
+
+    # ============ Conversation Management Routes ============
+
+    async def get_conversations(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready', 'conversations': []}, 503
+        if request.not_modified(await request.handlers.resource_etag_async('conversations')):
+            return None, 304
+        return _handler_result(await request.handlers.get_conversations_async())
+
+    async def search_conversations(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready', 'results': []}, 503
+        return _handler_result(await request.handlers.search_conversations_async(
+            request.query.get('q', ''), request.query_int('page', 1), request.query_int('page_size', 20)))
+
+    async def new_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        return _handler_result(await request.handlers.new_conversation_async(request.json().get('title', '')))
+
+    async def load_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        return _handler_result(await request.handlers.load_conversation_async(request.path_params['conversation_identifier']))
+
+    async def save_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        return _handler_result(await request.handlers.save_conversation_async())
+
+    async def duplicate_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        new_title = request.json().get('new_title')
+        if not new_title:
+            return {'error': 'New title not provided for duplication'}, 400
+        return _handler_result(await request.handlers.duplicate_conversation_async(request.path_params['conversation_id'], new_title))
+
+    async def rename_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        new_title = request.json().get('new_title')
+        if not new_title:
+            return {'error': 'New title not provided for renaming'}, 400
+        return _handler_result(await request.handlers.rename_conversation_async(request.path_params['conversation_id'], new_title))
+
+    async def delete_conversation(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        return _handler_result(await request.handlers.delete_conversation_async(request.path_params['conversation_id']))
+
+    # ============ Settings & Configuration Routes ============
+
+    async def get_settings(self, request: Request) -> JsonResult:
+        if not self.app_config:
+            return {'error': 'Global application configuration not ready'}, 503
+        ready = request.handlers and request.client and request.client.provider
+        client = request.client if ready else None
+        if request.not_modified(settings_etag(self.app_config, client)):
+            return None, 304
+        return get_settings_payload(self.app_config, client), 200
+
+    async def update_settings(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        data = request.json()
+        return _handler_result(await request.handlers.update_settings_async(
+            provider=data.get('provider'), model=data.get('model'),
+            streaming=data.get('streaming'), params=data.get('params')))
+
+    async def update_conversation_system_instruction(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        new_instruction = request.json().get('system_instruction')
+        if new_instruction is None:
+            return {'error': 'system_instruction field missing or null'}, 400
+        return _handler_result(await request.handlers.update_conversation_system_instruction_async(
+            request.path_params['conversation_id'], new_instruction))
+
+    # ============ Command & Navigation Routes ============
+
+    async def execute_command(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        command_str = request.json().get('command', '')
+        if not command_str:
+            return {'error': 'No command string provided'}, 400
+        return _handler_result(await request.handlers.execute_command_async(command_str))
+
+    async def retry_message(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        data = request.json()
+        return _handler_result(await request.handlers.retry_message_async(
+            request.path_params['message_id'], parse_revision(data.get('since_revision')), data.get('since_conversation_id')))
+
+    async def get_message_info(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        return _handler_result(await request.handlers.get_message_info_async(request.path_params['message_id']))
+
+    async def pin_message(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        pinned = bool(request.json().get('pinned', True))
+        return _handler_result(await request.handlers.pin_message_async(request.path_params['message_id'], pinned))
+
+    async def navigate_sibling(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        data = request.json()
+        message_id = data.get('message_id')
+        if not message_id:
+            return {'error': 'No message_id provided for navigation'}, 400
+        return _handler_result(await request.handlers.navigate_sibling_async(
+            message_id, data.get('direction', 'next'), parse_revision(data.get('since_revision')),
+            data.get('since_conversation_id')))
+
+    async def get_conversation_tree(self, request: Request) -> JsonResult:
+        if not request.handlers:
+            return {'error': 'GUI API service not ready'}, 503
+        if request.not_modified(await request.handlers.resource_etag_async('tree')):
+            return None, 304
+        return _handler_result(await request.handlers.get_conversation_tree_async())
+
+    # ============ Health Check & Debug Routes ============
+
+    async def health_check(self, request: Request) -> JsonResult:
+        health_status = {
+            'status': 'ok',
+            'api_handlers_ready': request.handlers is not None,
+            'chat_client_ready': request.client is not None,
+            'event_loop_ready': self.components.event_loop is not None,
+            'config_ready': self.app_config is not None
+        }
+        all_ready = all(health_status.values())
+        if not all_ready:
+            health_status['status'] = 'degraded'
+        return health_status, 200 if all_ready else 503
+
+    async def test_stream(self, request: Request) -> AsyncGenerator[Dict[str, Any], None]:
+        """Same messages as streaming.test_streaming_connection, produced in place."""
+        for message in [
+            {"type": "info", "message": "Streaming test started"},
+            {"type": "progress", "message": "Processing...", "percent": 50},
+            {"type": "info", "message": "Test complete"},
+            {"done": True, "message": "Streaming test successful"}
+        ]:
+            yield message
+            await asyncio.sleep(0.5)  # Simulate processing time
+
+
+def create_app(app_config: Optional[Config] = None, cli_args: Optional[Any] = None) -> ASGIApp:
+    """Builds the ASGI app; with no arguments the default configuration file is used."""
+    return ASGIApp(app_config or Config(), cli_args)
+
+
+def start_asgi_server(
+    app_config: Config,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    cli_args: Optional[Any] = None
+) -> None:
+    """
+    Starts the GUI as an ASGI app under uvicorn.
+
+    Args:
+        app_config: The main application configuration
+        host: Host to bind the server to
+        port: Port to run the server on
+        cli_args: Command line arguments from main application
+    """
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise ImportError(f"{e}. The ASGI server needs uvicorn: pip install uvicorn") from e
+
+    print("\n" + "=" * 60)
+    print(f"{Colors.HEADER}{Colors.BOLD}STARTING CannonAI GUI (ASGI + Bootstrap){Colors.ENDC}")
+    print("=" * 60 + "\n")
+    logger.info(f"Starting CannonAI ASGI GUI Server on {host}:{port}")
+
+    try:
+        print(f"[ASGI] Opening web browser to: http://{host}:{port}")
+        webbrowser.open(f"http://{host}:{port}")
+    except Exception as e:
+        logger.warning(f"Could not automatically open web browser: {e}")
+
+    print(f"\n{Colors.GREEN}ASGI server starting at http://{host}:{port}{Colors.ENDC}")
+    print(f"{Colors.CYAN}Press CTRL+C to quit{Colors.ENDC}\n")
+    uvicorn.run(create_app(app_config, cli_args), host=host, port=port, lifespan="on", log_level="info")
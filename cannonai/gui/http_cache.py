@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+CannonAI GUI HTTP Cache - ETags, response compression and content-hashed static assets
+
+Shared by the Flask server (server.py, routes.py) and the ASGI app (asgi.py):
+
+- Read routes answer If-None-Match with 304 Not Modified. Their ETags come from
+  cheap version stamps (conversation revision, catalog fingerprint, model-list
+  version, config mtime) checked before the payload is built; see
+  APIHandlers.resource_etag_async.
+- JSON bodies of MIN_COMPRESS_BYTES or more are sent gzip- or brotli-encoded when
+  the client accepts it (brotli needs the optional "brotli" package).
+- StaticAssets keeps the static files in memory, precompressed, and serves them
+  under /assets/<digest>/..., where the digest covers every static file. app.js
+  loads its modules by relative URL, so one digest for the whole tree keeps those
+  URLs versioned too. Versioned responses are cacheable for a year; the plain
+  /static/ URLs still work and are revalidated by ETag.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+    brotli_available = True
+except ImportError:
+    brotli_available = False
+
+logger = logging.getLogger("cannonai.gui.http_cache")
+
+MIN_COMPRESS_BYTES = 1024  # Smaller bodies gain little and cost a compressor call
+ASSETS_URL_PREFIX = "/assets"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Versioned asset URLs never change content
+REVALIDATE_CACHE_CONTROL = "no-cache"  # Cache, but check the ETag before every reuse
+API_CACHE_CONTROL = "private, no-cache"  # API responses belong to one session
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+Response = Tuple[int, List[Tuple[str, str]], bytes]  # (status, headers, body)
+
+
+# ============ ETags ============
+
+def make_etag(*parts: Any) -> str:
+    """A weak ETag over JSON-serializable version parts."""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against `etag`."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def file_mtime_ns(path: Optional[Path]) -> int:
+    """mtime of `path`, or 0 when it does not exist (ETag part for config-derived payloads)."""
+    try:
+        return os.stat(path).st_mtime_ns if path else 0
+    except OSError:
+        return 0
+
+
+# ============ Compression ============
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """"br" or "gzip" when the Accept-Encoding header allows it (brotli preferred), else None."""
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli_available and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """Encodes `body`; best=True spends more time for a smaller result (precompressed assets)."""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+
+def maybe_compress(body: bytes, content_type: str, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(body, Content-Encoding) for a dynamic response; small or binary bodies are sent as they are."""
+    if len(body) < MIN_COMPRESS_BYTES or not is_compressible(content_type):
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    return compress(body, encoding), encoding
+
+
+# ============ Static Assets ============
+
+class StaticAsset:
+    """One static file, its ETag and its precompressed encodings."""
+
+    def __init__(self, content: bytes, content_type: str, stamp: Tuple[int, int]):
+        self.content = content
+        self.content_type = content_type
+        self.stamp = stamp  # (mtime_ns, size) when read
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.etag = f'"{self.digest[:20]}"'
+        self.encoded: Dict[str, bytes] = {}
+        if len(content) >= MIN_COMPRESS_BYTES and is_compressible(content_type):
+            for encoding in ("br", "gzip") if brotli_available else ("gzip",):
+                compressed = compress(content, encoding, best=True)
+                if len(compressed) < len(content):
+                    self.encoded[encoding] = compressed
+
+
+class StaticAssets:
+    """In-memory, precompressed copy of the static directory with a content digest for versioned URLs."""
+
+    def __init__(self, static_dir: Path, url_prefix: str = ASSETS_URL_PREFIX):
+        self.static_dir = Path(static_dir).resolve()
+        self.url_prefix = url_prefix
+        self._lock = threading.Lock()
+        self._assets: Dict[str, StaticAsset] = {}
+        self.digest = ""
+        self.refresh()
+
+    def _scan_stamps(self) -> Dict[str, Tuple[int, int]]:
+        stamps: Dict[str, Tuple[int, int]] = {}
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                path = Path(root) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                stamps[path.relative_to(self.static_dir).as_posix()] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def refresh(self) -> bool:
+        """Re-reads files added or changed on disk (cheap when nothing changed). Returns whether anything did."""
+        stamps = self._scan_stamps()
+        with self._lock:
+            if stamps.keys() == self._assets.keys() and all(
+                    self._assets[name].stamp == stamp for name, stamp in stamps.items()):
+                return False
+            assets = {}
+            for name, stamp in stamps.items():
+                current = self._assets.get(name)
+                if current is not None and current.stamp == stamp:
+                    assets[name] = current
+                    continue
+                try:
+                    content = (self.static_dir / name).read_bytes()
+                except OSError as e:
+                    logger.warning(f"Could not read static file {name}: {e}")
+                    continue
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                assets[name] = StaticAsset(content, content_type, stamp)
+            tree_hash = hashlib.sha256()
+            for name in sorted(assets):
+                tree_hash.update(f"{name}\0{assets[name].digest}\n".encode())
+            self._assets = assets
+            self.digest = tree_hash.hexdigest()[:12]
+        logger.info(f"Static assets loaded: {len(assets)} files, digest {self.digest}")
+        return True
+
+    def url(self, filename: str) -> str:
+        """Versioned URL of a static file (used by index.html as static_url('...'))."""
+        return f"{self.url_prefix}/{self.digest}/{filename.lstrip('/')}"
+
+    def parse_versioned_path(self, path: str) -> Optional[Tuple[str, str]]:
+        """(digest, filename) for a path under url_prefix, else None."""
+        if not path.startswith(self.url_prefix + "/"):
+            return None
+        digest, _, filename = path[len(self.url_prefix) + 1:].partition("/")
+        return (digest, filename) if digest and filename else None
+
+    def response(self, filename: str, if_none_match: Optional[str], accept_encoding: Optional[str],
+                 digest: Optional[str] = None) -> Response:
+        """
+        The response for a static file. With `digest` (a versioned URL) it may be cached
+        for a year, unless the digest is out of date, in which case the current file is
+        sent for revalidation only so the stale URL is never pinned to new content.
+        """
+        asset = self._assets.get(filename)
+        if asset is None:
+            return 404, [("Content-Type", "application/json")], b'{"error": "Not found"}'
+        immutable = digest is not None and digest == self.digest
+        headers = [("ETag", asset.etag), ("Vary", "Accept-Encoding"),
+                   ("Cache-Control", IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL)]
+        if etag_matches(if_none_match, asset.etag):
+            return 304, headers, b""
+        body = asset.content
+        encoding = choose_encoding(accept_encoding)
+        if encoding in asset.encoded:
+            body = asset.encoded[encoding]
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Type", asset.content_type))
+        return 200, headers, body
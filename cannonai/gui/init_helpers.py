@@ -4,7 +4,8 @@ CannonAI GUI Initialization Helpers - Manages async component setup
 
 This module handles the initialization of async components for the GUI,
 including setting up the event loop, creating the AI client, and managing
-the thread that runs async operations.
+the thread that runs async operations. The ASGI server runs the components on
+its own loop instead (initialize_on_current_loop / aclose).
 """
 
 import asyncio
@@ -19,6 +20,7 @@ if TYPE_CHECKING:
     from command_handler import CommandHandler
     from config import Config
     from gui.api_handlers import APIHandlers
+    from gui.sessions import SessionPool
 
 logger = logging.getLogger("cannonai.gui.init_helpers")
 
@@ -33,6 +35,7 @@ class AsyncComponentManager:
         self.chat_client: Optional['AsyncClient'] = None
         self.command_handler: Optional['CommandHandler'] = None
         self.api_handlers: Optional['APIHandlers'] = None
+        self.session_pool: Optional['SessionPool'] = None  # Per-user clients; None when gui_sessions is disabled
         self.main_config: Optional['Config'] = None
         self._initialization_complete = False
         self._initialization_error: Optional[str] = None
@@ -153,12 +156,21 @@ class AsyncComponentManager:
 
             # *** ADDED: Create and set provider manager for seamless switching ***
             print("[Init] Creating provider manager for seamless provider switching...")
-            provider_manager = ProviderManager(app_config)
+            # Reuse the manager that created the client's provider (it owns the shared HTTP transport)
+            provider_manager = self.chat_client.provider_manager or ProviderManager(app_config)
             # Set initial provider in manager
             await provider_manager.switch_provider(self.chat_client.provider.provider_name, self.chat_client.current_model_name)
             self.api_handlers.set_provider_manager(provider_manager)
             print("[Init] Provider manager configured successfully")
 
+            # Per-user sessions start from this client's provider, model and settings
+            session_settings = app_config.get("gui_sessions", {})
+            if session_settings.get("enabled", True):
+                from gui.sessions import SessionPool
+                self.session_pool = SessionPool(app_config, self.chat_client, provider_manager, self.event_loop,
+                                                session_settings)
+                print("[Init] Per-user GUI sessions enabled")
+
             # Store main config reference in api_handlers module
             import gui.api_handlers as api_handlers_module
             api_handlers_module.main_config = app_config
@@ -182,6 +194,34 @@ class AsyncComponentManager:
             self.chat_client = None
             self._initialization_error = str(e)
 
+    async def initialize_on_current_loop(self, app_config: 'Config', cli_args: Optional[Any]) -> None:
+        """
+        Initializes the components on the running loop (the ASGI server's), with no loop thread.
+
+        Args:
+            app_config: The main application configuration
+            cli_args: Command line arguments passed from main app
+        """
+        self.main_config = app_config
+        self.event_loop = asyncio.get_running_loop()
+        await self.initialize_client_async(app_config, cli_args)
+
+    async def aclose(self) -> None:
+        """Flushes pending saves and closes the provider transport; the loop itself belongs to the server."""
+        print("[Init] Closing async components")
+        if self.session_pool:
+            await self.session_pool.aclose()
+        if self.chat_client:
+            try:
+                await asyncio.wait_for(self.chat_client.flush_pending_saves(), timeout=10.0)
+            except Exception as e:
+                logger.error(f"Error flushing pending saves during shutdown: {e}")
+            if self.chat_client.provider_manager:
+                try:
+                    await asyncio.wait_for(self.chat_client.provider_manager.aclose(), timeout=5.0)
+                except Exception as e:
+                    logger.error(f"Error closing provider HTTP transport during shutdown: {e}")
+
     def initialize_async_components(self, app_config: 'Config', cli_args: Optional[Any]) -> None:
         """
         Initializes async components, creating event loop and thread if needed.
@@ -326,7 +366,8 @@ class AsyncComponentManager:
             'loop_thread_alive': self.loop_thread and self.loop_thread.is_alive(),
             'chat_client_exists': self.chat_client is not None,
             'api_handlers_exists': self.api_handlers is not None,
-            'command_handler_exists': self.command_handler is not None
+            'command_handler_exists': self.command_handler is not None,
+            'sessions': self.session_pool.get_stats() if self.session_pool else None
         }
 
         if self.chat_client and hasattr(self.chat_client, 'provider'):
@@ -343,6 +384,20 @@ class AsyncComponentManager:
         print("[Init] Cleaning up async components")
         logger.info("Cleaning up GUI async components")
 
+        # Write any pending background autosaves before the loop goes away
+        if self.chat_client and self.event_loop and self.event_loop.is_running():
+            try:
+                if self.session_pool:
+                    asyncio.run_coroutine_threadsafe(self.session_pool.aclose(), self.event_loop).result(timeout=10.0)
+                asyncio.run_coroutine_threadsafe(self.chat_client.flush_pending_saves(), self.event_loop).result(timeout=10.0)
+            except Exception as e:
+                logger.error(f"Error flushing pending saves during cleanup: {e}")
+            if self.chat_client.provider_manager:
+                try:
+                    asyncio.run_coroutine_threadsafe(self.chat_client.provider_manager.aclose(), self.event_loop).result(timeout=5.0)
+                except Exception as e:
+                    logger.error(f"Error closing provider HTTP transport during cleanup: {e}")
+
         # Stop event loop
         if self.event_loop and self.event_loop.is_running():
             print("[Init] Stopping event loop")
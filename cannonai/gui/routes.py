@@ -6,13 +6,19 @@ This module contains all API route definitions for the CannonAI web interface.
 Routes are organized in a Flask Blueprint for modular registration.
 """
 import json
+import asyncio
 import logging
-from typing import Optional, Any, TYPE_CHECKING
+from typing import Optional, Any, Dict, TYPE_CHECKING
 from flask import Blueprint, request, jsonify, Response, stream_with_context
-from flask import current_app
+from flask import current_app, g
+
+from .api_handlers import get_settings_payload, parse_revision, settings_etag
+from .http_cache import API_CACHE_CONTROL, etag_matches, maybe_compress
+from .sessions import SESSION_COOKIE, SESSION_HEADER, SESSIONLESS_PATHS
 
 if TYPE_CHECKING:
     from gui.api_handlers import APIHandlers
+    from gui.sessions import SessionPool
     from async_client import AsyncClient
     from config import Config
 
@@ -26,13 +32,15 @@ _api_handlers: Optional['APIHandlers'] = None
 _chat_client: Optional['AsyncClient'] = None
 _event_loop: Optional[Any] = None  # asyncio.AbstractEventLoop
 _main_config: Optional['Config'] = None
+_session_pool: Optional['SessionPool'] = None
 
 
 def inject_dependencies(
         api_handlers: 'APIHandlers',
         chat_client: 'AsyncClient',
         event_loop: Any,
-        main_config: 'Config'
+        main_config: 'Config',
+        session_pool: Optional['SessionPool'] = None
 ) -> None:
     """
     Inject dependencies into the routes module.
@@ -43,13 +51,82 @@ def inject_dependencies(
         chat_client: The AsyncClient instance
         event_loop: The GUI event loop
         main_config: The main Config instance
+        session_pool: Per-user clients (None serves everyone with chat_client)
     """
-    global _api_handlers, _chat_client, _event_loop, _main_config
+    global _api_handlers, _chat_client, _event_loop, _main_config, _session_pool
     print("[Routes] Injecting dependencies into routes module")
     _api_handlers = api_handlers
     _chat_client = chat_client
     _event_loop = event_loop
     _main_config = main_config
+    _session_pool = session_pool
+
+
+# ============ Session Binding ============
+
+@gui_routes.before_request
+def bind_session():
+    """Points g.api_handlers / g.chat_client at the caller's session (cookie or X-Session-Token)."""
+    g.api_handlers, g.chat_client, g.session, g.new_session = _api_handlers, _chat_client, None, False
+    if _session_pool is None or not _event_loop or not _event_loop.is_running() or request.path in SESSIONLESS_PATHS:
+        return
+    token = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    session, created = asyncio.run_coroutine_threadsafe(_session_pool.acquire(token), _event_loop).result(timeout=30)
+    g.session, g.new_session = session, created
+    g.api_handlers, g.chat_client = session.api_handlers, session.client
+
+
+@gui_routes.after_request
+def send_session_token(response):
+    """Hands a newly created session's token to the browser (cookie) and to API callers (header)."""
+    if g.get('new_session'):
+        response.set_cookie(SESSION_COOKIE, g.session.token, httponly=True, samesite='Lax')
+        response.headers[SESSION_HEADER] = g.session.token
+    return response
+
+
+@gui_routes.teardown_request
+def release_session(exc):
+    """Marks the session idle again; for streams this runs once the stream has finished."""
+    session = g.pop('session', None)
+    if session is not None and _event_loop and _event_loop.is_running():
+        _event_loop.call_soon_threadsafe(_session_pool.release, session)
+
+
+# ============ Conditional GET & Compression ============
+
+def _not_modified(etag: Optional[str]) -> Optional[Response]:
+    """A 304 response when the caller's If-None-Match already names `etag`, else None."""
+    if not etag_matches(request.headers.get('If-None-Match'), etag):
+        return None
+    response = Response(status=304)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = API_CACHE_CONTROL
+    return response
+
+
+def _json_with_etag(result: Dict[str, Any], etag: Optional[str]):
+    """jsonify(result) with the usual status code; successful responses carry `etag`."""
+    status = result.get('status_code', 200 if 'error' not in result else 500)
+    response = jsonify(result)
+    if etag and status == 200:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = API_CACHE_CONTROL
+    return response, status
+
+
+@gui_routes.after_request
+def compress_json_response(response):
+    """gzip/brotli-encodes large JSON bodies for clients that accept it (SSE streams are left alone)."""
+    if response.direct_passthrough or response.is_streamed or response.mimetype != 'application/json' \
+            or 'Content-Encoding' in response.headers:
+        return response
+    body, encoding = maybe_compress(response.get_data(), response.mimetype, request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 # ============ Status & Connection Routes ============
@@ -58,10 +135,11 @@ def inject_dependencies(
 def get_status_api_route():
     """Get the current connection status and client info."""
     print("[Routes] Handling /api/status request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for /api/status")
         return jsonify({'connected': False, 'error': 'GUI API service not ready'}), 503
-    return jsonify(_api_handlers.get_status())
+    return jsonify(g.api_handlers.get_status(parse_revision(request.args.get('since_revision')),
+                                             request.args.get('since_conversation_id')))
 
 
 # ============ Model Management Routes ============
@@ -70,11 +148,14 @@ def get_status_api_route():
 def get_models_api_route():
     """Get available models for the current provider."""
     print("[Routes] Handling /api/models request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for /api/models")
         return jsonify({'error': 'GUI API service not ready', 'models': []}), 503
-    result = _api_handlers.get_models()
-    return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
+    etag = g.api_handlers.resource_etag('models')
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _json_with_etag(g.api_handlers.get_models(), etag)
 
 
 # ============ Message Handling Routes ============
@@ -83,7 +164,7 @@ def get_models_api_route():
 def send_message_api_route():
     """Send a non-streaming message to the AI."""
     print("[Routes] Handling /api/send request")
-    if not _api_handlers or not _chat_client:
+    if not g.api_handlers or not g.chat_client:
         print("[Routes] API handlers or chat client not ready for /api/send")
         return jsonify({'error': 'GUI API service or client not ready'}), 503
 
@@ -99,13 +180,9 @@ def send_message_api_route():
         return jsonify({'error': 'No message content or attachments provided'}), 400
 
     try:
-        # Add user message with attachments
-        _chat_client.add_user_message(message_content, attachments=attachments)
-        result = _api_handlers.send_message(message_content)
+        # The handler adds the user message (with attachments) under the conversation lock
+        result = g.api_handlers.send_message(message_content, attachments, add_user_message=True)
         return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
-    except ValueError as e:
-        logger.warning(f"ValueError in send_message_api_route: {e}")
-        return jsonify({'error': str(e)}), 400  # Bad Request
     except Exception as e:
         error_msg = f"Server error processing send request: {str(e)}"
         print(f"[Routes] Error in /api/send: {error_msg}")
@@ -118,7 +195,7 @@ def stream_message_api_route():
     """Stream a message response from the AI."""
     print("[Routes] Handling /api/stream request")
 
-    if not _api_handlers or not _chat_client or not _event_loop:
+    if not g.api_handlers or not g.chat_client or not _event_loop:
         print("[Routes] Required components not ready for streaming")
         logger.error("GUI API service, client, or event loop not ready for streaming.")
 
@@ -146,36 +223,17 @@ def stream_message_api_route():
     logger.info(
         f"Streaming request received for message: '{message_content[:50]}...' with {len(attachments or [])} attachments.")
 
-    try:
-        # Add user message with attachments
-        _chat_client.add_user_message(message_content, attachments=attachments)
-        print("[Routes] User message added successfully, starting stream")
-    except ValueError as e:
-        logger.warning(f"ValueError in stream_message_api_route before streaming: {e}")
-
-        def error_add_message():
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-        return Response(stream_with_context(error_add_message()), mimetype='text/event-stream')
-    except Exception as e:
-        error_msg = f"Failed to process user message for stream: {str(e)}"
-        print(f"[Routes] Error adding user message: {error_msg}")
-        logger.error(error_msg, exc_info=True)
-
-        def error_add_message_generic():
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
-
-        return Response(stream_with_context(error_add_message_generic()), mimetype='text/event-stream')
-
     # Import streaming utilities
     from .streaming import stream_with_queue
 
-    # Create the SSE stream generator
+    # Create the SSE stream generator (the handler adds the user message under the conversation lock)
     stream_generator = stream_with_queue(
-        api_handlers=_api_handlers,
+        api_handlers=g.api_handlers,
         message_content=message_content,
         event_loop=_event_loop,
-        timeout_seconds=90
+        timeout_seconds=90,
+        attachments=attachments,
+        add_user_message=True
     )
 
     print("[Routes] Returning SSE stream response")
@@ -188,10 +246,27 @@ def stream_message_api_route():
 def get_conversations_api_route():
     """Get list of saved conversations."""
     print("[Routes] Handling /api/conversations request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for /api/conversations")
         return jsonify({'error': 'GUI API service not ready', 'conversations': []}), 503
-    result = _api_handlers.get_conversations()
+    etag = g.api_handlers.resource_etag('conversations')
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _json_with_etag(g.api_handlers.get_conversations(), etag)
+
+
+@gui_routes.route('/api/search', methods=['GET'])
+def search_conversations_api_route():
+    """Full-text search across saved conversations (?q=terms&page=1&page_size=20)."""
+    print("[Routes] Handling /api/search request")
+    if not g.api_handlers:
+        print("[Routes] API handlers not ready for /api/search")
+        return jsonify({'error': 'GUI API service not ready', 'results': []}), 503
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', 20, type=int)
+    result = g.api_handlers.search_conversations(query, page, page_size)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -199,7 +274,7 @@ def get_conversations_api_route():
 def new_conversation_api_route():
     """Start a new conversation."""
     print("[Routes] Handling /api/conversation/new request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for new conversation")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -207,7 +282,7 @@ def new_conversation_api_route():
     title = data.get('title', '')
     print(f"[Routes] New conversation request with title: '{title}'")
 
-    result = _api_handlers.new_conversation(title)
+    result = g.api_handlers.new_conversation(title)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -215,11 +290,11 @@ def new_conversation_api_route():
 def load_conversation_api_route(conversation_identifier: str):
     """Load a saved conversation."""
     print(f"[Routes] Handling /api/conversation/load/{conversation_identifier}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for load conversation")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.load_conversation(conversation_identifier)
+    result = g.api_handlers.load_conversation(conversation_identifier)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -227,11 +302,11 @@ def load_conversation_api_route(conversation_identifier: str):
 def save_conversation_api_route():
     """Save the current conversation."""
     print("[Routes] Handling /api/conversation/save request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for save conversation")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.save_conversation()
+    result = g.api_handlers.save_conversation()
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -239,7 +314,7 @@ def save_conversation_api_route():
 def duplicate_conversation_api_route(conversation_id: str):
     """Duplicate a conversation with a new title."""
     print(f"[Routes] Handling /api/conversation/duplicate/{conversation_id}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for duplicate")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -250,7 +325,7 @@ def duplicate_conversation_api_route(conversation_id: str):
         return jsonify({'error': 'New title not provided for duplication'}), 400
 
     print(f"[Routes] Duplicating conversation {conversation_id} with title: '{new_title}'")
-    result = _api_handlers.duplicate_conversation(conversation_id, new_title)
+    result = g.api_handlers.duplicate_conversation(conversation_id, new_title)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -258,7 +333,7 @@ def duplicate_conversation_api_route(conversation_id: str):
 def rename_conversation_api_route(conversation_id: str):
     """Rename a conversation."""
     print(f"[Routes] Handling /api/conversation/rename/{conversation_id}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for rename")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -269,7 +344,7 @@ def rename_conversation_api_route(conversation_id: str):
         return jsonify({'error': 'New title not provided for renaming'}), 400
 
     print(f"[Routes] Renaming conversation {conversation_id} to: '{new_title}'")
-    result = _api_handlers.rename_conversation(conversation_id, new_title)
+    result = g.api_handlers.rename_conversation(conversation_id, new_title)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -277,11 +352,11 @@ def rename_conversation_api_route(conversation_id: str):
 def delete_conversation_api_route(conversation_id: str):
     """Delete a conversation."""
     print(f"[Routes] Handling /api/conversation/delete/{conversation_id}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for delete")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.delete_conversation(conversation_id)
+    result = g.api_handlers.delete_conversation(conversation_id)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -297,51 +372,34 @@ def get_settings_api_route():
         return jsonify({'error': 'Global application configuration not ready'}), 503
 
     # Check if client is fully initialized
-    if not _api_handlers or not _chat_client or not _chat_client.provider:
+    if not g.api_handlers or not g.chat_client or not g.chat_client.provider:
         print("[Routes] Client not fully ready, returning defaults from config")
         logger.warning(
             "/api/settings GET: API handlers or client not fully ready, returning defaults from main_config.")
-
-        settings_data = {
-            "default_provider": _main_config.get("default_provider"),
-            "provider_models": _main_config.get("provider_models", {}),
-            "system_instruction": _main_config.get("default_system_instruction", "You are a helpful assistant."),
-            "generation_params": _main_config.get("generation_params", {}),
-            "use_streaming": _main_config.get("use_streaming", False)
-        }
-        return jsonify(settings_data), 200
+        return jsonify(get_settings_payload(_main_config, None)), 200
 
     # Return full settings including current session state
-    settings_data = {
-        "default_provider": _main_config.get("default_provider"),
-        "provider_models": _main_config.get("provider_models", {}),
-        "system_instruction": _main_config.get("default_system_instruction", "You are a helpful assistant."),
-        "generation_params": _main_config.get("generation_params", {}),
-        "use_streaming": _main_config.get("use_streaming", False),
-        # Current session specific settings
-        "current_provider_name": _chat_client.provider.provider_name,
-        "current_model": _chat_client.current_model_name,
-        "current_params": _chat_client.params,
-        "current_streaming_preference": _chat_client.use_streaming,
-        "current_system_instruction_for_active_conv": _chat_client.system_instruction
-    }
-
+    etag = settings_etag(_main_config, g.chat_client)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    settings_data = get_settings_payload(_main_config, g.chat_client)
     print(f"[Routes] Returning settings with provider: {settings_data['current_provider_name']}")
-    return jsonify(settings_data), 200
+    return _json_with_etag(settings_data, etag)
 
 
 @gui_routes.route('/api/settings', methods=['POST'])
 def update_settings_api_route():
     """Update settings (provider, model, streaming, params)."""
     print("[Routes] Handling POST /api/settings request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for settings update")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
     data = request.get_json()
     print(f"[Routes] Settings update request with keys: {list(data.keys())}")
 
-    result = _api_handlers.update_settings(
+    result = g.api_handlers.update_settings(
         provider=data.get('provider'),
         model=data.get('model'),
         streaming=data.get('streaming'),
@@ -354,7 +412,7 @@ def update_settings_api_route():
 def update_conversation_system_instruction_api_route(conversation_id: str):
     """Update system instruction for a specific conversation."""
     print(f"[Routes] Handling /api/conversation/{conversation_id}/system_instruction")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for system instruction update")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -365,7 +423,7 @@ def update_conversation_system_instruction_api_route(conversation_id: str):
         return jsonify({'error': 'system_instruction field missing or null'}), 400
 
     print(f"[Routes] Updating system instruction for conversation {conversation_id}: '{new_instruction[:50]}...'")
-    result = _api_handlers.update_conversation_system_instruction(conversation_id, new_instruction)
+    result = g.api_handlers.update_conversation_system_instruction(conversation_id, new_instruction)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -375,7 +433,7 @@ def update_conversation_system_instruction_api_route(conversation_id: str):
 def execute_command_api_route():
     """Execute a CLI-style command."""
     print("[Routes] Handling /api/command request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for command execution")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -386,7 +444,7 @@ def execute_command_api_route():
         return jsonify({'error': 'No command string provided'}), 400
 
     print(f"[Routes] Executing command: '{command_str}'")
-    result = _api_handlers.execute_command(command_str)
+    result = g.api_handlers.execute_command(command_str)
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -396,11 +454,13 @@ def execute_command_api_route():
 def retry_message_api_route(message_id: str):
     """Retry generating a response for a message."""
     print(f"[Routes] Handling /api/retry/{message_id}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for retry")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.retry_message(message_id)
+    data = request.get_json(silent=True) or {}
+    result = g.api_handlers.retry_message(message_id, parse_revision(data.get('since_revision')),
+                                          data.get('since_conversation_id'))
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -408,11 +468,24 @@ def retry_message_api_route(message_id: str):
 def get_message_info_api_route(message_id: str):
     """Get information about a specific message."""
     print(f"[Routes] Handling /api/message/{message_id}")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for message info")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.get_message_info(message_id)
+    result = g.api_handlers.get_message_info(message_id)
+    return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
+
+
+@gui_routes.route('/api/message/<message_id>/pin', methods=['POST'])
+def pin_message_api_route(message_id: str):
+    """Pin or unpin a message so it is never left out of the model's context."""
+    print(f"[Routes] Handling /api/message/{message_id}/pin")
+    if not g.api_handlers:
+        print("[Routes] API handlers not ready for pin")
+        return jsonify({'error': 'GUI API service not ready'}), 503
+
+    data = request.get_json(silent=True) or {}
+    result = g.api_handlers.pin_message(message_id, bool(data.get('pinned', True)))
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -420,7 +493,7 @@ def get_message_info_api_route(message_id: str):
 def navigate_sibling_api_route():
     """Navigate between sibling messages (alternative responses)."""
     print("[Routes] Handling /api/navigate request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for navigation")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
@@ -433,7 +506,8 @@ def navigate_sibling_api_route():
         return jsonify({'error': 'No message_id provided for navigation'}), 400
 
     print(f"[Routes] Navigating {direction} from message {message_id}")
-    result = _api_handlers.navigate_sibling(message_id, direction)
+    result = g.api_handlers.navigate_sibling(message_id, direction, parse_revision(data.get('since_revision')),
+                                             data.get('since_conversation_id'))
     return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
 
 
@@ -441,12 +515,15 @@ def navigate_sibling_api_route():
 def get_conversation_tree_api_route():
     """Get the conversation tree structure for visualization."""
     print("[Routes] Handling /api/tree request")
-    if not _api_handlers:
+    if not g.api_handlers:
         print("[Routes] API handlers not ready for tree request")
         return jsonify({'error': 'GUI API service not ready'}), 503
 
-    result = _api_handlers.get_conversation_tree()
-    return jsonify(result), result.get('status_code', 200 if 'error' not in result else 500)
+    etag = g.api_handlers.resource_etag('tree')
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _json_with_etag(g.api_handlers.get_conversation_tree(), etag)
 
 
 # ============ Health Check & Debug Routes ============
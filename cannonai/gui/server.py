@@ -12,7 +12,7 @@ import logging
 import webbrowser
 from pathlib import Path
 from typing import Optional, Any
-from flask import Flask, render_template
+from flask import Flask, Response, render_template, request
 from flask_cors import CORS
 
 # Add project root to path if needed
@@ -21,6 +21,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 # Import our modular components
 from .routes import gui_routes, inject_dependencies
 from .init_helpers import get_component_manager
+from .http_cache import ASSETS_URL_PREFIX, REVALIDATE_CACHE_CONTROL, StaticAssets
 from config import Config
 from base_client import Colors
 
@@ -37,6 +38,10 @@ flask_app = Flask(__name__, template_folder='templates', static_folder='static')
 flask_app.secret_key = os.urandom(24)  # For session management, CSRF, etc.
 CORS(flask_app)  # Enable CORS for all routes
 
+# Static files served in memory, precompressed, under versioned /assets/<digest>/ URLs
+static_assets = StaticAssets(Path(__file__).resolve().parent / "static")
+flask_app.jinja_env.globals['static_url'] = static_assets.url
+
 # Register the routes blueprint
 print("[Server] Registering routes blueprint")
 flask_app.register_blueprint(gui_routes)
@@ -50,7 +55,18 @@ def index_route():
     """Serve the main HTML page."""
     print("[Server] Serving index.html")
     logger.debug("Serving index.html")
-    return render_template('index.html')
+    static_assets.refresh()  # Picks up edited static files so the page links their new digest
+    response = flask_app.make_response(render_template('index.html'))
+    response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response
+
+
+@flask_app.route(f'{ASSETS_URL_PREFIX}/<digest>/<path:filename>')
+def versioned_asset_route(digest: str, filename: str):
+    """Serve a static file from a versioned URL (long-lived cache, precompressed)."""
+    status, headers, body = static_assets.response(
+        filename, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'), digest=digest)
+    return Response(body, status=status, headers=headers)
 
 
 @flask_app.before_request
@@ -119,7 +135,8 @@ def start_gui_server(
             api_handlers=component_manager.api_handlers,
             chat_client=component_manager.chat_client,
             event_loop=component_manager.event_loop,
-            main_config=app_config
+            main_config=app_config,
+            session_pool=component_manager.session_pool
         )
         print(f"{Colors.GREEN}[Server] Dependencies injected successfully{Colors.ENDC}")
     else:
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+CannonAI GUI Sessions - Per-user AsyncClient instances for the GUI servers
+
+Each browser (cookie) or API caller (X-Session-Token header) gets its own
+AsyncClient, so its active conversation, branch and pending user message are
+not shared with other users. Sessions are created from the client built at
+startup: they share its ProviderManager, and with it the initialized providers,
+the HTTP transport and the response cache. Each session uses a provider handle
+with its own model setting (see BaseAIProvider.with_model).
+
+Sessions idle for longer than "idle_timeout_seconds" are evicted after their
+pending saves are written, as is the least recently used one when the pool is
+full. Sessions that open the same conversation work on one shared structure
+(see SharedConversations) with one save queue and journal writer, and handlers
+that change a conversation run under that conversation's lock, so two tabs (or
+users) working on the same conversation take turns and see each other's turns.
+
+Settings come from the "gui_sessions" section of cannonai_config.json.
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+
+from conversation_journal import ConversationJournal
+from conversation_persister import WriteBehindPersister
+from conversation_tree import SharedConversations
+
+if TYPE_CHECKING:
+    from async_client import AsyncClient
+    from config import Config
+    from gui.api_handlers import APIHandlers
+    from provider_manager import ProviderManager
+
+logger = logging.getLogger("cannonai.gui.sessions")
+
+SESSION_COOKIE = "cannonai_session"
+SESSION_HEADER = "X-Session-Token"
+SESSIONLESS_PATHS = ("/api/health", "/api/test/stream")  # Served without creating a session (monitoring)
+
+DEFAULT_SESSION_SETTINGS: Dict[str, Any] = {
+    "enabled": True,
+    "idle_timeout_seconds": 1800,  # Sessions unused for this long are evicted (their conversations are saved first)
+    "max_sessions": 32,  # The least recently used idle session is evicted to make room for a new one
+}
+SWEEP_INTERVAL = 60.0  # Seconds between idle-session sweeps
+
+
+class ConversationLocks:
+    """One asyncio.Lock per conversation id, dropped once no one holds or waits for it."""
+
+    def __init__(self):
+        self._locks: 'weakref.WeakValueDictionary[str, asyncio.Lock]' = weakref.WeakValueDictionary()
+
+    def get(self, conversation_id: Optional[str]) -> asyncio.Lock:
+        key = conversation_id or ""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
+class Session:
+    """A GUI user's client, command handler and API handlers."""
+
+    def __init__(self, token: str, client: 'AsyncClient', api_handlers: 'APIHandlers'):
+        self.token = token
+        self.client = client
+        self.api_handlers = api_handlers
+        self.last_used = time.monotonic()
+        self.active_requests = 0  # Requests (including open streams) using the session; busy sessions are not evicted
+
+
+class SessionPool:
+    """Session-scoped AsyncClient instances keyed by cookie or token, with idle-time eviction."""
+
+    def __init__(self, app_config: 'Config', template_client: 'AsyncClient',
+                 provider_manager: 'ProviderManager', event_loop: asyncio.AbstractEventLoop,
+                 settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            app_config: The main application configuration
+            template_client: The client created at startup; new sessions copy its provider, model and settings
+            provider_manager: The manager shared by all sessions
+            event_loop: The loop the clients run on
+            settings: The "gui_sessions" config section
+        """
+        self.settings = {**DEFAULT_SESSION_SETTINGS, **(settings or {})}
+        self.app_config = app_config
+        self.provider_manager = provider_manager
+        self.event_loop = event_loop
+        self.locks = ConversationLocks()
+        # Shared by every session's client, so a conversation open in two sessions is one structure saved by one queue
+        self.conversations = SharedConversations()
+        self.journal = ConversationJournal()
+        self.persister = WriteBehindPersister(coalesce_ms=app_config.get("autosave_coalesce_ms", 250))
+        self._sessions: 'OrderedDict[str, Session]' = OrderedDict()  # Least recently used first
+        self._last_sweep = time.monotonic()
+        self.sessions_created = 0
+        self.sessions_evicted = 0
+
+        # Startup state (CLI overrides included) that every new session starts from
+        self._provider_name = template_client.provider.provider_name
+        self._model = template_client.current_model_name
+        self._params = dict(template_client.params)
+        self._use_streaming = template_client.use_streaming
+        self._conversations_dir = template_client.base_directory
+
+    async def acquire(self, token: Optional[str]) -> Tuple[Session, bool]:
+        """
+        The session for `token`, created when the token is unknown (or evicted).
+        Pair with release() once the request or stream is done.
+
+        Returns:
+            (session, created) - when created, the caller sends session.token back to the client
+        """
+        await self._sweep_if_due()
+        session = self._sessions.get(token) if token else None
+        created = session is None
+        if created:
+            session = await self._create_session()
+        self._sessions.move_to_end(session.token)
+        session.last_used = time.monotonic()
+        session.active_requests += 1
+        return session, created
+
+    def release(self, session: Session) -> None:
+        session.active_requests = max(0, session.active_requests - 1)
+        session.last_used = time.monotonic()
+
+    async def _create_session(self) -> Session:
+        from async_client import AsyncClient
+        from command_handler import CommandHandler
+        from gui.api_handlers import APIHandlers
+
+        await self._make_room()
+        provider = await self.provider_manager.get_session_provider(self._provider_name, self._model)
+        client = AsyncClient(provider=provider, conversations_dir=self._conversations_dir, global_config=self.app_config)
+        client.provider_manager = self.provider_manager
+        client.share_conversations(self.conversations, self.journal)
+        client.persister = self.persister
+        client.params = dict(self._params)
+        client.use_streaming = self._use_streaming
+        client.is_web_ui = True
+
+        api_handlers = APIHandlers(client, CommandHandler(client), self.event_loop)
+        api_handlers.set_provider_manager(self.provider_manager)
+        api_handlers.conversation_locks = self.locks
+
+        token = secrets.token_urlsafe(24)
+        session = Session(token, client, api_handlers)
+        self._sessions[token] = session
+        self.sessions_created += 1
+        logger.info(f"GUI session {token[:8]} created ({len(self._sessions)} active)")
+        return session
+
+    async def _make_room(self) -> None:
+        """Evicts the least recently used idle sessions while the pool is full."""
+        max_sessions = max(1, int(self.settings.get("max_sessions") or 1))
+        for session in list(self._sessions.values()):
+            if len(self._sessions) < max_sessions:
+                return
+            if session.active_requests == 0:
+                await self._evict(session)
+        if len(self._sessions) >= max_sessions:
+            logger.warning(f"All {len(self._sessions)} GUI sessions are busy; exceeding max_sessions={max_sessions}")
+
+    async def _sweep_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        await self.evict_idle()
+
+    async def evict_idle(self) -> int:
+        """Evicts sessions idle for longer than idle_timeout_seconds. Returns how many were evicted."""
+        cutoff = time.monotonic() - float(self.settings.get("idle_timeout_seconds") or 0)
+        idle = [s for s in self._sessions.values() if s.active_requests == 0 and s.last_used < cutoff]
+        for session in idle:
+            await self._evict(session)
+        return len(idle)
+
+    async def _evict(self, session: Session) -> None:
+        self._sessions.pop(session.token, None)
+        self.sessions_evicted += 1
+        try:
+            await session.client.flush_pending_saves()
+        except Exception as e:
+            logger.error(f"Error saving conversation of evicted GUI session {session.token[:8]}: {e}", exc_info=True)
+        logger.info(f"GUI session {session.token[:8]} evicted ({len(self._sessions)} active)")
+
+    async def aclose(self) -> None:
+        """Writes every session's pending saves (on shutdown)."""
+        try:
+            await self.persister.flush()
+        except Exception as e:
+            logger.error(f"Error flushing GUI session saves: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"active": len(self._sessions), "busy": sum(1 for s in self._sessions.values() if s.active_requests),
+                "created": self.sessions_created, "evicted": self.sessions_evicted}
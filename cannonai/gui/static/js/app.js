@@ -264,7 +264,7 @@ class CannonAIApp {
     async loadStatus() {
         console.log("[App] Loading client status");
         try {
-            const data = await this.api.getStatus();
+            const data = await this.api.getStatus(this.conversations.getDeltaBase());
             this.ui.updateConnectionStatus(data.connected);
 
             if (data.connected) {
@@ -281,10 +281,11 @@ class CannonAIApp {
 
                 this.settings.updateModelSettingsForm(data.params, data.streaming, this.conversations.currentSystemInstruction);
 
-                // Update conversation data
+                // Update conversation data (full state or a delta since our revision)
+                let history = data.history;
                 if (data.conversation_id) {
                     this.conversations.setCurrentConversation(data.conversation_id, data.conversation_name);
-                    this.conversations.updateMessageTree(data.full_message_tree);
+                    history = this.conversations.applyConversationState(data);
                     this.toggleMessageInput(true); // Enable input
                 } else {
                     this.conversations.clearConversation();
@@ -292,8 +293,8 @@ class CannonAIApp {
                 }
 
                 // Rebuild chat display
-                if (data.history && Array.isArray(data.history)) {
-                    this.messages.rebuildChatFromHistory(data.history);
+                if (history && Array.isArray(history)) {
+                    this.messages.rebuildChatFromHistory(history);
                 } else {
                     this.messages.clearChatDisplay();
                 }
@@ -407,6 +408,8 @@ class CannonAIApp {
                 this.updateMessageId(tempUserMessageId, data.parent_id);
             }
 
+            this.showContextNotice(data.context);
+
             // Add assistant response
             this.messages.addMessageToDOM('assistant', data.response, data.message_id, {
                 model: data.model,
@@ -430,6 +433,13 @@ class CannonAIApp {
         }
     }
 
+    showContextNotice(context) {
+        // Tells the user when older messages were left out to fit the model's context window
+        if (context && context.dropped_count) {
+            this.ui.showAlert(`${context.dropped_count} older message(s) were left out to fit the model's context window.`, 'info');
+        }
+    }
+
     async handleStreamingMessage(messageContent, tempUserMessageId) {
         console.log("[App] Handling streaming message");
 
@@ -444,6 +454,12 @@ class CannonAIApp {
 
         try {
             for await (const eventData of this.api.streamMessage(messageContent)) {
+                if (eventData.failover) {
+                    const { from, to, model } = eventData.failover;
+                    this.ui.showAlert(`${from} is unavailable, answering with ${to} (${model})`, 'warning');
+                    continue;
+                }
+
                 if (eventData.error) {
                     this.messages.updateMessageInDOM(tempAssistantMessageId, `Error: ${eventData.error}`);
                     this.ui.showAlert(eventData.error, 'danger');
@@ -456,6 +472,8 @@ class CannonAIApp {
                 }
 
                 if (eventData.done) {
+                    this.showContextNotice(eventData.context);
+
                     // Update assistant message ID
                     if (eventData.message_id) {
                         this.updateMessageId(tempAssistantMessageId, eventData.message_id);
@@ -761,7 +779,7 @@ class CannonAIApp {
         this.ui.showThinking(true);
 
         try {
-            const data = await this.api.retryMessage(messageId);
+            const data = await this.api.retryMessage(messageId, this.conversations.getDeltaBase());
             if (data.error) {
                 this.ui.showAlert(data.error, 'danger');
                 return;
@@ -780,12 +798,10 @@ class CannonAIApp {
                 );
             }
 
-            if (data.full_message_tree) {
-                this.conversations.updateMessageTree(data.full_message_tree);
-            }
+            const history = this.conversations.applyConversationState(data);
 
-            if (data.history && Array.isArray(data.history)) {
-                this.messages.rebuildChatFromHistory(data.history);
+            if (history && Array.isArray(history)) {
+                this.messages.rebuildChatFromHistory(history);
             }
 
             this.ui.showAlert('Generated new response', 'success');
@@ -803,7 +819,7 @@ class CannonAIApp {
         this.ui.showThinking(true);
 
         try {
-            const data = await this.api.navigateSibling(messageId, direction);
+            const data = await this.api.navigateSibling(messageId, direction, this.conversations.getDeltaBase());
 
             if (data.error) {
                 this.ui.showAlert(data.error, 'danger');
@@ -823,12 +839,10 @@ class CannonAIApp {
                 );
             }
 
-            if (data.full_message_tree) {
-                this.conversations.updateMessageTree(data.full_message_tree);
-            }
+            const history = this.conversations.applyConversationState(data);
 
-            if (data.history && Array.isArray(data.history)) {
-                this.messages.rebuildChatFromHistory(data.history);
+            if (history && Array.isArray(history)) {
+                this.messages.rebuildChatFromHistory(history);
             } else {
                 this.messages.clearChatDisplay();
                 this.ui.showAlert('Navigation resulted in empty history.', 'warning');
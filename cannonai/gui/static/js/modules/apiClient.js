@@ -11,10 +11,11 @@ export class APIClient {
 
     // ============ Connection & Status ============
 
-    async getStatus() {
+    async getStatus(deltaBase = null) {
         console.log("[APIClient] Getting connection status");
         try {
-            const response = await fetch(`${this.apiBase}/api/status`);
+            const query = deltaBase ? `?${new URLSearchParams(deltaBase)}` : '';
+            const response = await fetch(`${this.apiBase}/api/status${query}`);
             const data = await response.json();
             console.log("[APIClient] Status response:", data);
             return data;
@@ -290,11 +291,13 @@ export class APIClient {
 
     // ============ Message Navigation ============
 
-    async retryMessage(messageId) {
+    async retryMessage(messageId, deltaBase = null) {
         console.log("[APIClient] Retrying message:", messageId);
         try {
             const response = await fetch(`${this.apiBase}/api/retry/${messageId}`, {
-                method: 'POST'
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ...deltaBase })
             });
             const data = await response.json();
             console.log("[APIClient] Retry response:", data);
@@ -305,13 +308,13 @@ export class APIClient {
         }
     }
 
-    async navigateSibling(messageId, direction) {
+    async navigateSibling(messageId, direction, deltaBase = null) {
         console.log("[APIClient] Navigating sibling:", messageId, "direction:", direction);
         try {
             const response = await fetch(`${this.apiBase}/api/navigate`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message_id: messageId, direction })
+                body: JSON.stringify({ message_id: messageId, direction, ...deltaBase })
             });
             const data = await response.json();
             console.log("[APIClient] Navigate response:", data);
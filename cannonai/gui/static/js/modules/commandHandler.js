@@ -103,7 +103,7 @@ export class CommandHandler {
         
         // Update message tree if provided
         if (data.full_message_tree) {
-            this.conversations.updateMessageTree(data.full_message_tree);
+            this.conversations.updateMessageTree(data.full_message_tree, data.revision, data.conversation_id);
         }
         
         // Rebuild chat display if history provided
@@ -9,6 +9,8 @@ export class ConversationManager {
         this.currentConversationId = null;
         this.conversationName = "New Conversation";
         this.messageTree = {};
+        this.revision = null; // Server revision the local tree reflects (null = send everything next time)
+        this.revisionConversationId = null; // Conversation that revision was issued for
         this.currentSystemInstruction = "You are a helpful assistant.";
     }
 
@@ -35,6 +37,8 @@ export class ConversationManager {
         this.currentConversationId = null;
         this.conversationName = "New Conversation";
         this.messageTree = {};
+        this.revision = null;
+        this.revisionConversationId = null;
         
         const convNameEl = document.getElementById('conversationName');
         if (convNameEl) {
@@ -45,12 +49,74 @@ export class ConversationManager {
     /**
      * Update message tree from server data
      */
-    updateMessageTree(messageTree) {
+    updateMessageTree(messageTree, revision, conversationId) {
         console.log("[ConversationManager] Updating message tree");
         this.messageTree = messageTree || {};
+        this.revision = revision ?? null;
+        this.revisionConversationId = conversationId ?? null;
         this._rebuildMessageTreeRelationships();
     }
 
+    /**
+     * Revision and its conversation to send as since_revision/since_conversation_id,
+     * or null when the server should send everything
+     */
+    getDeltaBase() {
+        if (this.revision == null || !this.revisionConversationId) {
+            return null;
+        }
+        return { since_revision: this.revision, since_conversation_id: this.revisionConversationId };
+    }
+
+    /**
+     * Apply a status/retry/navigate response (full state or delta) and return the active history
+     */
+    applyConversationState(data) {
+        if (data.delta) {
+            this.applyDelta(data.changed_messages, data.revision);
+            return this.getActivePathHistory(data.active_path);
+        }
+        this.updateMessageTree(data.full_message_tree, data.revision, data.conversation_id);
+        return data.history;
+    }
+
+    /**
+     * Merge messages added or changed since our revision into the local tree
+     */
+    applyDelta(changedMessages, revision) {
+        const changedIds = Object.keys(changedMessages || {});
+        console.log(`[ConversationManager] Applying delta: ${changedIds.length} message(s), revision ${this.revision} -> ${revision}`);
+
+        // Server copies are complete (children included), so they replace local nodes outright
+        changedIds.forEach(messageId => {
+            this.messageTree[messageId] = changedMessages[messageId];
+        });
+        this.revision = revision ?? null;
+    }
+
+    /**
+     * Build the active history (same shape as the server's 'history') from message IDs on the active path
+     */
+    getActivePathHistory(activePath) {
+        const history = [];
+        (activePath || []).forEach(messageId => {
+            const message = this.messageTree[messageId];
+            if (!message || (message.type !== 'user' && message.type !== 'assistant')) return;
+            history.push({
+                role: message.type,
+                content: message.content || '',
+                id: messageId,
+                model: message.model,
+                timestamp: message.timestamp,
+                parent_id: message.parent_id,
+                token_usage: message.token_usage,
+                attachments: message.attachments,
+                pinned: message.pinned || false
+            });
+        });
+        return history;
+    }
+
     /**
      * Add or update a message in the tree
      */
@@ -4,12 +4,19 @@ CannonAI GUI Streaming Module - Handles Server-Sent Events (SSE) generation and
 
 This module provides utilities for streaming AI responses via Server-Sent Events,
 managing the async producer/consumer pattern between the AI client and Flask's response stream.
+
+The producer runs on the GUI event loop and puts events into a bounded thread-safe
+queue; the Flask thread blocks on that queue only when it is empty, then drains every
+event already queued and sends them as one SSE write. No per-event future or
+cross-thread call is needed, which keeps the bridge's cost per token in microseconds.
 """
 
 import json
+import queue
 import asyncio
 import logging
-from typing import AsyncGenerator, Dict, Any, Optional, TYPE_CHECKING
+import time
+from typing import AsyncGenerator, Dict, Any, Iterator, List, Optional, TYPE_CHECKING
 from datetime import datetime
 
 if TYPE_CHECKING:
@@ -17,6 +24,10 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger("cannonai.gui.streaming")
 
+STREAM_QUEUE_SIZE = 256  # Events buffered between the loop and the Flask thread
+PRODUCER_BACKOFF = 0.001  # Seconds the producer yields to the loop while the queue is full
+LOOP_CHECK_INTERVAL = 1.0  # Seconds between checks that the event loop is still running
+
 
 class StreamingError(Exception):
     """Custom exception for streaming-related errors."""
@@ -33,7 +44,6 @@ def format_sse_message(data: Dict[str, Any]) -> str:
     Returns:
         SSE-formatted string with 'data:' prefix and double newline
     """
-    print(f"[Streaming] Formatting SSE message with keys: {list(data.keys())}")
     return f"data: {json.dumps(data)}\n\n"
 
 
@@ -54,58 +64,84 @@ def create_error_stream(error_message: str) -> AsyncGenerator[str, None]:
     return error_generator()
 
 
-async def stream_with_queue(
+def _is_end_event(item: Any) -> bool:
+    return item is None or (isinstance(item, dict) and bool(item.get("done") or item.get("error")))
+
+
+async def _put_event(events: 'queue.Queue', item: Optional[Dict[str, Any]]) -> None:
+    """Queues an event from the loop without blocking it; waits out a full queue (a slow client)."""
+    while True:
+        try:
+            events.put_nowait(item)
+            return
+        except queue.Full:
+            await asyncio.sleep(PRODUCER_BACKOFF)
+
+
+def _drain_events(events: 'queue.Queue', first: Optional[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """The event just received plus all events already queued, stopping at the end of the stream."""
+    batch = [first]
+    while not _is_end_event(batch[-1]):
+        try:
+            batch.append(events.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def stream_with_queue(
     api_handlers: 'APIHandlers',
     message_content: str,
     event_loop: asyncio.AbstractEventLoop,
-    timeout_seconds: int = 90
-) -> AsyncGenerator[str, None]:
+    timeout_seconds: int = 90,
+    attachments: Optional[List[Dict[str, Any]]] = None,
+    add_user_message: bool = False
+) -> Iterator[str]:
     """
     Main streaming function that manages the async producer/consumer pattern.
     
-    This function creates a queue to bridge between the async AI response generator
-    and Flask's synchronous response stream. It handles timeouts, errors, and
-    proper cleanup.
+    A producer task on the GUI event loop forwards the AI response events into a
+    bounded thread-safe queue. This generator runs in Flask's thread: it waits for
+    the next event, takes every event already queued with it, and yields them as a
+    single SSE chunk. It handles timeouts, errors, and proper cleanup.
     
     Args:
         api_handlers: The APIHandlers instance with stream_message method
         message_content: The user's message content
         event_loop: The GUI event loop where async operations run
-        timeout_seconds: Timeout for queue operations
+        timeout_seconds: Timeout for waiting on the next event
+        attachments: Attachments of the user message
+        add_user_message: Whether stream_message adds the user message itself
         
     Yields:
-        SSE-formatted messages for the client
+        SSE-formatted messages for the client (one or more events per chunk)
     """
     print(f"[Streaming] Starting stream_with_queue for message: '{message_content[:50]}...'")
-    queue: asyncio.Queue[Optional[Dict[Any, Any]]] = asyncio.Queue()
-    producer_task: Optional[asyncio.Task] = None
+    events: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    producer_task = None
     
     async def producer():
         """Producer coroutine that gets AI responses and puts them in the queue."""
         try:
-            print(f"[Streaming] Producer starting for message: '{message_content[:50]}...'")
-            async for item in api_handlers.stream_message(message_content):
-                print(f"[Streaming] Producer received item with keys: {list(item.keys()) if isinstance(item, dict) else 'non-dict'}")
-                await queue.put(item)
+            async for item in api_handlers.stream_message(message_content, attachments, add_user_message):
+                await _put_event(events, item)
                 
                 # Check for completion or error conditions
-                if isinstance(item, dict) and (item.get("done") or item.get("error")):
-                    print(f"[Streaming] Producer detected end condition: done={item.get('done')}, error={item.get('error')}")
+                if _is_end_event(item):
                     break
                     
         except Exception as e:
             error_msg = f"Streaming producer error: {str(e)}"
             print(f"[Streaming] Producer error: {error_msg}")
             logger.error(error_msg, exc_info=True)
-            await queue.put({"error": error_msg})
+            await _put_event(events, {"error": error_msg})
         finally:
-            print("[Streaming] Producer finished, sending sentinel")
-            await queue.put(None)  # Sentinel to indicate end of stream
+            await _put_event(events, None)  # Sentinel to indicate end of stream
     
+    start_time = datetime.now()
     try:
         # Schedule the producer on the GUI event loop
         if event_loop and event_loop.is_running():
-            print("[Streaming] Scheduling producer on GUI event loop")
             producer_task = asyncio.run_coroutine_threadsafe(producer(), event_loop)
         else:
             error_msg = "Server event loop not available for streaming"
@@ -116,67 +152,60 @@ async def stream_with_queue(
         
         # Consumer loop - runs in Flask's context
         items_processed = 0
-        start_time = datetime.now()
-        
-        while True:
-            try:
-                print(f"[Streaming] Consumer waiting for item (processed: {items_processed})")
-                
-                # Check if event loop is still running
-                if not event_loop or not event_loop.is_running():
+        writes = 0
+        finished = False
+        while not finished:
+            # Wait for the next event, checking now and then that the loop is still running
+            deadline = time.monotonic() + timeout_seconds
+            first = None
+            while True:
+                if not event_loop.is_running():
                     error_msg = "Stream interrupted: server event loop stopped"
                     print(f"[Streaming] Error: {error_msg}")
                     logger.warning(error_msg)
                     yield format_sse_message({'error': error_msg})
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    error_msg = f"Stream timeout after {timeout_seconds}s waiting for response"
+                    print(f"[Streaming] Timeout error: {error_msg}")
+                    logger.warning(error_msg)
+                    yield format_sse_message({'error': error_msg})
+                    return
+                try:
+                    first = events.get(timeout=min(remaining, LOOP_CHECK_INTERVAL))
                     break
+                except queue.Empty:
+                    continue
+
+            batch = _drain_events(events, first)
+            finished = _is_end_event(batch[-1])
+            payload = "".join(format_sse_message(item) for item in batch if item is not None)
+            if payload:
+                items_processed += len(batch) - (batch[-1] is None)
+                writes += 1
+                yield payload
+        
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info(f"SSE stream ended after {elapsed:.2f}s: {items_processed} events in {writes} writes")
                 
-                # Get item from queue with timeout
-                item_future = asyncio.run_coroutine_threadsafe(queue.get(), event_loop)
-                item = item_future.result(timeout=timeout_seconds)
-                
-                if item is None:  # Sentinel received
-                    print(f"[Streaming] Consumer received sentinel after {items_processed} items")
-                    logger.debug(f"SSE stream complete after {items_processed} items")
-                    break
-                
-                items_processed += 1
-                print(f"[Streaming] Consumer yielding item #{items_processed}")
-                yield format_sse_message(item)
-                
-                # Check for completion conditions
-                if item.get("error") or item.get("done"):
-                    elapsed = (datetime.now() - start_time).total_seconds()
-                    print(f"[Streaming] Stream ended by event after {elapsed:.2f}s: {item}")
-                    logger.info(f"SSE stream ended after {elapsed:.2f}s and {items_processed} items")
-                    break
-                    
-            except asyncio.TimeoutError:
-                error_msg = f"Stream timeout after {timeout_seconds}s waiting for response"
-                print(f"[Streaming] Timeout error: {error_msg}")
-                logger.warning(error_msg)
-                yield format_sse_message({'error': error_msg})
-                break
-                
-            except Exception as e:
-                error_msg = f"Streaming consumer error: {str(e)}"
-                print(f"[Streaming] Consumer error: {error_msg}")
-                logger.error(error_msg, exc_info=True)
-                yield format_sse_message({'error': error_msg})
-                break
+    except Exception as e:
+        error_msg = f"Streaming consumer error: {str(e)}"
+        print(f"[Streaming] Consumer error: {error_msg}")
+        logger.error(error_msg, exc_info=True)
+        yield format_sse_message({'error': error_msg})
                 
     finally:
-        # Cleanup
-        print("[Streaming] Cleaning up stream resources")
+        # Cleanup (also runs when the client disconnects and Flask closes the generator)
         if producer_task and not producer_task.done():
             print("[Streaming] Cancelling producer task")
             producer_task.cancel()
             
         elapsed_total = (datetime.now() - start_time).total_seconds()
         print(f"[Streaming] Stream completed after {elapsed_total:.2f}s total")
-        logger.info(f"Stream cleanup complete after {elapsed_total:.2f}s")
 
 
-async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> AsyncGenerator[str, None]:
+def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> Iterator[str]:
     """
     Test function to verify SSE streaming is working.
     
@@ -188,7 +217,7 @@ async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> As
     """
     print("[Streaming] Running streaming connection test")
     
-    async def test_producer(queue: asyncio.Queue):
+    async def test_producer(events: queue.Queue):
         """Simple test producer that sends a few messages."""
         messages = [
             {"type": "info", "message": "Streaming test started"},
@@ -199,16 +228,16 @@ async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> As
         
         for i, msg in enumerate(messages):
             print(f"[Streaming] Test producer sending message {i+1}/{len(messages)}")
-            await queue.put(msg)
+            await _put_event(events, msg)
             await asyncio.sleep(0.5)  # Simulate processing time
             
-        await queue.put(None)  # Sentinel
+        await _put_event(events, None)  # Sentinel
     
-    queue: asyncio.Queue = asyncio.Queue()
+    events: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
     
     # Schedule test producer
     if event_loop and event_loop.is_running():
-        asyncio.run_coroutine_threadsafe(test_producer(queue), event_loop)
+        asyncio.run_coroutine_threadsafe(test_producer(events), event_loop)
     else:
         yield format_sse_message({'error': 'Test failed: no event loop'})
         return
@@ -216,8 +245,7 @@ async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> As
     # Consume test messages
     while True:
         try:
-            item_future = asyncio.run_coroutine_threadsafe(queue.get(), event_loop)
-            item = item_future.result(timeout=5)
+            item = events.get(timeout=5)
             
             if item is None:
                 break
@@ -227,7 +255,7 @@ async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> As
             if item.get("done"):
                 break
                 
-        except asyncio.TimeoutError:
+        except queue.Empty:
             yield format_sse_message({'error': 'Test timeout'})
             break
         except Exception as e:
@@ -235,3 +263,48 @@ async def test_streaming_connection(event_loop: asyncio.AbstractEventLoop) -> As
             break
     
     print("[Streaming] Test streaming completed")
+
+
+if __name__ == "__main__":
+    # Microbenchmark: per-token cost of the SSE bridge, with the producer as fast as possible.
+    # "per-event future" is the previous bridge (one run_coroutine_threadsafe(queue.get()) per token).
+    import threading
+
+    TOKENS = 20000
+
+    class _FakeHandlers:
+        async def stream_message(self, message_content, attachments=None, add_user_message=False):
+            for i in range(TOKENS):
+                yield {'chunk': 'tok ', 'accumulated': ''}
+                if i % 64 == 0:
+                    await asyncio.sleep(0)  # Let the loop breathe, as a network stream would
+            yield {'done': True, 'full_response': ''}
+
+    def _per_event_future_bridge(handlers, loop):
+        async_queue: asyncio.Queue = asyncio.Queue()
+
+        async def producer():
+            async for item in handlers.stream_message(""):
+                await async_queue.put(item)
+            await async_queue.put(None)
+
+        asyncio.run_coroutine_threadsafe(producer(), loop)
+        while True:
+            item = asyncio.run_coroutine_threadsafe(async_queue.get(), loop).result(timeout=10)
+            if item is None:
+                break
+            yield f"data: {json.dumps(item)}\n\n"
+
+    bench_loop = asyncio.new_event_loop()
+    threading.Thread(target=bench_loop.run_forever, daemon=True).start()
+    while not bench_loop.is_running():
+        time.sleep(0.01)
+
+    for label, bridge in [("per-event future", lambda: _per_event_future_bridge(_FakeHandlers(), bench_loop)),
+                          ("batched queue", lambda: stream_with_queue(_FakeHandlers(), "bench", bench_loop))]:
+        start = time.perf_counter()
+        writes = sum(1 for _ in bridge())
+        elapsed = time.perf_counter() - start
+        print(f"{label:>16}: {elapsed * 1e6 / TOKENS:8.2f} us/token, {writes} writes for {TOKENS} tokens")
+
+    bench_loop.call_soon_threadsafe(bench_loop.stop)
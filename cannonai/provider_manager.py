@@ -3,14 +3,23 @@
 CannonAI Provider Manager - Dynamic provider instance management for seamless switching.
 
 This module provides a manager for creating, caching, and switching between AI provider
-instances without requiring application restart.
+instances without requiring application restart. The manager also owns the shared HTTP
+transport (see providers/transport.py) that every provider it creates sends requests through,
+and the optional exact-match response cache (see providers/response_cache.py).
+
+When the "provider_fallback_chain" config lists other providers, `generate_with_failover`
+and `stream_with_failover` move a request down that chain whenever the active provider is
+rate-limited, failing or has its circuit open (see providers/base_provider.py).
 """
 
 import asyncio
-from typing import Dict, Optional, Type
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type
 from pathlib import Path
 
 from providers import get_provider_class, ProviderConfig, BaseAIProvider, ProviderError
+from providers.base_provider import CircuitBreaker
+from providers.response_cache import ResponseCache
+from providers.transport import HttpTransport
 from config import Config
 from base_client import Colors
 
@@ -30,7 +39,36 @@ class ProviderManager:
         self._provider_cache: Dict[str, BaseAIProvider] = {}
         self._current_provider_name: Optional[str] = None
         self._current_provider: Optional[BaseAIProvider] = None
-        
+        self.transport = HttpTransport(main_config.get("http_transport", {}))
+        config_file = getattr(main_config, "config_file", None)
+        self.response_cache = ResponseCache(main_config.get("response_cache", {}),
+                                            default_dir=Path(config_file).parent if config_file else None)
+
+    def create_provider(self, provider_name: str, model: str, api_key: Optional[str] = None) -> BaseAIProvider:
+        """
+        Instantiates (but does not initialize or cache) a provider wired to the shared transport.
+
+        Raises:
+            ValueError: If the provider is unknown or no API key is found.
+            ProviderError: If the provider's SDK is not installed.
+        """
+        api_key = api_key or self.main_config.get_api_key(provider_name)
+        if not api_key:
+            raise ValueError(f"API key for provider '{provider_name}' not found. "
+                           f"Please set it in config or environment variable ({provider_name.upper()}_API_KEY)")
+        provider_class = get_provider_class(provider_name)
+        provider = provider_class(ProviderConfig(api_key=api_key, model=model))
+        provider.attach_transport(self.transport)
+        provider.attach_response_cache(self.response_cache)
+        provider.configure_prompt_cache(self.main_config.get("prompt_cache", {}))
+        return provider
+
+    def register_provider(self, provider_name: str, provider: BaseAIProvider) -> None:
+        """Caches a provider created elsewhere (e.g. by ClientManager) and makes it current."""
+        self._provider_cache[provider_name] = provider
+        self._current_provider_name = provider_name
+        self._current_provider = provider
+
     def get_current_provider(self) -> Optional[BaseAIProvider]:
         """Get the currently active provider instance."""
         return self._current_provider
@@ -81,12 +119,6 @@ class ProviderManager:
         # Create new provider instance
         print(f"[ProviderManager] Creating new provider instance for {provider_name}")
         
-        # Get API key
-        api_key = self.main_config.get_api_key(provider_name)
-        if not api_key:
-            raise ValueError(f"API key for provider '{provider_name}' not found. "
-                           f"Please set it in config or environment variable ({provider_name.upper()}_API_KEY)")
-        
         # Determine model
         if not model:
             model = self.main_config.get_default_model_for_provider(provider_name)
@@ -101,9 +133,7 @@ class ProviderManager:
         
         # Create provider instance
         try:
-            provider_class = get_provider_class(provider_name)
-            provider_config = ProviderConfig(api_key=api_key, model=model)
-            provider = provider_class(provider_config)
+            provider = self.create_provider(provider_name, model)
             
             # Initialize the provider
             print(f"[ProviderManager] Initializing new {provider_name} provider...")
@@ -121,6 +151,21 @@ class ProviderManager:
             print(f"{Colors.FAIL}[ProviderManager] Error creating provider {provider_name}: {e}{Colors.ENDC}")
             raise ProviderError(f"Failed to create provider {provider_name}: {str(e)}") from e
     
+    async def get_session_provider(self, provider_name: str, model: Optional[str] = None) -> BaseAIProvider:
+        """
+        A per-session handle on the cached provider (see BaseAIProvider.with_model), so
+        several GUI sessions can use one initialized provider with different models.
+
+        Raises:
+            ValueError: If the model is not valid for the provider.
+            ProviderError: If the provider cannot be created or initialized.
+        """
+        provider = await self.get_or_create_provider(provider_name)
+        model = model or provider.config.model
+        if model != provider.config.model and not provider.validate_model(model):
+            raise ValueError(f"Model '{model}' not valid for {provider_name}")
+        return provider.with_model(model)
+
     async def switch_provider(self, provider_name: str, model: Optional[str] = None) -> BaseAIProvider:
         """
         Switch to a different provider.
@@ -160,6 +205,131 @@ class ProviderManager:
         self._current_provider_name = None
         print("[ProviderManager] Provider cleanup complete")
     
+    async def aclose(self) -> None:
+        """Closes the shared HTTP transport and its pooled connections, and the response cache."""
+        await self.transport.aclose()
+        self.response_cache.close()
+
+    def get_fallback_chain(self, primary_name: str) -> List[Tuple[str, Optional[str]]]:
+        """
+        The (provider, model) pairs to try after `primary_name`, in configured order.
+
+        "provider_fallback_chain" is an ordered list of provider names (the primary is
+        skipped wherever it appears); "provider_fallback_models" maps a provider to the
+        model to use when it stands in, otherwise its default model is used.
+        """
+        models = self.main_config.get("provider_fallback_models", {}) or {}
+        chain = []
+        for name in self.main_config.get("provider_fallback_chain", []) or []:
+            if name != primary_name and name not in (entry[0] for entry in chain):
+                chain.append((name, models.get(name)))
+        return chain
+
+    @staticmethod
+    def _is_healthy(provider: BaseAIProvider) -> bool:
+        return provider.circuit_breaker.would_allow()
+
+    @staticmethod
+    def _should_fail_over(provider: BaseAIProvider, retryable: bool) -> bool:
+        """Transient errors (after the provider's own retries) and an open or half-open circuit move on; bad requests do not."""
+        return retryable or provider.circuit_breaker.state != CircuitBreaker.CLOSED
+
+    async def _fallback_providers(self, primary: BaseAIProvider) -> AsyncIterator[BaseAIProvider]:
+        """
+        Yields the healthy fallback providers for `primary`, creating them on first use.
+        Each is a handle with the chain's model (see get_session_provider), so a failover
+        never changes the model of the cached instance used by the CLI and other sessions.
+        """
+        for name, model in self.get_fallback_chain(primary.provider_name):
+            cached = self._provider_cache.get(name)
+            if cached is not None and not self._is_healthy(cached):
+                print(f"{Colors.WARNING}[ProviderManager] Skipping fallback {name}: circuit open{Colors.ENDC}")
+                continue
+            try:
+                yield await self.get_session_provider(name, model)
+            except (ValueError, ProviderError) as e:
+                print(f"{Colors.WARNING}[ProviderManager] Skipping fallback {name}: {e}{Colors.ENDC}")
+
+    async def generate_with_failover(self, primary: BaseAIProvider,
+                                     build_messages: Callable[[BaseAIProvider], List[Dict[str, Any]]],
+                                     params: Dict[str, Any], use_cache: bool = True,
+                                     system_instruction: Optional[str] = None) -> Tuple[BaseAIProvider, Tuple[str, Dict[str, Any]]]:
+        """
+        Non-streaming generation on `primary`, then on each healthy fallback in turn.
+
+        `build_messages` prepares the history for a given provider (message formats differ);
+        `use_cache` and `system_instruction` are passed to `generate_cached`. Returns the provider that answered together with its (text, metadata) result; if
+        every candidate fails, the error from the primary is raised.
+        """
+        try:
+            return primary, await primary.generate_cached(build_messages(primary), params, use_cache=use_cache,
+                                                          system_instruction=system_instruction)
+        except ProviderError as e:
+            if not self._should_fail_over(primary, e.retryable):
+                raise
+            first_error = e
+        print(f"{Colors.WARNING}[ProviderManager] {primary.provider_name} failed ({first_error}); trying fallback providers{Colors.ENDC}")
+        async for provider in self._fallback_providers(primary):
+            try:
+                result = await provider.generate_cached(build_messages(provider), params, use_cache=use_cache,
+                                                        system_instruction=system_instruction)
+            except ProviderError as e:
+                print(f"{Colors.WARNING}[ProviderManager] Fallback {provider.provider_name} failed: {e}{Colors.ENDC}")
+                continue
+            print(f"{Colors.GREEN}[ProviderManager] Response served by fallback {provider.provider_name} ({provider.config.model}){Colors.ENDC}")
+            return provider, result
+        raise first_error
+
+    async def stream_with_failover(self, primary: BaseAIProvider,
+                                   build_messages: Callable[[BaseAIProvider], List[Dict[str, Any]]],
+                                   params: Dict[str, Any], use_cache: bool = True,
+                                   system_instruction: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams from `primary`, moving to the next healthy fallback if a provider fails
+        before producing any text. Once text has been streamed an error is passed on as
+        is, since a partial answer cannot be continued by another model.
+
+        Yields the provider's chunk dicts; a {"failover": {...}} event announces each
+        switch, and the final "done" chunk carries the "provider" and "model" that served it.
+        """
+        candidates = self._fallback_providers(primary)
+        provider: Optional[BaseAIProvider] = primary
+        first_error: Optional[Dict[str, Any]] = None
+        while provider is not None:
+            started = False
+            failed: Optional[Dict[str, Any]] = None
+            try:
+                stream = await provider.generate_cached(build_messages(provider), params, stream=True, use_cache=use_cache,
+                                                        system_instruction=system_instruction)
+                async for chunk in stream:
+                    if chunk.get("error"):
+                        failed = chunk
+                        break
+                    if chunk.get("done"):
+                        chunk = dict(chunk, provider=provider.provider_name, model=provider.config.model)
+                    started = started or bool(chunk.get("chunk"))
+                    yield chunk
+                    if chunk.get("done"):
+                        return
+            except ProviderError as e:
+                failed = {"error": str(e), "retryable": e.retryable}
+            if failed is None:
+                return  # Stream ended without a "done" chunk
+            if started or not self._should_fail_over(provider, bool(failed.get("retryable"))):
+                yield failed
+                return
+            first_error = first_error or failed
+            print(f"{Colors.WARNING}[ProviderManager] {provider.provider_name} stream failed ({failed['error']}); trying next provider{Colors.ENDC}")
+            previous = provider.provider_name
+            try:
+                provider = await candidates.__anext__()
+            except StopAsyncIteration:
+                provider = None
+            if provider is not None:
+                yield {"failover": {"from": previous, "to": provider.provider_name, "model": provider.config.model,
+                                    "reason": failed["error"]}}
+        yield first_error
+
     def get_all_cached_providers(self) -> Dict[str, BaseAIProvider]:
         """Get all cached provider instances."""
         return self._provider_cache.copy()
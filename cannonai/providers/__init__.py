@@ -3,15 +3,15 @@ AI Provider interfaces and implementations for CannonAI.
 
 This module provides a unified interface for different AI providers (Gemini, Claude, OpenAI, etc.)
 allowing the application to work with multiple AI services through a common API.
+
+Provider modules are imported on first use, so a session only loads the SDK of
+the provider it actually talks to (importing this package loads no SDK at all).
 """
 
-from .base_provider import BaseAIProvider, ProviderError, ProviderConfig
-from .gemini_provider import GeminiProvider
-from .openai_provider import OpenAIProvider
-from .deepseek_provider import DeepSeekProvider
+import importlib
+from typing import Dict, Tuple, Type
 
-# Future imports will be added as we implement them
-# from .claude_provider import ClaudeProvider
+from .base_provider import BaseAIProvider, ProviderError, ProviderConfig
 
 __all__ = [
     'BaseAIProvider',
@@ -20,33 +20,72 @@ __all__ = [
     'GeminiProvider',
     'OpenAIProvider',
     'DeepSeekProvider',
-    # 'ClaudeProvider',
+    'ClaudeProvider',
+    'get_provider_class',
+    'available_providers',
 ]
 
-# Provider registry for easy lookup
-PROVIDERS = {
-    'gemini': GeminiProvider,
-    'openai': OpenAIProvider,
-    'deepseek': DeepSeekProvider,
-    # 'claude': ClaudeProvider,
+# Provider registry: name -> (module, class name). Modules are imported lazily.
+PROVIDER_MODULES: Dict[str, Tuple[str, str]] = {
+    'gemini': ('.gemini_provider', 'GeminiProvider'),
+    'openai': ('.openai_provider', 'OpenAIProvider'),
+    'deepseek': ('.deepseek_provider', 'DeepSeekProvider'),
+    'claude': ('.claude_provider', 'ClaudeProvider'),
+}
+
+# SDK each provider module needs, for the error message when it is missing
+PROVIDER_PACKAGES: Dict[str, str] = {
+    'gemini': 'google-genai',
+    'openai': 'openai',
+    'deepseek': 'openai',
+    'claude': 'httpx',
 }
 
-def get_provider_class(provider_name: str):
-    """Get the provider class by name.
-    
+_loaded_classes: Dict[str, Type[BaseAIProvider]] = {}
+
+
+def available_providers() -> list:
+    """Names of all registered providers (without importing any of them)."""
+    return list(PROVIDER_MODULES.keys())
+
+
+def get_provider_class(provider_name: str) -> Type[BaseAIProvider]:
+    """Get the provider class by name, importing its module on first use.
+
     Args:
         provider_name: Name of the provider (e.g., 'gemini', 'claude', 'openai')
-        
+
     Returns:
         The provider class
-        
+
     Raises:
         ValueError: If provider is not found
+        ProviderError: If the provider's SDK is not installed
     """
     print(f"DEBUG: Looking up provider class for: {provider_name}")
-    
-    if provider_name not in PROVIDERS:
-        available = ', '.join(PROVIDERS.keys())
+
+    if provider_name not in PROVIDER_MODULES:
+        available = ', '.join(PROVIDER_MODULES.keys())
         raise ValueError(f"Unknown provider: {provider_name}. Available providers: {available}")
-    
-    return PROVIDERS[provider_name]
+
+    provider_class = _loaded_classes.get(provider_name)
+    if provider_class is None:
+        module_name, class_name = PROVIDER_MODULES[provider_name]
+        try:
+            module = importlib.import_module(module_name, __name__)
+        except ImportError as e:
+            package = PROVIDER_PACKAGES.get(provider_name, provider_name)
+            raise ProviderError(f"The '{provider_name}' provider requires the '{package}' package "
+                                f"(pip install {package}): {e}") from e
+        provider_class = _loaded_classes[provider_name] = getattr(module, class_name)
+    return provider_class
+
+
+def __getattr__(name: str):
+    # Keeps `from providers import GeminiProvider` (and PROVIDERS) working without eager imports
+    for provider_name, (_, class_name) in PROVIDER_MODULES.items():
+        if name == class_name:
+            return get_provider_class(provider_name)
+    if name == 'PROVIDERS':
+        return {provider_name: get_provider_class(provider_name) for provider_name in PROVIDER_MODULES}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,10 +6,31 @@ It provides a consistent interface for interacting with different AI services.
 """
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Tuple, Callable
+from dataclasses import dataclass, replace
+from typing import Dict, List, Any, Optional, Union, AsyncGenerator, AsyncIterator, Awaitable, Tuple, Callable, TypeVar
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 import asyncio
+import copy
+import logging
+import random
+import time
+
+from .prompt_cache import DEFAULT_PROMPT_CACHE_SETTINGS, PromptCacheStats, stable_prefix_length
+from .response_cache import cache_key, replay_chunks
+from .token_estimator import get_estimator
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+# Transport-level exceptions (raised by httpx / the SDKs) that carry no status code
+_TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+    "WriteTimeout", "PoolTimeout", "ReadError", "WriteError", "RemoteProtocolError", "ServerDisconnectedError",
+}
 
 
 @dataclass
@@ -32,8 +53,115 @@ class ProviderConfig:
 
 
 class ProviderError(Exception):
-    """Base exception for provider-related errors."""
-    pass
+    """Base exception for provider-related errors.
+
+    Errors that come from a provider's API carry the HTTP status code and the
+    server's Retry-After hint (seconds) when available; `retryable` marks
+    transient failures (rate limits, 5xx, dropped connections).
+    """
+
+    def __init__(self, message: str = "", status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header (delta seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, honouring the server's Retry-After hint."""
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 max_retry_after: float = 60.0):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = max(0.0, base_delay)
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after  # A longer server-requested wait fails the call instead
+
+    @classmethod
+    def from_config(cls, config: "ProviderConfig") -> "RetryPolicy":
+        return cls(max_retries=config.max_retries, base_delay=config.retry_delay)
+
+    def delay_for(self, attempt: int, error: ProviderError) -> Optional[float]:
+        """Seconds to wait before retry number `attempt` (0-based), or None to give up."""
+        if not error.retryable or attempt >= self.max_retries:
+            return None
+        if error.retry_after is not None:
+            return error.retry_after if error.retry_after <= self.max_retry_after else None
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)  # "Equal jitter" keeps a floor under the wait
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    After `failure_threshold` consecutive transient failures the circuit opens and
+    calls fail fast for `reset_timeout` seconds. The first call after that is let
+    through as a trial (half-open): success closes the circuit, failure reopens it.
+    Other calls keep failing fast while the trial is in flight.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.trial_in_flight = False  # Half-open: the single trial call has been let through
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def would_allow(self) -> bool:
+        """Whether allow_request() would let a call through now (without claiming the trial)."""
+        if self.state == self.OPEN:
+            return self.retry_in() <= 0
+        return self.state == self.CLOSED or not self.trial_in_flight
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if not self.would_allow():
+            return False
+        self.state = self.HALF_OPEN
+        self.trial_in_flight = True
+        return True
+
+    def abandon_trial(self) -> None:
+        """The trial call ended without an outcome (cancelled); the next call becomes the trial."""
+        self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
 
 
 class BaseAIProvider(ABC):
@@ -42,6 +170,13 @@ class BaseAIProvider(ABC):
     All AI providers (Gemini, Claude, OpenAI, etc.) must implement this interface
     to ensure compatibility with the CannonAI system.
     """
+
+    # Per-model limits ({"context_window", "max_output_tokens"}), filled in by providers that know them
+    MODEL_SPECS: Dict[str, Dict[str, int]] = {}
+    # Context size assumed for models without a known limit (None disables history budgeting)
+    DEFAULT_CONTEXT_WINDOW: Optional[int] = None
+    # Seconds a fetched model list is reused by list_models_cached() before the provider is asked again
+    MODEL_LIST_TTL = 600.0
     
     def __init__(self, config: ProviderConfig):
         """Initialize the provider with configuration.
@@ -53,6 +188,66 @@ class BaseAIProvider(ABC):
         self.config = config
         self._client = None  # Will be initialized by concrete implementations
         self._is_initialized = False
+        self.transport = None  # Shared HttpTransport, attached by ProviderManager before initialize()
+        self.response_cache = None  # Shared ResponseCache, attached by ProviderManager when enabled
+        self.context_windows: Dict[str, int] = {}  # Input token limits reported by list_models()
+        self.prompt_cache_settings: Dict[str, Any] = dict(DEFAULT_PROMPT_CACHE_SETTINGS)
+        self.prompt_cache_stats = PromptCacheStats()
+        self.retry_policy = RetryPolicy.from_config(config)
+        self.circuit_breaker = CircuitBreaker()
+        self.retry_stats: Dict[str, int] = {"calls": 0, "attempts": 0, "retries": 0, "successes": 0,
+                                            "failures": 0, "short_circuited": 0}
+        # Shared with with_model() handles; "version" changes only when a refetch returns a different list
+        self._model_list: Dict[str, Any] = {"models": None, "fetched_at": 0.0, "version": 0}
+
+    def with_model(self, model: str) -> 'BaseAIProvider':
+        """
+        A handle on this provider with its own model setting, for one GUI session.
+        The SDK client, transport, caches, circuit breaker and stats stay shared, so
+        changing the handle's model does not change it for other sessions.
+        """
+        handle = copy.copy(self)
+        handle.config = replace(self.config, model=model)
+        return handle
+
+    def attach_transport(self, transport) -> None:
+        """Hands the provider the shared HTTP transport to use instead of a private client."""
+        self.transport = transport
+
+    def attach_response_cache(self, cache) -> None:
+        """Hands the provider the shared exact-match response cache (see providers/response_cache.py)."""
+        self.response_cache = cache
+
+    def configure_prompt_cache(self, settings: Optional[Dict[str, Any]]) -> None:
+        """Applies the "prompt_cache" config section (see providers/prompt_cache.py)."""
+        self.prompt_cache_settings = {**DEFAULT_PROMPT_CACHE_SETTINGS, **(settings or {})}
+
+    def cacheable_prefix_length(self, messages: List[Dict[str, Any]],
+                                system_instruction: Optional[str] = None) -> Optional[int]:
+        """
+        Number of leading `messages` that, together with the system instruction, form a
+        cacheable prompt prefix: the earlier turns, which every request re-sends unchanged.
+        0 means only the system instruction is cacheable; None means nothing should be
+        marked (prompt caching disabled or the prefix shorter than min_prefix_tokens).
+        """
+        if not self.prompt_cache_settings.get("enabled"):
+            return None
+        length = stable_prefix_length(messages)
+        estimator = get_estimator()
+        prefix_tokens = estimator.count_text(system_instruction or "") + sum(estimator.count_message(m) for m in messages[:length])
+        return length if prefix_tokens >= int(self.prompt_cache_settings["min_prefix_tokens"]) else None
+
+    def get_context_window(self, model: Optional[str] = None) -> Optional[int]:
+        """Context size in tokens of `model` (default: the configured one), or None if unknown."""
+        model = model or self.config.model
+        spec = self.MODEL_SPECS.get(model, {})
+        return spec.get("context_window") or self.context_windows.get(model) or self.DEFAULT_CONTEXT_WINDOW
+
+    def http_client(self):
+        """Pooled async HTTP client for this provider's base URL, or None to let the SDK build its own."""
+        if self.transport is None or not self.config.api_base_url:
+            return None
+        return self.transport.get_client(self.config.api_base_url, self.config.timeout)
     
     @abstractmethod
     async def initialize(self) -> bool:
@@ -80,12 +275,33 @@ class BaseAIProvider(ABC):
         """
         pass
     
+    async def list_models_cached(self) -> List[Dict[str, Any]]:
+        """list_models(), reused for MODEL_LIST_TTL seconds. Empty or failed listings are not kept."""
+        cached = self._model_list
+        if cached["models"] is not None and time.monotonic() - cached["fetched_at"] < self.MODEL_LIST_TTL:
+            return cached["models"]
+        models = await self.list_models()
+        if models:
+            if models != cached["models"]:
+                cached["version"] += 1
+            cached["models"], cached["fetched_at"] = models, time.monotonic()
+        return models
+
+    @property
+    def model_list_version(self) -> Optional[int]:
+        """Version of the cached model list, or None when there is none or it has expired."""
+        cached = self._model_list
+        if cached["models"] is None or time.monotonic() - cached["fetched_at"] >= self.MODEL_LIST_TTL:
+            return None
+        return cached["version"]
+
     @abstractmethod
     async def generate_response(
         self,
         messages: List[Dict[str, str]],
         params: Optional[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        system_instruction: Optional[str] = None
     ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
         """Generate a response from the AI model.
         
@@ -93,6 +309,8 @@ class BaseAIProvider(ABC):
             messages: List of message dictionaries with 'role' and 'content'
             params: Optional generation parameters (temperature, max_tokens, etc.)
             stream: Whether to stream the response
+            system_instruction: Sent through the provider's native system channel, never as a chat turn
+                (a 'system_instruction_override' key on the first message is still honoured)
             
         Returns:
             If stream=False: Tuple of (response_text, metadata)
@@ -102,6 +320,84 @@ class BaseAIProvider(ABC):
         """
         pass
     
+    async def generate_cached(
+        self,
+        messages: List[Dict[str, Any]],
+        params: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+        use_cache: bool = True,
+        system_instruction: Optional[str] = None
+    ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
+        """`generate_response` behind the exact-match response cache, when one is attached.
+
+        A hit returns the stored answer (replayed as chunks when streaming) with
+        metadata "cached": True; a miss calls the provider and stores a successful
+        answer. `use_cache=False` skips both lookup and store (e.g. regenerations).
+        """
+        cache = self.response_cache
+        key = None
+        if cache is not None and cache.enabled:
+            if use_cache:
+                key_params = {**(params or {}), "system_instruction": system_instruction} if system_instruction else params
+                key = cache_key(self.provider_name, self.config.model, messages, key_params)
+            else:
+                cache.note_bypass()
+        if key is None:
+            return await self._generate_measured(messages, params, stream, system_instruction)
+
+        entry = await cache.get(key)
+        if entry is not None:
+            logger.debug(f"Response cache hit for {self.provider_name}/{self.config.model}")
+            if stream:
+                return self._replay_cached(entry)
+            return entry["text"], {**entry["metadata"], "cached": True}
+        if stream:
+            return self._stream_and_store(key, await self._generate_measured(messages, params, True, system_instruction))
+        text, metadata = await self._generate_measured(messages, params, False, system_instruction)
+        await cache.put(key, text, metadata)
+        return text, metadata
+
+    async def _generate_measured(self, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]], stream: bool,
+                                 system_instruction: Optional[str] = None) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
+        """`generate_response` with its token usage (and, when streaming, time to first token) fed to prompt_cache_stats."""
+        started = time.monotonic()
+        if stream:
+            return self._measure_stream(await self.generate_response(
+                messages, params, stream=True, system_instruction=system_instruction), started)
+        text, metadata = await self.generate_response(messages, params, stream=False, system_instruction=system_instruction)
+        self.prompt_cache_stats.record(metadata.get("token_usage"))
+        return text, metadata
+
+    async def _measure_stream(self, stream: AsyncGenerator[Dict[str, Any], None],
+                              started: float) -> AsyncGenerator[Dict[str, Any], None]:
+        ttft_ms = None
+        async for chunk_data in stream:
+            if ttft_ms is None and chunk_data.get("chunk"):
+                ttft_ms = (time.monotonic() - started) * 1000
+            if chunk_data.get("done") and not chunk_data.get("error"):
+                self.prompt_cache_stats.record(chunk_data.get("token_usage"), ttft_ms)
+                if ttft_ms is not None:
+                    chunk_data["ttft_ms"] = round(ttft_ms, 1)
+            yield chunk_data
+
+    async def _replay_cached(self, entry: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        accumulated = ""
+        for chunk in replay_chunks(entry):
+            accumulated += chunk
+            yield {"chunk": chunk, "accumulated": accumulated}
+        yield {"done": True, "full_response": entry["text"], "token_usage": entry["metadata"].get("token_usage", {}),
+               "cached": True}
+
+    async def _stream_and_store(self, key: str, stream: AsyncGenerator[Dict[str, Any], None]) -> AsyncGenerator[Dict[str, Any], None]:
+        chunks: List[str] = []
+        async for chunk_data in stream:
+            if chunk_data.get("chunk"):
+                chunks.append(chunk_data["chunk"])
+            if chunk_data.get("done") and not chunk_data.get("error"):
+                text = chunk_data.get("full_response") or "".join(chunks)
+                await self.response_cache.put(key, text, {"token_usage": chunk_data.get("token_usage", {})}, chunks)
+            yield chunk_data
+
     @abstractmethod
     def validate_model(self, model_name: str) -> bool:
         """Check if a model name is valid for this provider.
@@ -171,6 +467,122 @@ class BaseAIProvider(ABC):
         """
         return {}
     
+    # ---------- Retry / circuit breaker ----------
+
+    def classify_error(self, error: Exception, context: str = "") -> ProviderError:
+        """
+        Wraps an SDK/transport exception in a ProviderError carrying its status code,
+        Retry-After hint and whether it is transient. Providers can override this for
+        SDK-specific exception types.
+        """
+        if isinstance(error, ProviderError):
+            return error
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None)
+        if not isinstance(status, int):
+            status = getattr(error, "code", None)  # google-genai APIError
+        if not isinstance(status, int):
+            status = getattr(response, "status_code", None)
+        status = status if isinstance(status, int) else None
+        headers = getattr(response, "headers", None)
+        retry_after = _parse_retry_after(headers.get("retry-after")) if headers is not None else None
+        retryable = (status in RETRYABLE_STATUS_CODES if status is not None else
+                     isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError))
+                     or type(error).__name__ in _TRANSIENT_ERROR_NAMES)
+        message = getattr(error, "message", None) or str(error) or type(error).__name__
+        return ProviderError(f"{context}: {message}" if context else message,
+                             status_code=status, retry_after=retry_after, retryable=retryable)
+
+    async def call_with_retry(self, operation: Callable[[], Awaitable[T]], context: str = "") -> T:
+        """
+        Runs `operation` under the provider's retry policy and circuit breaker.
+
+        Transient failures are retried with backoff; other errors, an exhausted retry
+        budget or an open circuit raise a ProviderError immediately.
+        """
+        stats = self.retry_stats
+        stats["calls"] += 1
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow_request():
+                stats["short_circuited"] += 1
+                retry_in = self.circuit_breaker.retry_in()
+                raise ProviderError(f"{context or self.provider_name}: provider unavailable after repeated failures "
+                                    f"(circuit open, retrying in {retry_in:.0f}s)", retry_after=retry_in)
+            stats["attempts"] += 1
+            try:
+                result = await operation()
+            except asyncio.CancelledError:
+                self.circuit_breaker.abandon_trial()
+                raise
+            except Exception as e:
+                error = self.classify_error(e, context)
+                if error.retryable:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()  # The backend answered; the request itself was bad
+                delay = self.retry_policy.delay_for(attempt, error)
+                if delay is None or self.circuit_breaker.state == CircuitBreaker.OPEN:
+                    stats["failures"] += 1
+                    raise error from e
+                stats["retries"] += 1
+                attempt += 1
+                logger.warning(f"{error} (status {error.status_code}); retry {attempt}/{self.retry_policy.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.circuit_breaker.record_success()
+            stats["successes"] += 1
+            return result
+
+    async def stream_with_retry(self, open_stream: Callable[[], Awaitable[Any]], context: str = "") -> AsyncIterator[Any]:
+        """
+        Yields the raw items of a provider stream. Opening the stream and reading its
+        first item run under `call_with_retry`; once an item has been yielded a failure
+        propagates, since a partially delivered answer cannot be replayed.
+        """
+        async def open_and_read_first() -> Tuple[Any, Any, bool]:
+            iterator = (await open_stream()).__aiter__()
+            try:
+                return iterator, await iterator.__anext__(), False
+            except StopAsyncIteration:
+                return iterator, None, True
+
+        iterator, first_item, exhausted = await self.call_with_retry(open_and_read_first, context)
+        if exhausted:
+            return
+        yield first_item
+        try:
+            async for item in iterator:
+                yield item
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise self.classify_error(e, context) from e
+
+    def complete_token_usage(self, usage: Optional[Dict[str, Any]], prompt_messages: List[Dict[str, Any]],
+                             response_text: str) -> Dict[str, Any]:
+        """
+        Token usage reported by the backend, or a local estimate (flagged "estimated": True)
+        when the response came back without prompt or completion counts.
+        """
+        usage = {k: v for k, v in (usage or {}).items() if v is not None}  # A reported 0 is a real count
+        if "prompt_tokens" in usage and "completion_tokens" in usage:
+            usage.setdefault("total_tokens", usage["prompt_tokens"] + usage["completion_tokens"])
+            return usage
+        logger.debug(f"{self.provider_name} returned incomplete token usage {usage}; estimating the rest locally")
+        estimate = get_estimator().estimate_usage(prompt_messages, response_text)
+        prompt_tokens = usage.get("prompt_tokens", estimate["prompt_tokens"])  # Reported counts win over estimates
+        completion_tokens = usage.get("completion_tokens", estimate["completion_tokens"])
+        cache_counts = {k: usage[k] for k in ("cached_tokens", "cache_creation_tokens") if k in usage}
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens, **cache_counts, "estimated": True}
+
+    def get_retry_stats(self) -> Dict[str, Any]:
+        """Retry and circuit-breaker counters for monitoring."""
+        breaker = self.circuit_breaker
+        return {**self.retry_stats, "circuit_state": breaker.state, "circuit_opened": breaker.times_opened,
+                "consecutive_failures": breaker.consecutive_failures}
+
     @property
     def is_initialized(self) -> bool:
         """Check if the provider has been initialized."""
@@ -1,167 +1,410 @@
 """
 Anthropic Claude AI Provider Implementation.
 
-This module implements the BaseAIProvider interface for Anthropic's Claude AI models.
-Currently a placeholder implementation that will be completed when Claude API integration is added.
+This module implements the BaseAIProvider interface for Anthropic's Claude models
+by calling the Messages API directly over the shared httpx transport. Streaming
+uses the API's native server-sent events, the system instruction is sent as the
+top-level `system` field, and token usage comes from the `message_start` and
+`message_delta` events. Long stable prompt prefixes get `cache_control`
+breakpoints (see providers/prompt_cache.py). Point `api_base_url` at a local
+server to test it offline.
 """
 
-import os
 import asyncio
-from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Tuple
-from pathlib import Path
+import json
+import logging
+from typing import Dict, List, Any, Optional, Union, AsyncGenerator, AsyncIterator, Tuple
 
-from .base_provider import BaseAIProvider, ProviderConfig, ProviderError
+from .base_provider import BaseAIProvider, ProviderConfig, ProviderError, _parse_retry_after, RETRYABLE_STATUS_CODES
+
+try:
+    import httpx
+except ImportError:
+    logging.error(
+        "Failed to import 'httpx'. "
+        "The Claude provider calls the Anthropic Messages API over httpx. "
+        "Try: pip install httpx",
+        exc_info=True
+    )
+    raise
+
+logger = logging.getLogger(__name__)
 
 
 class ClaudeProvider(BaseAIProvider):
     """Anthropic Claude AI provider implementation."""
-    
-    # Default Claude models
+
+    DEFAULT_BASE_URL = "https://api.anthropic.com/v1"
+    API_VERSION = "2023-06-01"  # Sent as the anthropic-version header
+    DEFAULT_CONTEXT_WINDOW = 200000
+    DEFAULT_MAX_TOKENS = 1024  # The Messages API requires max_tokens on every request
+
+    # Default Claude models (used when the models endpoint cannot be listed)
     DEFAULT_MODELS = [
         "claude-3-opus-20240229",
         "claude-3-sonnet-20240229",
         "claude-3-haiku-20240307",
-        "claude-3.5-sonnet-20241022",
-        "claude-3.5-haiku-20241022"
+        "claude-3-5-sonnet-20241022",
+        "claude-3-5-haiku-20241022"
     ]
-    
+
+    # Attachment MIME types sent as document blocks; images use image blocks
+    DOCUMENT_MIME_TYPES = {"application/pdf"}
+    # Marks the end of a cacheable prompt prefix (the API caches everything up to it for 5 minutes)
+    CACHE_BREAKPOINT = {"type": "ephemeral"}
+
     def __init__(self, config: ProviderConfig):
         """Initialize the Claude provider.
-        
+
         Args:
             config: Provider configuration with API key and model
         """
         super().__init__(config)
-        print(f"DEBUG: Initializing ClaudeProvider with model: {config.model}")
-        
+
         # Set API base URL if not provided
         if not config.api_base_url:
-            config.api_base_url = "https://api.anthropic.com/v1"
-    
+            config.api_base_url = self.DEFAULT_BASE_URL
+        self._http: Optional["httpx.AsyncClient"] = None
+        self._owns_http = False  # True when no shared transport was attached
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "x-api-key": self.config.api_key,
+            "anthropic-version": self.API_VERSION,
+            "content-type": "application/json",
+        }
+
+    def _url(self, path: str) -> str:
+        return f"{self.config.api_base_url.rstrip('/')}/{path.lstrip('/')}"
+
     async def initialize(self) -> bool:
         """Initialize the Claude client with API key."""
-        print(f"DEBUG: Initializing Claude client with API key: {self.config.api_key[:8]}...")
-        
-        # TODO: Implement actual Claude client initialization
-        # For now, return True to indicate placeholder success
-        print("WARNING: Claude provider is a placeholder implementation")
-        self._is_initialized = True
-        return True
-    
+        try:
+            if not self.config.api_key:
+                logger.error("API key not found in provider configuration.")
+                self._is_initialized = False
+                return False
+
+            logger.info(f"Initializing Claude client with API key: {self.config.api_key[:8]}...")
+            self._http = self.http_client()
+            if self._http is None:  # No shared transport attached; use a private pooled client
+                self._http = httpx.AsyncClient(timeout=self.config.timeout)
+                self._owns_http = True
+
+            # Test the key by listing models
+            await self.list_models()
+
+            logger.info("Claude provider initialized successfully")
+            self._is_initialized = True
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to initialize Claude provider: {e}", exc_info=True)
+            self._is_initialized = False
+            return False
+
     async def list_models(self) -> List[Dict[str, Any]]:
         """Get list of available Claude models."""
-        print("DEBUG: Fetching available Claude models...")
-        
-        # TODO: Implement actual model listing from Claude API
-        # For now, return default models
-        models = []
-        for model_id in self.DEFAULT_MODELS:
-            model_info = {
-                'name': model_id,
-                'display_name': model_id.replace('-', ' ').title(),
-                'description': f'Claude model: {model_id}',
-                'input_token_limit': 200000,  # Claude 3 supports up to 200k tokens
-                'output_token_limit': 4096,
-                'supported_methods': ['chat']
-            }
-            models.append(model_info)
-            print(f"DEBUG: Added model: {model_info['name']}")
-        
-        print(f"DEBUG: Total Claude models available: {len(models)}")
-        return models
-    
+        if self._http is None:
+            return self._get_fallback_models()
+        try:
+            response = await self.call_with_retry(
+                lambda: self._request("GET", "models", params={"limit": 100}), context="Claude models error")
+            models = []
+            for model_obj in response.json().get("data", []):
+                model_id = model_obj.get("id", "")
+                models.append({
+                    'name': model_id,
+                    'display_name': model_obj.get("display_name") or model_id,
+                    'description': f'Claude model: {model_id}',
+                    'input_token_limit': self.DEFAULT_CONTEXT_WINDOW,
+                    'output_token_limit': None,
+                    'supported_methods': ['chat']
+                })
+            logger.info(f"Total Claude models available: {len(models)}")
+            return models or self._get_fallback_models()
+        except ProviderError as e:
+            if e.status_code in (401, 403):
+                raise  # A bad key should fail initialization
+            logger.warning(f"Could not list Claude models ({e}); using defaults")
+            return self._get_fallback_models()
+
+    def _get_fallback_models(self) -> List[Dict[str, Any]]:
+        return [{
+            'name': model_id,
+            'display_name': model_id.replace('-', ' ').title(),
+            'description': f'Claude model: {model_id} (fallback)',
+            'input_token_limit': self.DEFAULT_CONTEXT_WINDOW,
+            'output_token_limit': None,
+            'supported_methods': ['chat']
+        } for model_id in self.DEFAULT_MODELS]
+
+    async def _request(self, method: str, path: str, **kwargs) -> "httpx.Response":
+        """Sends a request and raises a classified ProviderError for non-2xx responses."""
+        response = await self._http.request(method, self._url(path), headers=self._headers(), **kwargs)
+        if response.status_code >= 400:
+            raise self._status_error(response, response.text)
+        return response
+
+    def _status_error(self, response: "httpx.Response", body: str) -> ProviderError:
+        message = body
+        try:
+            message = json.loads(body).get("error", {}).get("message", body)
+        except (ValueError, AttributeError):
+            pass
+        status = response.status_code
+        return ProviderError(f"Claude API error {status}: {message}", status_code=status,
+                             retry_after=_parse_retry_after(response.headers.get("retry-after")),
+                             retryable=status in RETRYABLE_STATUS_CODES)
+
+    def _build_request_body(self, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]],
+                            stream: bool, system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """Maps normalized messages and CannonAI params onto a Messages API request body."""
+        normalized = self.normalize_messages(messages)
+        system_parts = [system_instruction] if system_instruction else []
+        system_parts += [m["content"] for m in normalized if m["role"] == "system" and m["content"]]
+        chat_messages = [m for m in normalized if m["role"] != "system"]
+        # Breakpoints on the system block and the last turn before the new one cache the stable prefix
+        prefix_length = self.cacheable_prefix_length(chat_messages, "\n\n".join(system_parts))
+        if prefix_length:
+            chat_messages = chat_messages[:prefix_length - 1] + [self._with_cache_breakpoint(chat_messages[prefix_length - 1])] \
+                + chat_messages[prefix_length:]
+
+        merged_params = self.get_default_params()
+        if params:
+            merged_params.update(params)
+        body: Dict[str, Any] = {
+            "model": self.config.model,
+            "messages": chat_messages,
+            "max_tokens": int(merged_params.get("max_output_tokens") or merged_params.get("max_tokens") or self.DEFAULT_MAX_TOKENS),
+            "stream": stream,
+        }
+        if system_parts:
+            body["system"] = "\n\n".join(system_parts)
+            if prefix_length is not None:
+                body["system"] = [{"type": "text", "text": body["system"], "cache_control": self.CACHE_BREAKPOINT}]
+        for key in ("temperature", "top_p", "top_k"):
+            if merged_params.get(key) is not None:
+                body[key] = merged_params[key]
+        if merged_params.get("stop_sequences"):
+            body["stop_sequences"] = merged_params["stop_sequences"]
+        return body
+
     async def generate_response(
         self,
         messages: List[Dict[str, str]],
         params: Optional[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        system_instruction: Optional[str] = None
     ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
         """Generate a response from Claude.
-        
+
         Args:
             messages: List of message dictionaries with 'role' and 'content'
             params: Generation parameters
             stream: Whether to stream the response
-            
+            system_instruction: Sent as the top-level `system` field
+
         Returns:
             If stream=False: Tuple of (response_text, metadata)
             If stream=True: AsyncGenerator yielding response chunks
         """
-        print(f"DEBUG: Generating {'streaming' if stream else 'non-streaming'} response with {len(messages)} messages")
-        
-        # TODO: Implement actual Claude API calls
-        # For now, return a placeholder response
-        placeholder_response = (
-            "This is a placeholder response from the Claude provider. "
-            "The actual Claude API integration has not been implemented yet. "
-            "Please use the Gemini provider for now."
-        )
-        
+        if not self._is_initialized or self._http is None:
+            raise ProviderError("Claude provider not properly initialized")
+
+        body = self._build_request_body(messages, params, stream, system_instruction)
+        logger.debug(f"Claude request: model={body['model']}, max_tokens={body['max_tokens']}, stream={stream}, "
+                     f"messages={len(body['messages'])}")
         if stream:
-            async def placeholder_stream():
-                # Simulate streaming by yielding chunks
-                words = placeholder_response.split()
-                for i, word in enumerate(words):
-                    yield {
-                        'chunk': word + ' ',
-                        'accumulated': ' '.join(words[:i+1])
-                    }
-                    await asyncio.sleep(0.05)  # Simulate typing delay
-                
-                yield {
-                    'done': True,
-                    'full_response': placeholder_response,
-                    'token_usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
-                }
-            
-            return placeholder_stream()
-        else:
-            return placeholder_response, {'token_usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}}
-    
+            return self._stream_claude_response(body)
+        return await self._generate_claude_response_non_stream(body)
+
+    async def _generate_claude_response_non_stream(self, body: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """Generate non-streaming response from Claude."""
+        try:
+            response = await self.call_with_retry(
+                lambda: self._request("POST", "messages", json=body), context="Claude API error")
+            data = response.json()
+            response_text = "".join(block.get("text", "") for block in data.get("content", [])
+                                    if block.get("type") == "text")
+            token_usage = self._token_usage(data.get("usage", {}))
+            logger.debug(f"Claude response generated. Stop reason: {data.get('stop_reason')}. Tokens: {token_usage}")
+            return response_text, {'token_usage': token_usage, 'stop_reason': data.get('stop_reason')}
+        except ProviderError as e:
+            logger.error(f"{e} (status {e.status_code})")
+            raise
+        except Exception as e:
+            logger.error(f"Claude API error: {e}", exc_info=True)
+            raise ProviderError(f"Claude API error: {str(e)}")
+
+    async def _open_event_stream(self, body: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """POSTs a streaming request and yields the decoded server-sent events as they arrive."""
+        async with self._http.stream("POST", self._url("messages"), headers=self._headers(), json=body) as response:
+            if response.status_code >= 400:
+                raise self._status_error(response, (await response.aread()).decode("utf-8", "replace"))
+            event_name, data_lines = None, []
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event_name = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+                elif not line and data_lines:  # A blank line ends the event
+                    event = json.loads("\n".join(data_lines))
+                    event.setdefault("type", event_name)
+                    yield event
+                    event_name, data_lines = None, []
+
+    async def _stream_claude_response(self, body: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream response from Claude."""
+        try:
+            # Open the stream (the HTTP status and first event are retried)
+            async def open_stream() -> AsyncIterator[Dict[str, Any]]:
+                return self._open_event_stream(body)
+
+            events = self.stream_with_retry(open_stream, context="Claude streaming error")
+            full_response = ""
+            usage: Dict[str, Any] = {}
+            stop_reason = None
+
+            async for event in events:
+                event_type = event.get("type")
+                if event_type == "content_block_delta" and event.get("delta", {}).get("type") == "text_delta":
+                    chunk_text = event["delta"].get("text", "")
+                    if chunk_text:
+                        full_response += chunk_text
+                        yield {'chunk': chunk_text, 'accumulated': full_response}
+                elif event_type == "message_start":
+                    usage.update(event.get("message", {}).get("usage", {}))
+                elif event_type == "message_delta":
+                    usage.update(event.get("usage", {}))  # Cumulative output_tokens
+                    stop_reason = event.get("delta", {}).get("stop_reason", stop_reason)
+                elif event_type == "error":
+                    error = event.get("error", {})
+                    raise ProviderError(f"Claude streaming error: {error.get('message', error)}",
+                                        retryable=error.get("type") in ("overloaded_error", "api_error"))
+
+            yield {
+                'done': True,
+                'full_response': full_response,
+                'token_usage': self.complete_token_usage(self._token_usage(usage), body['messages'], full_response),
+                'stop_reason': stop_reason
+            }
+
+        except Exception as e:
+            logger.error(f"Claude streaming error: {e}", exc_info=True)
+            yield {
+                'error': str(e) if isinstance(e, ProviderError) else f"Claude streaming error: {str(e)}",
+                'retryable': isinstance(e, ProviderError) and e.retryable
+            }
+
+    @classmethod
+    def _with_cache_breakpoint(cls, message: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of `message` whose last content block carries a cache_control breakpoint."""
+        content = message["content"]
+        if not content:
+            return message
+        blocks = [{"type": "text", "text": content}] if isinstance(content, str) else [dict(b) for b in content]
+        blocks[-1]["cache_control"] = cls.CACHE_BREAKPOINT
+        return {**message, "content": blocks}
+
+    @staticmethod
+    def _token_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Maps Messages API usage onto CannonAI's prompt/completion/total (and prompt cache) counts.
+        Counts the API did not send are left out, so complete_token_usage() estimates them.
+        """
+        if not usage:
+            return {}
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        cache_creation_tokens = usage.get("cache_creation_input_tokens") or 0
+        token_usage = {'cached_tokens': cached_tokens, 'cache_creation_tokens': cache_creation_tokens}
+        if usage.get("input_tokens") is not None:
+            token_usage['prompt_tokens'] = usage["input_tokens"] + cache_creation_tokens + cached_tokens
+        if usage.get("output_tokens") is not None:
+            token_usage['completion_tokens'] = usage["output_tokens"]
+        if 'prompt_tokens' in token_usage and 'completion_tokens' in token_usage:
+            token_usage['total_tokens'] = token_usage['prompt_tokens'] + token_usage['completion_tokens']
+        return token_usage
+
     def validate_model(self, model_name: str) -> bool:
         """Check if a model name is valid for Claude."""
-        print(f"DEBUG: Validating model name: {model_name}")
-        
-        # Check if it's a Claude model
-        is_valid = model_name.startswith("claude")
-        print(f"DEBUG: Model '{model_name}' is {'valid' if is_valid else 'invalid'} for Claude")
-        
-        return is_valid
-    
+        return model_name.startswith("claude")
+
     def get_default_params(self) -> Dict[str, Any]:
         """Get default generation parameters for Claude."""
         return {
             'temperature': 0.7,
-            'max_tokens': 800,
-            'top_p': 0.95,
-            'top_k': 40,
+            'max_output_tokens': self.DEFAULT_MAX_TOKENS,
         }
-    
-    def normalize_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
-        """Normalize message format for Claude API."""
-        print(f"DEBUG: Normalizing {len(messages)} messages for Claude format")
-        
+
+    def _content_blocks(self, text: str, attachments: Optional[List[Dict[str, Any]]]) -> Union[str, List[Dict[str, Any]]]:
+        """Plain text, or a list of content blocks when the message has attachments."""
+        if not attachments:
+            return text
+        blocks: List[Dict[str, Any]] = []
+        for attachment in attachments:
+            mime_type = attachment.get("mime_type", "")
+            data = attachment.get("data")
+            if not data:
+                continue
+            source = {"type": "base64", "media_type": mime_type, "data": data}
+            if mime_type.startswith("image/"):
+                blocks.append({"type": "image", "source": source})
+            elif mime_type in self.DOCUMENT_MIME_TYPES:
+                blocks.append({"type": "document", "source": source})
+            else:
+                logger.warning(f"Skipping attachment with unsupported MIME type '{mime_type}' for Claude")
+        if text:
+            blocks.append({"type": "text", "text": text})
+        return blocks or text
+
+    def normalize_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Normalize message format for Claude API.
+
+        System instructions (role 'system', 'is_system_instruction' or a leading
+        'system_instruction_override') become role 'system' entries, which
+        generate_response moves into the request's top-level `system` field.
+        """
         normalized = []
-        
-        # Claude supports system messages, so we can handle them properly
+        after_system_instruction = False
         for msg in messages:
             role = msg.get('role', 'user')
             content = msg.get('content', '')
-            
+
+            if msg.get('system_instruction_override'):
+                normalized.append({'role': 'system', 'content': msg['system_instruction_override']})
+                if not content:
+                    continue
+            if role == 'system' or msg.get('is_system_instruction'):
+                normalized.append({'role': 'system', 'content': content})
+                after_system_instruction = True
+                continue
+            if after_system_instruction and role in ('ai', 'assistant', 'model'):
+                after_system_instruction = False
+                continue  # Synthetic acknowledgement of a system prompt sent as a user turn
+            after_system_instruction = False
+
             # Map roles to Claude format
             if role in ['human', 'user']:
                 role = 'user'
             elif role in ['ai', 'assistant', 'model']:
                 role = 'assistant'
-            elif role == 'system':
-                role = 'system'  # Claude supports system messages
             else:
-                print(f"WARNING: Unknown role '{role}', defaulting to 'user'")
+                logger.warning(f"Unknown role '{role}', defaulting to 'user'")
                 role = 'user'
-            
+
             normalized.append({
                 'role': role,
-                'content': content
+                'content': self._content_blocks(content, msg.get('attachments'))
             })
-        
+
         return normalized
+
+    def cleanup(self) -> None:
+        """Drops the private HTTP client (shared transport clients are closed by ProviderManager)."""
+        if self._owns_http and self._http is not None and not self._http.is_closed:
+            try:
+                asyncio.get_running_loop().create_task(self._http.aclose())
+            except RuntimeError:
+                pass
+        self._http = None
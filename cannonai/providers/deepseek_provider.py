@@ -15,7 +15,7 @@ from pathlib import Path
 from .base_provider import BaseAIProvider, ProviderConfig, ProviderError
 
 try:
-    from openai import OpenAI, AsyncOpenAI
+    from openai import AsyncOpenAI
 except ImportError:
     logging.error(
         "Failed to import 'openai'. "
@@ -51,6 +51,7 @@ class DeepSeekProvider(BaseAIProvider):
             "max_output_tokens": 65536  # 64K max
         }
     }
+    DEFAULT_CONTEXT_WINDOW = 64000
     
     def __init__(self, config: ProviderConfig):
         """Initialize the DeepSeek provider.
@@ -61,8 +62,7 @@ class DeepSeekProvider(BaseAIProvider):
         super().__init__(config)
         logger.info(f"Initializing DeepSeekProvider with model: {config.model}")
         
-        # Store SDK clients
-        self._sync_client: Optional[OpenAI] = None
+        # Store SDK client (async only; its HTTP pool comes from the shared transport)
         self._async_client: Optional[AsyncOpenAI] = None
         
         # Set API base URL if not provided
@@ -80,15 +80,13 @@ class DeepSeekProvider(BaseAIProvider):
                 
             logger.info(f"Initializing DeepSeek client with API key: {self.config.api_key[:8]}...")
             
-            # Initialize both sync and async clients using OpenAI SDK
-            self._sync_client = OpenAI(
-                api_key=self.config.api_key,
-                base_url=self.config.api_base_url
-            )
-            
+            # DeepSeek is OpenAI-compatible, so the OpenAI SDK is used with DeepSeek's base URL
             self._async_client = AsyncOpenAI(
                 api_key=self.config.api_key,
-                base_url=self.config.api_base_url
+                base_url=self.config.api_base_url,
+                timeout=self.config.timeout,
+                max_retries=0,  # Retries are handled by call_with_retry (see base_provider)
+                http_client=self.http_client()
             )
             
             # Test the connection by listing models
@@ -188,7 +186,8 @@ class DeepSeekProvider(BaseAIProvider):
         self,
         messages: List[Dict[str, str]],
         params: Optional[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        system_instruction: Optional[str] = None
     ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
         """Generate a response from DeepSeek.
         
@@ -196,6 +195,7 @@ class DeepSeekProvider(BaseAIProvider):
             messages: List of message dictionaries with 'role' and 'content'
             params: Generation parameters
             stream: Whether to stream the response
+            system_instruction: Sent as the leading 'system' role message
             
         Returns:
             If stream=False: Tuple of (response_text, metadata)
@@ -209,10 +209,10 @@ class DeepSeekProvider(BaseAIProvider):
         # Normalize messages for DeepSeek format
         normalized_messages = self.normalize_messages(messages)
         
-        # Extract system instruction if present
-        system_instruction = None
-        if messages and messages[0].get('system_instruction_override'):
+        # System instruction: passed out-of-band, or as an override key on the first message
+        if not system_instruction and messages and messages[0].get('system_instruction_override'):
             system_instruction = messages[0]['system_instruction_override']
+        if system_instruction:
             logger.debug(f"Using system instruction: {system_instruction[:50]}...")
             
         # Build final message list
@@ -254,6 +254,10 @@ class DeepSeekProvider(BaseAIProvider):
             'stream': stream
         }
         
+        # Ask for token usage in the final stream chunk
+        if stream:
+            deepseek_params['stream_options'] = {'include_usage': True}
+
         # Add response format if specified
         if 'response_format' in merged_params:
             deepseek_params['response_format'] = merged_params['response_format']
@@ -287,24 +291,22 @@ class DeepSeekProvider(BaseAIProvider):
     ) -> Tuple[str, Dict[str, Any]]:
         """Generate non-streaming response from DeepSeek."""
         try:
-            response = await self._async_client.chat.completions.create(**params)
+            response = await self.call_with_retry(
+                lambda: self._async_client.chat.completions.create(**params), context="DeepSeek API error")
             
             # Extract response text
             response_text = response.choices[0].message.content or ""
             
             # Extract token usage
-            token_usage = {}
-            if response.usage:
-                token_usage = {
-                    'prompt_tokens': response.usage.prompt_tokens,
-                    'completion_tokens': response.usage.completion_tokens,
-                    'total_tokens': response.usage.total_tokens
-                }
+            token_usage = self._usage_to_dict(response.usage) if response.usage else {}
                 
             logger.debug(f"DeepSeek response generated. Tokens: {token_usage}")
             
             return response_text, {'token_usage': token_usage}
             
+        except ProviderError as e:
+            logger.error(f"{e} (status {e.status_code})")
+            raise
         except Exception as e:
             logger.error(f"DeepSeek API error: {e}", exc_info=True)
             raise ProviderError(f"DeepSeek API error: {str(e)}")
@@ -315,12 +317,16 @@ class DeepSeekProvider(BaseAIProvider):
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream response from DeepSeek."""
         try:
-            # Create the stream
-            stream = await self._async_client.chat.completions.create(**params)
+            # Create the stream (opening it and reading the first chunk are retried)
+            stream = self.stream_with_retry(
+                lambda: self._async_client.chat.completions.create(**params), context="DeepSeek streaming error")
             
             full_response = ""
+            usage = None
             
             async for chunk in stream:
+                if getattr(chunk, 'usage', None):  # Sent in a final chunk with no choices (stream_options.include_usage)
+                    usage = self._usage_to_dict(chunk.usage)
                 if chunk.choices and chunk.choices[0].delta.content:
                     chunk_text = chunk.choices[0].delta.content
                     full_response += chunk_text
@@ -330,23 +336,35 @@ class DeepSeekProvider(BaseAIProvider):
                         'accumulated': full_response
                     }
             
-            # Final yield with token usage (note: streaming doesn't provide token counts in real-time)
+            # Final yield with the usage reported in the last chunk (estimated locally if the backend sent none)
             yield {
                 'done': True,
                 'full_response': full_response,
-                'token_usage': {
-                    'prompt_tokens': 0,  # Not available in streaming
-                    'completion_tokens': 0,  # Not available in streaming
-                    'total_tokens': 0  # Not available in streaming
-                }
+                'token_usage': self.complete_token_usage(usage, params['messages'], full_response)
             }
             
         except Exception as e:
             logger.error(f"DeepSeek streaming error: {e}", exc_info=True)
             yield {
-                'error': f"DeepSeek streaming error: {str(e)}"
+                'error': str(e) if isinstance(e, ProviderError) else f"DeepSeek streaming error: {str(e)}",
+                'retryable': isinstance(e, ProviderError) and e.retryable
             }
     
+    @staticmethod
+    def _usage_to_dict(usage: Any) -> Dict[str, Any]:
+        """Token counts from a completion's usage object, including prompt tokens served from the context cache.
+
+        DeepSeek caches request prefixes on disk automatically and reports the hits as
+        prompt_cache_hit_tokens; keeping the system message and history in stored order
+        makes each turn's prompt extend the previous one's cached prefix.
+        """
+        return {
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'total_tokens': usage.total_tokens,
+            'cached_tokens': getattr(usage, 'prompt_cache_hit_tokens', None) or 0
+        }
+
     def validate_model(self, model_name: str) -> bool:
         """Check if a model name is valid for DeepSeek."""
         logger.debug(f"Validating model name: {model_name}")
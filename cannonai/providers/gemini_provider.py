@@ -3,14 +3,20 @@
 Google Gemini AI Provider Implementation (New SDK Pattern).
 
 This module implements the BaseAIProvider interface for Google's Gemini AI models,
-using the new `google-genai` SDK pattern with `genai.Client()`.
+using the new `google-genai` SDK pattern with `genai.Client()`. Long stable prompt
+prefixes are moved into cached contents (see providers/prompt_cache.py).
 """
 
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Tuple
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Tuple, Set
 
 from .base_provider import BaseAIProvider, ProviderConfig, ProviderError
+from .token_estimator import get_estimator
 
 try:
     from google import genai  # For genai.Client()
@@ -40,12 +46,24 @@ class GeminiProvider(BaseAIProvider):
         "gemini-pro"
     ]
 
+    DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+    DEFAULT_CONTEXT_WINDOW = 1048576  # Current Gemini models accept 1M input tokens
+    CACHE_EXPIRY_MARGIN = 30  # Seconds; cached contents this close to expiring are no longer used
+    CACHE_CREATE_BACKOFF = 600  # Seconds without creating cached contents after the API refused one
+
     def __init__(self, config: ProviderConfig):
         super().__init__(config)
+        if not config.api_base_url:  # Key for the shared transport pool
+            config.api_base_url = self.DEFAULT_BASE_URL
         # _sdk_client will store the genai.Client() instance
         self._sdk_client: Optional[genai.Client] = None
         # _async_sdk_interface will store client.aio
         self._async_sdk_interface: Optional[Any] = None
+        # Cached contents holding conversation prefixes: prefix digest -> {"name", "length", "expires_at"}
+        self._cached_contents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending_cache_digests: Set[str] = set()
+        self._cache_tasks: Set[asyncio.Task] = set()
+        self._cache_backoff_until = 0.0
 
         # Model name normalization is less critical if client.models takes short names,
         # but good to keep for consistency if full paths are ever needed.
@@ -67,8 +85,14 @@ class GeminiProvider(BaseAIProvider):
                 self._is_initialized = False
                 return False
 
-            # Initialize the client using the new SDK pattern
-            self._sdk_client = genai.Client(api_key=self.config.api_key)
+            # Initialize the client using the new SDK pattern. SDK versions whose HttpOptions
+            # accept an httpx client get the shared pooled one; older ones keep their own.
+            http_options = {"timeout": int(self.config.timeout * 1000)}  # Milliseconds
+            shared_client = self.http_client()
+            if shared_client is not None and "httpx_async_client" in getattr(genai_types.HttpOptions, "model_fields", {}):
+                http_options["httpx_async_client"] = shared_client
+            self._sdk_client = genai.Client(api_key=self.config.api_key,
+                                            http_options=genai_types.HttpOptions(**http_options))
             if hasattr(self._sdk_client, 'aio'):
                 self._async_sdk_interface = self._sdk_client.aio
                 logger.info("Initialized Gemini provider using new SDK: genai.Client() and client.aio.")
@@ -129,6 +153,9 @@ class GeminiProvider(BaseAIProvider):
                                        'input_token_limit': getattr(model_obj, 'input_token_limit', None),
                                        'output_token_limit': getattr(model_obj, 'output_token_limit', None),
                                        'supported_methods': list(supported_methods or supported_actions)})  # Combine or prioritize
+                    input_limit = getattr(model_obj, 'input_token_limit', None)
+                    if input_limit:  # Remembered for context budgeting, under both the full and short name
+                        self.context_windows[model_obj.name] = self.context_windows[model_obj.name.split('/')[-1]] = input_limit
             logger.info(f"Models processed from API: {models_seen_count}. Matching criteria: {len(api_models)}.")
             if not api_models:
                 logger.warning("No models matching criteria found via API. Using fallback.")
@@ -155,7 +182,8 @@ class GeminiProvider(BaseAIProvider):
         return name_to_use  # Return as is, assuming SDK handles it.
 
     async def generate_response(
-            self, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None, stream: bool = False
+            self, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None, stream: bool = False,
+            system_instruction: Optional[str] = None
     ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
         if not self._is_initialized or not self._async_sdk_interface or not hasattr(self._async_sdk_interface, 'models'):
             raise ProviderError("GeminiProvider not properly initialized or async interface not available.")
@@ -175,10 +203,20 @@ class GeminiProvider(BaseAIProvider):
 
         # Build the config object for the SDK
         # System instruction is now part of GenerateContentConfig as per new SDK docs
-        system_instruction_text = messages[0].get("system_instruction_override") if messages and messages[0].get("system_instruction_override") else None
+        system_instruction_text = system_instruction or (messages[0].get("system_instruction_override") if messages else None)
 
         gen_config_obj = self._build_generation_config_object(params, system_instruction_text)
 
+        # Send the stable prefix by reference to a cached content when one is live. The cached
+        # content holds the system instruction and tool config, so the request must not repeat them.
+        if not gen_config_obj.tools:
+            cached_name, cached_length = self._use_cached_prefix(model_name_str, normalized_contents, gen_config_obj,
+                                                                 system_instruction_text)
+            if cached_name:
+                gen_config_obj = gen_config_obj.model_copy(
+                    update={"cached_content": cached_name, "system_instruction": None, "tool_config": None})
+                normalized_contents = normalized_contents[cached_length:]
+
         logger.debug(f"Gemini Request: Model='{model_name_str}', Stream={stream}, Config={gen_config_obj}, Msgs Count={len(normalized_contents)}")
 
         # Ensure the methods exist on the SDK interface
@@ -188,7 +226,7 @@ class GeminiProvider(BaseAIProvider):
             raise ProviderError("SDK async interface does not support 'generate_content'.")
 
         if stream:
-            return self._stream_gemini_response(model_name_str, normalized_contents, gen_config_obj)
+            return self._stream_gemini_response(model_name_str, normalized_contents, gen_config_obj, messages)
         else:
             return await self._generate_gemini_response_non_stream(model_name_str, normalized_contents, gen_config_obj)
 
@@ -196,41 +234,49 @@ class GeminiProvider(BaseAIProvider):
             self, model_id: str, contents: List[genai_types.Content], gen_config: genai_types.GenerateContentConfig
     ) -> Tuple[str, Dict[str, Any]]:
         try:
-            # Call using client.aio.models.generate_content
-            api_response = await self._async_sdk_interface.models.generate_content(  # type: ignore
-                model=model_id,  # Pass model ID string
-                contents=contents,
-                config=gen_config  # Pass the config object
-            )
+            # Call using client.aio.models.generate_content, under the retry policy
+            api_response = await self.call_with_retry(
+                lambda: self._async_sdk_interface.models.generate_content(  # type: ignore
+                    model=model_id,  # Pass model ID string
+                    contents=contents,
+                    config=gen_config  # Pass the config object
+                ), context="Gemini non-streaming error")
             response_text = api_response.text or ""
             token_usage = self.extract_token_usage(api_response)
             return response_text, {'token_usage': token_usage}
+        except ProviderError as e:
+            logger.error(f"{e} (status {e.status_code})")
+            raise
         except Exception as e:
             logger.error(f"Gemini non-streaming error: {e}", exc_info=True)
             raise ProviderError(f"Gemini non-streaming error: {getattr(e, 'message', str(e))}")
 
     async def _stream_gemini_response(
-            self, model_id: str, contents: List[genai_types.Content], gen_config: genai_types.GenerateContentConfig
+            self, model_id: str, contents: List[genai_types.Content], gen_config: genai_types.GenerateContentConfig,
+            messages: Optional[List[Dict[str, Any]]] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         try:
-            # Call using client.aio.models.generate_content_stream
-            stream_iterator = await self._async_sdk_interface.models.generate_content_stream(  # type: ignore
-                model=model_id,  # Pass model ID string
-                contents=contents,
-                config=gen_config  # Pass the config object
-            )
+            # Call using client.aio.models.generate_content_stream (opening it and reading the first chunk are retried)
+            stream_iterator = self.stream_with_retry(
+                lambda: self._async_sdk_interface.models.generate_content_stream(  # type: ignore
+                    model=model_id,  # Pass model ID string
+                    contents=contents,
+                    config=gen_config  # Pass the config object
+                ), context="Gemini streaming error")
             full_response_text = ""
             final_token_usage = {}
             async for chunk in stream_iterator:  # chunk is types.GenerateContentResponse
                 chunk_text = chunk.text if hasattr(chunk, 'text') else ""
                 full_response_text += chunk_text
                 current_chunk_token_usage = self.extract_token_usage(chunk)
-                if current_chunk_token_usage: final_token_usage.update(current_chunk_token_usage)
+                if current_chunk_token_usage: final_token_usage.update(current_chunk_token_usage)  # The last chunk carries the totals
                 yield {"chunk": chunk_text}
-            yield {"done": True, "full_response": full_response_text, "token_usage": final_token_usage}
+            token_usage = self.complete_token_usage(final_token_usage, messages or [], full_response_text)
+            yield {"done": True, "full_response": full_response_text, "token_usage": token_usage}
         except Exception as e:
             logger.error(f"Gemini streaming error: {e}", exc_info=True)
-            yield {"error": f"Gemini streaming error: {getattr(e, 'message', str(e))}"}
+            yield {"error": str(e) if isinstance(e, ProviderError) else f"Gemini streaming error: {getattr(e, 'message', str(e))}",
+                   "retryable": isinstance(e, ProviderError) and e.retryable}
 
     def _convert_messages_to_gemini_format(self, messages: List[Dict[str, Any]]) -> List[genai_types.Content]:
         """
@@ -364,6 +410,121 @@ class GeminiProvider(BaseAIProvider):
             logger.error(f"Error creating final GenerateContentConfig with kwargs {config_kwargs}: {e_final_cfg}", exc_info=True)
             raise ProviderError(f"Final GenerateContentConfig creation failed: {e_final_cfg}")
 
+    # ---------- Prompt-prefix caching ----------
+
+    @staticmethod
+    def _contents_as_messages(contents: List[genai_types.Content]) -> List[Dict[str, Any]]:
+        """Role/text/attachment-size view of Gemini contents, for prefix detection and token estimates."""
+        return [{
+            "role": content.role,
+            "content": "".join(part.text or "" for part in content.parts or []),
+            "attachments": [{"mime_type": part.inline_data.mime_type or "", "size": len(part.inline_data.data or b"")}
+                            for part in content.parts or [] if part.inline_data]
+        } for content in contents]
+
+    @staticmethod
+    def _prefix_digests(model: str, gen_config: genai_types.GenerateContentConfig,
+                        contents: List[genai_types.Content]) -> List[str]:
+        """digests[n] fingerprints a cached content for `contents[:n]` under this model, system instruction and tool config."""
+        def dump(value: Any) -> Any:
+            return value.model_dump(mode="json", exclude_none=True) if value is not None else None
+
+        running = hashlib.sha256(json.dumps([model, dump(gen_config.system_instruction), dump(gen_config.tool_config)],
+                                            sort_keys=True).encode("utf-8"))
+        digests = [running.hexdigest()]
+        for content in contents:
+            running.update(json.dumps(dump(content), sort_keys=True).encode("utf-8"))
+            digests.append(running.hexdigest())
+        return digests
+
+    def _use_cached_prefix(self, model: str, contents: List[genai_types.Content],
+                           gen_config: genai_types.GenerateContentConfig,
+                           system_instruction_text: Optional[str] = None) -> Tuple[Optional[str], int]:
+        """
+        Name and length of the longest live cached content covering the start of `contents`,
+        or (None, 0). Schedules a TTL refresh for the one used and, when the stable prefix has
+        grown by at least min_prefix_tokens past it, the creation of a longer one for later turns.
+        """
+        messages = self._contents_as_messages(contents)
+        prefix_length = self.cacheable_prefix_length(messages, system_instruction_text)
+        if not prefix_length or not hasattr(self._async_sdk_interface, "caches"):
+            return None, 0
+        digests = self._prefix_digests(model, gen_config, contents[:prefix_length])
+        now = time.time()
+        ttl = int(self.prompt_cache_settings["ttl_seconds"])
+        entry = None
+        for length in range(prefix_length, 0, -1):
+            candidate = self._cached_contents.get(digests[length])
+            if candidate is None:
+                continue
+            if candidate["expires_at"] - now < self.CACHE_EXPIRY_MARGIN:
+                del self._cached_contents[digests[length]]
+                continue
+            entry = candidate
+            self._cached_contents.move_to_end(digests[length])
+            break
+
+        cached_length = entry["length"] if entry else 0
+        uncached_prefix = self._contents_as_messages(contents[cached_length:prefix_length])
+        if sum(get_estimator().count_message(m) for m in uncached_prefix) >= int(self.prompt_cache_settings["min_prefix_tokens"]) \
+                and digests[prefix_length] not in self._pending_cache_digests and now >= self._cache_backoff_until:
+            self._pending_cache_digests.add(digests[prefix_length])
+            self._run_cache_task(self._create_cached_content(model, contents[:prefix_length], gen_config,
+                                                             digests[prefix_length]))
+        if entry is None:
+            return None, 0
+        if entry["expires_at"] - now < ttl / 2 and not entry.get("refreshing"):
+            entry["refreshing"] = True
+            self._run_cache_task(self._refresh_cached_content(entry, ttl))
+        return entry["name"], entry["length"]
+
+    def _run_cache_task(self, coroutine) -> None:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._cache_tasks.add(task)
+        task.add_done_callback(self._cache_tasks.discard)
+
+    async def _create_cached_content(self, model: str, contents: List[genai_types.Content],
+                                     gen_config: genai_types.GenerateContentConfig, digest: str) -> None:
+        ttl = int(self.prompt_cache_settings["ttl_seconds"])
+        try:
+            cached = await self._async_sdk_interface.caches.create(model=model, config=genai_types.CreateCachedContentConfig(
+                contents=contents, system_instruction=gen_config.system_instruction,
+                tool_config=gen_config.tool_config, ttl=f"{ttl}s", display_name="cannonai-prefix"))
+        except Exception as e:
+            # Usually a model without explicit caching or a prefix under its minimum size
+            self._cache_backoff_until = time.time() + self.CACHE_CREATE_BACKOFF
+            logger.info(f"Gemini cached content not created ({e}); retrying in {self.CACHE_CREATE_BACKOFF}s")
+            return
+        finally:
+            self._pending_cache_digests.discard(digest)
+        self._cached_contents[digest] = {"name": cached.name, "length": len(contents), "expires_at": time.time() + ttl}
+        logger.debug(f"Created Gemini cached content {cached.name} for a {len(contents)}-message prefix")
+        while len(self._cached_contents) > max(1, int(self.prompt_cache_settings["max_cached_contents"])):
+            _, evicted = self._cached_contents.popitem(last=False)
+            self._run_cache_task(self._delete_cached_content(evicted["name"]))
+
+    async def _refresh_cached_content(self, entry: Dict[str, Any], ttl: int) -> None:
+        try:
+            await self._async_sdk_interface.caches.update(
+                name=entry["name"], config=genai_types.UpdateCachedContentConfig(ttl=f"{ttl}s"))
+            entry["expires_at"] = time.time() + ttl
+        except Exception as e:
+            logger.info(f"Could not extend Gemini cached content {entry['name']}: {e}")
+        finally:
+            entry["refreshing"] = False
+
+    async def _delete_cached_content(self, name: str) -> None:
+        try:
+            await self._async_sdk_interface.caches.delete(name=name)
+        except Exception as e:
+            logger.debug(f"Could not delete Gemini cached content {name} (it expires on its own): {e}")
+
+    def cleanup(self) -> None:
+        """Cancels pending cached-content requests; the cached contents themselves expire with their TTL."""
+        for task in list(self._cache_tasks):
+            task.cancel()
+        self._cached_contents.clear()
+
     def validate_model(self, model_name: str) -> bool:
         # The new SDK is flexible with model names (e.g., 'gemini-2.0-flash', 'models/gemini-2.0-flash')
         return bool(model_name)  # Basic check, actual validation happens at API call
@@ -387,9 +548,12 @@ class GeminiProvider(BaseAIProvider):
         if hasattr(resp_chunk, 'usage_metadata') and resp_chunk.usage_metadata:
             meta = resp_chunk.usage_metadata
             # Attributes are directly on usage_metadata object
-            if hasattr(meta, 'prompt_token_count'): usage['prompt_tokens'] = meta.prompt_token_count
-            if hasattr(meta, 'candidates_token_count'): usage['completion_tokens'] = meta.candidates_token_count
-            if hasattr(meta, 'total_token_count'): usage['total_tokens'] = meta.total_token_count
+            # Fields may be present but None on intermediate stream chunks; keep only reported counts
+            if getattr(meta, 'prompt_token_count', None) is not None: usage['prompt_tokens'] = meta.prompt_token_count
+            if getattr(meta, 'candidates_token_count', None) is not None: usage['completion_tokens'] = meta.candidates_token_count
+            if getattr(meta, 'total_token_count', None) is not None: usage['total_tokens'] = meta.total_token_count
+            # Prompt tokens served from a cached content (explicit or the API's implicit prefix cache)
+            if getattr(meta, 'cached_content_token_count', None) is not None: usage['cached_tokens'] = meta.cached_content_token_count
             # Infer if some counts are missing
             if 'completion_tokens' not in usage and 'prompt_tokens' in usage and 'total_tokens' in usage:
                 usage['completion_tokens'] = usage['total_tokens'] - usage['prompt_tokens']
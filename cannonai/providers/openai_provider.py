@@ -13,9 +13,10 @@ from typing import Dict, List, Any, Optional, Union, AsyncGenerator, Tuple
 from pathlib import Path
 
 from .base_provider import BaseAIProvider, ProviderConfig, ProviderError
+from .response_cache import cache_key
 
 try:
-    from openai import OpenAI, AsyncOpenAI
+    from openai import AsyncOpenAI
 except ImportError:
     logging.error(
         "Failed to import 'openai'. "
@@ -52,6 +53,7 @@ class OpenAIProvider(BaseAIProvider):
         "o3-pro": {"context_window": 200000, "max_output_tokens": 100000},
         "gpt-4.1-mini": {"context_window": 1047576, "max_output_tokens": 32768}
     }
+    DEFAULT_CONTEXT_WINDOW = 128000  # Smallest window among current chat models
     
     def __init__(self, config: ProviderConfig):
         """Initialize the OpenAI provider.
@@ -62,8 +64,7 @@ class OpenAIProvider(BaseAIProvider):
         super().__init__(config)
         logger.info(f"Initializing OpenAIProvider with model: {config.model}")
         
-        # Store SDK clients
-        self._sync_client: Optional[OpenAI] = None
+        # Store SDK client (async only; its HTTP pool comes from the shared transport)
         self._async_client: Optional[AsyncOpenAI] = None
         
         # Set API base URL if not provided
@@ -80,15 +81,12 @@ class OpenAIProvider(BaseAIProvider):
                 
             logger.info(f"Initializing OpenAI client with API key: {self.config.api_key[:8]}...")
             
-            # Initialize both sync and async clients
-            self._sync_client = OpenAI(
-                api_key=self.config.api_key,
-                base_url=self.config.api_base_url if self.config.api_base_url != "https://api.openai.com/v1" else None
-            )
-            
             self._async_client = AsyncOpenAI(
                 api_key=self.config.api_key,
-                base_url=self.config.api_base_url if self.config.api_base_url != "https://api.openai.com/v1" else None
+                base_url=self.config.api_base_url if self.config.api_base_url != "https://api.openai.com/v1" else None,
+                timeout=self.config.timeout,
+                max_retries=0,  # Retries are handled by call_with_retry (see base_provider)
+                http_client=self.http_client()
             )
             
             # Test the connection by listing models
@@ -182,7 +180,8 @@ class OpenAIProvider(BaseAIProvider):
         self,
         messages: List[Dict[str, str]],
         params: Optional[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        system_instruction: Optional[str] = None
     ) -> Union[Tuple[str, Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]:
         """Generate a response from OpenAI.
         
@@ -190,6 +189,7 @@ class OpenAIProvider(BaseAIProvider):
             messages: List of message dictionaries with 'role' and 'content'
             params: Generation parameters
             stream: Whether to stream the response
+            system_instruction: Sent as the leading 'system' role message
             
         Returns:
             If stream=False: Tuple of (response_text, metadata)
@@ -203,10 +203,10 @@ class OpenAIProvider(BaseAIProvider):
         # Normalize messages for OpenAI format
         normalized_messages = self.normalize_messages(messages)
         
-        # Extract system instruction if present
-        system_instruction = None
-        if messages and messages[0].get('system_instruction_override'):
+        # System instruction: passed out-of-band, or as an override key on the first message
+        if not system_instruction and messages and messages[0].get('system_instruction_override'):
             system_instruction = messages[0]['system_instruction_override']
+        if system_instruction:
             logger.debug(f"Using system instruction: {system_instruction[:50]}...")
             
         # Build final message list
@@ -239,6 +239,18 @@ class OpenAIProvider(BaseAIProvider):
             'stream': stream
         }
         
+        # Ask for token usage in the final stream chunk
+        if stream:
+            openai_params['stream_options'] = {'include_usage': True}
+
+        # Prefixes over 1024 tokens are cached automatically. The system message and history
+        # come first in stored order, so each request extends the previous one's prefix; a
+        # per-conversation prompt_cache_key routes those requests to the same cache.
+        if self.config.api_base_url == "https://api.openai.com/v1" and self.cacheable_prefix_length(final_messages) is not None:
+            conversation_key = cache_key(self.provider_name, self.config.model, final_messages[:2], None)
+            if conversation_key:
+                openai_params['extra_body'] = {'prompt_cache_key': conversation_key[:32]}
+
         # Add stop sequences if provided
         if 'stop_sequences' in merged_params and merged_params['stop_sequences']:
             openai_params['stop'] = merged_params['stop_sequences']
@@ -271,24 +283,22 @@ class OpenAIProvider(BaseAIProvider):
     ) -> Tuple[str, Dict[str, Any]]:
         """Generate non-streaming response from OpenAI."""
         try:
-            response = await self._async_client.chat.completions.create(**params)
+            response = await self.call_with_retry(
+                lambda: self._async_client.chat.completions.create(**params), context="OpenAI API error")
             
             # Extract response text
             response_text = response.choices[0].message.content or ""
             
             # Extract token usage
-            token_usage = {}
-            if response.usage:
-                token_usage = {
-                    'prompt_tokens': response.usage.prompt_tokens,
-                    'completion_tokens': response.usage.completion_tokens,
-                    'total_tokens': response.usage.total_tokens
-                }
+            token_usage = self._usage_to_dict(response.usage) if response.usage else {}
                 
             logger.debug(f"OpenAI response generated. Tokens: {token_usage}")
             
             return response_text, {'token_usage': token_usage}
             
+        except ProviderError as e:
+            logger.error(f"{e} (status {e.status_code})")
+            raise
         except Exception as e:
             logger.error(f"OpenAI API error: {e}", exc_info=True)
             raise ProviderError(f"OpenAI API error: {str(e)}")
@@ -299,12 +309,16 @@ class OpenAIProvider(BaseAIProvider):
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream response from OpenAI."""
         try:
-            # Create the stream
-            stream = await self._async_client.chat.completions.create(**params)
+            # Create the stream (opening it and reading the first chunk are retried)
+            stream = self.stream_with_retry(
+                lambda: self._async_client.chat.completions.create(**params), context="OpenAI streaming error")
             
             full_response = ""
+            usage = None
             
             async for chunk in stream:
+                if getattr(chunk, 'usage', None):  # Sent in a final chunk with no choices (stream_options.include_usage)
+                    usage = self._usage_to_dict(chunk.usage)
                 if chunk.choices and chunk.choices[0].delta.content:
                     chunk_text = chunk.choices[0].delta.content
                     full_response += chunk_text
@@ -314,23 +328,31 @@ class OpenAIProvider(BaseAIProvider):
                         'accumulated': full_response
                     }
             
-            # Final yield with token usage (note: streaming doesn't provide token counts in real-time)
+            # Final yield with the usage reported in the last chunk (estimated locally if the backend sent none)
             yield {
                 'done': True,
                 'full_response': full_response,
-                'token_usage': {
-                    'prompt_tokens': 0,  # Not available in streaming
-                    'completion_tokens': 0,  # Not available in streaming
-                    'total_tokens': 0  # Not available in streaming
-                }
+                'token_usage': self.complete_token_usage(usage, params['messages'], full_response)
             }
             
         except Exception as e:
             logger.error(f"OpenAI streaming error: {e}", exc_info=True)
             yield {
-                'error': f"OpenAI streaming error: {str(e)}"
+                'error': str(e) if isinstance(e, ProviderError) else f"OpenAI streaming error: {str(e)}",
+                'retryable': isinstance(e, ProviderError) and e.retryable
             }
     
+    @staticmethod
+    def _usage_to_dict(usage: Any) -> Dict[str, Any]:
+        """Token counts from a completion's usage object, including prompt tokens served from the prefix cache."""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'total_tokens': usage.total_tokens,
+            'cached_tokens': getattr(details, 'cached_tokens', None) or 0
+        }
+
     def validate_model(self, model_name: str) -> bool:
         """Check if a model name is valid for OpenAI."""
         logger.debug(f"Validating model name: {model_name}")
@@ -0,0 +1,75 @@
+"""
+Prompt-prefix caching helpers for CannonAI providers.
+
+Every turn re-sends the system instruction and the unchanged earlier turns;
+only the newest user turn differs. Backends that can cache a prompt prefix skip
+the prefill of that part, which shortens the time to first token on long
+conversations. ``BaseAIProvider.cacheable_prefix_length`` decides how much of a
+request is the stable prefix and each provider marks it in its own way:
+
+    claude    cache_control breakpoints on the system block and the last prior turn
+    gemini    a cached content created through the SDK, reused by name, TTL refreshed
+    openai    automatic prefix caching; the request keeps a prefix-stable order
+    deepseek  automatic context caching on disk; same ordering rule as openai
+
+Cache-hit tokens are reported as "cached_tokens" in token_usage (and cache
+writes as "cache_creation_tokens" where the backend bills them separately).
+Settings come from the "prompt_cache" section of cannonai_config.json and
+prompt caching is off by default: Gemini cached contents are created and kept
+alive on the account (storage is billed per hour) and Claude bills cache writes
+above the normal input rate, so it is opt-in:
+
+    "prompt_cache": {"enabled": true, "min_prefix_tokens": 1024,
+                     "ttl_seconds": 300, "max_cached_contents": 8}
+"""
+
+from typing import Dict, List, Any, Optional
+
+DEFAULT_PROMPT_CACHE_SETTINGS: Dict[str, Any] = {
+    "enabled": False,  # Opt-in, like the response cache
+    "min_prefix_tokens": 1024,  # Shorter prefixes are not marked (backends will not cache them anyway)
+    "ttl_seconds": 300,  # Lifetime of Gemini cached contents, extended while a conversation keeps using one
+    "max_cached_contents": 8,  # Gemini cached contents kept per provider; the least recently used is deleted
+}
+
+
+def stable_prefix_length(messages: List[Dict[str, Any]]) -> int:
+    """Number of leading messages sent unchanged on the previous turn: everything before the last user message."""
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get("role") == "user":
+            return index
+    return 0
+
+
+class PromptCacheStats:
+    """Cache-hit counters and time-to-first-token averages for requests with and without a prefix hit."""
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_creation_tokens = 0
+        self._ttft_ms: Dict[bool, List[float]] = {True: [], False: []}  # hit -> [total, count]
+
+    def record(self, token_usage: Optional[Dict[str, Any]], ttft_ms: Optional[float] = None) -> None:
+        usage = token_usage or {}
+        hit = bool(usage.get("cached_tokens"))
+        self.requests += 1
+        self.hits += hit
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.cached_tokens += usage.get("cached_tokens") or 0
+        self.cache_creation_tokens += usage.get("cache_creation_tokens") or 0
+        if ttft_ms is not None:
+            totals = self._ttft_ms[hit] or [0.0, 0]
+            self._ttft_ms[hit] = [totals[0] + ttft_ms, totals[1] + 1]
+
+    def _average_ttft(self, hit: bool) -> Optional[float]:
+        totals = self._ttft_ms[hit]
+        return round(totals[0] / totals[1], 1) if totals else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "hits": self.hits, "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens, "cache_creation_tokens": self.cache_creation_tokens,
+                "cached_token_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+                "avg_ttft_ms_hit": self._average_ttft(True), "avg_ttft_ms_miss": self._average_ttft(False)}
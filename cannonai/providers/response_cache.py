@@ -0,0 +1,230 @@
+"""
+Exact-match response cache for CannonAI providers.
+
+``ResponseCache`` stores provider answers keyed by a stable hash of (provider,
+model, normalized messages, params), so a byte-identical request (regenerations,
+scripted prompts, shared team prompts) is answered without an API call. Entries
+live in an in-memory LRU tier backed by a SQLite file on disk with a TTL and a
+size cap; the least recently used rows are evicted when the cap is exceeded.
+
+The cache is owned by ``ProviderManager`` and attached to each provider it
+creates; ``BaseAIProvider.generate_cached`` consults it. Settings come from the
+"response_cache" section of cannonai_config.json (disabled by default).
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS: Dict[str, Any] = {
+    "enabled": False,
+    "memory_entries": 256,  # Size of the in-memory LRU tier
+    "disk": True,  # Keep a persistent tier next to the config file
+    "path": "",  # Disk tier location; empty means <config dir>/response_cache.sqlite3
+    "ttl_seconds": 7 * 24 * 3600,  # Entries older than this are ignored and pruned
+    "max_disk_mb": 100,  # Least recently used rows are evicted above this size
+}
+
+REPLAY_CHUNK_CHARS = 64  # Chunk size when replaying an answer that was not stored as a stream
+
+
+def _canonical(value: Any) -> Any:
+    """JSON-safe, order-stable form of a request; bytes are replaced by their digest."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes_sha256__": hashlib.sha256(value).hexdigest()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot build a stable cache key for {type(value).__name__}")
+
+
+def cache_key(provider_name: str, model: str, messages: List[Dict[str, Any]],
+              params: Optional[Dict[str, Any]]) -> Optional[str]:
+    """SHA-256 key of a request, or None if it holds values without a stable encoding."""
+    try:
+        payload = json.dumps(_canonical([provider_name, model, messages, params or {}]),
+                             sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except (TypeError, ValueError) as e:
+        logger.debug(f"Response not cacheable: {e}")
+        return None
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def replay_chunks(entry: Dict[str, Any]) -> List[str]:
+    """Chunks to replay for a cached entry: the original stream chunks when stored, else slices of the text."""
+    if entry.get("chunks"):
+        return entry["chunks"]
+    text = entry.get("text") or ""
+    return [text[i:i + REPLAY_CHUNK_CHARS] for i in range(0, len(text), REPLAY_CHUNK_CHARS)]
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache of provider responses."""
+
+    FILENAME = "response_cache.sqlite3"
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, default_dir: Optional[Path] = None):
+        self.settings = dict(DEFAULT_CACHE_SETTINGS)
+        self.settings.update(settings or {})
+        self.enabled = bool(self.settings["enabled"])
+        self.memory_entries = max(0, int(self.settings["memory_entries"]))
+        self.ttl_seconds = float(self.settings["ttl_seconds"])
+        self.max_disk_bytes = int(float(self.settings["max_disk_mb"]) * 1024 * 1024)
+        self.db_path: Optional[Path] = None
+        if self.settings["disk"]:
+            if self.settings["path"]:
+                self.db_path = Path(self.settings["path"]).expanduser()
+            elif default_dir is not None:
+                self.db_path = Path(default_dir) / self.FILENAME
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()  # Disk tier runs in asyncio.to_thread worker threads
+        self._conn: Optional[sqlite3.Connection] = None
+        self.stats: Dict[str, int] = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0,
+                                      "bypassed": 0, "evictions": 0}
+
+    # ---------- Public API ----------
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The cached entry ({"text", "metadata", "chunks"}) for a key, counting the hit or miss."""
+        entry = self._memory_get(key)
+        if entry is not None:
+            self.stats["hits_memory"] += 1
+            return entry
+        if self.db_path is not None:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self.stats["hits_disk"] += 1
+                self._memory_put(key, entry)
+                return entry
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, text: str, metadata: Dict[str, Any], chunks: Optional[List[str]] = None) -> None:
+        """Stores a successful response in both tiers."""
+        entry = {"text": text, "metadata": metadata or {}, "chunks": chunks or [], "stored_at": time.time()}
+        self._memory_put(key, entry)
+        self.stats["stores"] += 1
+        if self.db_path is not None:
+            try:
+                await asyncio.to_thread(self._disk_put, key, entry)
+            except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not write response cache entry: {e}")
+
+    def note_bypass(self) -> None:
+        self.stats["bypassed"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters plus tier sizes, for /cache and the GUI status."""
+        hits = self.stats["hits_memory"] + self.stats["hits_disk"]
+        lookups = hits + self.stats["misses"]
+        return {**self.stats, "enabled": self.enabled, "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_size": len(self._memory), "disk_path": str(self.db_path) if self.db_path else None}
+
+    def clear(self) -> None:
+        """Drops every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self.db_path is not None and self.db_path.exists():
+                self._connect().execute("DELETE FROM responses")
+                self._connect().commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- Memory tier ----------
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > self.ttl_seconds:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _memory_put(self, key: str, entry: Dict[str, Any]) -> None:
+        if self.memory_entries == 0:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # ---------- Disk tier ----------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT payload, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if time.time() - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                return json.loads(row[0])
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning(f"Response cache read failed ({e}); treating as a miss")
+                return None
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        payload = json.dumps(entry, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses (key, payload, size, stored_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (key, payload, len(payload.encode("utf-8")), entry["stored_at"], now))
+            self._prune(conn, now)
+            conn.commit()
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """Deletes expired rows, then least recently used rows until the tier fits in max_disk_mb."""
+        expired = conn.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl_seconds,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        evicted = 0
+        if total > self.max_disk_bytes:
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                if total <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        self.stats["evictions"] += max(expired, 0) + evicted
@@ -0,0 +1,85 @@
+"""
+Local token estimates for CannonAI.
+
+Used where the provider does not report a count: budgeting history against a
+model's context window (context_budget.py) and filling in token usage a stream
+ended without. Counts are exact for OpenAI-style tokenizers when the optional
+``tiktoken`` package is installed, and a characters-per-token estimate otherwise.
+"""
+
+from typing import Dict, List, Any, Optional
+
+try:
+    import tiktoken
+    tiktoken_available = True
+except ImportError:
+    tiktoken_available = False
+
+CHARS_PER_TOKEN = 4  # Conservative average for English text without a tokenizer
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and framing tokens per message
+IMAGE_TOKENS = 1000  # Flat estimate per image attachment (providers bill 258-1600)
+
+
+class TokenEstimator:
+    """Local prompt-token estimates; exact for OpenAI-style tokenizers when tiktoken is available."""
+
+    def __init__(self):
+        self._encoding = None
+        if tiktoken_available:
+            try:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:  # Encoding files may be unavailable offline
+                self._encoding = None
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def count_attachment(self, attachment: Dict[str, Any]) -> int:
+        mime_type = attachment.get("mime_type", "")
+        if mime_type.startswith("image/"):
+            return IMAGE_TOKENS
+        size = attachment.get("size")
+        if size is None:  # Inline attachment: base64 text is ~4/3 of the raw size
+            size = len(attachment.get("data") or "") * 3 // 4
+        return size // CHARS_PER_TOKEN
+
+    def count_content(self, content: Any) -> int:
+        """Tokens in a message body: plain text or a list of OpenAI-style content parts."""
+        if isinstance(content, str):
+            return self.count_text(content)
+        tokens = 0
+        for part in content or []:
+            if isinstance(part, str):
+                tokens += self.count_text(part)
+            elif isinstance(part, dict):
+                tokens += IMAGE_TOKENS if part.get("type") == "image_url" else self.count_text(part.get("text") or "")
+        return tokens
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.count_content(message.get("content"))
+        for attachment in message.get("attachments") or []:
+            if isinstance(attachment, dict):
+                tokens += self.count_attachment(attachment)
+        return tokens
+
+
+    def estimate_usage(self, prompt_messages: List[Dict[str, Any]], completion_text: str) -> Dict[str, Any]:
+        """A token_usage dict computed locally, flagged "estimated"."""
+        prompt_tokens = sum(self.count_message(m) for m in prompt_messages if isinstance(m, dict))
+        completion_tokens = self.count_text(completion_text or "")
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens, "estimated": True}
+
+
+_default_estimator: Optional[TokenEstimator] = None
+
+
+def get_estimator() -> TokenEstimator:
+    global _default_estimator
+    if _default_estimator is None:
+        _default_estimator = TokenEstimator()
+    return _default_estimator
@@ -0,0 +1,75 @@
+"""
+Shared HTTP transport for CannonAI providers.
+
+``HttpTransport`` keeps one pooled ``httpx.AsyncClient`` per (base URL, timeout)
+so that every provider talking to the same API reuses the same keep-alive
+connections (and TLS sessions) across turns and provider switches. It is owned
+by ``ProviderManager`` and handed to providers before ``initialize()``; providers
+pass the client to their SDK instead of letting it build a private one.
+
+Pool settings come from the "http_transport" section of cannonai_config.json.
+HTTP/2 is used when the optional ``h2`` package is installed.
+"""
+
+import importlib.util
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import httpx
+    httpx_available = True
+except ImportError:  # Providers fall back to their SDK's own HTTP client
+    httpx_available = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSPORT_SETTINGS: Dict[str, Any] = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0,  # Seconds an idle connection is kept open
+    "connect_timeout": 10.0,  # Capped by the provider's own timeout
+    "http2": True,  # Only takes effect when the 'h2' package is installed
+}
+
+
+class HttpTransport:
+    """Pool of shared async HTTP clients, one per base URL and timeout."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        self.settings = dict(DEFAULT_TRANSPORT_SETTINGS)
+        self.settings.update(settings or {})
+        self.http2 = bool(self.settings["http2"]) and importlib.util.find_spec("h2") is not None
+        self._clients: Dict[Tuple[str, float], "httpx.AsyncClient"] = {}
+
+    @property
+    def available(self) -> bool:
+        return httpx_available
+
+    def get_client(self, base_url: str, timeout: float) -> Optional["httpx.AsyncClient"]:
+        """Returns the shared client for a base URL, creating it on first use. None if httpx is missing."""
+        if not httpx_available:
+            return None
+        key = (base_url.rstrip("/"), float(timeout))
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            settings = self.settings
+            limits = httpx.Limits(max_connections=settings["max_connections"],
+                                  max_keepalive_connections=settings["max_keepalive_connections"],
+                                  keepalive_expiry=settings["keepalive_expiry"])
+            client_timeout = httpx.Timeout(timeout, connect=min(settings["connect_timeout"], timeout))
+            client = httpx.AsyncClient(limits=limits, timeout=client_timeout, http2=self.http2, follow_redirects=True)
+            self._clients[key] = client
+            logger.info(f"Created pooled HTTP client for {key[0]} (timeout {timeout}s, http2={self.http2})")
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        return {"clients": [url for url, _ in self._clients], "http2": self.http2, "available": httpx_available}
+
+    async def aclose(self) -> None:
+        """Closes every pooled client (and its connections)."""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing pooled HTTP client: {e}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+CannonAI Startup Profile - Import-time report for a cold start.
+
+Runs a fresh interpreter with ``python -X importtime`` that imports what a CLI
+(or GUI) session imports before the first prompt, including the configured
+provider's module, and summarizes the slowest imports. Used by
+``cannonai.py --profile-startup``.
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+# Third-party packages worth calling out when they show up in a cold start
+SDK_PACKAGES = ("google.genai", "openai", "anthropic", "httpx", "flask", "tabulate", "colorama")
+
+_PROFILE_SCRIPT = """
+import time
+start = time.perf_counter()
+import cannonai
+from providers import get_provider_class
+provider_name = {provider_name!r}
+if provider_name:
+    try:
+        get_provider_class(provider_name)
+    except Exception as e:
+        print("PROVIDER-ERROR", e)
+if {gui!r}:
+    import gui.server
+print("WALL-SECONDS", time.perf_counter() - start)
+"""
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parses `-X importtime` output into {"module", "depth", "self_us", "cumulative_us"} rows."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        stripped = name.lstrip()
+        rows.append({"module": stripped, "depth": (len(name) - len(stripped) - 1) // 2,
+                     "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return rows
+
+
+def profile_startup(provider_name: Optional[str], gui: bool = False) -> Dict[str, Any]:
+    """Measures a cold start in a subprocess. Returns wall time, import rows and any provider error."""
+    script = _PROFILE_SCRIPT.format(provider_name=provider_name, gui=gui)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            cwd=str(Path(__file__).resolve().parent), capture_output=True, text=True)
+    report: Dict[str, Any] = {"rows": parse_importtime(result.stderr), "wall_seconds": None, "provider_error": None,
+                              "returncode": result.returncode, "stderr_tail": ""}
+    for line in result.stdout.splitlines():
+        if line.startswith("WALL-SECONDS "):
+            report["wall_seconds"] = float(line.split()[1])
+        elif line.startswith("PROVIDER-ERROR "):
+            report["provider_error"] = line[len("PROVIDER-ERROR "):]
+    if result.returncode != 0:
+        report["stderr_tail"] = "\n".join(l for l in result.stderr.splitlines() if not l.startswith("import time:"))[-2000:]
+    return report
+
+
+def print_startup_report(report: Dict[str, Any], colors: Any, top: int = 20) -> None:
+    """Prints the slowest top-level imports and which SDK packages were loaded."""
+    rows = report["rows"]
+    if report["returncode"] != 0:
+        print(f"{colors.FAIL}Startup profile run failed:{colors.ENDC}\n{report['stderr_tail']}")
+        return
+    total_ms = sum(row["self_us"] for row in rows) / 1000
+    print(f"\n{colors.HEADER}{colors.BOLD}Startup import profile{colors.ENDC}")
+    if report["wall_seconds"] is not None:
+        print(f"Wall time to ready: {report['wall_seconds'] * 1000:.1f} ms (imports: {total_ms:.1f} ms, {len(rows)} modules)")
+    print(f"\n{colors.CYAN}{'cumulative ms':>14}{'self ms':>10}  module{colors.ENDC}")
+    top_level = sorted((row for row in rows if row["depth"] == 0), key=lambda row: row["cumulative_us"], reverse=True)
+    for row in top_level[:top]:
+        print(f"{row['cumulative_us'] / 1000:>14.1f}{row['self_us'] / 1000:>10.1f}  {row['module']}")
+    loaded = {row["module"] for row in rows}
+    sdks = [name for name in SDK_PACKAGES if name in loaded]
+    print(f"\nThird-party packages loaded: {', '.join(sdks) if sdks else 'none'}")
+    if report["provider_error"]:
+        print(f"{colors.WARNING}Provider import failed: {report['provider_error']}{colors.ENDC}")
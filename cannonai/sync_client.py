@@ -16,13 +16,17 @@ from tabulate import tabulate
 
 from base_client import BaseGeminiClient, Colors
 
-try:
-    from google import genai
-    from google.genai import types
-except ImportError:
-    print("Error: google-genai package not installed.")
-    print("Please install with: pip install google-genai")
-    exit(1)
+
+def _import_genai():
+    """Imports the google-genai SDK on first use so importing this module stays cheap."""
+    try:
+        from google import genai
+        from google.genai import types
+    except ImportError:
+        print("Error: google-genai package not installed.")
+        print("Please install with: pip install google-genai")
+        exit(1)
+    return genai, types
 
 
 class SyncGeminiClient(BaseGeminiClient):
@@ -65,6 +69,7 @@ class SyncGeminiClient(BaseGeminiClient):
             
         try:
             print(f"Initializing client with API key: {self.api_key[:4]}...{self.api_key[-4:]}")
+            genai, _ = _import_genai()
             self.client = genai.Client(api_key=self.api_key)
             print(f"{Colors.GREEN}Successfully connected to Gemini API.{Colors.ENDC}")
             return True
@@ -178,6 +183,7 @@ class SyncGeminiClient(BaseGeminiClient):
         try:
             response_text = ""
             
+            _, types = _import_genai()
             # Configure generation parameters
             config = types.GenerateContentConfig(
                 temperature=self.params["temperature"],
@@ -0,0 +1,118 @@
+"""ClaudeProvider against a local mock of the Messages API (http.server, server-sent events)."""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from providers.base_provider import ProviderConfig
+from providers.claude_provider import ClaudeProvider
+
+SSE_EVENTS: List[Tuple[str, Dict[str, Any]]] = [
+    ("message_start", {"type": "message_start", "message": {
+        "id": "msg_1", "type": "message", "role": "assistant", "content": [], "model": "claude-test",
+        "usage": {"input_tokens": 21, "output_tokens": 1}}}),
+    ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+    ("ping", {"type": "ping"}),
+    ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hello"}}),
+    ("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": " world"}}),
+    ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+    ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 5}}),
+    ("message_stop", {"type": "message_stop"}),
+]
+
+
+class MockMessagesAPI(BaseHTTPRequestHandler):
+    """Answers GET /v1/models and POST /v1/messages; queued statuses are sent before the event stream."""
+
+    requests: List[Dict[str, Any]] = []
+    queued_errors: List[Tuple[int, Dict[str, str]]] = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json(200, {"data": [{"id": "claude-test", "display_name": "Claude Test"}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append({"path": self.path, "headers": dict(self.headers), "body": body})
+        if self.queued_errors:
+            status, headers = self.queued_errors.pop(0)
+            self._send_json(status, {"type": "error", "error": {"type": "rate_limit_error", "message": "Slow down"}}, headers)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for event_name, data in SSE_EVENTS:
+            self.wfile.write(f"event: {event_name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+
+@pytest.fixture
+def mock_api():
+    MockMessagesAPI.requests = []
+    MockMessagesAPI.queued_errors = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockMessagesAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+async def _stream(base_url: str, retry_delay: float = 0.0) -> Tuple[ClaudeProvider, List[Dict[str, Any]]]:
+    provider = ClaudeProvider(ProviderConfig(api_key="test-key", model="claude-test", api_base_url=base_url,
+                                             timeout=5, retry_delay=retry_delay))
+    assert await provider.initialize()
+    try:
+        stream = await provider.generate_response([{"role": "user", "content": "Hi"}], stream=True,
+                                                  system_instruction="Be brief.")
+        return provider, [chunk async for chunk in stream]
+    finally:
+        await provider._http.aclose()
+
+
+def test_stream_reports_text_and_usage(mock_api):
+    provider, chunks = asyncio.run(_stream(mock_api))
+
+    assert [c["chunk"] for c in chunks if "chunk" in c] == ["Hello", " world"]  # The ping adds nothing
+    done = chunks[-1]
+    assert done["done"] and done["full_response"] == "Hello world" and done["stop_reason"] == "end_turn"
+    usage = done["token_usage"]
+    assert (usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"]) == (21, 5, 26)
+    assert "estimated" not in usage
+
+    request = MockMessagesAPI.requests[0]
+    assert request["path"] == "/v1/messages"
+    assert request["headers"]["x-api-key"] == "test-key"
+    assert request["body"]["system"] == "Be brief."
+    assert request["body"]["messages"] == [{"role": "user", "content": "Hi"}]
+    assert request["body"]["stream"] is True
+
+
+def test_stream_retries_rate_limit_with_retry_after(mock_api):
+    MockMessagesAPI.queued_errors = [(429, {"Retry-After": "0"})]
+    started = time.monotonic()
+    provider, chunks = asyncio.run(_stream(mock_api, retry_delay=30.0))  # The server's hint replaces the backoff
+
+    assert time.monotonic() - started < 10
+    assert chunks[-1]["full_response"] == "Hello world"
+    assert len(MockMessagesAPI.requests) == 2
+    assert provider.get_retry_stats()["retries"] == 1
+    assert provider.get_retry_stats()["circuit_state"] == "closed"
@@ -0,0 +1,74 @@
+"""Each budget strategy drops whole turns until the history fits, and never the newest turn."""
+
+from typing import Any, Dict, List
+
+from context_budget import fit_to_budget, group_turns
+
+
+class CharEstimator:
+    """One token per character of content, so budgets are easy to reason about."""
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        return len(message.get("content") or "")
+
+
+def _history(turns: int = 6) -> List[Dict[str, Any]]:
+    messages = []
+    for turn in range(turns):
+        messages.append({"id": f"u{turn}", "role": "user", "content": f"question {turn:>2}"})  # 11 tokens
+        messages.append({"id": f"a{turn}", "role": "assistant", "content": f"answer {turn:>4}"})  # 11 tokens
+    return messages
+
+
+def _kept_turns(kept: List[Dict[str, Any]]) -> List[int]:
+    return [int(m["id"][1:]) for m in kept if m["role"] == "user"]
+
+
+def _fit(messages, strategy: str, context_window: int = 110, **kwargs):
+    # 110-token window, 22 reserved for the reply: room for 4 of the 22-token turns
+    return fit_to_budget([], messages, context_window, 22, strategy=strategy, safety_margin=0.0,
+                         estimator=CharEstimator(), **kwargs)
+
+
+def test_turns_start_at_user_messages():
+    messages = [{"role": "assistant"}, {"role": "user"}, {"role": "assistant"}, {"role": "assistant"}, {"role": "user"}]
+    assert group_turns(messages) == [[0], [1, 2, 3], [4]]
+
+
+def test_history_that_fits_is_untouched():
+    messages = _history(3)
+    kept, report = _fit(messages, "drop_oldest")
+    assert kept is messages
+    assert report.dropped == [] and report.prompt_tokens == report.original_tokens == 66
+
+
+def test_drop_oldest():
+    kept, report = _fit(_history(), "drop_oldest")
+    assert _kept_turns(kept) == [2, 3, 4, 5]
+    assert [d["id"] for d in report.dropped] == ["u0", "a0", "u1", "a1"]
+    assert (report.original_tokens, report.prompt_tokens, report.budget_tokens) == (132, 88, 88)
+    assert not report.over_budget
+
+
+def test_first_last_drops_from_the_middle():
+    kept, _ = _fit(_history(), "first_last", keep_first=1, keep_last=2)
+    assert _kept_turns(kept) == [0, 3, 4, 5]
+
+
+def test_pinned_turns_are_kept():
+    messages = _history()
+    messages[3]["pinned"] = True  # Answer of turn 1
+    kept, _ = _fit(messages, "pinned")
+    assert _kept_turns(kept) == [1, 3, 4, 5]
+
+
+def test_over_budget_keeps_newest_turn_and_reports_it():
+    messages = _history()
+    for message in messages:
+        message["pinned"] = True
+    kept, report = _fit(messages, "pinned", context_window=40)
+    assert kept == messages
+    assert report.over_budget
+
+    kept, report = _fit(_history(), "drop_oldest", context_window=40)
+    assert _kept_turns(kept) == [5] and report.over_budget  # 22 tokens left for an 18-token budget
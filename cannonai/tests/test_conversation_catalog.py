@@ -0,0 +1,61 @@
+"""The catalog lists conversations from its SQLite index and re-reads only files that changed."""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+from conversation_catalog import ConversationCatalog
+
+
+def _write(path: Path, conversation_id: str, title: str, updated_at: str, messages: int = 0) -> Dict[str, Any]:
+    data = {"conversation_id": conversation_id,
+            "metadata": {"title": title, "updated_at": updated_at, "total_message_count": messages},
+            "messages": {f"m{i}": {"id": f"m{i}", "type": "user", "content": "hi"} for i in range(messages)}}
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return data
+
+
+def test_listing_is_newest_first_and_follows_external_changes(tmp_path):
+    _write(tmp_path / "older.json", "id-old", "Older", "2024-01-01T00:00:00", messages=1)
+    _write(tmp_path / "newer.json", "id-new", "Newer", "2024-02-01T00:00:00", messages=2)
+    catalog = ConversationCatalog(tmp_path)
+
+    entries = catalog.list_entries()
+    assert [(e["title"], e["message_count"]) for e in entries] == [("Newer", 2), ("Older", 1)]
+
+    _write(tmp_path / "older.json", "id-old", "Older, renamed", "2024-03-01T00:00:00", messages=3)
+    os.remove(tmp_path / "newer.json")
+    assert [(e["title"], e["message_count"]) for e in catalog.list_entries()] == [("Older, renamed", 3)]
+
+
+def test_unchanged_files_are_not_reread(tmp_path, monkeypatch):
+    _write(tmp_path / "a.json", "id-a", "A", "2024-01-01T00:00:00")
+    ConversationCatalog(tmp_path).list_entries()
+
+    def read_summary(path):
+        raise AssertionError(f"{path} was re-read")
+
+    reopened = ConversationCatalog(tmp_path)  # A restart keeps the index on disk
+    monkeypatch.setattr(reopened, "_read_summary_from_file", read_summary)
+    assert [e["title"] for e in reopened.list_entries()] == ["A"]
+
+
+def test_corrupt_catalog_is_rebuilt(tmp_path):
+    _write(tmp_path / "a.json", "id-a", "A", "2024-01-01T00:00:00")
+    (tmp_path / ConversationCatalog.CATALOG_FILENAME).write_bytes(b"not a database" * 100)
+
+    assert [e["title"] for e in ConversationCatalog(tmp_path).list_entries()] == ["A"]
+
+
+def test_record_updates_listing_without_a_rescan(tmp_path):
+    catalog = ConversationCatalog(tmp_path)
+    catalog.list_entries()
+    data = _write(tmp_path / "saved.json", "id-saved", "Saved", "2024-01-01T00:00:00", messages=2)
+    catalog.record(tmp_path / "saved.json", data)
+
+    assert catalog.fingerprint() == catalog.fingerprint()
+    assert [(e["conversation_id"], e["message_count"]) for e in catalog.list_entries()] == [("id-saved", 2)]
+    catalog.remove(tmp_path / "saved.json")
+    os.remove(tmp_path / "saved.json")
+    assert catalog.list_entries() == []
@@ -0,0 +1,52 @@
+"""Every installed codec round-trips a conversation, and reading detects the format of the file."""
+
+from typing import Any, Dict
+
+import pytest
+
+from conversation_codecs import CODECS, DEFAULT_CODEC, get_codec, load_file, open_text_stream
+
+CONVERSATION: Dict[str, Any] = {
+    "conversation_id": "conv-1",
+    "metadata": {"title": "Codecs ✓", "total_message_count": 1},
+    "messages": {"m": {"id": "m", "type": "user", "content": "héllo " * 50, "children": []}},
+}
+
+
+def _write(path, codec_name: str) -> None:
+    codec = CODECS[codec_name]
+    path.write_bytes(codec.finish(codec.encode(CONVERSATION)))
+
+
+@pytest.mark.parametrize("codec_name", sorted(CODECS))
+def test_round_trip_detects_the_codec(tmp_path, codec_name):
+    path = tmp_path / "conv.json"
+    _write(path, codec_name)
+    assert load_file(path) == CONVERSATION
+
+
+@pytest.mark.parametrize("codec_name", sorted(CODECS))
+def test_text_stream_is_json_for_json_based_codecs(tmp_path, codec_name):
+    path = tmp_path / "conv.json"
+    _write(path, codec_name)
+    stream = open_text_stream(path)
+    if codec_name == "msgpack":
+        assert stream is None
+        return
+    with stream:
+        assert stream.read(1) == "{"
+
+
+def test_compressed_codecs_are_smaller(tmp_path):
+    sizes = {}
+    for name in ("json", "json-compact", "gzip"):
+        _write(tmp_path / name, name)
+        sizes[name] = (tmp_path / name).stat().st_size
+    assert sizes["gzip"] < sizes["json-compact"] < sizes["json"]
+
+
+def test_unknown_or_missing_codec_falls_back_to_json():
+    assert get_codec("nonsense").name == DEFAULT_CODEC
+    assert get_codec(None).name == DEFAULT_CODEC
+    if "zstd" not in CODECS:
+        assert get_codec("zstd").name == DEFAULT_CODEC
@@ -0,0 +1,102 @@
+"""Journal saves append deltas, and replaying the file rebuilds the conversation that was saved."""
+
+import json
+from typing import Any, Dict
+
+from conversation_journal import ConversationJournal, convert_journal_to_json, convert_json_to_journal
+
+
+def _conversation() -> Dict[str, Any]:
+    return {
+        "conversation_id": "conv-1",
+        "version": "2.0.0",
+        "metadata": {"title": "Journal", "model": "m-1"},
+        "branches": {"main": {"head": "a"}},
+        "messages": {"u": {"id": "u", "parent_id": None, "type": "user", "content": "hi", "children": ["a"]},
+                     "a": {"id": "a", "parent_id": "u", "type": "assistant", "content": "hello", "children": []}},
+    }
+
+
+def _add_turn(data: Dict[str, Any]) -> None:
+    data["messages"]["a"]["children"].append("u2")
+    data["messages"]["u2"] = {"id": "u2", "parent_id": "a", "type": "user", "content": "again", "children": []}
+    data["metadata"]["title"] = "Journal, continued"
+    del data["metadata"]["model"]
+
+
+def _record_types(path):
+    return [json.loads(line)["type"] for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_save_appends_deltas_that_replay_to_the_saved_structure(tmp_path):
+    path = tmp_path / "conv.jsonl"
+    data = _conversation()
+    journal = ConversationJournal()
+    journal.save(path, data)
+    _add_turn(data)
+    journal.save(path, data)
+
+    assert _record_types(path) == ["header", "message", "message", "message", "meta"]
+    assert ConversationJournal().load(path) == data
+
+
+def test_changed_message_replays_in_place(tmp_path):
+    path = tmp_path / "conv.jsonl"
+    data = _conversation()
+    journal = ConversationJournal()
+    journal.save(path, data)
+    data["messages"]["u"]["pinned"] = True
+    journal.mark_messages_changed(path, ["u"])
+    journal.save(path, data)
+
+    loaded = ConversationJournal().load(path)
+    assert list(loaded["messages"]) == ["u", "a"]
+    assert loaded["messages"]["u"]["pinned"] is True
+    assert loaded["messages"]["u"]["children"] == ["a"]
+
+
+def test_torn_final_record_is_ignored(tmp_path):
+    path = tmp_path / "conv.jsonl"
+    data = _conversation()
+    ConversationJournal().save(path, data)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type":"message","message":{"id":"x"')  # Interrupted append
+
+    assert ConversationJournal().load(path) == data
+
+
+def test_journal_compacts_after_threshold(tmp_path):
+    path = tmp_path / "conv.jsonl"
+    data = _conversation()
+    journal = ConversationJournal(compact_after_records=1)
+    journal.save(path, data)
+    data["metadata"]["title"] = "Renamed"
+    journal.save(path, data)  # Appends, reaching the threshold
+    _add_turn(data)
+    journal.save(path, data)  # Rewrites the file instead of appending
+
+    assert _record_types(path) == ["header", "message", "message", "message"]
+    assert ConversationJournal().load(path) == data
+
+
+def test_header_read_applies_metadata_deltas(tmp_path):
+    path = tmp_path / "conv.jsonl"
+    data = _conversation()
+    journal = ConversationJournal()
+    journal.save(path, data)
+    journal.append_metadata(path, {"title": "Appended"})
+
+    header = journal.read_header(path)
+    assert "messages" not in header
+    assert (header["conversation_id"], header["metadata"]["title"]) == ("conv-1", "Appended")
+
+
+def test_conversion_round_trip(tmp_path):
+    json_path = tmp_path / "conv.json"
+    data = _conversation()
+    json_path.write_text(json.dumps(data), encoding="utf-8")
+
+    journal_path = convert_json_to_journal(json_path, remove_source=True)
+    assert not json_path.exists()
+    back = convert_journal_to_json(journal_path)
+    assert json.loads(back.read_text(encoding="utf-8")) == data
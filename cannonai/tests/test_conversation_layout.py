@@ -0,0 +1,54 @@
+"""Sharded paths depend only on the conversation ID, and both layouts are scanned and migrated."""
+
+import json
+from pathlib import Path
+
+from conversation_catalog import ConversationCatalog
+from conversation_layout import DirectoryScanner, conversations_root, migrate_to_sharded, sharded_relpath
+
+CONVERSATION_ID = "3f2a9c1e-0000-4000-8000-000000000001"
+
+
+def _write(path: Path, conversation_id: str, title: str = "Layout") -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"conversation_id": conversation_id, "metadata": {"title": title}, "messages": {}}),
+                    encoding="utf-8")
+
+
+def test_sharded_paths():
+    assert sharded_relpath(CONVERSATION_ID) == Path("3f/2a") / f"{CONVERSATION_ID}.json"
+    assert sharded_relpath(CONVERSATION_ID, ".jsonl").suffix == ".jsonl"
+    odd = sharded_relpath("not-a-uuid")  # Hashed into a shard instead
+    assert len(odd.parts) == 3 and all(len(part) == 2 for part in odd.parts[:2])
+
+
+def test_conversations_root_for_both_layouts(tmp_path):
+    assert conversations_root(tmp_path / sharded_relpath(CONVERSATION_ID)) == tmp_path
+    assert conversations_root(tmp_path / "Title_3f2a9c1e.json") == tmp_path
+
+
+def test_scanner_lists_both_layouts_and_sees_new_shard_files(tmp_path):
+    _write(tmp_path / "Flat_12345678.json", "12345678-flat")
+    _write(tmp_path / sharded_relpath(CONVERSATION_ID), CONVERSATION_ID)
+    (tmp_path / "notes.txt").write_text("ignored")
+    scanner = DirectoryScanner(tmp_path)
+    assert set(scanner.scan()) == {"Flat_12345678.json", f"3f/2a/{CONVERSATION_ID}.json"}
+
+    neighbour = CONVERSATION_ID.replace("0001", "0002")
+    _write(tmp_path / sharded_relpath(neighbour), neighbour)
+    assert f"3f/2a/{neighbour}.json" in scanner.scan()
+
+
+def test_migration_moves_flat_files_into_shards(tmp_path):
+    flat = tmp_path / "Layout_3f2a9c1e.json"
+    _write(flat, CONVERSATION_ID)
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+
+    assert migrate_to_sharded(tmp_path, dry_run=True) == [(flat, tmp_path / sharded_relpath(CONVERSATION_ID))]
+    assert flat.exists()
+    migrate_to_sharded(tmp_path)
+
+    assert not flat.exists() and (tmp_path / "broken.json").exists()
+    catalog = ConversationCatalog(tmp_path)
+    assert catalog.find_path_by_id(CONVERSATION_ID) == tmp_path / sharded_relpath(CONVERSATION_ID)
+    assert [e["title"] for e in catalog.list_entries()] == ["Layout"]
@@ -0,0 +1,81 @@
+"""Write-behind saves for one conversation are coalesced and never overlap."""
+
+import asyncio
+
+from conversation_persister import WriteBehindPersister
+
+
+async def _record(written, value):
+    written.append(value)
+
+
+def test_marks_within_the_window_coalesce_into_the_last_save():
+    async def run():
+        persister = WriteBehindPersister(coalesce_ms=20)
+        written = []
+        for version in range(5):
+            persister.mark_dirty("conv", lambda version=version: _record(written, version))
+        assert persister.has_pending("conv")
+        await asyncio.sleep(0.1)
+        return persister, written
+
+    persister, written = asyncio.run(run())
+    assert written == [4]
+    assert persister.stats == {"requested": 5, "written": 1, "failed": 0}
+
+
+def test_flush_writes_now_and_discard_drops():
+    async def run():
+        persister = WriteBehindPersister(coalesce_ms=60_000)
+        written = []
+        persister.mark_dirty("a", lambda: _record(written, "a"))
+        persister.mark_dirty("b", lambda: _record(written, "b"))
+        await persister.discard("b")
+        await persister.flush()
+        assert not persister.has_pending()
+        return written
+
+    assert asyncio.run(run()) == ["a"]
+
+
+def test_saves_for_one_key_do_not_overlap():
+    async def run():
+        persister = WriteBehindPersister(coalesce_ms=0)
+        active, overlaps, written = [], [], []
+
+        async def slow_save(version):
+            overlaps.append(bool(active))
+            active.append(version)
+            await asyncio.sleep(0.02)
+            active.remove(version)
+            written.append(version)
+
+        persister.mark_dirty("conv", lambda: slow_save(1))
+        await asyncio.sleep(0.005)  # First save is in flight
+        persister.mark_dirty("conv", lambda: slow_save(2))
+        await persister.flush("conv")
+        return overlaps, written
+
+    overlaps, written = asyncio.run(run())
+    assert written == [1, 2]
+    assert overlaps == [False, False]
+
+
+def test_failed_save_is_counted_and_later_saves_still_run():
+    async def run():
+        persister = WriteBehindPersister(coalesce_ms=0)
+        written = []
+
+        async def failing_save():
+            raise OSError("disk full")
+
+        persister.mark_dirty("conv", failing_save)
+        await persister.flush()
+        persister.mark_dirty("conv", lambda: _record(written, "retry"))
+        await persister.flush()
+        return persister, written
+
+    persister, written = asyncio.run(run())
+    assert written == ["retry"]
+    assert (persister.stats["failed"], persister.stats["written"]) == (1, 1)
+
@@ -0,0 +1,66 @@
+"""Pinning a message that is already on disk survives a reload in both storage formats."""
+
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from async_client import AsyncClient
+from config import Config
+from conversation_journal import JOURNAL_SUFFIX
+from providers.base_provider import BaseAIProvider, ProviderConfig
+
+
+class EchoProvider(BaseAIProvider):
+    provider_name = "echo"
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        return "echo", {"token_usage": {}}
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+def _conversation_file(client: AsyncClient) -> Any:
+    path = client.conversation_path(client.base_directory, client.conversation_data["metadata"]["title"], client.conversation_id)
+    return path.with_suffix(JOURNAL_SUFFIX) if client.storage_format == "journal" else path
+
+
+@pytest.mark.parametrize("storage_format", ["json", "journal"])
+def test_pin_made_after_save_is_reloaded(tmp_path, storage_format):
+    async def run():
+        config = Config(config_file=tmp_path / "cannonai_config.json", quiet=True)
+        client = AsyncClient(provider=EchoProvider(ProviderConfig(api_key="key", model="echo-1")),
+                             conversations_dir=tmp_path / "conversations", global_config=config)
+        client.storage_format = storage_format
+        await client.start_new_conversation("Pins", is_web_ui=True)
+        first = client.create_message_structure("user", "keep me", message_id="m1")
+        second = client.create_message_structure("assistant", "reply", message_id="m2", parent_id="m1")
+        for message in (first, second):
+            client._add_message_to_conversation(client.conversation_data, message)
+        await client.save_conversation(quiet=True)  # Both messages are written before the pin
+
+        assert client.set_message_pinned("m1")
+        await client.save_conversation(quiet=True)
+        path = _conversation_file(client)
+        reloaded = await client.load_conversation_data(path)
+        assert reloaded["messages"]["m1"].get("pinned") is True
+        assert list(reloaded["messages"]) == ["m1", "m2"]
+        assert reloaded["messages"]["m1"]["children"] == ["m2"]
+
+        assert client.set_message_pinned("m1", False)
+        await client.save_conversation(quiet=True)
+        reloaded = await client.load_conversation_data(path)
+        assert "pinned" not in reloaded["messages"]["m1"]
+
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+"""The search index adds only new messages on save, across restarts, and replaces edited ones."""
+
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from conversation_catalog import ConversationCatalog
+
+
+def _conversation(*contents: str) -> Dict[str, Any]:
+    messages = {f"m{i}": {"id": f"m{i}", "type": "user", "content": text} for i, text in enumerate(contents)}
+    return {"conversation_id": "conv-1", "metadata": {"title": "Search"}, "messages": messages}
+
+
+def _save(catalog: ConversationCatalog, path: Path, data: Dict[str, Any]):
+    update = catalog.prepare_search_update(path, data)
+    path.write_text(json.dumps(data), encoding="utf-8")
+    catalog.record(path, data)
+    catalog.apply_search_update(path, update)
+    return update
+
+
+@pytest.fixture
+def conversation_file(tmp_path):
+    if not ConversationCatalog(tmp_path).search_available:
+        pytest.skip("SQLite without FTS5")
+    return tmp_path / "conv-1.json"
+
+
+def _hits(catalog: ConversationCatalog, query: str):
+    return [r["message_id"] for r in catalog.search(query)["results"]]
+
+
+def test_save_after_restart_indexes_only_new_messages(conversation_file):
+    data = _conversation("apples are red")
+    first = ConversationCatalog(conversation_file.parent)
+    _save(first, conversation_file, data)
+    first.close()
+
+    data["messages"]["m1"] = {"id": "m1", "type": "assistant", "content": "bananas are yellow"}
+    restarted = ConversationCatalog(conversation_file.parent)
+    update = _save(restarted, conversation_file, data)
+
+    assert not update.full
+    assert [doc[0] for doc in update.new_docs] == ["m1"]
+    assert _hits(restarted, "apples") == ["m0"]  # Indexed once, not again after the restart
+    assert _hits(restarted, "bananas") == ["m1"]
+
+
+def test_changed_message_is_reindexed(conversation_file):
+    data = _conversation("apples are red", "pears are green")
+    catalog = ConversationCatalog(conversation_file.parent)
+    _save(catalog, conversation_file, data)
+
+    data["messages"]["m0"]["content"] = "cherries are red"
+    catalog.mark_messages_changed(conversation_file, ["m0"])
+    update = _save(catalog, conversation_file, data)
+
+    assert [doc[0] for doc in update.new_docs] == ["m0"]
+    assert _hits(catalog, "apples") == []
+    assert _hits(catalog, "cherries") == ["m0"]
+    assert _hits(catalog, "pears") == ["m1"]
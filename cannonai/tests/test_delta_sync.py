@@ -0,0 +1,94 @@
+"""Delta sync hands out only unseen messages, and never against another conversation or index."""
+
+import asyncio
+import gc
+from typing import Any, Dict, List
+
+from async_client import AsyncClient
+from command_handler import CommandHandler
+from config import Config
+from conversation_tree import ConversationTree, SharedConversations
+from gui.api_handlers import APIHandlers
+from providers.base_provider import BaseAIProvider, ProviderConfig
+
+
+class EchoProvider(BaseAIProvider):
+    provider_name = "echo"
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        return "echo", {"token_usage": {}}
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+def _conversation(conversation_id: str, count: int) -> Dict[str, Any]:
+    data: Dict[str, Any] = {"conversation_id": conversation_id, "metadata": {"active_branch": "main"},
+                            "messages": {}, "branches": {"main": {"last_message": None}}}
+    tree = ConversationTree(data)
+    parent = None
+    for i in range(count):
+        msg_id = f"{conversation_id}{i}"
+        tree.add_message({"id": msg_id, "type": "user", "content": "", "parent_id": parent,
+                          "branch_id": "main", "children": []})
+        parent = msg_id
+    return data
+
+
+def test_revision_of_one_tree_is_not_a_delta_base_for_another():
+    a, b = ConversationTree(_conversation("a", 2)), ConversationTree(_conversation("b", 5))
+    a.touch("a1")
+    assert b.changes_since(a.revision) is None
+    assert b.changes_since(b.base_revision) == {}
+
+
+def test_reopened_tree_does_not_reuse_revisions():
+    shared = SharedConversations()
+    data = _conversation("c", 3)
+    tree = shared.open(data)
+    tree.touch("c0", "c1")
+    old_revision = tree.revision
+    del tree
+    gc.collect()
+    reopened = shared.open(data)
+    assert reopened.base_revision > old_revision
+    assert reopened.changes_since(old_revision) is None
+
+
+def test_status_sends_full_state_for_another_conversations_revision(tmp_path):
+    async def run():
+        config = Config(config_file=tmp_path / "cannonai_config.json", quiet=True)
+        client = AsyncClient(provider=EchoProvider(ProviderConfig(api_key="key", model="echo-1")),
+                             conversations_dir=tmp_path / "conversations", global_config=config)
+        handlers = APIHandlers(client, CommandHandler(client), asyncio.get_running_loop())
+
+        await client.start_new_conversation("First", is_web_ui=True)
+        client.add_user_message("one")
+        first = handlers.get_status()
+        client.add_user_message("two")
+        same = handlers.get_status(first["revision"], first["conversation_id"])
+        assert same["delta"] is True
+        changed = same["changed_messages"]
+        assert sorted(m["content"] for m in changed.values()) == ["one", "two"]  # The parent gained a child
+        assert same["active_path"] == [m["id"] for m in sorted(changed.values(), key=lambda m: m["content"])]
+
+        await client.start_new_conversation("Second", is_web_ui=True)
+        for text in ("b0", "b1", "b2"):
+            client.add_user_message(text)
+        other = handlers.get_status(same["revision"], first["conversation_id"])
+        assert other["delta"] is False
+        assert [m["content"] for m in other["history"]] == ["b0", "b1", "b2"]
+        assert handlers.get_status(same["revision"])["delta"] is False  # No conversation given
+        await client.flush_pending_saves()
+
+    asyncio.run(run())
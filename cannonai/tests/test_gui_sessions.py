@@ -0,0 +1,70 @@
+"""GUI sessions that open the same conversation share it instead of overwriting each other's turns."""
+
+import asyncio
+from typing import Any, Dict, List
+
+from async_client import AsyncClient
+from config import Config
+from gui.sessions import SessionPool
+from providers.base_provider import BaseAIProvider, ProviderConfig
+
+
+class EchoProvider(BaseAIProvider):
+    provider_name = "echo"
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        return f"echo: {messages[-1]['content']}", {"token_usage": {}}
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+class SingleProviderManager:
+    """The parts of ProviderManager the sessions use, serving every request from one provider."""
+
+    def __init__(self, provider: BaseAIProvider):
+        self.provider = provider
+
+    async def get_session_provider(self, provider_name: str, model: str = None) -> BaseAIProvider:
+        return self.provider.with_model(model or self.provider.config.model)
+
+    async def generate_with_failover(self, primary, build_messages, params, use_cache=True, system_instruction=None):
+        return primary, await primary.generate_response(build_messages(primary), params, system_instruction=system_instruction)
+
+
+def test_two_sessions_on_one_conversation_keep_both_turns(tmp_path):
+    async def run():
+        config = Config(config_file=tmp_path / "cannonai_config.json", quiet=True)
+        provider = EchoProvider(ProviderConfig(api_key="key", model="echo-1"))
+        await provider.initialize()
+        template = AsyncClient(provider=provider, conversations_dir=tmp_path / "conversations", global_config=config)
+        pool = SessionPool(config, template, SingleProviderManager(provider), asyncio.get_running_loop())
+        (first, _), (second, _) = await pool.acquire(None), await pool.acquire(None)
+
+        await first.api_handlers.new_conversation_async("Shared")
+        conversation_id = first.client.conversation_id
+        await second.api_handlers.load_conversation_async(conversation_id)
+        assert second.client.conversation_data is first.client.conversation_data
+
+        await first.api_handlers.send_message_async("from A", add_user_message=True)
+        await second.api_handlers.send_message_async("from B", add_user_message=True)
+        data = first.client.conversation_data
+        assert first.client.get_tree(data) is second.client.get_tree(data)  # One revision sequence for both tabs
+        await pool.aclose()
+
+        path = next((tmp_path / "conversations").rglob(f"*{conversation_id[:8]}*.json"))
+        saved = await template.load_conversation_data(path)
+        contents = [m["content"] for m in saved["messages"].values()]
+        assert contents == ["from A", "echo: from A", "from B", "echo: from B"]
+
+    asyncio.run(run())
@@ -0,0 +1,121 @@
+"""Read routes answer If-None-Match with 304 until their version stamp changes; static assets are versioned."""
+
+import asyncio
+import gzip
+from typing import Any, Dict, List, Tuple
+
+from async_client import AsyncClient
+from command_handler import CommandHandler
+from config import Config
+from gui.api_handlers import APIHandlers
+from gui.asgi import ASGIApp, STATIC_DIR
+from gui.http_cache import IMMUTABLE_CACHE_CONTROL, choose_encoding, etag_matches, make_etag, maybe_compress
+from providers.base_provider import BaseAIProvider, ProviderConfig
+
+
+class EchoProvider(BaseAIProvider):
+    provider_name = "echo"
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        return f"echo: {messages[-1]['content']}", {"token_usage": {}}
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+class Components:
+    """The parts of AsyncComponentManager the ASGI app uses, around one ready client."""
+
+    session_pool = None
+
+    def __init__(self, client: AsyncClient):
+        self.chat_client = client
+        self.event_loop = asyncio.get_running_loop()
+        self.api_handlers = APIHandlers(client, CommandHandler(client), self.event_loop)
+
+    async def initialize_on_current_loop(self, app_config, cli_args) -> None:
+        pass
+
+    def is_ready(self) -> bool:
+        return True
+
+    async def aclose(self) -> None:
+        pass
+
+
+async def _get(app: ASGIApp, path: str, **headers: str) -> Tuple[int, Dict[str, str], bytes]:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": "GET", "path": path, "query_string": b"",
+               "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]}, receive, send)
+    response_headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], response_headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_etag_helpers():
+    etag = make_etag("tree", "conv-1", 7)
+    assert etag.startswith('W/"') and etag == make_etag("tree", "conv-1", 7) != make_etag("tree", "conv-1", 8)
+    assert etag_matches(f'"other", {etag[2:]}', etag)  # Weak comparison ignores the W/ prefix
+    assert etag_matches("*", etag) and not etag_matches(None, etag)
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("deflate, gzip") == "gzip"
+
+    body = b'{"text": "' + b"x" * 5000 + b'"}'
+    compressed, encoding = maybe_compress(body, "application/json", "gzip")
+    assert encoding == "gzip" and gzip.decompress(compressed) == body
+    assert maybe_compress(b"{}", "application/json", "gzip") == (b"{}", None)
+
+
+def test_read_routes_answer_304_until_the_state_changes(tmp_path):
+    async def run():
+        config = Config(config_file=tmp_path / "cannonai_config.json", quiet=True)
+        provider = EchoProvider(ProviderConfig(api_key="key", model="echo-1"))
+        await provider.initialize()
+        client = AsyncClient(provider=provider, conversations_dir=tmp_path / "conversations", global_config=config)
+        components = Components(client)
+        app = ASGIApp(config, component_manager=components)
+        await client.start_new_conversation("Cached", is_web_ui=True)
+        await client.flush_pending_saves()
+
+        for path in ("/api/conversations", "/api/tree"):
+            status, headers, body = await _get(app, path)
+            assert status == 200 and body
+            etag = headers["etag"]
+            status, headers, body = await _get(app, path, if_none_match=etag)
+            assert (status, body, headers["etag"]) == (304, b"", etag)
+
+        _, headers, _ = await _get(app, "/api/tree")
+        tree_etag = headers["etag"]
+        _, headers, _ = await _get(app, "/api/conversations")
+        list_etag = headers["etag"]
+        await components.api_handlers.send_message_async("Hello", add_user_message=True)
+        await client.flush_pending_saves()
+        assert (await _get(app, "/api/tree", if_none_match=tree_etag))[0] == 200
+        assert (await _get(app, "/api/conversations", if_none_match=list_etag))[0] == 200
+
+        versioned = app.assets.url("js/app.js")
+        status, headers, body = await _get(app, versioned, accept_encoding="gzip")
+        assert status == 200 and headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+        assert headers.get("content-encoding") == "gzip" and gzip.decompress(body) == (STATIC_DIR / "js" / "app.js").read_bytes()
+        status, _, _ = await _get(app, versioned, if_none_match=headers["etag"])
+        assert status == 304
+        status, headers, _ = await _get(app, "/assets/0000stale000/js/app.js")
+        assert status == 200 and headers["cache-control"] != IMMUTABLE_CACHE_CONTROL
+
+    asyncio.run(run())
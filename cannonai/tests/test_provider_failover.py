@@ -0,0 +1,133 @@
+"""Failover to a fallback provider records the model of the handle that actually answered."""
+
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from async_client import AsyncClient
+from config import Config
+from provider_manager import ProviderManager
+from providers.base_provider import BaseAIProvider, ProviderConfig, ProviderError
+
+
+class FakeProvider(BaseAIProvider):
+    def __init__(self, config: ProviderConfig, fail: bool = False):
+        super().__init__(config)
+        self.fail = fail
+        self.calls: List[str] = []  # Models asked, shared with with_model() handles
+        self._is_initialized = True
+
+    async def initialize(self) -> bool:
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        self.calls.append(self.config.model)
+        if self.fail:
+            raise ProviderError(f"{self.provider_name} is down", status_code=503, retryable=True)
+        text = f"{self.config.model} says hi"
+        if not stream:
+            return text, {"token_usage": {}}
+
+        async def chunks():
+            yield {"chunk": text}
+            yield {"done": True, "full_response": text, "token_usage": {}}
+        return chunks()
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+class PrimaryProvider(FakeProvider):
+    provider_name = "primary"
+
+
+class BackupProvider(FakeProvider):
+    provider_name = "backup"
+
+
+@pytest.fixture
+def client(tmp_path):
+    config = Config(config_file=tmp_path / "cannonai_config.json", quiet=True)
+    config.set("provider_fallback_chain", ["primary", "backup"])
+    config.set("provider_fallback_models", {"backup": "backup-large"})
+    manager = ProviderManager(config)
+    manager.register_provider("backup", BackupProvider(ProviderConfig(api_key="key", model="backup-small")))
+    primary = PrimaryProvider(ProviderConfig(api_key="key", model="primary-1"), fail=True)
+    manager.register_provider("primary", primary)
+    client = AsyncClient(provider=primary, conversations_dir=tmp_path / "conversations", global_config=config)
+    client.provider_manager = manager
+    return client
+
+
+def _last_assistant(client: AsyncClient) -> Dict[str, Any]:
+    return [m for m in client.conversation_data["messages"].values() if m["type"] == "assistant"][-1]
+
+
+def test_streaming_failover_records_fallback_model(client):
+    async def run():
+        await client.start_new_conversation("Failover", is_web_ui=True)
+        client.add_user_message("Hello")
+        events = [event async for event in client.get_streaming_response()]
+        await client.flush_pending_saves()
+        return events
+
+    events = asyncio.run(run())
+    failover = next(e["failover"] for e in events if e.get("failover"))
+    assert (failover["to"], failover["model"]) == ("backup", "backup-large")
+    done = events[-1]
+    assert (done["provider"], done["model"], done["full_response"]) == ("backup", "backup-large", "backup-large says hi")
+    message = _last_assistant(client)
+    assert (message["provider"], message["model"]) == ("backup", "backup-large")
+    assert client.provider_manager.get_all_cached_providers()["backup"].config.model == "backup-small"
+
+
+def test_non_streaming_failover_records_fallback_model(client):
+    async def run():
+        await client.start_new_conversation("Failover", is_web_ui=True)
+        client.add_user_message("Hello")
+        result = await client.get_response()
+        await client.flush_pending_saves()
+        return result
+
+    text, _ = asyncio.run(run())
+    assert text == "backup-large says hi"
+    message = _last_assistant(client)
+    assert (message["provider"], message["model"]) == ("backup", "backup-large")
+
+
+def test_bad_request_does_not_fail_over(client):
+    async def run():
+        primary = client.provider
+        primary.fail = False
+
+        async def bad_request(*args, **kwargs):
+            raise ProviderError("prompt too long", status_code=400)
+        primary.generate_response = bad_request
+        with pytest.raises(ProviderError, match="prompt too long"):
+            await client.provider_manager.generate_with_failover(primary, lambda p: [], {})
+
+    asyncio.run(run())
+    assert client.provider_manager.get_all_cached_providers()["backup"].calls == []
+
+
+def test_fallback_with_open_circuit_is_skipped(client):
+    async def run():
+        manager = client.provider_manager
+        backup = manager.get_all_cached_providers()["backup"]
+        for _ in range(backup.circuit_breaker.failure_threshold):
+            backup.circuit_breaker.record_failure()
+        with pytest.raises(ProviderError, match="primary is down"):
+            await manager.generate_with_failover(client.provider, lambda p: [], {})
+        return [e async for e in manager.stream_with_failover(client.provider, lambda p: [], {})]
+
+    events = asyncio.run(run())
+    assert client.provider_manager.get_all_cached_providers()["backup"].calls == []
+    assert not any(e.get("failover") for e in events)
+    assert "primary is down" in events[-1]["error"]
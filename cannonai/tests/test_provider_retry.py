@@ -0,0 +1,107 @@
+"""Provider calls retry transient failures with backoff, and a circuit breaker stops hammering a failing backend."""
+
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from providers.base_provider import BaseAIProvider, CircuitBreaker, ProviderConfig, ProviderError, RetryPolicy
+
+
+class FlakyProvider(BaseAIProvider):
+    provider_name = "flaky"
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        return "ok", {}
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+def _failing(*errors: ProviderError):
+    """An operation that raises `errors` in turn and then returns "ok"."""
+    remaining = list(errors)
+    calls = []
+
+    async def operation():
+        calls.append(None)
+        if remaining:
+            raise remaining.pop(0)
+        return "ok"
+    return operation, calls
+
+
+def _unavailable() -> ProviderError:
+    return ProviderError("unavailable", status_code=503, retryable=True)
+
+
+@pytest.fixture
+def provider():
+    return FlakyProvider(ProviderConfig(api_key="key", model="flaky-1", max_retries=3, retry_delay=0.0))
+
+
+def test_retry_policy_delays():
+    policy = RetryPolicy(max_retries=2, base_delay=1.0, max_delay=3.0)
+    assert 0.5 <= policy.delay_for(0, _unavailable()) <= 1.0  # Equal jitter: between half and all of the ceiling
+    assert 1.0 <= policy.delay_for(1, _unavailable()) <= 2.0
+    assert 1.5 <= RetryPolicy(max_retries=9, base_delay=1.0, max_delay=3.0).delay_for(6, _unavailable()) <= 3.0
+    assert policy.delay_for(2, _unavailable()) is None  # Retry budget spent
+    assert policy.delay_for(0, ProviderError("bad request", status_code=400)) is None
+    assert policy.delay_for(0, ProviderError("slow down", status_code=429, retry_after=7, retryable=True)) == 7
+    assert policy.delay_for(0, ProviderError("slow down", status_code=429, retry_after=600, retryable=True)) is None
+
+
+def test_transient_failures_are_retried(provider):
+    operation, calls = _failing(_unavailable(), _unavailable())
+    assert asyncio.run(provider.call_with_retry(operation)) == "ok"
+
+    assert len(calls) == 3
+    stats = provider.get_retry_stats()
+    assert (stats["retries"], stats["successes"], stats["failures"], stats["circuit_state"]) == (2, 1, 0, "closed")
+
+
+def test_bad_request_is_not_retried(provider):
+    operation, calls = _failing(ProviderError("bad request", status_code=400))
+    with pytest.raises(ProviderError, match="bad request"):
+        asyncio.run(provider.call_with_retry(operation))
+    assert len(calls) == 1
+    assert provider.circuit_breaker.consecutive_failures == 0
+
+
+def test_circuit_opens_then_half_open_trial_closes_it(provider):
+    provider.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60.0)
+    operation, calls = _failing(*[_unavailable()] * 5)
+    with pytest.raises(ProviderError):
+        asyncio.run(provider.call_with_retry(operation))
+    assert len(calls) == 2  # The open circuit ends the retries early
+    assert provider.get_retry_stats()["circuit_state"] == "open"
+
+    with pytest.raises(ProviderError, match="circuit open"):
+        asyncio.run(provider.call_with_retry(operation))
+    assert len(calls) == 2 and provider.retry_stats["short_circuited"] == 1
+
+    provider.circuit_breaker.opened_at -= 60.0  # Reset timeout elapsed
+    succeed, _ = _failing()
+    assert asyncio.run(provider.call_with_retry(succeed)) == "ok"
+    assert provider.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.opened_at -= 60.0
+    assert breaker.allow_request() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()  # Only one trial at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.would_allow()
+    assert breaker.times_opened == 2
@@ -0,0 +1,114 @@
+"""Identical requests are answered from the response cache, in memory and across restarts."""
+
+import asyncio
+from typing import Any, Dict, List
+
+from providers.base_provider import BaseAIProvider, ProviderConfig
+from providers.response_cache import ResponseCache, cache_key
+
+MESSAGES = [{"role": "user", "content": "What is 2 + 2?"}]
+
+
+class CountingProvider(BaseAIProvider):
+    provider_name = "counting"
+
+    def __init__(self, config: ProviderConfig):
+        super().__init__(config)
+        self.calls = 0
+
+    async def initialize(self) -> bool:
+        self._is_initialized = True
+        return True
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def generate_response(self, messages, params=None, stream=False, system_instruction=None):
+        self.calls += 1
+        text = f"answer {self.calls}"
+        usage = {"prompt_tokens": 5, "completion_tokens": 2}
+        if not stream:
+            return text, {"token_usage": usage}
+
+        async def chunks():
+            yield {"chunk": "answer "}
+            yield {"chunk": str(self.calls)}
+            yield {"done": True, "full_response": text, "token_usage": usage}
+        return chunks()
+
+    def validate_model(self, model_name: str) -> bool:
+        return True
+
+    def get_default_params(self) -> Dict[str, Any]:
+        return {}
+
+
+def _provider(cache: ResponseCache) -> CountingProvider:
+    provider = CountingProvider(ProviderConfig(api_key="key", model="count-1"))
+    provider.attach_response_cache(cache)
+    return provider
+
+
+def test_key_ignores_dict_order_but_not_content():
+    key = cache_key("p", "m", MESSAGES, {"temperature": 0.2, "top_p": 1})
+    assert key == cache_key("p", "m", MESSAGES, {"top_p": 1, "temperature": 0.2})
+    assert key != cache_key("p", "m", MESSAGES, {"temperature": 0.3, "top_p": 1})
+    assert key != cache_key("p", "other", MESSAGES, {"temperature": 0.2, "top_p": 1})
+    assert cache_key("p", "m", [{"content": object()}], None) is None  # Not cacheable
+
+
+def test_repeat_request_is_served_from_cache(tmp_path):
+    cache = ResponseCache({"enabled": True}, default_dir=tmp_path)
+    provider = _provider(cache)
+
+    async def run():
+        first = await provider.generate_cached(MESSAGES, {"temperature": 0})
+        second = await provider.generate_cached(MESSAGES, {"temperature": 0})
+        bypassed = await provider.generate_cached(MESSAGES, {"temperature": 0}, use_cache=False)
+        with_system = await provider.generate_cached(MESSAGES, {"temperature": 0}, system_instruction="Be terse.")
+        return first, second, bypassed, with_system
+
+    first, second, bypassed, with_system = asyncio.run(run())
+    assert first[0] == second[0] == "answer 1"
+    assert second[1]["cached"] is True and "cached" not in first[1]
+    assert bypassed[0] == "answer 2" and with_system[0] == "answer 3"
+    stats = cache.get_stats()
+    assert (stats["hits_memory"], stats["misses"], stats["bypassed"]) == (1, 2, 1)
+
+
+def test_streamed_answer_is_replayed_from_disk_after_restart(tmp_path):
+    async def stream(provider):
+        return [chunk async for chunk in await provider.generate_cached(MESSAGES, stream=True)]
+
+    first_cache = ResponseCache({"enabled": True}, default_dir=tmp_path)
+    original = asyncio.run(stream(_provider(first_cache)))
+    first_cache.close()
+
+    cache = ResponseCache({"enabled": True}, default_dir=tmp_path)
+    provider = _provider(cache)
+    replayed = asyncio.run(stream(provider))
+    assert provider.calls == 0
+    assert [c["chunk"] for c in replayed if "chunk" in c] == [c["chunk"] for c in original if "chunk" in c]
+    assert replayed[-1]["full_response"] == "answer 1" and replayed[-1]["cached"] is True
+    assert cache.get_stats()["hits_disk"] == 1
+
+
+def test_expired_and_evicted_entries_are_misses(tmp_path):
+    async def run():
+        cache = ResponseCache({"enabled": True, "ttl_seconds": 0, "disk": False})
+        await cache.put("old", "text", {})
+        await asyncio.sleep(0.01)
+        assert await cache.get("old") is None
+
+        lru = ResponseCache({"enabled": True, "memory_entries": 1, "disk": False})
+        await lru.put("a", "A", {})
+        await lru.put("b", "B", {})
+        assert await lru.get("a") is None and (await lru.get("b"))["text"] == "B"
+
+        small = ResponseCache({"enabled": True, "memory_entries": 0, "max_disk_mb": 0.0005}, default_dir=tmp_path)
+        await small.put("first", "x" * 300, {})
+        await small.put("second", "y" * 300, {})
+        assert await small.get("first") is None and (await small.get("second"))["text"] == "y" * 300
+        assert small.stats["evictions"] == 1
+
+    asyncio.run(run())